@@ -4,7 +4,8 @@ from django.utils.translation import ugettext_lazy as _
 
 from imagekit.admin import AdminThumbnail
 
-from gravvy.apps.account.models import User, AuthToken, RegistrationProfile
+from gravvy.apps.account.models import (
+    User, AuthToken, RegistrationProfile, RecentContact)
 from gravvy.apps.account.forms import UserChangeForm, UserCreationForm
 
 # Register your models here.
@@ -144,12 +145,26 @@ class RegistrationAdmin(admin.ModelAdmin):
     resend_verification_sms.short_description = _("Re-send verification codes")
 
 
+class RecentContactAdmin(admin.ModelAdmin):
+    """
+    Representation of a RecentContact in the admin interface
+    """
+    list_display = ('user', 'contact', 'last_invited_at')
+    fields = ('user', 'contact', 'last_invited_at')
+    raw_id_fields = ('user', 'contact')
+    search_fields = ('user__phone_number', 'user__full_name',
+                     'contact__phone_number', 'contact__full_name')
+    ordering = ('-last_invited_at',)
+
+
 # Register UserAdmin
 admin.site.register(User, MyUserAdmin)
 # Register AuthTokenAdmin
 admin.site.register(AuthToken, AuthTokenAdmin)
 # Register RegistrationAdmin
 admin.site.register(RegistrationProfile, RegistrationAdmin)
+# Register RecentContactAdmin
+admin.site.register(RecentContact, RecentContactAdmin)
 
 
 
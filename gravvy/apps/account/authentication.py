@@ -12,7 +12,8 @@ from django.conf import settings
 from rest_framework import exceptions
 from rest_framework.authentication import TokenAuthentication
 
-from gravvy.apps.account.models import AuthToken, User
+from gravvy.apps.account.models import AuthToken, User, token_cache
+from gravvy.apps.monitoring.metrics import AUTH_TOKEN_LOOKUPS
 
 class ExpiringTokenAuthentication(TokenAuthentication):
     """
@@ -26,10 +27,16 @@ class ExpiringTokenAuthentication(TokenAuthentication):
     model = AuthToken
     
     def authenticate_credentials(self, key):
-        try:
-            token = self.model.objects.get(key=key)
-        except self.model.DoesNotExist:
-            raise exceptions.AuthenticationFailed('Invalid token')
+        token = token_cache.get(key)
+        if token is not None:
+            AUTH_TOKEN_LOOKUPS.labels('hit').inc()
+        else:
+            AUTH_TOKEN_LOOKUPS.labels('miss').inc()
+            try:
+                token = self.model.objects.get(key=key)
+            except self.model.DoesNotExist:
+                raise exceptions.AuthenticationFailed('Invalid token')
+            token_cache.set(key, token)
 
         if not token.user.is_active:
             raise exceptions.AuthenticationFailed('User inactive or deleted')
@@ -0,0 +1,78 @@
+"""
+Build the recent contacts of users from their invite activities.
+
+Recent contacts are recorded as users invite contacts, so this is only needed
+to backfill the recent contacts of invites that were sent before the
+RecentContact table was added. The recent contacts of each user are rebuilt
+from scratch, so the command is safe to re-run.
+"""
+from itertools import groupby
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Max
+
+from gravvy.apps.account.models import User, RecentContact
+from gravvy.apps.activity.models import Activity
+
+
+class Command(BaseCommand):
+    help = "Build the recent contacts of users from their invite activities."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500, dest='batch_size',
+            help="Number of users to rebuild the recent contacts of at a "
+            "time.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        user_type = ContentType.objects.get_for_model(User)
+        invites = Activity.objects.filter(
+            verb='invite', object_content_type=user_type)
+
+        users_count = contacts_count = 0
+        last_actor_id = 0
+        while True:
+            # page through the inviting users by id so each batch is a cheap
+            # index range scan no matter how far along we are.
+            actor_ids = list(invites.filter(
+                    actor_id__gt=last_actor_id).order_by(
+                    'actor_id').values_list('actor_id', flat=True).distinct()[
+                    :batch_size])
+            if not actor_ids:
+                break
+
+            # each user's latest invite of each of their contacts, grouped by
+            # user and most recent first. Users can't be their own contacts.
+            last_invites = invites.filter(
+                actor_id__in=actor_ids,
+                object_id__in=User.objects.values('pk')).exclude(
+                object_id=F('actor_id')).order_by().values(
+                'actor_id', 'object_id').annotate(
+                last_invited_at=Max('created_at')).order_by(
+                'actor_id', '-last_invited_at')
+
+            recent_contacts = []
+            for actor_id, actor_invites in groupby(
+                last_invites.iterator(), lambda invite: invite['actor_id']):
+                actor_invites = list(actor_invites)
+                recent_contacts.extend(
+                    RecentContact(user_id=actor_id,
+                                  contact_id=invite['object_id'],
+                                  last_invited_at=invite['last_invited_at'])
+                    for invite in actor_invites[
+                        :settings.ACCOUNT_MAX_RECENT_CONTACTS])
+
+            with transaction.atomic():
+                RecentContact.objects.filter(user_id__in=actor_ids).delete()
+                RecentContact.objects.bulk_create(recent_contacts)
+
+            users_count += len(actor_ids)
+            contacts_count += len(recent_contacts)
+            last_actor_id = actor_ids[-1]
+
+        self.stdout.write("%d recent contacts of %d users" % (
+                contacts_count, users_count))
@@ -0,0 +1,236 @@
+"""
+Benchmark the phone number handling of hot paths against the users of the
+configured database, e.g. a development database seeded with:
+    python manage.py seeddata --users 10000 --videos 0
+
+Users are loaded and serialized with their phone numbers loaded lazily, as
+LazyPhoneNumbers, and parsed eagerly, the way PhoneNumberField loaded them
+before LazyPhoneNumber. Each measurement is the best of `--runs` runs.
+
+The throughput of contact invites is measured with the phone number parse
+cache enabled and disabled. The first active user invites batches of contacts
+to new videos, drawn from a small address book so phone numbers repeat as they
+do in practice. Invites are measured through the API, in-process with push
+notifications and SMS messages stubbed out, and through the user resolution
+the API does, which is where their phone numbers are parsed. Everything the
+invites create is rolled back.
+
+Results are written as JSON with `--output`, so runs can be compared across
+commits.
+"""
+import json
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import reverse
+from django.db import transaction
+from django.test import RequestFactory
+from django.test.utils import override_settings
+from rest_framework.request import Request
+from rest_framework.test import APIClient
+
+from gravvy.apps.account.models import User
+from gravvy.apps.account.serializers import (
+    UserPublicSerializer, UserNumberSerializer)
+from gravvy.apps.video.models import Video, VideoUsers
+from gravvy.fields.phonenumber_field.modelfields import PhoneNumberField
+from gravvy.fields.phonenumber_field.phonenumber import (
+    PhoneNumber, parse_cache)
+
+# format of the phone numbers of the address book contacts invited
+CONTACT_PHONE_NUMBER_FORMAT = '+1 (213) 555-%04d'
+
+
+# ---------------------------------------------------------------------------- #
+# HELPER FUNCTIONS
+# ---------------------------------------------------------------------------- #
+
+def eager_from_db_value(self, value, expression, connection, context):
+    """
+    PhoneNumberField.from_db_value as it was before LazyPhoneNumber: every
+    loaded phone number is parsed and validated.
+    """
+    if value is None or value == '':
+        return self.to_python(value)
+    phone_number = PhoneNumber.from_string(value)
+    phone_number.is_valid()
+    return phone_number
+
+
+def best_time(function, runs):
+    """
+    Time runs of a function
+
+    Returns:
+        shortest duration of a run, in seconds
+    """
+    durations = []
+    for _ in range(runs):
+        start = time.time()
+        function()
+        durations.append(time.time() - start)
+    return round(min(durations), 3)
+
+
+# ---------------------------------------------------------------------------- #
+# COMMAND
+# ---------------------------------------------------------------------------- #
+
+class Command(BaseCommand):
+    help = "Benchmark the phone number handling of hot paths."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--runs', type=int, default=3, dest='runs',
+            help="Number of times each measurement is run.")
+        parser.add_argument(
+            '--batches', type=int, default=50, dest='batches',
+            help="Number of invite requests.")
+        parser.add_argument(
+            '--batch-size', type=int, default=40, dest='batch_size',
+            help="Number of contacts invited per request.")
+        parser.add_argument(
+            '--contacts', type=int, default=200, dest='contacts',
+            help="Number of contacts in the address book invites are drawn "
+            "from.")
+        parser.add_argument(
+            '--output', dest='output',
+            help="File to write the JSON results to.")
+
+    def handle(self, *args, **options):
+        users_count = User.objects.count()
+        if not users_count:
+            raise CommandError("There are no users. Seed some with the "
+                               "seeddata command first.")
+
+        runs = options['runs']
+        results = {'users': users_count,
+                   'lazy': self.benchmark_users(runs)}
+        lazy_from_db_value = PhoneNumberField.from_db_value
+        PhoneNumberField.from_db_value = eager_from_db_value
+        try:
+            results['eager'] = self.benchmark_users(runs)
+        finally:
+            PhoneNumberField.from_db_value = lazy_from_db_value
+
+        results['invites'] = {}
+        for name, cache_size in (('cache_disabled', 0),
+                                 ('cache_enabled',
+                                  settings.PHONENUMBER_PARSE_CACHE_SIZE)):
+            with override_settings(PHONENUMBER_PARSE_CACHE_SIZE=cache_size):
+                results['invites'][name] = {
+                    'api': self.benchmark_invites(
+                        options, self.invite_through_api),
+                    'resolution': self.benchmark_invites(
+                        options, self.resolve_invites),
+                }
+
+        self.stdout.write("%d users, best of %d runs" % (users_count, runs))
+        self.stdout.write("%-30s %10s %10s" % ('', 'eager', 'lazy'))
+        for name in ('load_seconds', 'serialize_seconds'):
+            self.stdout.write("%-30s %9.2fs %9.2fs" % (
+                    name, results['eager'][name], results['lazy'][name]))
+        self.stdout.write("%-30s %10s %10s" % (
+                'invites/s', 'no cache', 'cache'))
+        for path in ('api', 'resolution'):
+            self.stdout.write("%-30s %10.1f %10.1f" % (
+                    path,
+                    results['invites']['cache_disabled'][path][
+                        'invites_per_second'],
+                    results['invites']['cache_enabled'][path][
+                        'invites_per_second']))
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2, sort_keys=True)
+            self.stdout.write("Results written to %s" % options['output'])
+
+    def benchmark_users(self, runs):
+        """
+        Benchmark loading all users and serializing them
+
+        Returns:
+            dictionary of the durations, in seconds
+        """
+        request = Request(RequestFactory().get('/'))
+
+        def load():
+            parse_cache.clear()
+            return list(User.objects.all())
+
+        def serialize():
+            users = load()
+            UserPublicSerializer(
+                users, many=True, context={'request': request}).data
+
+        return {'load_seconds': best_time(load, runs),
+                'serialize_seconds': best_time(serialize, runs)}
+
+    def benchmark_invites(self, options, invite):
+        """
+        Benchmark inviting contacts to new videos
+
+        Args:
+            options: command options
+            invite: function inviting a list of contacts to a video, given the
+                inviting user, the video and the contacts' request data
+
+        Returns:
+            dictionary of the invite throughput and parse cache statistics
+        """
+        inviter = User.objects.filter(is_active=True).first()
+        if inviter is None:
+            raise CommandError("There are no active users to invite contacts.")
+
+        contacts = [CONTACT_PHONE_NUMBER_FORMAT % i
+                    for i in range(options['contacts'])]
+        with override_settings(
+            PUSH_DRY_RUN=True,
+            ALLOWED_HOSTS=settings.ALLOWED_HOSTS + ['testserver']):
+            with transaction.atomic():
+                parse_cache.clear()
+                elapsed = 0
+                for batch in range(options['batches']):
+                    video = Video.objects.create(owner=inviter, title='video')
+                    start = (batch * options['batch_size']) % len(contacts)
+                    users = [{'phone_number': contacts[(start + i) %
+                                                       len(contacts)]}
+                             for i in range(options['batch_size'])]
+                    started = time.time()
+                    invite(inviter, video, users)
+                    elapsed += time.time() - started
+                transaction.set_rollback(True)
+
+        invites = options['batches'] * options['batch_size']
+        return {'invites': invites,
+                'seconds': round(elapsed, 3),
+                'invites_per_second': round(invites / elapsed, 1),
+                'parse_cache': parse_cache.stats()}
+
+    def invite_through_api(self, inviter, video, users):
+        """
+        Invite contacts to a video with a request to the video users endpoint
+        """
+        client = APIClient()
+        client.force_authenticate(user=inviter)
+        response = client.post(
+            reverse('video-user-list', kwargs={'hash_key': video.hash_key}),
+            {'users': users}, format='json')
+        if response.status_code != 201:
+            raise CommandError("Invite failed with status %d: %s" % (
+                    response.status_code, response.content[:200]))
+
+    def resolve_invites(self, inviter, video, users):
+        """
+        Validate and resolve the users of contacts and add them to a video,
+        as the video users endpoint does before recording activities and
+        sending notifications
+        """
+        request = Request(RequestFactory().post('/'))
+        request.user = inviter
+        serializer = UserNumberSerializer(
+            data=users, many=True, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        VideoUsers.objects.add_users_to_video(
+            video, *serializer.create(serializer.data))
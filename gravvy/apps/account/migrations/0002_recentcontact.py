@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.utils.timezone
+from django.conf import settings
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecentContact',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('last_invited_at', models.DateTimeField(default=django.utils.timezone.now, help_text='Date/time the contact was last invited by the user', verbose_name='last invited at')),
+                ('contact', models.ForeignKey(related_name='recent_contact_of', verbose_name='contact', to=settings.AUTH_USER_MODEL, help_text='Invited user')),
+                ('user', models.ForeignKey(related_name='recent_contacts', verbose_name='user', to=settings.AUTH_USER_MODEL, help_text='User that invited the contact')),
+            ],
+            options={
+                'ordering': ('-last_invited_at', '-id'),
+                'verbose_name': 'recent contact',
+                'verbose_name_plural': 'recent contacts',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='recentcontact',
+            unique_together=set([('user', 'contact')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='recentcontact',
+            index_together=set([('user', 'last_invited_at')]),
+        ),
+    ]
@@ -2,8 +2,10 @@ import binascii
 import os
 import random
 import datetime
+from collections import OrderedDict
 
-from django.db import models, transaction
+from django.db import models, transaction, IntegrityError
+from django.db.models.signals import post_save, post_delete
 from django.contrib.auth.models import (
     AbstractBaseUser, BaseUserManager, PermissionsMixin)
 from django.core.urlresolvers import reverse
@@ -13,9 +15,9 @@ from django.utils import timezone
 from django.conf import settings
 
 from imagekit.models import ImageSpecField
-from imagekit.processors import SmartResize, Adjust, Transpose
-
 from gravvy.utils import get_upload_path
+from gravvy.cache import CacheNamespace
+from gravvy.processors import Thumbnail
 from gravvy.apps.push.utils import send_sms_message
 from gravvy.fields.phonenumber_field.modelfields import PhoneNumberField
 
@@ -25,6 +27,9 @@ from gravvy.fields.phonenumber_field.modelfields import PhoneNumberField
 # Custom User Model
 #-------------------------------------------------------------------------------
 
+# cache of users by phone number
+user_cache = CacheNamespace('user')
+
 # HELPER FUNCTIONS
 def get_avatar_path(instance, filename):
     return get_upload_path(instance, filename, 'img/u/')
@@ -124,6 +129,83 @@ class UserManager(BaseUserManager):
                                      False, False, is_active=False)
         return user
 
+    def get_cached_by_number(self, phone_number):
+        """
+        Get a user by phone number from the cache, or from the database if it
+        isn't cached. Cached users are invalidated when saved, but are shared
+        by other requests so this is only for reading users: never save the
+        returned user.
+        
+        Args:
+            phone_number: user's phone number
+            
+        Returns:
+            User instance
+        
+        Raises:
+            User.DoesNotExist: there's no user with this phone number
+        """
+        phone_number = self.model._meta.get_field(
+            'phone_number').get_prep_value(phone_number)
+        return user_cache.get_or_load(
+            phone_number, lambda: self.get(phone_number=phone_number))
+
+    def get_users_by_numbers(self, phone_numbers):
+        """
+        Bulk version of `get_user_by_number`. Get the users that already exist
+        in our system and create new, inactive `User`s for the other phone
+        numbers. This uses a constant number of queries regardless of the
+        number of phone numbers.
+
+        The new users get unusable passwords rather than random ones as
+        hashing a password per user is slow, and inactive users can't log in
+        anyway. Their password is set on account activation.
+
+        Args:
+            phone_numbers: list of phone numbers
+
+        Returns:
+            list of User instances, one per distinct phone number, in the
+            order of the phone numbers.
+        """
+        # prepare the phone numbers the same way filtering by them would, so
+        # they can be matched to the phone numbers of the fetched users.
+        phone_number_field = self.model._meta.get_field('phone_number')
+        phone_numbers = OrderedDict(
+            (phone_number_field.get_prep_value(n), None) for n in phone_numbers
+            ).keys()
+
+        users = dict(
+            (unicode(u.phone_number), u) for u in
+            self.filter(phone_number__in=phone_numbers))
+
+        missing_numbers = [n for n in phone_numbers if n not in users]
+        if missing_numbers:
+            now = timezone.now()
+            new_users = []
+            for phone_number in missing_numbers:
+                user = self.model(phone_number=phone_number, is_staff=False,
+                                  is_active=False, is_superuser=False,
+                                  date_joined=now)
+                user.set_unusable_password()
+                new_users.append(user)
+
+            try:
+                with transaction.atomic(using=self._db):
+                    self.bulk_create(new_users)
+            except IntegrityError:
+                # some of these users were created by a concurrent request so
+                # fall back to getting/creating the users one at a time.
+                for phone_number in missing_numbers:
+                    users[phone_number] = self.get_user_by_number(phone_number)
+            else:
+                # bulk_create doesn't set primary keys so fetch the new users
+                users.update(
+                    (unicode(u.phone_number), u) for u in
+                    self.filter(phone_number__in=missing_numbers))
+
+        return [users[n] for n in phone_numbers]
+
 
 class AbstractUser(AbstractBaseUser, PermissionsMixin):
     """
@@ -196,32 +278,42 @@ class User(AbstractUser):
         _('profile picture'), upload_to=get_avatar_path, blank=True)
     
     # imagekit spec for avatar shown in mobile app's UITableViews
-    # The Transpose processor will use the metadata in the image and rotate by 
+    # The Thumbnail processor uses the metadata in the image to rotate it by 
     # the specified amount. This ensures the image will be the right orientation
-    # We put this processor first as subsequent processors will strip the
-    # metadata from the image.
     avatar_thumbnail = ImageSpecField(
         source='avatar',
-        processors=[Transpose(Transpose.AUTO),
-                    SmartResize(width=settings.AVATAR_THUMBNAIL_SIZE, 
-                                height=settings.AVATAR_THUMBNAIL_SIZE),
-                    Adjust(contrast = 1.2, sharpness=1.1)],
+        processors=[Thumbnail(width=settings.AVATAR_THUMBNAIL_SIZE, 
+                              height=settings.AVATAR_THUMBNAIL_SIZE)],
         format='JPEG',
         options={'quality':90})
     
+    # WebP version of the avatar thumbnail for clients that can display it.
+    avatar_thumbnail_webp = ImageSpecField(
+        source='avatar',
+        processors=[Thumbnail(width=settings.AVATAR_THUMBNAIL_SIZE, 
+                              height=settings.AVATAR_THUMBNAIL_SIZE)],
+        format='WEBP',
+        options={'quality':80})
+    
     # this is used for tracking avatar changes
     # ref: http://stackoverflow.com/a/1793323
     __original_avatar = None
+    # this is used for tracking active flag changes
+    __original_is_active = None
     
     class Meta(AbstractUser.Meta):
         swappable = 'AUTH_USER_MODEL'
         
-    def get_avatar_thumbnail_url(self):
+    def get_avatar_thumbnail_url(self, webp=False):
         """
         get url of avatar's thumbnail. If there isn't an avatar_thumbnail then
         return an empty string
+        
+        Args:
+            webp: (bool) get the url of the WebP version of the thumbnail
         """
-        return self.avatar_thumbnail.url if self.avatar_thumbnail else ''
+        thumbnail = self.avatar_thumbnail_webp if webp else self.avatar_thumbnail
+        return thumbnail.url if thumbnail else ''
     
     def get_absolute_url(self):
         return reverse('user-detail', kwargs={'phone_number':self.phone_number})
@@ -268,14 +360,25 @@ class User(AbstractUser):
         Returns:      
             None 
         """
-        # get avatar_thumbnail location and delete it
-        instance.avatar_thumbnail.storage.delete(instance.avatar_thumbnail.name)
+        # get thumbnail locations and delete them
+        for thumbnail in (instance.avatar_thumbnail, 
+                          instance.avatar_thumbnail_webp):
+            thumbnail.storage.delete(thumbnail.name)
         # delete avatar
         instance.avatar.delete()
     
     def __init__(self, *args, **kwargs):
         super(User, self).__init__(*args, **kwargs)
         self.__original_avatar = self.avatar
+        self.__original_is_active = self.is_active
+    
+    def is_active_changed(self):
+        """
+        Determine if the user's active flag has changed since the user was
+        loaded or last saved. This is for post_save signal handlers, which run
+        before the flag is marked as saved.
+        """
+        return self.is_active != self.__original_is_active
     
     def save(self, *args, **kwargs):
         """
@@ -298,6 +401,7 @@ class User(AbstractUser):
         super(User, self).save(*args, **kwargs)
         # update the image file tracking properties
         self.__original_avatar = self.avatar
+        self.__original_is_active = self.is_active
     
     def delete(self, *args, **kwargs):
         """
@@ -333,6 +437,13 @@ class User(AbstractUser):
 # Authentication Token Model
 #-------------------------------------------------------------------------------
 
+# cache of auth tokens by key. Tokens are cached without their user, so the
+# user is always read fresh. They're kept in the shared cache only: the local
+# tier of another process would keep authenticating a deleted or regenerated
+# token until its entry expired.
+token_cache = CacheNamespace('auth-token', cache_alias='shared')
+
+
 class AuthToken(models.Model):
     """
     Customized authorization token model.
@@ -357,6 +468,96 @@ class AuthToken(models.Model):
         return self.key
 
 
+#-------------------------------------------------------------------------------
+# Recent Contacts Model
+#-------------------------------------------------------------------------------
+class RecentContactManager(models.Manager):
+    """
+    Custom manager for the RecentContact model
+    """
+    
+    def record_invites(self, user, contacts, invited_at=None):
+        """
+        Record a user's invitation of contacts, moving them to the front of
+        the user's recent contacts. Only the ACCOUNT_MAX_RECENT_CONTACTS most
+        recently invited contacts of a user are kept.
+        
+        Args:
+            user: user that sent the invitations
+            contacts: list of invited users
+            invited_at: date/time of the invitations. Defaults to now.
+            
+        Returns:
+            None
+        """
+        # users can't be their own contacts
+        contact_ids = set(contact.id for contact in contacts) - set([user.id])
+        if not contact_ids:
+            return
+        
+        if invited_at is None:
+            invited_at = timezone.now()
+        
+        recent_contacts = self.filter(user_id=user.id)
+        updated_ids = set(recent_contacts.filter(
+                contact_id__in=contact_ids).values_list('contact_id', flat=True))
+        if updated_ids:
+            recent_contacts.filter(contact_id__in=updated_ids).update(
+                last_invited_at=invited_at)
+        
+        new_ids = contact_ids - updated_ids
+        if not new_ids:
+            return
+        
+        try:
+            with transaction.atomic(using=self._db):
+                self.bulk_create([
+                        RecentContact(user_id=user.id, contact_id=contact_id,
+                                      last_invited_at=invited_at)
+                        for contact_id in new_ids])
+        except IntegrityError:
+            # a concurrent invite recorded some of these contacts first
+            for contact_id in new_ids:
+                self.update_or_create(
+                    user_id=user.id, contact_id=contact_id,
+                    defaults={'last_invited_at': invited_at})
+        
+        # trim the contacts that fell off the end of the list
+        self.filter(id__in=recent_contacts.values('id')[
+                settings.ACCOUNT_MAX_RECENT_CONTACTS:]).delete()
+
+
+class RecentContact(models.Model):
+    """
+    A user's recently invited contact. This is kept up to date as users
+    invite contacts to videos, so a user's recent contacts can be read with
+    one indexed query instead of from their invite activities.
+    """
+    user = models.ForeignKey(
+        User, related_name='recent_contacts', verbose_name=_('user'),
+        help_text=_("User that invited the contact"))
+    
+    contact = models.ForeignKey(
+        User, related_name='recent_contact_of', verbose_name=_('contact'),
+        help_text=_("Invited user"))
+    
+    last_invited_at = models.DateTimeField(
+        _('last invited at'), default=timezone.now,
+        help_text=_("Date/time the contact was last invited by the user"))
+    
+    objects = RecentContactManager()
+    
+    class Meta:
+        unique_together = ('user', 'contact')
+        index_together = ('user', 'last_invited_at')
+        verbose_name = _('recent contact')
+        verbose_name_plural = _('recent contacts')
+        ordering = ('-last_invited_at', '-id')
+    
+    def __unicode__(self):
+        return u'user:%s contact:%s' % (str(self.user), str(self.contact))
+
+
 #-------------------------------------------------------------------------------
 # User Registration Model
 #-------------------------------------------------------------------------------
@@ -526,3 +727,31 @@ class RegistrationProfile(models.Model):
         send_sms_message(self.user, message)
         
     
+
+
+#-------------------------------------------------------------------------------
+# Signal Handlers
+#-------------------------------------------------------------------------------
+def invalidate_cached_user(sender, instance, **kwargs):
+    """
+    Remove a saved or deleted user from the cache
+    """
+    user_cache.invalidate(unicode(instance.phone_number))
+
+
+def invalidate_cached_token(sender, instance, **kwargs):
+    """
+    Remove a saved or deleted auth token from the cache
+    """
+    token_cache.invalidate(instance.key)
+
+
+# connect the signals
+post_save.connect(invalidate_cached_user, sender=User,
+                  dispatch_uid="gravvy.apps.account.models")
+post_delete.connect(invalidate_cached_user, sender=User,
+                    dispatch_uid="gravvy.apps.account.models")
+post_save.connect(invalidate_cached_token, sender=AuthToken,
+                  dispatch_uid="gravvy.apps.account.models")
+post_delete.connect(invalidate_cached_token, sender=AuthToken,
+                    dispatch_uid="gravvy.apps.account.models")
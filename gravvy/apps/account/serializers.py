@@ -13,8 +13,11 @@ from gravvy.utils import human_readable_size
 from gravvy.fields.phonenumber_field import serializerfields, phonenumber
 from gravvy.apps.account.models import User, RegistrationProfile
 from gravvy.apps.rest.fields import ImageField
+from gravvy.apps.rest.negotiation import accepts_webp
+from gravvy.apps.monitoring.serializers import ProfiledSerializerMixin
 
-class AbstractBaseUserSerializer(serializers.HyperlinkedModelSerializer):
+class AbstractBaseUserSerializer(ProfiledSerializerMixin,
+                                 serializers.HyperlinkedModelSerializer):
     """
     Abstract base serializer to be used for getting and updating users.
     All other User serializers are to build off of this.
@@ -61,9 +64,11 @@ class AbstractBaseUserSerializer(serializers.HyperlinkedModelSerializer):
     
     def get_avatar_thumbnail(self, obj):
         """
-        Get the  absolute URI of the user's avatar thumbnail
+        Get the  absolute URI of the user's avatar thumbnail, in the best
+        image format the client accepts
         """
-        return obj.get_avatar_thumbnail_url()
+        return obj.get_avatar_thumbnail_url(
+            webp=accepts_webp(self.context.get('request')))
 
 
 class UserPublicSerializer(AbstractBaseUserSerializer):
@@ -121,6 +126,34 @@ class UserCreationSerializer(AbstractBaseUserSerializer):
         return user
 
 
+class UserNumberListSerializer(serializers.ListSerializer):
+    """
+    List serializer used by UserNumberSerializer when called with `many=True`.
+    It gets all the users associated with the provided phone numbers at once
+    rather than one at a time.
+    """
+    
+    def create(self, validated_data):
+        """
+        Instantiate the User instances associated with the provided phone 
+        numbers, normalizing these just like UserNumberSerializer.create
+        """
+        user = self.context['request'].user
+        # can only get a default country code if user is authenticated
+        default_region = (user.phone_number.region_code 
+                          if user.is_authenticated() else None)
+        
+        phone_numbers = []
+        for attrs in validated_data:
+            phone_number = attrs['phone_number']
+            if default_region:
+                phone_number = phonenumber.normalize_phone_number(
+                    phone_number, region=default_region) or phone_number
+            phone_numbers.append(phone_number)
+        
+        return User.objects.get_users_by_numbers(phone_numbers)
+
+
 class UserNumberSerializer(AbstractBaseUserSerializer):
     """
     Serializer class to show users public data on read and allows for 
@@ -141,6 +174,7 @@ class UserNumberSerializer(AbstractBaseUserSerializer):
         model = User
         fields = ('id', 'phone_number', 'full_name', 'updated_at')
         read_only_fields = ('id', 'full_name', 'updated_at')
+        list_serializer_class = UserNumberListSerializer
         
     def create(self, validated_data):
         """
@@ -158,19 +192,36 @@ class UserNumberSerializer(AbstractBaseUserSerializer):
                 
             # now try and get a valid phone number using the default
             # region. If able to get one update the data object.
-            try:
-                phone_number_obj = phonenumber.PhoneNumber.from_string(
-                    phone_number=phone_number_str, region=default_region)
-                if phone_number_obj.is_valid():
-                    validated_data['phone_number'] = phone_number_obj.as_e164
-            except phonenumber.NumberParseException:
-                pass
+            phone_number_e164 = phonenumber.normalize_phone_number(
+                phone_number_str, region=default_region)
+            if phone_number_e164:
+                validated_data['phone_number'] = phone_number_e164
 
         number = validated_data.get('phone_number')
         user = User.objects.get_user_by_number(number)
         return user
 
     
+class UserMatchSerializer(serializers.Serializer):
+    """
+    Serializer to be used for validating a batch of phone numbers, typically
+    from a user's address book, to be matched to registered users.
+    """
+    phone_numbers = serializers.ListField(
+        child=serializers.CharField(max_length=64),
+        help_text=_("Required. Phone numbers in any format."))
+    
+    def validate_phone_numbers(self, value):
+        """
+        Check that the number of phone numbers is within allowed limits
+        """
+        if len(value) > settings.ACCOUNT_MAX_MATCH_PHONE_NUMBERS:
+            raise serializers.ValidationError(
+                "Ensure this list has at most %d phone numbers (it has %d)."
+                % (settings.ACCOUNT_MAX_MATCH_PHONE_NUMBERS, len(value)))
+        return value
+
+
 class UserMinimalSerializer(AbstractBaseUserSerializer):
     """
     Serializer to be used for providing minimal information about a User
@@ -1,3 +1,206 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
 from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+from django.utils.six import StringIO
+from rest_framework import exceptions
+from rest_framework.test import APIClient
+
+from gravvy.apps.account.authentication import ExpiringTokenAuthentication
+from gravvy.apps.account.models import User, RecentContact, AuthToken
+from gravvy.apps.activity.models import Activity
 
 # Create your tests here.
+
+class RecentContactTests(TestCase):
+    """
+    Tests of recording and backfilling users' recent contacts
+    """
+    
+    def setUp(self):
+        self.user = User.objects.create_user('+12025550100', 'password')
+        self.contacts = [
+            User.objects.create_user('+120255501%02d' % (i + 1), 'password')
+            for i in range(settings.ACCOUNT_MAX_RECENT_CONTACTS + 2)]
+        self.now = timezone.now()
+    
+    def get_contact_ids(self):
+        return list(RecentContact.objects.filter(
+                user=self.user).values_list('contact_id', flat=True))
+    
+    def test_most_recent_first(self):
+        first, second = self.contacts[:2]
+        RecentContact.objects.record_invites(
+            self.user, [first], self.now - timedelta(minutes=1))
+        RecentContact.objects.record_invites(self.user, [second], self.now)
+        self.assertEqual(self.get_contact_ids(), [second.id, first.id])
+        
+        # inviting a contact again moves them to the front
+        RecentContact.objects.record_invites(
+            self.user, [first], self.now + timedelta(minutes=1))
+        self.assertEqual(self.get_contact_ids(), [first.id, second.id])
+    
+    def test_not_own_contact(self):
+        RecentContact.objects.record_invites(self.user, [self.user])
+        self.assertEqual(self.get_contact_ids(), [])
+    
+    def test_trimmed(self):
+        for i, contact in enumerate(self.contacts):
+            RecentContact.objects.record_invites(
+                self.user, [contact], self.now + timedelta(minutes=i))
+        self.assertEqual(
+            self.get_contact_ids(),
+            [contact.id for contact in reversed(self.contacts)][
+                :settings.ACCOUNT_MAX_RECENT_CONTACTS])
+    
+    def test_backfill(self):
+        user_type = ContentType.objects.get_for_model(User)
+        def invite(contact, minutes):
+            Activity.objects.create(
+                actor=self.user, verb='invite', object_content_type=user_type,
+                object_id=contact.id,
+                created_at=self.now + timedelta(minutes=minutes))
+        invite(self.contacts[0], 0)
+        invite(self.contacts[1], 1)
+        invite(self.contacts[0], 2)
+        invite(self.user, 3)
+        # an outdated recent contact is replaced
+        RecentContact.objects.record_invites(self.user, [self.contacts[2]])
+        
+        call_command('backfillrecentcontacts', stdout=StringIO())
+        self.assertEqual(self.get_contact_ids(),
+                         [self.contacts[0].id, self.contacts[1].id])
+
+
+class TokenCacheTests(TestCase):
+    """
+    Tests of authenticating with cached auth tokens
+    """
+    
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('+12025550100', 'password')
+        self.token = AuthToken.objects.create(user=self.user)
+        self.authentication = ExpiringTokenAuthentication()
+    
+    def authenticate(self, key):
+        return self.authentication.authenticate_credentials(key)
+    
+    def test_cached(self):
+        self.authenticate(self.token.key)
+        # only the user is read once the token is cached
+        with self.assertNumQueries(1):
+            user, token = self.authenticate(self.token.key)
+        self.assertEqual(user, self.user)
+        self.assertEqual(token, self.token)
+    
+    def test_user_not_cached(self):
+        self.authenticate(self.token.key)
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authenticate(self.token.key)
+    
+    def test_deleted(self):
+        self.authenticate(self.token.key)
+        self.token.delete()
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authenticate(self.token.key)
+    
+    def test_not_cached_locally(self):
+        self.authenticate(self.token.key)
+        # another process regenerates the token: its invalidation reaches
+        # the shared cache but not this process's local tier.
+        AuthToken.objects.filter(pk=self.token.pk).update(key='0' * 40)
+        caches['shared'].clear()
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authenticate(self.token.key)
+    
+    def test_refreshed(self):
+        self.authenticate(self.token.key)
+        AuthToken.objects.filter(pk=self.token.pk).update(
+            updated_at=timezone.now() -
+            timedelta(seconds=settings.SESSION_COOKIE_AGE + 1))
+        response = APIClient().post(
+            reverse('obtain_auth_token'),
+            {'phone_number': '+12025550100', 'password': 'password'},
+            format='json')
+        new_key = response.data['token']
+        self.assertNotEqual(new_key, self.token.key)
+        
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authenticate(self.token.key)
+        user, token = self.authenticate(new_key)
+        self.assertEqual(user, self.user)
+
+
+class UserMatchTests(TestCase):
+    """
+    Tests of matching phone numbers, such as those of an address book, to
+    registered users
+    """
+    
+    def setUp(self):
+        self.user = User.objects.create_user('+12025550100', 'password')
+        self.contact = User.objects.create_user('+12025550101', 'password')
+        self.uk_contact = User.objects.create_user('+442079460018', 'password')
+        self.inactive_contact = User.objects.create_user(
+            '+12025550102', 'password')
+        self.inactive_contact.is_active = False
+        self.inactive_contact.save()
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+    
+    def match(self, phone_numbers):
+        return self.client.post(reverse('user-match-list'),
+                                {'phone_numbers': phone_numbers},
+                                format='json')
+    
+    def get_matches(self, phone_numbers):
+        """
+        Get the matched numbers of each matched user's phone number
+        """
+        response = self.match(phone_numbers)
+        self.assertEqual(response.status_code, 200)
+        return dict((user['phone_number'], user['matched_numbers'])
+                    for user in response.data['results'])
+    
+    def test_formats_grouped(self):
+        phone_numbers = ['+1 (202) 555-0101', '202.555.0101', '+12025550101']
+        self.assertEqual(self.get_matches(phone_numbers),
+                         {'+12025550101': phone_numbers})
+    
+    def test_national_numbers_in_user_region(self):
+        # numbers without a country code are assumed to be from the US, like
+        # the requesting user's
+        self.assertEqual(
+            self.get_matches(['(202) 555-0101', '020 7946 0018',
+                              '+44 20 7946 0018']),
+            {'+12025550101': ['(202) 555-0101'],
+             '+442079460018': ['+44 20 7946 0018']})
+    
+    def test_inactive_and_unmatched_excluded(self):
+        self.assertEqual(
+            self.get_matches(['+12025550102', '+12025550199', 'not a number',
+                              '+12025550101']),
+            {'+12025550101': ['+12025550101']})
+        self.assertEqual(self.get_matches([]), {})
+    
+    @override_settings(ACCOUNT_MAX_MATCH_PHONE_NUMBERS=2)
+    def test_too_many_phone_numbers(self):
+        self.assertEqual(self.match(['+12025550101'] * 2).status_code, 200)
+        response = self.match(['+12025550101'] * 3)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('phone_numbers', response.data)
+    
+    def test_anonymous(self):
+        response = APIClient().post(reverse('user-match-list'),
+                                    {'phone_numbers': ['+12025550101']},
+                                    format='json')
+        self.assertEqual(response.status_code, 401)
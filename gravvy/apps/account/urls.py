@@ -12,6 +12,11 @@ urlpatterns = [
     # user list
     url(r'^users/$', views.UserList.as_view(), name='user-list'),
     
+    # match phone numbers to registered users
+    url(r'^users/match/$', 
+        views.UserMatchList.as_view(), 
+        name='user-match-list'),
+    
     # user details and associated lists
     url(r'^users/(?P<phone_number>\+\d{1,15})/$',
         views.UserDetail.as_view(), 
@@ -36,6 +41,10 @@ urlpatterns = [
         views.AuthenticatedUserActivityList.as_view(), 
         name='user-auth-activity-list'),
     
+    url(r'^user/activities/stream/$',
+        views.AuthenticatedUserActivityStream.as_view(), 
+        name='user-auth-activity-stream'),
+    
     url(r'^user/recentcontacts/$',
         views.AuthenticatedUserRecentContactList.as_view(), 
         name='user-auth-recentcontacts-list'),
@@ -4,6 +4,7 @@ from django.conf import settings
 from django.utils import timezone
 from django.db.models import Q, Prefetch
 from django.contrib.contenttypes.models import ContentType
+from django.http import Http404, StreamingHttpResponse
 
 from rest_framework import generics, status, permissions, parsers, renderers
 from rest_framework.authtoken.views import ObtainAuthToken
@@ -12,19 +13,25 @@ from rest_framework.decorators import api_view
 from rest_framework.reverse import reverse
 from rest_framework.views import APIView
 
-from gravvy.apps.account.models import  User, AuthToken, RegistrationProfile
+from gravvy.apps.account.models import (
+    User, AuthToken, RegistrationProfile, RecentContact, token_cache)
 from gravvy.apps.account.permissions import IsOwnerOrReadOnly, IsDetailOwner
 from gravvy.apps.account.authentication import ExpiringTokenAuthentication
 from gravvy.apps.account.serializers import (
     UserPublicSerializer, UserPrivateSerializer, UserCreationSerializer,
-    AuthTokenSerializer, ActivateAccountSerializer)
+    UserMatchSerializer, AuthTokenSerializer, ActivateAccountSerializer)
+from gravvy.fields.phonenumber_field.phonenumber import normalize_phone_number
 
-from gravvy.apps.video.models import Video, VideoUsers, Clip
+from gravvy.apps.video.models import Video, VideoUsers, Clip, Like
 from gravvy.apps.video.serializers import VideoSerializer
 
-from gravvy.apps.activity.models import Activity
-from gravvy.apps.activity.serializers import ActivitySerializer
+from gravvy.apps.activity.models import Activity, ActivityGroup
+from gravvy.apps.activity.serializers import (
+    ActivitySerializer, ActivityGroupSerializer)
 from gravvy.apps.activity.pagination import ActivityCursorPagination
+from gravvy.apps.activity.stream import stream_activities
+from gravvy.apps.rest.negotiation import accepts_webp
+from gravvy.apps.rest.renderers import EventStreamRenderer
 
 # Create your views here.
 
@@ -74,6 +81,7 @@ class UserList(generics.CreateAPIView):
     ## Endpoints
     Name                             | Description                       
     -------------------------------- | ----------------------------------------
+    [`/users/match/`](match/)        | Find the registered users in a list of phone numbers
     [`/users/<phone number>/`](+18005551234/) | Get/Update a specific user's details
     [`/users/<phone number>/videos/`](+18005551234/videos/) | Get a user's associated videos
 
@@ -95,6 +103,77 @@ class UserList(generics.CreateAPIView):
             return UserPublicSerializer
 
 
+class UserMatchList(generics.GenericAPIView):
+    """
+    Find the registered users in a list of phone numbers, such as the contacts
+    in a user's address book. This saves having to look up each phone number
+    individually.
+    
+    ## Reading
+    You can't read using this endpoint.
+    
+    
+    ## Publishing
+    ### Permissions
+    * Only authenticated users can __POST__ using this endpoint.
+    
+    ### Fields
+    Parameter       | Description                                 | Type
+    --------------- | ------------------------------------------- | ----------
+    `phone_numbers` | phone numbers to be matched to users. These don't have to be in E.164 format, as numbers without a country code are assumed to be from the authenticated user's region. **Required** | _array_
+    
+    There is a limit to the number of phone numbers that can be matched per
+    request. Exceeding this results in a `400 Bad Request` response.
+    
+    ### Response
+    A list of the registered users with any of the phone numbers. Each is a 
+    [User object](../+18005551234/) with the following additional field:
+    
+    Name              | Description                             | Type
+    ----------------- | --------------------------------------- | ----------
+    `matched_numbers` | submitted phone numbers matching the user | _array_
+    
+    
+    ## Deleting
+    You can't delete using this endpoint
+    
+    
+    ## Updating
+    You can't update using this endpoint
+    
+    """
+    parser_classes = (parsers.JSONParser,)
+    permission_classes = (permissions.IsAuthenticated,)
+    serializer_class = UserPublicSerializer
+    
+    def post(self, request, *args, **kwargs):
+        serializer = UserMatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        # normalize the phone numbers, keeping track of the submitted phone
+        # numbers with each E.164 representation so these can be returned
+        # with the matched users. 
+        # Numbers without a country code are assumed to be from the same 
+        # region as the requesting user.
+        region = request.user.phone_number.region_code
+        matched_numbers = {}
+        for phone_number in serializer.validated_data['phone_numbers']:
+            phone_number_e164 = normalize_phone_number(phone_number, region)
+            if phone_number_e164:
+                matched_numbers.setdefault(phone_number_e164, []).append(
+                    phone_number)
+        
+        # Get all matching users in one query
+        users = User.objects.filter(
+            phone_number__in=matched_numbers.keys(), is_active=True)
+        
+        results = self.get_serializer(users, many=True).data
+        for user_data in results:
+            user_data['matched_numbers'] = matched_numbers[
+                user_data['phone_number']]
+        return Response({'results': results})
+    
+
 # -----------------------------------------------------------------------------
 # USER'S DETAILS AND ASSOCIATED LISTS
 # -----------------------------------------------------------------------------
@@ -185,6 +264,24 @@ class UserDetail(generics.RetrieveUpdateAPIView):
             serializer_class = UserPublicSerializer
         
         return serializer_class
+    
+    def get_object(self):
+        """
+        Reads get the user from the cache. Updates save the user so they get
+        it from the database.
+        """
+        if self.request.method not in permissions.SAFE_METHODS:
+            return super(UserDetail, self).get_object()
+        
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            user = User.objects.get_cached_by_number(
+                self.kwargs[lookup_url_kwarg])
+        except User.DoesNotExist:
+            raise Http404
+        
+        self.check_object_permissions(self.request, user)
+        return user
  
 
 class UserVideoList(generics.ListAPIView):
@@ -239,19 +336,17 @@ class UserVideoList(generics.ListAPIView):
                 queryset=Clip.objects.select_related('owner'),
                 to_attr='prefetched_clips')
             
-            prefetch_activity_object_likes = Prefetch(
-                'activity_objects',
-                queryset=Activity.objects.filter(actor__phone_number=lookup, 
-                                                 verb='like'),
-                to_attr='prefetched_activity_object_likes'
-                )
+            prefetch_likes = Prefetch(
+                'likes',
+                queryset=Like.objects.filter(user__phone_number=lookup),
+                to_attr='prefetched_likes')
 
             return Video.objects.filter(
                 Q(users__phone_number__in=[lookup]) | 
                 Q(owner__phone_number=lookup)).select_related(
                 'owner').prefetch_related(
                     prefetch_videousers, prefetch_clips,
-                    prefetch_activity_object_likes).distinct()
+                    prefetch_likes).distinct()
         return Video.objects.none()
 
 
@@ -315,6 +410,7 @@ class AuthenticatedUserDetail(generics.RetrieveUpdateAPIView):
     -------------------- | -----------------------------------------------
     [`videos/`](videos/)  | All the videos authenticated user is associated with
     [`activities/`](activities/) | Activities of user's associated videos
+    [`activities/stream/`](activities/stream/) | Realtime stream of these activities
     [`recentcontacts/`](recentcontacts/) | Recent contacts of user
 
     ##
@@ -377,17 +473,16 @@ class AuthenticatedUserVideoList(generics.ListAPIView):
             queryset=Clip.objects.select_related('owner'),
             to_attr='prefetched_clips')
         
-        prefetch_activity_object_likes = Prefetch(
-            'activity_objects',
-            queryset=Activity.objects.filter(actor_id=user.id, verb='like'),
-            to_attr='prefetched_activity_object_likes'
-            )
+        prefetch_likes = Prefetch(
+            'likes',
+            queryset=Like.objects.filter(user_id=user.id),
+            to_attr='prefetched_likes')
         
         return Video.objects.filter(
             Q(users__id__in=[user.id]) | Q(owner_id=user.id)).select_related(
             'owner').prefetch_related(
                 prefetch_videousers, prefetch_clips, 
-                prefetch_activity_object_likes).distinct()
+                prefetch_likes).distinct()
     
 
 class AuthenticatedUserActivityList(generics.ListAPIView):
@@ -410,6 +505,28 @@ class AuthenticatedUserActivityList(generics.ListAPIView):
     `target`     | Activity's target                  | _User/Clip/Video object_
     `created_at` | Activity's creation date/time      | _date/time_
     
+    ### Aggregation
+    Add `?aggregate=true` to the URL to get consecutive activities of an actor
+    with the same verb and target, such as an invite of many users to a video,
+    as a single Activity Group object. Activities without a target are grouped
+    by their object instead. An activity joins a group if it happened within 
+    10 minutes of the group's first activity.
+    
+    Name         | Description                        | Type
+    ------------ | ---------------------------------- | ------------------------
+    `id`         | Unique identifier of the group     | _integer_
+    `actor`      | Activities' actor                  | _User object_
+    `verb`       | Activities' verb                   | _string_
+    `object`     | Latest activity's object           | _User/Clip/Video object_
+    `target`     | Activities' target                 | _User/Clip/Video object_
+    `count`      | Number of activities in the group  | _integer_
+    `sample`     | Latest few objects, latest first   | _list of objects_
+    `created_at` | First activity's date/time         | _date/time_
+    `updated_at` | Latest activity's date/time        | _date/time_
+    
+    Groups are ordered by `created_at`, so they keep their place in the list
+    as they grow.
+    
     
     ## Publishing
     You can't create using this endpoint
@@ -424,24 +541,103 @@ class AuthenticatedUserActivityList(generics.ListAPIView):
    
     """
     permission_classes = (permissions.IsAuthenticated,)
-    serializer_class = ActivitySerializer
     pagination_class = ActivityCursorPagination
+    
+    def is_aggregated(self):
+        """
+        Determine if the activities are listed as activity groups
+        """
+        return self.request.query_params.get('aggregate') in ('1', 'true')
+    
+    def get_serializer_class(self):
+        if self.is_aggregated():
+            return ActivityGroupSerializer
+        return ActivitySerializer
 
     def get_queryset(self):
         """
         This view should return a list of all videos for the request's user
         """
         # get user's associated videos
-        user = self.request.user
-        videos = Video.objects.filter(
-            Q(users__id__in=[user.id]) | Q(owner_id=user.id))
+        video_ids = VideoUsers.objects.get_video_ids(self.request.user)
+        video_type = ContentType.objects.get_for_model(Video)
         
-        return Activity.objects.filter(
-            Q(target_videos__in=videos) | Q(object_videos__in=videos)
-            ).select_related('actor').prefetch_related(
-            'object', 'target').order_by('-created_at')
+        video_filter = (
+            Q(target_content_type=video_type, target_id__in=video_ids) | 
+            Q(object_content_type=video_type, object_id__in=video_ids))
+        if self.is_aggregated():
+            # the groups' objects are loaded with their samples
+            return ActivityGroup.objects.filter(video_filter).select_related(
+                'actor').prefetch_related('target').order_by('-created_at')
+        
+        return Activity.objects.filter(video_filter).select_related(
+            'actor').prefetch_related('object', 'target').order_by(
+            '-created_at')
+    
+    def paginate_queryset(self, queryset):
+        page = super(AuthenticatedUserActivityList, self).paginate_queryset(
+            queryset)
+        if page is not None and self.is_aggregated():
+            ActivityGroup.objects.prefetch_samples(page)
+        return page
             
 
+class AuthenticatedUserActivityStream(APIView):
+    """
+    Stream the activities of videos the authenticated user is associated with
+    as they happen.
+    
+    ## Reading
+    ### Permissions
+    * Only authenticated users can read this endpoint.
+    
+    ### Fields
+    Reading this endpoint opens a stream of 
+    [server-sent events](https://www.w3.org/TR/eventsource/). Each activity is
+    sent as an `activity` event, whose data is an Activity object with the 
+    same fields as those of the [activities list](../), except that `id` is 
+    null for invites: they're recorded in batches, whether users are invited 
+    when a video is created or added to an existing video, and batched 
+    activities don't get their ids back from the database.
+    
+    Idle streams get a keepalive comment every 20 seconds or so. Streams are 
+    closed after 10 minutes, and clients should reconnect after the delay in 
+    the stream's `retry` field. Activities that happen while a client is 
+    disconnected aren't sent when it reconnects, so clients should refresh 
+    the activities list then.
+    
+    
+    ## Publishing
+    You can't create using this endpoint
+    
+    
+    ## Deleting
+    You can't delete using this endpoint
+    
+    
+    ## Updating
+    You can't update using this endpoint
+   
+    """
+    permission_classes = (permissions.IsAuthenticated,)
+    renderer_classes = (EventStreamRenderer, renderers.JSONRenderer)
+    
+    def get(self, request, format=None):
+        # streams are only served by processes made for long lived 
+        # connections
+        if not settings.ACTIVITY_STREAM_SERVE:
+            raise Http404
+        
+        image_format = 'webp' if accepts_webp(request) else 'jpeg'
+        response = StreamingHttpResponse(
+            stream_activities(request.user, image_format),
+            content_type=EventStreamRenderer.media_type)
+        response['Cache-Control'] = 'no-cache'
+        # stop nginx from buffering the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+    
+
 class AuthenticatedUserRecentContactList(generics.GenericAPIView):
     """
     List all recent contacts of authenticated user
@@ -475,18 +671,11 @@ class AuthenticatedUserRecentContactList(generics.GenericAPIView):
         This view should return a list of all recent contacts of the
         request's user
         """
-        user = request.user
-        contacts_ids = Activity.objects.filter(
-            actor_id=user.id, 
-            verb='invite').prefetch_related('object').order_by(
-            '-created_at').values_list('object_id', flat=True).distinct()
-        
-        contacts_ids = list(contacts_ids)
-        contacts = list(User.objects.filter(id__in=contacts_ids).exclude(
-                id=user.id))
-        contacts.sort(key=lambda c: contacts_ids.index(c.id))
-        
-        recent_contacts = contacts[:settings.ACCOUNT_MAX_RECENT_CONTACTS]
+        recent_contacts = [
+            recent_contact.contact for recent_contact in 
+            RecentContact.objects.filter(
+                user_id=request.user.id).select_related('contact')[
+                :settings.ACCOUNT_MAX_RECENT_CONTACTS]]
         serializer = self.get_serializer(recent_contacts, many=True)
         return Response({'results': serializer.data})
     
@@ -571,6 +760,8 @@ class ObtainExpiringAuthToken(ObtainAuthToken):
             # first key generated is unique then use it, else tough luck.
             new_key = token.generate_key()
             if AuthToken.objects.filter(key=new_key).count() == 0:
+                # the old key mustn't authenticate from the cache
+                token_cache.invalidate(token.key)
                 token.key = new_key
             
             # saving auto-updates the updated_at field.
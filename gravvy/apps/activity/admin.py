@@ -1,5 +1,5 @@
 from django.contrib import admin
-from gravvy.apps.activity.models import Activity
+from gravvy.apps.activity.models import Activity, ActivityGroup
 
 # Register your models here.
 
@@ -19,4 +19,23 @@ class ActivityAdmin(admin.ModelAdmin):
         qs = super(ActivityAdmin, self).get_queryset(request)
         return qs.select_related('actor').prefetch_related('object', 'target')
 
+
+class ActivityGroupAdmin(admin.ModelAdmin):
+    """
+    ModelAdmin associated with the ActivityGroup model.
+    """
+    date_hierarchy = 'created_at'
+    list_display = ('__unicode__', 'actor', 'verb', 'target', 'count',
+                    'created_at')
+    list_filter = ('verb',)
+    search_fields = ('actor__phone_number', 'actor__full_name')
+    
+    def get_queryset(self, request):
+        """
+        Prefetch generic relationships
+        """
+        qs = super(ActivityGroupAdmin, self).get_queryset(request)
+        return qs.select_related('actor').prefetch_related('target')
+
 admin.site.register(Activity, ActivityAdmin)
+admin.site.register(ActivityGroup, ActivityGroupAdmin)
@@ -0,0 +1,64 @@
+"""
+Build the activity groups of activities from scratch.
+
+Activities are grouped as they're created, so this is only needed to group
+the activities that were created before the ActivityGroup table was added.
+The groups of each actor are rebuilt from scratch, so the command is safe to
+re-run, though activities an actor creates while their groups are being
+rebuilt may be grouped separately.
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from gravvy.apps.activity.models import Activity, ActivityGroup
+
+
+class Command(BaseCommand):
+    help = "Build the activity groups of activities from scratch."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500, dest='batch_size',
+            help="Number of actors to rebuild the activity groups of at a "
+            "time.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        actors_count = groups_count = 0
+        last_actor_id = 0
+        while True:
+            # page through the actors by id so each batch is a cheap index
+            # range scan no matter how far along we are.
+            actor_ids = list(Activity.objects.filter(
+                    actor_id__gt=last_actor_id).order_by(
+                    'actor_id').values_list('actor_id', flat=True).distinct()[
+                    :batch_size])
+            if not actor_ids:
+                break
+
+            with transaction.atomic():
+                activities = Activity.objects.filter(actor_id__in=actor_ids)
+                activities.update(group=None)
+                ActivityGroup.objects.filter(actor_id__in=actor_ids).delete()
+
+                activities = list(activities.order_by(
+                        'actor_id', 'created_at', 'id').only(
+                        'id', 'actor', 'verb', 'object_content_type',
+                        'object_id', 'target_content_type', 'target_id',
+                        'created_at'))
+                ActivityGroup.objects.add_activities(activities)
+
+                activity_ids = {}
+                for activity in activities:
+                    activity_ids.setdefault(activity.group_id, []).append(
+                        activity.id)
+                for group_id, ids in activity_ids.items():
+                    Activity.objects.filter(id__in=ids).update(
+                        group=group_id)
+
+            actors_count += len(actor_ids)
+            groups_count += len(activity_ids)
+            last_actor_id = actor_ids[-1]
+
+        self.stdout.write("Built %d activity groups of %d actors"
+                          % (groups_count, actors_count))
@@ -0,0 +1,369 @@
+"""
+Load test the realtime activity stream of a running server with many idle
+subscribers, and report how quickly activities reach all of them.
+
+The given user's activity stream is opened by every subscriber. All the
+streams are read by a single thread with epoll, so thousands of them can be
+opened from one box. Once they're all open they're left idle for a while,
+then the user likes and unlikes one of their videos repeatedly, and the time
+between each like request being sent and its activity arriving on each
+stream is measured.
+
+When the server runs on the same box, pass its process id with
+`--server-pid` to also report the CPU time and memory it used while the
+streams were idle.
+
+Results are written as JSON with `--output`, so runs can be compared across
+commits.
+"""
+import json
+import resource
+import select
+import socket
+import threading
+import time
+import urlparse
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import reverse
+from django.utils import timezone
+import requests
+
+from gravvy.utils import percentile, get_commit
+
+
+# ---------------------------------------------------------------------------- #
+# HELPER FUNCTIONS
+# ---------------------------------------------------------------------------- #
+
+def raise_open_files_limit():
+    """
+    Raise the soft limit of open files of this process to its hard limit
+
+    Returns:
+        the new limit
+    """
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard != resource.RLIM_INFINITY and soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        soft = hard
+    return soft
+
+
+def get_process_stats(pid):
+    """
+    Get the CPU time and memory used by a process on this box, from /proc
+
+    Returns:
+        dictionary of the process's `cpu_seconds`, `rss_mb` and `threads`
+    """
+    with open('/proc/%d/stat' % pid) as stat_file:
+        # the process name is in parentheses and may contain spaces
+        fields = stat_file.read().rsplit(')', 1)[1].split()
+    ticks = float(fields[11]) + float(fields[12])
+    page_size = resource.getpagesize()
+    return {
+        'cpu_seconds': ticks / 100,
+        'rss_mb': round(int(fields[21]) * page_size / 1024.0 / 1024.0, 1),
+        'threads': int(fields[17]),
+        }
+
+
+# ---------------------------------------------------------------------------- #
+# STREAMS
+# ---------------------------------------------------------------------------- #
+
+class Stream(object):
+    """
+    An open activity stream, and the times its activities arrived at.
+    """
+
+    def __init__(self, sock):
+        self.socket = sock
+        self.buffer = ''
+        self.status_code = None
+        self.subscribed = False
+        self.closed = False
+        self.keepalives = 0
+        self.activity_times = []
+
+    def feed(self, data, now, is_activity):
+        """
+        Parse data read from the stream
+
+        Args:
+            data: data read
+            now: time the data was read at
+            is_activity: callable taking the data of an activity event and
+                returning True if it's one of the load test's activities
+        """
+        self.buffer += data
+        if self.status_code is None:
+            if '\r\n\r\n' not in self.buffer:
+                return
+            headers, self.buffer = self.buffer.split('\r\n\r\n', 1)
+            self.status_code = int(headers.split(None, 2)[1])
+
+        # events are separated by blank lines
+        events = self.buffer.split('\n\n')
+        self.buffer = events.pop()
+        for event in events:
+            if event.startswith('retry:'):
+                self.subscribed = True
+            elif event.startswith(': keepalive'):
+                self.keepalives += 1
+            elif event.startswith('event: activity'):
+                data = event.split('\ndata: ', 1)[1]
+                if is_activity(json.loads(data)):
+                    self.activity_times.append(now)
+
+
+class StreamReader(threading.Thread):
+    """
+    Reads all open streams with epoll
+    """
+
+    def __init__(self, is_activity):
+        super(StreamReader, self).__init__(name='stream-reader')
+        self.daemon = True
+        self.is_activity = is_activity
+        self.poll = select.epoll()
+        self.streams = {}
+        self.lock = threading.Lock()
+        self.stopped = False
+
+    def add(self, stream):
+        with self.lock:
+            self.streams[stream.socket.fileno()] = stream
+        self.poll.register(stream.socket.fileno(), select.EPOLLIN)
+
+    def run(self):
+        while not self.stopped:
+            for fileno, _ in self.poll.poll(0.5):
+                with self.lock:
+                    stream = self.streams[fileno]
+                try:
+                    data = stream.socket.recv(65536)
+                except socket.error:
+                    data = ''
+                if not data:
+                    stream.closed = True
+                    self.poll.unregister(fileno)
+                    continue
+                stream.feed(data, time.time(), self.is_activity)
+
+    def stop(self):
+        self.stopped = True
+        self.join()
+        for stream in self.streams.values():
+            stream.socket.close()
+
+
+# ---------------------------------------------------------------------------- #
+# COMMAND
+# ---------------------------------------------------------------------------- #
+
+class Command(BaseCommand):
+    help = "Load test the realtime activity stream with idle subscribers."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url', dest='url', required=True,
+            help="Base URL of a running server to load test, e.g. "
+            "http://localhost:8000.")
+        parser.add_argument(
+            '--phone-number', dest='phone_number', required=True,
+            help="Phone number of the user to subscribe and act as. The "
+            "user should be a member of at least one video.")
+        parser.add_argument(
+            '--password', dest='password', default='password',
+            help="Password of the user to subscribe and act as.")
+        parser.add_argument(
+            '--subscribers', type=int, default=1000, dest='subscribers',
+            help="Number of streams to open.")
+        parser.add_argument(
+            '--idle', type=float, default=30, dest='idle',
+            help="Number of seconds to leave the streams idle for.")
+        parser.add_argument(
+            '--events', type=int, default=20, dest='events',
+            help="Number of activities to publish.")
+        parser.add_argument(
+            '--interval', type=float, default=0.5, dest='interval',
+            help="Number of seconds between activities.")
+        parser.add_argument(
+            '--server-pid', type=int, dest='server_pid',
+            help="Process id of the server, if it runs on this box.")
+        parser.add_argument(
+            '--output', dest='output',
+            help="File to write the JSON results to.")
+
+    def handle(self, *args, **options):
+        self.url = options['url'].rstrip('/')
+        self.session = requests.Session()
+        response = self.session.post(
+            self.url + reverse('obtain_auth_token'),
+            json={'phone_number': options['phone_number'],
+                  'password': options['password']})
+        if response.status_code != 200:
+            raise CommandError("Couldn't obtain an auth token: %s"
+                               % response.content)
+        self.token = response.json()['token']
+        self.session.headers['Authorization'] = 'Token ' + self.token
+
+        videos = self.session.get(
+            self.url + reverse('user-auth-video-list')).json()
+        if isinstance(videos, dict):
+            videos = videos['results']
+        if not videos:
+            raise CommandError("%s isn't a member of any videos"
+                               % options['phone_number'])
+        hash_key = videos[0]['hash_key']
+        # make sure the video isn't liked, so each like makes an activity
+        self.session.delete(self.url + reverse(
+                'video-detail-like', kwargs={'hash_key': hash_key}))
+
+        open_files = raise_open_files_limit()
+        if options['subscribers'] + 20 > open_files:
+            raise CommandError("Can only open %d files" % open_files)
+
+        results = self.run(hash_key, options)
+        self.write_summary(results)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2, sort_keys=True)
+            self.stdout.write("Results written to %s" % options['output'])
+
+    def run(self, hash_key, options):
+        """
+        Run the load test
+
+        Returns:
+            dictionary of the results
+        """
+        phone_number = options['phone_number']
+        def is_activity(data):
+            return (data['verb'] == 'like' and
+                    data['actor']['phone_number'] == phone_number)
+        reader = StreamReader(is_activity)
+        reader.start()
+        streams = []
+        try:
+            # open the streams
+            start = time.time()
+            for _ in range(options['subscribers']):
+                stream = self.open_stream()
+                streams.append(stream)
+                reader.add(stream)
+            self.wait_for(lambda: all(s.subscribed or s.closed
+                                      for s in streams), 60)
+            connect_seconds = time.time() - start
+            subscribed = [s for s in streams if s.subscribed]
+
+            # leave them idle
+            server_stats = {}
+            if options['server_pid']:
+                before = get_process_stats(options['server_pid'])
+            time.sleep(options['idle'])
+            if options['server_pid']:
+                after = get_process_stats(options['server_pid'])
+                server_stats = {
+                    'idle_cpu_percent': round(
+                        (after['cpu_seconds'] - before['cpu_seconds']) * 100 /
+                        options['idle'], 2),
+                    'rss_mb': after['rss_mb'],
+                    'threads': after['threads'],
+                    }
+
+            # publish activities
+            like_url = self.url + reverse(
+                'video-detail-like', kwargs={'hash_key': hash_key})
+            sent_times = []
+            for _ in range(options['events']):
+                sent_times.append(time.time())
+                self.session.put(like_url)
+                self.session.delete(like_url)
+                time.sleep(options['interval'])
+            self.wait_for(lambda: all(
+                    len(s.activity_times) >= len(sent_times)
+                    for s in subscribed if not s.closed), 10)
+        finally:
+            reader.stop()
+
+        latencies = sorted(
+            (stream.activity_times[i] - sent_at) * 1000
+            for stream in subscribed
+            for i, sent_at in enumerate(sent_times)
+            if i < len(stream.activity_times))
+        expected = len(subscribed) * len(sent_times)
+        return {
+            'commit': get_commit(),
+            'started_at': timezone.now().isoformat(),
+            'target': self.url,
+            'subscribers': options['subscribers'],
+            'subscribed': len(subscribed),
+            'failed': len(streams) - len(subscribed),
+            'connect_seconds': round(connect_seconds, 2),
+            'idle_seconds': options['idle'],
+            'keepalives_per_stream': (
+                sum(s.keepalives for s in subscribed) / len(subscribed)
+                if subscribed else 0),
+            'server': server_stats,
+            'events': len(sent_times),
+            'deliveries': len(latencies),
+            'missed_deliveries': expected - len(latencies),
+            'latency_ms': {
+                'p50': round(percentile(latencies, 50), 2),
+                'p95': round(percentile(latencies, 95), 2),
+                'p99': round(percentile(latencies, 99), 2),
+                'max': round(latencies[-1], 2),
+                } if latencies else None,
+            }
+
+    def open_stream(self):
+        """
+        Open an activity stream. HTTP/1.0 is used so the stream isn't sent
+        with chunked transfer encoding.
+        """
+        url = urlparse.urlparse(self.url)
+        sock = socket.create_connection(
+            (url.hostname, url.port or 80), timeout=10)
+        sock.sendall(
+            'GET %s HTTP/1.0\r\n'
+            'Host: %s\r\n'
+            'Accept: text/event-stream\r\n'
+            'Authorization: Token %s\r\n\r\n'
+            % (reverse('user-auth-activity-stream'), url.netloc, self.token))
+        sock.setblocking(0)
+        return Stream(sock)
+
+    def wait_for(self, condition, timeout):
+        """
+        Wait for a condition to be met, for up to `timeout` seconds
+        """
+        deadline = time.time() + timeout
+        while not condition() and time.time() < deadline:
+            time.sleep(0.1)
+
+    def write_summary(self, results):
+        self.stdout.write(
+            "%s: %d/%d streams open after %.1fs, %d failed" % (
+                results['target'], results['subscribed'],
+                results['subscribers'], results['connect_seconds'],
+                results['failed']))
+        server = results['server']
+        if server:
+            self.stdout.write(
+                "server while idle for %ss: %.2f%% CPU, %.1f MB RSS, "
+                "%d threads" % (results['idle_seconds'],
+                                server['idle_cpu_percent'], server['rss_mb'],
+                                server['threads']))
+        latency = results['latency_ms']
+        self.stdout.write(
+            "%d events: %d deliveries, %d missed" % (
+                results['events'], results['deliveries'],
+                results['missed_deliveries']))
+        if latency:
+            self.stdout.write(
+                "delivery latency: p50 %.1f ms, p95 %.1f ms, p99 %.1f ms, "
+                "max %.1f ms" % (latency['p50'], latency['p95'],
+                                 latency['p99'], latency['max']))
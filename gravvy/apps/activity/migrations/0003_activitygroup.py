@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.utils.timezone
+from django.conf import settings
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('activity', '0002_auto_20160831_0603'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityGroup',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('verb', models.CharField(max_length=50, verbose_name='verb', choices=[(b'add', 'add'), (b'delete', 'delete'), (b'follow', 'start following'), (b'invite', 'invite'), (b'leave', 'left'), (b'like', 'like'), (b'play', 'play'), (b'post', 'post'), (b'share', 'share'), (b'stop-following', 'stop following'), (b'unlike', 'unlike'), (b'unshare', 'unshare')])),
+                ('object_id', models.PositiveIntegerField(null=True, blank=True)),
+                ('target_id', models.PositiveIntegerField(null=True, blank=True)),
+                ('count', models.PositiveIntegerField(default=1, help_text='Number of activities in group', verbose_name='count')),
+                ('sample_object_ids', models.CommaSeparatedIntegerField(help_text='Ids of a sample of the objects, latest first', max_length=255, verbose_name='sample object ids', blank=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='date created', db_index=True)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='date updated')),
+                ('actor', models.ForeignKey(related_name='activity_groups', verbose_name='actor', to=settings.AUTH_USER_MODEL)),
+                ('object_content_type', models.ForeignKey(related_name='+', blank=True, to='contenttypes.ContentType', null=True)),
+                ('target_content_type', models.ForeignKey(related_name='+', blank=True, to='contenttypes.ContentType', null=True)),
+            ],
+            options={
+                'ordering': ('-created_at',),
+            },
+        ),
+        migrations.AddField(
+            model_name='activity',
+            name='group',
+            field=models.ForeignKey(related_name='activities', on_delete=django.db.models.deletion.DO_NOTHING, verbose_name='group', blank=True, to='activity.ActivityGroup', null=True),
+        ),
+        migrations.AlterIndexTogether(
+            name='activitygroup',
+            index_together=set([('target_content_type', 'target_id'), ('actor', 'created_at'), ('object_content_type', 'object_id')]),
+        ),
+    ]
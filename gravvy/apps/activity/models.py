@@ -8,8 +8,10 @@ Refs:
       - https://github.com/justquick/django-activity-stream [great but bloated]
       - https://github.com/paulosman/django-activity
 """
-from collections import OrderedDict
+from collections import OrderedDict, defaultdict
+from datetime import timedelta
 
+from django.conf import settings
 from django.db import models
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
@@ -20,12 +22,27 @@ from django.utils.translation import ugettext_lazy as _
 from django.core.urlresolvers import reverse
 
 from gravvy.apps.account.models import User
-from gravvy.apps.activity.signals import activity
-from gravvy.apps.activity.utils import activity_handler
+from gravvy.apps.activity.signals import activity, activity_batch
+from gravvy.apps.activity.utils import activity_handler, activity_batch_handler
 from gravvy.apps.activity import schema
 
 
 # Create your models here.
+class ActivityQuerySet(models.QuerySet):
+    """
+    QuerySet of activities that keeps the groups of deleted activities up to
+    date.
+    """
+    
+    def delete(self):
+        group_ids = set(self.filter(group__isnull=False).values_list(
+                'group_id', flat=True))
+        super(ActivityQuerySet, self).delete()
+        ActivityGroup.objects.refresh(group_ids)
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
 class Activity(models.Model):
     """
     Activity describes an actor acting out a verb (on an optional object) 
@@ -84,6 +101,14 @@ class Activity(models.Model):
         _('activity timestamp/date created'), default=timezone.now, 
         db_index=True)
     
+    # group of consecutive activities this belongs to. Groups are only ever
+    # deleted once they have no activities left.
+    group = models.ForeignKey(
+        'ActivityGroup', related_name='activities', blank=True, null=True,
+        on_delete=models.DO_NOTHING, verbose_name=_('group'))
+    
+    objects = ActivityQuerySet.as_manager()
+    
     class Meta:
         ordering=('-created_at',)
     
@@ -156,5 +181,264 @@ class Activity(models.Model):
         return self.object.get_absolute_url() if self.object else None
 
 
-# connect the signal
+class ActivityGroupManager(models.Manager):
+    """
+    Custom manager for the ActivityGroup model
+    """
+    
+    def add_activities(self, activities):
+        """
+        Add activities that are about to be created to their groups. An 
+        activity joins the latest group of its actor if it has the same key
+        as the group and happened within ACTIVITY_GROUP_WINDOW seconds after
+        the group's first activity. Otherwise it starts a new group.
+        
+        This takes a query for each actor of the activities, and one for each
+        group joined or started. Joined groups have their counts incremented
+        rather than overwritten, so concurrent activities of the actor joining
+        the same group are all counted.
+        
+        Args:
+            activities: unsaved Activity objects in the order they happened,
+                with their objects and targets set. Their groups are set.
+        """
+        window = timedelta(seconds=settings.ACTIVITY_GROUP_WINDOW)
+        latest_groups = {}
+        # counts of the existing groups when they were read, by object id
+        read_counts = {}
+        # groups of the activities, and the groups to save by object id
+        activity_groups = []
+        changed_groups = OrderedDict()
+        for activity in activities:
+            actor_id = activity.actor_id
+            if actor_id not in latest_groups:
+                latest_groups[actor_id] = self.filter(
+                    actor_id=actor_id).order_by('-created_at', '-id').first()
+                if latest_groups[actor_id] is not None:
+                    read_counts[id(latest_groups[actor_id])] = \
+                        latest_groups[actor_id].count
+            
+            group = latest_groups[actor_id]
+            if (group is not None and 
+                group.get_key() == ActivityGroup.get_activity_key(activity) and
+                group.created_at <= activity.created_at <= 
+                group.created_at + window):
+                group.add(activity)
+            else:
+                group = ActivityGroup.from_activity(activity)
+                latest_groups[actor_id] = group
+            activity_groups.append(group)
+            changed_groups[id(group)] = group
+        
+        for group in changed_groups.values():
+            if group.pk is None:
+                group.save()
+                continue
+            # the latest object and sample are those of the last update
+            self.filter(pk=group.pk).update(
+                count=models.F('count') + group.count - read_counts[id(group)],
+                object_id=group.object_id,
+                sample_object_ids=group.sample_object_ids,
+                updated_at=group.updated_at)
+        for activity, group in zip(activities, activity_groups):
+            activity.group = group
+    
+    def refresh(self, group_ids):
+        """
+        Bring groups up to date after some of their activities were deleted.
+        Groups without activities left are deleted.
+        
+        Args:
+            group_ids: ids of the groups to refresh
+        """
+        if not group_ids:
+            return
+        
+        # groups are bounded by the grouping window, so there aren't many
+        # activities left in them.
+        groups = OrderedDict()
+        for group_id, object_id, created_at in Activity.objects.filter(
+            group_id__in=group_ids).order_by(
+            'group_id', '-created_at', '-id').values_list(
+            'group_id', 'object_id', 'created_at'):
+            groups.setdefault(group_id, []).append((object_id, created_at))
+        
+        empty_group_ids = set(group_ids) - set(groups)
+        if empty_group_ids:
+            self.filter(id__in=empty_group_ids).delete()
+        
+        for group_id, group_activities in groups.items():
+            object_ids = [object_id for object_id, created_at in
+                          group_activities if object_id is not None]
+            self.filter(id=group_id).update(
+                count=len(group_activities),
+                object_id=group_activities[0][0],
+                sample_object_ids=ActivityGroup.join_sample(object_ids),
+                updated_at=group_activities[0][1])
+    
+    def prefetch_samples(self, groups):
+        """
+        Load the sample objects of groups, with one query per type of object.
+        The latest object of each group is the first of its sample, so this
+        loads the groups' objects too.
+        
+        Args:
+            groups: list of ActivityGroup objects
+        """
+        object_ids = defaultdict(set)
+        for group in groups:
+            if group.object_content_type_id is not None:
+                object_ids[group.object_content_type_id].update(
+                    group.get_sample_ids())
+        
+        objects = {}
+        for content_type_id, ids in object_ids.items():
+            model = ContentType.objects.get_for_id(
+                content_type_id).model_class()
+            objects[content_type_id] = model._base_manager.in_bulk(ids)
+        
+        for group in groups:
+            found = objects.get(group.object_content_type_id, {})
+            group._sample_objects = [
+                found[object_id] for object_id in group.get_sample_ids() 
+                if object_id in found]
+            if group.object_id in found:
+                group.object = found[group.object_id]
+
+
+class ActivityGroup(models.Model):
+    """
+    Consecutive activities of an actor with the same verb and target, such as
+    an invite of many users to a video, shown as one item in the activity
+    feed. Activities without a target are grouped by their object instead,
+    so a group is always about a single target or object.
+    
+    Groups are kept up to date as activities are created and deleted. They
+    keep the latest object of their activities, and a small sample of the
+    objects, latest first.
+    """
+    actor = models.ForeignKey(User, related_name="activity_groups",
+                              verbose_name=_('actor'))
+    
+    verb = models.CharField(
+        _('verb'), max_length=50, choices=schema.VERB_CHOICES)
+    
+    # latest object
+    object_content_type = models.ForeignKey(
+        ContentType, related_name='+', blank=True, null=True)
+    object_id = models.PositiveIntegerField(blank=True, null=True)
+    object = GenericForeignKey('object_content_type', 'object_id')
+    
+    # target
+    target_content_type = models.ForeignKey(
+        ContentType, related_name='+', blank=True, null=True)
+    target_id = models.PositiveIntegerField(blank=True, null=True)
+    target = GenericForeignKey('target_content_type', 'target_id')
+    
+    count = models.PositiveIntegerField(
+        _('count'), default=1, help_text=_("Number of activities in group"))
+    
+    sample_object_ids = models.CommaSeparatedIntegerField(
+        _('sample object ids'), max_length=255, blank=True,
+        help_text=_("Ids of a sample of the objects, latest first"))
+    
+    # time of the first and latest activities
+    created_at = models.DateTimeField(
+        _('date created'), default=timezone.now, db_index=True)
+    updated_at = models.DateTimeField(
+        _('date updated'), default=timezone.now)
+    
+    objects = ActivityGroupManager()
+    
+    class Meta:
+        ordering = ('-created_at',)
+        index_together = (('actor', 'created_at'),
+                          ('target_content_type', 'target_id'),
+                          ('object_content_type', 'object_id'))
+    
+    def __unicode__(self):
+        return u'%s %s %d' % (self.actor, self.verb, self.count)
+    
+    @staticmethod
+    def get_activity_key(activity):
+        """
+        Get the key an activity is grouped by: its verb and target, and the
+        type of its object. Activities without a target are grouped by their
+        object instead.
+        """
+        return (activity.verb, activity.target_content_type_id,
+                activity.target_id, activity.object_content_type_id,
+                activity.object_id if activity.target_id is None else None)
+    
+    @staticmethod
+    def join_sample(object_ids):
+        """
+        Get the sample object ids to store from the ids of a group's objects,
+        latest first
+        """
+        return ','.join(str(object_id) for object_id in 
+                        object_ids[:settings.ACTIVITY_GROUP_SAMPLE_SIZE])
+    
+    @classmethod
+    def from_activity(cls, activity):
+        """
+        Start a group with an activity
+        
+        Returns:
+            unsaved ActivityGroup object
+        """
+        return cls(
+            actor_id=activity.actor_id, verb=activity.verb,
+            object_content_type_id=activity.object_content_type_id,
+            object_id=activity.object_id,
+            target_content_type_id=activity.target_content_type_id,
+            target_id=activity.target_id,
+            sample_object_ids=cls.join_sample(
+                [activity.object_id] if activity.object_id is not None
+                else []),
+            created_at=activity.created_at, updated_at=activity.created_at)
+    
+    def get_key(self):
+        """
+        Get the key of the group's activities
+        """
+        return (self.verb, self.target_content_type_id, self.target_id,
+                self.object_content_type_id,
+                self.object_id if self.target_id is None else None)
+    
+    def get_sample_ids(self):
+        """
+        Get the ids of the sample of the group's objects, latest first
+        """
+        return [int(object_id) for object_id in 
+                self.sample_object_ids.split(',') if object_id]
+    
+    @property
+    def sample_objects(self):
+        """
+        The sample of the group's objects, latest first. Load these for many
+        groups at once with `ActivityGroup.objects.prefetch_samples()`.
+        """
+        if not hasattr(self, '_sample_objects'):
+            ActivityGroup.objects.prefetch_samples([self])
+        return self._sample_objects
+    
+    def add(self, activity):
+        """
+        Add a later activity with the same key to the group
+        
+        Args:
+            activity: unsaved Activity object
+        """
+        self.count += 1
+        self.updated_at = activity.created_at
+        if activity.object_id is not None:
+            self.object_id = activity.object_id
+            self.sample_object_ids = self.join_sample(
+                [activity.object_id] + self.get_sample_ids())
+
+
+# connect the signals
 activity.connect(activity_handler, dispatch_uid="gravvy.apps.activity.models")
+activity_batch.connect(activity_batch_handler, 
+                       dispatch_uid="gravvy.apps.activity.models")
@@ -1,7 +1,7 @@
 
 from rest_framework import serializers
 
-from gravvy.apps.activity.models import Activity
+from gravvy.apps.activity.models import Activity, ActivityGroup
 
 from gravvy.apps.account.models import User
 from gravvy.apps.account.serializers import UserMinimalSerializer
@@ -10,6 +10,8 @@ from gravvy.apps.video.models import Clip, Video
 from gravvy.apps.video.serializers import (
     ClipMinimalSerializer, VideoMinimalSerializer)
 
+from gravvy.apps.monitoring.serializers import ProfiledSerializerMixin
+
 class ActivityRelatedField(serializers.RelatedField):
     """
     A custom field to use for the `target` and `object` generic relationships
@@ -19,20 +21,23 @@ class ActivityRelatedField(serializers.RelatedField):
         """
         Serialize user instances using a user serializer, clip instances using a
         clip serializer, and video Instances using a video serializer.
+        The request context is passed on so the nested serializers can pick
+        the right thumbnail formats.
         """
         if isinstance(value, User):
-            serializer = UserMinimalSerializer(value)
+            serializer = UserMinimalSerializer(value, context=self.context)
         elif isinstance(value, Clip):
-            serializer = ClipMinimalSerializer(value)
+            serializer = ClipMinimalSerializer(value, context=self.context)
         elif isinstance(value, Video):
-            serializer = VideoMinimalSerializer(value)
+            serializer = VideoMinimalSerializer(value, context=self.context)
         else:
             raise Exception('Unexpected type of target or object')
         
         return serializer.data
             
 
-class ActivitySerializer(serializers.ModelSerializer):
+class ActivitySerializer(ProfiledSerializerMixin,
+                         serializers.ModelSerializer):
     """
     Serializer to be used for getting Activities
     """
@@ -45,3 +50,21 @@ class ActivitySerializer(serializers.ModelSerializer):
         fields = ('id', 'actor', 'verb', 'object', 'target', 'created_at',)
         read_only_fields = ('verb', 'created_at',)
 
+
+class ActivityGroupSerializer(ProfiledSerializerMixin,
+                              serializers.ModelSerializer):
+    """
+    Serializer to be used for getting activity groups. The `object` is the
+    group's latest object, and the `sample` the latest few of its objects.
+    """
+    actor = UserMinimalSerializer(read_only=True)
+    object = ActivityRelatedField(read_only=True)
+    target = ActivityRelatedField(read_only=True)
+    sample = ActivityRelatedField(
+        many=True, read_only=True, source='sample_objects')
+    
+    class Meta:
+        model = ActivityGroup
+        fields = ('id', 'actor', 'verb', 'object', 'target', 'count',
+                  'sample', 'created_at', 'updated_at',)
+        read_only_fields = ('verb', 'count', 'created_at', 'updated_at',)
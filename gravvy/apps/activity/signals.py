@@ -1,5 +1,35 @@
 from django.dispatch import Signal
 
+
+class ActivitySignal(Signal):
+    """
+    Activity creation signal that can also send a batch of activities with
+    `send_many`. Receivers of the batch get all the activities at once so
+    they can process them in bulk.
+    """
+    
+    def send_many(self, sender, activities):
+        """
+        Send a batch of activities performed by the same actor to all 
+        connected `activity_batch` receivers.
+        
+        Args:
+            sender: actor that performed all the activities
+            activities: list of dictionaries of the keyword arguments that
+                would be sent with each activity, i.e. `verb` and optionally
+                `object` and `target`.
+        
+        Returns:
+            list of tuple pairs [(receiver, response), ... ]
+        """
+        if not activities:
+            return []
+        return activity_batch.send(sender, activities=activities)
+
+
 # activity creation signal
-activity = Signal(providing_args=['verb', 'object', 'target',
-                                  'created_at'])
+activity = ActivitySignal(providing_args=['verb', 'object', 'target',
+                                          'created_at'])
+
+# batch activity creation signal, sent by `activity.send_many`
+activity_batch = Signal(providing_args=['activities'])
@@ -0,0 +1,478 @@
+"""
+Realtime stream of the activities of users' videos.
+
+Activities are published as they're created, to the topics of the video
+they're about and, for invites, of the invited user. They're serialized when
+they're published so streaming them never reads them back from the database.
+Each process has a bus that routes published activities to the subscriptions
+of the streams that process serves.
+
+With PostgreSQL, activities are published with NOTIFY on the
+ACTIVITY_STREAM_CHANNEL channel, which the bus of every process serving
+streams LISTENs to on a connection of its own. Notifications are only
+delivered once the transaction that published them commits. With other
+databases activities are only published to the bus of the publishing process,
+which is enough for the development server.
+
+A stream holds its HTTP connection open while it waits for activities, so
+the stream endpoint is only served by processes with the
+ACTIVITY_STREAM_SERVE setting on: gunicorn's gevent worker running
+`gravvy.wsgi_stream`, as described in the README. Idle streams wait without a timeout:
+timed waits of Python 2 poll, so thousands of them would keep the CPU busy.
+The bus thread instead wakes all streams every ACTIVITY_STREAM_KEEPALIVE
+seconds to send a keepalive. Waiting streams don't hold a database
+connection.
+
+Table Of Contents:
+    Subscription: a stream's subscription to the activities of its topics
+    ActivityBus: routes published activities to the subscriptions of a process
+    get_activity_topics: get the topics an activity is published to
+    publish_activities: publish activities to the bus of every process
+    stream_activities: generate the server-sent events of a user's stream
+    activity_bus: the bus of this process
+"""
+
+import collections
+import json
+import logging
+import select
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, connections, DEFAULT_DB_ALIAS
+from rest_framework.renderers import JSONRenderer
+
+from gravvy.apps.account.models import User
+from gravvy.apps.activity.serializers import ActivitySerializer
+from gravvy.apps.monitoring.metrics import (
+    ACTIVITY_STREAM_SUBSCRIPTIONS, ACTIVITY_STREAM_EVENTS)
+from gravvy.apps.rest.negotiation import IMAGE_FORMAT_QUERY_PARAM
+from gravvy.apps.video.models import Video, VideoUsers
+
+logger = logging.getLogger('gravvy.activity')
+
+# image formats of the thumbnails of streamed activities. Activities are
+# serialized in each of them, the first being the default.
+IMAGE_FORMATS = ('jpeg', 'webp')
+
+# max size of a NOTIFY payload, in bytes
+MAX_PAYLOAD_SIZE = 7999
+
+# number of seconds to wait before listening again after losing the
+# listening connection
+RECONNECT_DELAY = 5
+
+# number of milliseconds clients should wait before reconnecting to a closed
+# stream
+RETRY_DELAY = 3000
+
+# message that wakes a subscription up to send a keepalive
+KEEPALIVE = object()
+
+# activity published to a subscription: the topics it was published to and
+# its server-sent event, by image format.
+Message = collections.namedtuple('Message', ['topics', 'events'])
+
+
+def get_video_topic(video_id):
+    return 'video:%s' % video_id
+
+
+def get_user_topic(user_id):
+    return 'user:%s' % user_id
+
+
+class ImageFormatRequest(object):
+    """
+    Stand-in for the request in the context of the serializers of published
+    activities, which only use it to pick the format of thumbnail URLs. The
+    URLs of stored files are left as they are.
+    """
+
+    def __init__(self, image_format):
+        self.query_params = self.GET = {IMAGE_FORMAT_QUERY_PARAM: image_format}
+        self.META = {}
+
+    def build_absolute_uri(self, location):
+        return location
+
+
+# ---------------------------------------------------------------------------- #
+# SUBSCRIPTIONS
+# ---------------------------------------------------------------------------- #
+
+class Subscription(object):
+    """
+    A stream's subscription to the activities of a user's videos. Published
+    activities are queued until the stream gets them.
+    """
+
+    def __init__(self, user_id, image_format=IMAGE_FORMATS[0]):
+        """
+        Args:
+            user_id: id of user whose videos' activities are subscribed to
+            image_format: format of the thumbnails of the activities
+        """
+        self.user_id = user_id
+        self.user_topic = get_user_topic(user_id)
+        self.image_format = image_format
+        # topics are updated by the bus
+        self.topics = frozenset()
+        self._messages = collections.deque()
+        self._ready = threading.Event()
+
+    def get_topics(self, video_ids):
+        """
+        Get the topics of the subscription: those of the user and of the
+        user's videos.
+
+        Args:
+            video_ids: ids of the user's videos
+        """
+        return frozenset([self.user_topic] +
+                         [get_video_topic(video_id) for video_id in video_ids])
+
+    def put(self, message):
+        """
+        Queue a message and wake the stream up
+        """
+        self._messages.append(message)
+        self._ready.set()
+
+    def get(self):
+        """
+        Wait for messages. This waits without a timeout, so a subscription
+        doesn't use any CPU until it gets a message.
+
+        Returns:
+            list of Message instances and KEEPALIVEs, in the order they were
+            queued
+        """
+        self._ready.wait()
+        self._ready.clear()
+        messages = []
+        while self._messages:
+            messages.append(self._messages.popleft())
+        return messages
+
+    def get_event(self, message):
+        """
+        Get the server-sent event of a message in the subscription's image
+        format
+        """
+        return message.events.get(self.image_format,
+                                  message.events[IMAGE_FORMATS[0]])
+
+
+# ---------------------------------------------------------------------------- #
+# BUS
+# ---------------------------------------------------------------------------- #
+
+class ActivityBus(object):
+    """
+    Routes published activities to the subscriptions of this process, by
+    topic, and wakes all subscriptions up periodically to send keepalives.
+
+    The bus thread, started by the first subscription, listens for activities
+    published by other processes and sends the keepalives.
+    """
+
+    def __init__(self):
+        # subscriptions by topic
+        self._subscriptions = {}
+        self._all_subscriptions = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def subscribe(self, subscription):
+        """
+        Add a subscription to the bus, starting the bus thread if needed.
+        """
+        with self._lock:
+            self._all_subscriptions.add(subscription)
+            self._index(subscription, subscription.topics)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self.run, name='activity-bus')
+                self._thread.daemon = True
+                self._thread.start()
+        ACTIVITY_STREAM_SUBSCRIPTIONS.inc()
+
+    def unsubscribe(self, subscription):
+        """
+        Remove a subscription from the bus
+        """
+        with self._lock:
+            self._all_subscriptions.discard(subscription)
+            self._unindex(subscription, subscription.topics)
+        ACTIVITY_STREAM_SUBSCRIPTIONS.dec()
+
+    def set_topics(self, subscription, topics):
+        """
+        Change the topics of a subscription on the bus
+        """
+        with self._lock:
+            self._unindex(subscription, subscription.topics - topics)
+            self._index(subscription, topics - subscription.topics)
+            subscription.topics = topics
+
+    def _index(self, subscription, topics):
+        for topic in topics:
+            self._subscriptions.setdefault(topic, set()).add(subscription)
+
+    def _unindex(self, subscription, topics):
+        for topic in topics:
+            subscriptions = self._subscriptions.get(topic)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[topic]
+
+    def dispatch(self, payload):
+        """
+        Route a published activity to the subscriptions of its topics. The
+        activity's server-sent events are rendered once, however many
+        subscriptions get them.
+
+        Args:
+            payload: published JSON payload with the `topics` of the activity
+                and the activity serialized in each image format
+        """
+        if not self._all_subscriptions:
+            return
+
+        payload = json.loads(payload)
+        with self._lock:
+            subscriptions = set()
+            for topic in payload['topics']:
+                subscriptions.update(self._subscriptions.get(topic, ()))
+        if not subscriptions:
+            return
+
+        renderer = JSONRenderer()
+        message = Message(
+            frozenset(payload['topics']),
+            dict((image_format, 'event: activity\ndata: %s\n\n' %
+                  renderer.render(data))
+                 for image_format, data in payload['activity'].items()))
+        for subscription in subscriptions:
+            subscription.put(message)
+        ACTIVITY_STREAM_EVENTS.labels('delivered').inc(len(subscriptions))
+
+    def tick(self):
+        """
+        Wake all subscriptions up to send a keepalive
+        """
+        with self._lock:
+            subscriptions = list(self._all_subscriptions)
+        for subscription in subscriptions:
+            subscription.put(KEEPALIVE)
+
+    def run(self):
+        """
+        Bus thread: listen for published activities and send keepalives,
+        forever.
+        """
+        keepalive = settings.ACTIVITY_STREAM_KEEPALIVE
+        while True:
+            if connections[DEFAULT_DB_ALIAS].vendor != 'postgresql':
+                # activities are dispatched by the processes publishing them
+                time.sleep(keepalive)
+                self.tick()
+                continue
+
+            try:
+                self.listen(keepalive)
+            except Exception:
+                logger.exception("Activity stream listener failed")
+                time.sleep(RECONNECT_DELAY)
+
+    def listen(self, keepalive):
+        """
+        Listen for activities published with NOTIFY, sending keepalives
+        every `keepalive` seconds. This only returns on errors.
+
+        The listening connection is opened outside of Django's connection
+        handling so it's never closed at the end of a request.
+        """
+        database = connections[DEFAULT_DB_ALIAS]
+        listener = database.get_new_connection(
+            database.get_connection_params())
+        try:
+            listener.autocommit = True
+            listener.cursor().execute(
+                'LISTEN "%s"' % settings.ACTIVITY_STREAM_CHANNEL)
+            next_tick = time.time() + keepalive
+            while True:
+                timeout = max(next_tick - time.time(), 0)
+                if select.select([listener], [], [], timeout)[0]:
+                    listener.poll()
+                    while listener.notifies:
+                        self.dispatch(listener.notifies.pop(0).payload)
+                if time.time() >= next_tick:
+                    self.tick()
+                    next_tick = time.time() + keepalive
+        finally:
+            listener.close()
+
+
+# the bus of this process
+activity_bus = ActivityBus()
+
+
+# ---------------------------------------------------------------------------- #
+# PUBLISHING
+# ---------------------------------------------------------------------------- #
+
+def get_activity_topics(activity):
+    """
+    Get the topics an activity is published to: that of the video it's
+    about, and of the invited user of invites.
+
+    Args:
+        activity: Activity instance
+
+    Returns:
+        list of topics
+    """
+    video_type = ContentType.objects.get_for_model(Video)
+    topics = []
+    if activity.target_content_type_id == video_type.id:
+        topics.append(get_video_topic(activity.target_id))
+    elif activity.object_content_type_id == video_type.id:
+        topics.append(get_video_topic(activity.object_id))
+
+    user_type = ContentType.objects.get_for_model(User)
+    if (activity.verb == 'invite' and
+        activity.object_content_type_id == user_type.id):
+        topics.append(get_user_topic(activity.object_id))
+    return topics
+
+
+def get_activity_payload(activity):
+    """
+    Get the payload an activity is published with
+
+    Args:
+        activity: Activity instance with its actor, object and target loaded
+
+    Returns:
+        JSON payload, or None if the activity can't be published
+    """
+    topics = get_activity_topics(activity)
+    if not topics:
+        return None
+
+    serialized = {}
+    for image_format in IMAGE_FORMATS:
+        data = ActivitySerializer(activity, context={
+                'request': ImageFormatRequest(image_format)}).data
+        # only formats that make a difference are published
+        if data not in serialized.values():
+            serialized[image_format] = data
+
+    renderer = JSONRenderer()
+    payload = renderer.render({'topics': topics, 'activity': serialized})
+    if len(payload) > MAX_PAYLOAD_SIZE:
+        # fall back to the default image format
+        payload = renderer.render({
+                'topics': topics,
+                'activity': {IMAGE_FORMATS[0]: serialized[IMAGE_FORMATS[0]]}})
+    if len(payload) > MAX_PAYLOAD_SIZE:
+        logger.warning("Activity %s is too large to publish", activity.pk)
+        return None
+    return payload
+
+
+def publish_activities(activities):
+    """
+    Publish activities to the buses of all processes
+
+    Args:
+        activities: list of Activity instances with their actor, object and
+            target loaded
+
+    Returns:
+        None
+    """
+    payloads = filter(None, [get_activity_payload(activity)
+                             for activity in activities])
+    if not payloads:
+        return
+
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT pg_notify(%s, payload) FROM unnest(%s::text[]) '
+                'AS payload', [settings.ACTIVITY_STREAM_CHANNEL, payloads])
+    else:
+        for payload in payloads:
+            activity_bus.dispatch(payload)
+    ACTIVITY_STREAM_EVENTS.labels('published').inc(len(payloads))
+
+
+# ---------------------------------------------------------------------------- #
+# STREAMING
+# ---------------------------------------------------------------------------- #
+
+def release_connection():
+    """
+    Close the database connection of this thread, unless it's in a
+    transaction, so waiting streams don't hold connections.
+    """
+    if not connection.in_atomic_block:
+        connection.close()
+
+
+def stream_activities(user, image_format=IMAGE_FORMATS[0]):
+    """
+    Generate the server-sent events of the realtime activity stream of a
+    user's videos: an `activity` event with each activity, and keepalive
+    comments in between. The stream ends after ACTIVITY_STREAM_MAX_AGE
+    seconds.
+
+    The user's videos are looked up again, from the cache, on every
+    keepalive, and right away when the user is invited to a video.
+
+    Args:
+        user: user whose videos' activities are streamed
+        image_format: format of the thumbnails of the activities
+
+    Yields:
+        server-sent event strings
+    """
+    # subscribe on the first iteration, as unstarted generators aren't
+    # finalized when the response is closed.
+    subscription = Subscription(user.id, image_format)
+    subscription.topics = subscription.get_topics(
+        VideoUsers.objects.get_video_ids(user))
+    activity_bus.subscribe(subscription)
+    try:
+        closes_at = time.time() + settings.ACTIVITY_STREAM_MAX_AGE
+        yield 'retry: %d\n\n' % RETRY_DELAY
+
+        while True:
+            release_connection()
+            events = []
+            for message in subscription.get():
+                if message is KEEPALIVE:
+                    if time.time() >= closes_at:
+                        if events:
+                            yield ''.join(events)
+                        return
+                    activity_bus.set_topics(
+                        subscription, subscription.get_topics(
+                            VideoUsers.objects.get_video_ids(user)))
+                    events.append(': keepalive\n\n')
+                else:
+                    if subscription.user_topic in message.topics:
+                        # the user was invited to a video
+                        activity_bus.set_topics(
+                            subscription, subscription.topics | message.topics)
+                    events.append(subscription.get_event(message))
+            if events:
+                yield ''.join(events)
+    finally:
+        activity_bus.unsubscribe(subscription)
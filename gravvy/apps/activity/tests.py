@@ -1,3 +1,230 @@
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.db.models import F
 from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from gravvy.apps.account.models import User
+from gravvy.apps.activity import activity
+from gravvy.apps.activity.models import Activity, ActivityGroup
+from gravvy.apps.activity.pagination import ActivityCursorPagination
+from gravvy.apps.activity.stream import (
+    Subscription, activity_bus, KEEPALIVE)
+from gravvy.apps.video.models import Video, VideoUsers
 
 # Create your tests here.
+
+@override_settings(ACTIVITY_STREAM_SERVE=True)
+class ActivityStreamTests(TestCase):
+    """
+    Tests of the realtime activity stream
+    """
+    
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user('+12025550100', 'password')
+        self.member = User.objects.create_user('+12025550101', 'password')
+        self.video = Video.objects.create(owner=self.owner, title='video')
+        self.other_video = Video.objects.create(owner=self.owner,
+                                                title='other video')
+        VideoUsers.objects.add_users_to_video(self.video, self.member)
+        
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.member)
+    
+    def subscribe(self, video_ids):
+        subscription = Subscription(self.member.id)
+        subscription.topics = subscription.get_topics(video_ids)
+        activity_bus.subscribe(subscription)
+        self.addCleanup(activity_bus.unsubscribe, subscription)
+        return subscription
+    
+    def open_stream(self):
+        response = self.client.get(reverse('user-auth-activity-stream'))
+        self.addCleanup(response.close)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = iter(response.streaming_content)
+        self.assertTrue(next(events).startswith('retry:'))
+        return events
+    
+    def get_activity(self, event):
+        event_type, data = event.splitlines()[:2]
+        self.assertEqual(event_type, 'event: activity')
+        return json.loads(data[len('data: '):])
+    
+    def test_routed_by_topic(self):
+        subscription = self.subscribe([self.video.id])
+        activity.send(self.owner, verb='like', object=self.other_video)
+        activity.send(self.owner, verb='like', object=self.video)
+        activity_bus.tick()
+        
+        messages = subscription.get()
+        self.assertEqual(len(messages), 2)
+        activity_data = self.get_activity(subscription.get_event(messages[0]))
+        self.assertEqual(activity_data['verb'], 'like')
+        self.assertEqual(activity_data['object']['hash_key'],
+                         self.video.hash_key)
+        self.assertIs(messages[1], KEEPALIVE)
+    
+    def test_stream(self):
+        events = self.open_stream()
+        activity.send(self.owner, verb='like', object=self.video)
+        activity_data = self.get_activity(next(events))
+        self.assertEqual(activity_data['actor']['phone_number'],
+                         unicode(self.owner.phone_number))
+        
+        activity_bus.tick()
+        self.assertEqual(next(events), ': keepalive\n\n')
+    
+    def test_stream_picks_up_invites(self):
+        events = self.open_stream()
+        VideoUsers.objects.add_users_to_video(self.other_video, self.member)
+        activity.send_many(self.owner, [
+                {'verb': 'invite', 'object': self.member,
+                 'target': self.other_video}])
+        activity_data = self.get_activity(next(events))
+        self.assertEqual(activity_data['verb'], 'invite')
+        # batched activities are published without their ids
+        self.assertIsNone(activity_data['id'])
+        
+        activity.send(self.owner, verb='like', object=self.other_video)
+        activity_data = self.get_activity(next(events))
+        self.assertEqual(activity_data['verb'], 'like')
+        self.assertIsNotNone(activity_data['id'])
+    
+    def test_requires_authentication(self):
+        self.client.force_authenticate(user=None)
+        response = self.client.get(reverse('user-auth-activity-stream'),
+                                   HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response.status_code, 401)
+        self.assertTrue(response.content.startswith('event: error\n'))
+    
+    def test_not_served(self):
+        # streams aren't served by the mod_wsgi processes
+        with self.settings(ACTIVITY_STREAM_SERVE=False):
+            response = self.client.get(reverse('user-auth-activity-stream'),
+                                       HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response.status_code, 404)
+
+
+class ActivityGroupTests(TestCase):
+    """
+    Tests of grouping consecutive activities and the aggregated activity feed
+    """
+    
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user('+12025550100', 'password')
+        self.member = User.objects.create_user('+12025550101', 'password')
+        self.video = Video.objects.create(owner=self.owner, title='video')
+        VideoUsers.objects.add_users_to_video(self.video, self.member)
+        self.invited = [
+            User.objects.create_user('+1202555011%d' % i, 'password')
+            for i in range(5)]
+        
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.member)
+    
+    def invite(self, users):
+        activity.send_many(self.owner, [
+                {'verb': 'invite', 'object': user, 'target': self.video}
+                for user in users])
+    
+    def test_invites_grouped(self):
+        self.invite(self.invited[:2])
+        self.invite(self.invited[2:])
+        group = ActivityGroup.objects.get()
+        self.assertEqual(group.count, 5)
+        self.assertEqual(group.object_id, self.invited[-1].id)
+        self.assertEqual(group.get_sample_ids(),
+                         [user.id for user in self.invited[:1:-1]])
+        self.assertEqual(group.activities.count(), 5)
+    
+    def test_concurrent_joins_counted(self):
+        self.invite(self.invited[:1])
+        add = ActivityGroup.add
+        def add_after_concurrent_join(group, activity):
+            # another process joins the group after it was read
+            ActivityGroup.objects.filter(pk=group.pk).update(
+                count=F('count') + 1)
+            add(group, activity)
+        ActivityGroup.add = add_after_concurrent_join
+        try:
+            self.invite(self.invited[1:2])
+        finally:
+            ActivityGroup.add = add
+        self.assertEqual(ActivityGroup.objects.get().count, 3)
+    
+    def test_other_activity_starts_new_group(self):
+        self.invite(self.invited[:2])
+        activity.send(self.owner, verb='like', object=self.video)
+        self.invite(self.invited[2:])
+        self.assertEqual(
+            list(ActivityGroup.objects.order_by('id').values_list(
+                    'verb', 'count')),
+            [('invite', 2), ('like', 1), ('invite', 3)])
+    
+    def test_window(self):
+        self.invite(self.invited[:1])
+        ActivityGroup.objects.update(created_at=timezone.now() - timedelta(
+                seconds=settings.ACTIVITY_GROUP_WINDOW + 1))
+        self.invite(self.invited[1:])
+        self.assertEqual(
+            list(ActivityGroup.objects.order_by('id').values_list(
+                    'count', flat=True)), [1, 4])
+    
+    def test_deletes_refresh_groups(self):
+        self.invite(self.invited)
+        Activity.objects.filter(object_id=self.invited[-1].id).delete()
+        group = ActivityGroup.objects.get()
+        self.assertEqual(group.count, 4)
+        self.assertEqual(group.object_id, self.invited[-2].id)
+        
+        Activity.objects.filter(verb='invite').delete()
+        self.assertFalse(ActivityGroup.objects.exists())
+    
+    def test_aggregated_feed(self):
+        self.invite(self.invited)
+        activity.send(self.member, verb='like', object=self.video)
+        response = self.client.get(reverse('user-auth-activity-list'),
+                                   {'aggregate': 'true'})
+        self.assertEqual(response.status_code, 200)
+        like, invites = response.data['results']
+        self.assertEqual(like['count'], 1)
+        self.assertEqual(like['object']['hash_key'], self.video.hash_key)
+        self.assertEqual(invites['count'], 5)
+        self.assertEqual(invites['target']['hash_key'], self.video.hash_key)
+        self.assertEqual(
+            [user['phone_number'] for user in invites['sample']],
+            [unicode(user.phone_number) for user in 
+             self.invited[:-settings.ACTIVITY_GROUP_SAMPLE_SIZE - 1:-1]])
+        
+        response = self.client.get(reverse('user-auth-activity-list'))
+        self.assertEqual(len(response.data['results']), 6)
+    
+    def test_aggregated_feed_pages(self):
+        self.addCleanup(setattr, ActivityCursorPagination, 'page_size',
+                        ActivityCursorPagination.page_size)
+        ActivityCursorPagination.page_size = 3
+        for user in self.invited:
+            activity.send(self.owner, verb='like', object=self.video)
+            self.invite([user])
+        
+        url = reverse('user-auth-activity-list') + '?aggregate=true'
+        group_ids = []
+        while url:
+            response = self.client.get(url)
+            group_ids.extend(group['id'] for group in response.data['results'])
+            url = response.data['next']
+            # the latest group growing doesn't move it
+            self.invite([self.owner])
+        self.assertEqual(sorted(group_ids), sorted(
+                ActivityGroup.objects.values_list('id', flat=True)))
+        self.assertEqual(len(group_ids), 10)
@@ -3,14 +3,15 @@ Utility functions associated with the activity app
 
 Table of Contents:
     - activity_handler: create activity instance on triggered by signal call
+    - activity_batch_handler: create a batch of activity instances in bulk
 """
+from django.contrib.contenttypes.models import ContentType
 
 def activity_handler(sender, **kwargs):
     """
     Receiver function for activity signal. This callback creates an
-    Activity object instance. This would also be a good place to possibly
-    publish the activity stream object to a realtime channel if we had such
-    functionality built-in.
+    Activity object instance in its activity group, and publishes it to the
+    realtime activity stream.
     
     Args:
         sender: signal sender
@@ -20,7 +21,8 @@ def activity_handler(sender, **kwargs):
         None
     """
     # Avoid circular imports
-    from gravvy.apps.activity.models import Activity
+    from gravvy.apps.activity.models import Activity, ActivityGroup
+    from gravvy.apps.activity.stream import publish_activities
     
     kwargs.pop('signal', None)
     
@@ -29,13 +31,63 @@ def activity_handler(sender, **kwargs):
     object = kwargs.pop('object', None) 
     target = kwargs.pop('target', None)
     
-    # Go through these hoops to ensure the database is only hit once
-    if not object and not target:
-        act = Activity.objects.create(actor=actor, verb=verb)
-    elif not object and target:
-        act = Activity.objects.create(actor=actor, verb=verb, target=target)
-    elif object and not target:
-        act = Activity.objects.create(actor=actor, verb=verb, object=object)
-    else:
-        act = Activity.objects.create(actor=actor, verb=verb, 
-                                      object=object, target=target)
+    # the object and target are assigned rather than passed to the
+    # constructor so they're cached on the activity for publishing it
+    act = Activity(actor=actor, verb=verb)
+    if object:
+        act.object = object
+    if target:
+        act.target = target
+    ActivityGroup.objects.add_activities([act])
+    act.save()
+    
+    publish_activities([act])
+
+
+def activity_batch_handler(sender, activities, **kwargs):
+    """
+    Receiver function for activity_batch signal. This callback creates all
+    the Activity object instances in the batch with a single query, in their
+    activity groups, and publishes them to the realtime activity stream. The
+    content types of the objects and targets are resolved upfront rather than
+    once per activity.
+    
+    Args:
+        sender: signal sender, which is the actor of all activities
+        activities: list of dictionaries with each activity's `verb`, and
+            optional `object` and `target`
+        **kwargs: all keyword arguments
+        
+    Returns:      
+        list of created Activity objects
+    """
+    # Avoid circular imports
+    from gravvy.apps.activity.models import Activity, ActivityGroup
+    from gravvy.apps.activity.stream import publish_activities
+    
+    actor = sender
+    
+    # get the content types of all related objects at once, so assigning the
+    # objects and targets doesn't query them
+    related_models = set()
+    for activity in activities:
+        for field in ('object', 'target'):
+            if activity.get(field) is not None:
+                related_models.add(type(activity[field]))
+    ContentType.objects.get_for_models(*related_models)
+    
+    acts = []
+    for activity in activities:
+        act = Activity(actor=actor, verb=activity['verb'])
+        if activity.get('object') is not None:
+            act.object = activity['object']
+        if activity.get('target') is not None:
+            act.target = activity['target']
+        acts.append(act)
+    
+    ActivityGroup.objects.add_activities(acts)
+    # bulk_create doesn't set primary keys, so the activities are published
+    # without ids
+    acts = Activity.objects.bulk_create(acts)
+    publish_activities(acts)
+    return acts
@@ -0,0 +1,140 @@
+"""
+Prometheus metrics of the project's hot paths.
+
+Metrics are kept per process. When running multiple WSGI worker processes,
+set the `prometheus_multiproc_dir` environment variable to an empty directory
+before starting the server: each worker then writes its metrics to
+memory-mapped files in that directory, and the scrape endpoint aggregates the
+files of all workers.
+
+Table Of Contents:
+    PUSH_MESSAGES: counter of push messages sent or failed
+    PUSH_FANOUT: histogram of the number of devices of bulk push messages
+    PUSH_COALESCED: counter of push notifications held for coalescing
+    PUSH_DEVICES_DEACTIVATED: counter of devices deactivated for bad tokens
+    APNS_RESPONSES: counter of APNS responses to notifications by reason
+    APNS_SEND_SECONDS: histogram of durations of sends over HTTP/2 to APNS
+    SMS_MESSAGES: counter of SMS messages sent or failed
+    CLIP_TRANSCODE_SECONDS: histogram of clip transcoding durations
+    THUMBNAIL_SECONDS: histogram of thumbnail generation durations
+    ACTIVITY_SEND_SECONDS: histogram of activity_send durations
+    AUTH_TOKEN_LOOKUPS: counter of auth token lookups by cache result
+    CACHE_REQUESTS: counter of cache lookups by tier and result
+    PHONENUMBER_PARSE_CACHE_REQUESTS: counter of phone number parse cache
+        lookups by result
+    REQUEST_SECONDS: histogram of request durations by view
+    ACTIVITY_STREAM_SUBSCRIPTIONS: gauge of open activity streams
+    ACTIVITY_STREAM_EVENTS: counter of activities published and delivered
+    get_registry: get the registry of the metrics to expose
+"""
+
+import os
+
+from prometheus_client import (
+    Counter, Gauge, Histogram, CollectorRegistry, REGISTRY)
+from prometheus_client import multiprocess
+
+# buckets of request and call durations, in seconds
+DURATION_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+
+PUSH_MESSAGES = Counter(
+    'gravvy_push_messages_total',
+    'Push notifications sent to devices, by result (sent or failed)',
+    ['result'])
+
+PUSH_FANOUT = Histogram(
+    'gravvy_push_fanout_devices',
+    'Number of devices a bulk push notification is sent to',
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000))
+
+PUSH_COALESCED = Counter(
+    'gravvy_push_coalesced_total',
+    'Push notifications of video users held for coalescing, by outcome (held '
+    'on their own or merged into a held notification)',
+    ['outcome'])
+
+PUSH_DEVICES_DEACTIVATED = Counter(
+    'gravvy_push_devices_deactivated_total',
+    'Devices deactivated because APNS no longer accepts their tokens, by '
+    'source (response to a notification, or feedback service)',
+    ['source'])
+
+APNS_RESPONSES = Counter(
+    'gravvy_apns_responses_total',
+    'Responses of APNS to notifications sent over HTTP/2, by reason (Success '
+    'or the reason APNS gave for rejecting the notification)',
+    ['reason'])
+
+APNS_SEND_SECONDS = Histogram(
+    'gravvy_apns_send_seconds',
+    'Time taken to send a batch of notifications over HTTP/2 to APNS and get '
+    'all its responses',
+    buckets=DURATION_BUCKETS)
+
+SMS_MESSAGES = Counter(
+    'gravvy_sms_messages_total',
+    'SMS messages sent through Plivo, by result (sent or failed)',
+    ['result'])
+
+CLIP_TRANSCODE_SECONDS = Histogram(
+    'gravvy_clip_transcode_seconds',
+    'Time taken to transcode uploaded clips',
+    buckets=(.5, 1, 2.5, 5, 10, 20, 30, 60, 120))
+
+THUMBNAIL_SECONDS = Histogram(
+    'gravvy_thumbnail_generation_seconds',
+    'Time taken to generate and store an image thumbnail',
+    buckets=DURATION_BUCKETS)
+
+ACTIVITY_SEND_SECONDS = Histogram(
+    'gravvy_activity_send_seconds',
+    'Time taken to record an activity and update video user stats',
+    buckets=DURATION_BUCKETS)
+
+AUTH_TOKEN_LOOKUPS = Counter(
+    'gravvy_auth_token_lookups_total',
+    'Auth token lookups by cache result (hit or miss)',
+    ['result'])
+
+CACHE_REQUESTS = Counter(
+    'gravvy_cache_requests_total',
+    'Cache lookups by cache tier (local or shared) and result (hit or miss)',
+    ['tier', 'result'])
+
+PHONENUMBER_PARSE_CACHE_REQUESTS = Counter(
+    'gravvy_phonenumber_parse_cache_requests_total',
+    'Phone number parse cache lookups by result (hit or miss)',
+    ['result'])
+
+REQUEST_SECONDS = Histogram(
+    'gravvy_request_duration_seconds',
+    'Request durations by view and HTTP method',
+    ['view', 'method'],
+    buckets=DURATION_BUCKETS)
+
+ACTIVITY_STREAM_SUBSCRIPTIONS = Gauge(
+    'gravvy_activity_stream_subscriptions',
+    'Open realtime activity streams',
+    multiprocess_mode='livesum')
+
+ACTIVITY_STREAM_EVENTS = Counter(
+    'gravvy_activity_stream_events_total',
+    'Activities published to the realtime activity stream, and delivered to '
+    'its subscriptions, by stage (published or delivered)',
+    ['stage'])
+
+
+def get_registry():
+    """
+    Get the registry of the metrics to expose. This aggregates the metrics of
+    all worker processes when running in multiprocess mode.
+
+    Returns:
+        prometheus_client CollectorRegistry
+    """
+    if ('prometheus_multiproc_dir' in os.environ or
+        'PROMETHEUS_MULTIPROC_DIR' in os.environ):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
@@ -0,0 +1,115 @@
+"""
+Profiling and metrics middleware.
+
+Table Of Contents:
+    ProfilingMiddleware: profile a sample of requests
+    MetricsMiddleware: record the duration of every request by view
+"""
+
+import json
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.db import connections
+
+from gravvy.apps.monitoring.profiling import (
+    Profile, get_current_profile, set_current_profile, profile_buffer)
+from gravvy.apps.monitoring.metrics import REQUEST_SECONDS
+
+logger = logging.getLogger('gravvy.profiling')
+
+
+class ProfilingMiddleware(object):
+    """
+    Profile a fraction of requests, set by the PROFILING_SAMPLE_RATE setting,
+    recording their duration and the count and time of their SQL queries,
+    storage, APNS and Plivo calls, and serializers.
+
+    SQL queries are recorded by turning on the query log of each database
+    connection for the duration of a profiled request, so requests that
+    aren't sampled don't pay for it. Finished profiles are logged to the
+    `gravvy.profiling` logger as JSON and kept in the profile buffer.
+
+    This should be the first middleware so the profile covers all others.
+    """
+
+    def process_request(self, request):
+        set_current_profile(None)
+        sample_rate = getattr(settings, 'PROFILING_SAMPLE_RATE', 0)
+        if sample_rate <= 0 or random.random() >= sample_rate:
+            return None
+
+        profile = Profile(request.method, request.path)
+        for connection in connections.all():
+            profile.query_log_state[connection.alias] = (
+                connection.force_debug_cursor, len(connection.queries_log))
+            connection.force_debug_cursor = True
+        set_current_profile(profile)
+        return None
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        profile = get_current_profile()
+        if profile is not None:
+            match = request.resolver_match
+            profile.endpoint = (match.view_name if match else None) or (
+                getattr(view_func, '__name__', None))
+        return None
+
+    def process_response(self, request, response):
+        profile = get_current_profile()
+        if profile is None:
+            return response
+        set_current_profile(None)
+
+        for connection in connections.all():
+            state = profile.query_log_state.get(connection.alias)
+            if state is None:
+                continue
+            force_debug_cursor, start = state
+            connection.force_debug_cursor = force_debug_cursor
+            # the query log has a max length so the oldest of a request's
+            # queries may have been dropped from it.
+            queries = list(connection.queries_log)[start:]
+            if queries:
+                profile.add('sql', sum(float(q['time']) for q in queries),
+                            count=len(queries))
+
+        profile.finish(response.status_code)
+        profile_buffer.record(profile)
+        logger.info(json.dumps(profile.as_dict(), sort_keys=True))
+        return response
+
+
+class MetricsMiddleware(object):
+    """
+    Record the duration of every request in the REQUEST_SECONDS histogram,
+    labelled by the name of the view that handled it. For REST API views
+    this is the name of the DRF view class.
+
+    This should be one of the first middleware so the duration covers all
+    others.
+    """
+
+    def process_request(self, request):
+        request.metrics_started_at = time.time()
+        request.metrics_view_name = None
+        return None
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'cls', None)
+        request.metrics_view_name = (
+            view_class.__name__ if view_class is not None else
+            getattr(view_func, '__name__', None))
+        return None
+
+    def process_response(self, request, response):
+        started_at = getattr(request, 'metrics_started_at', None)
+        if started_at is not None:
+            # requests that don't resolve to a view, such as 404s, are
+            # grouped together
+            view_name = request.metrics_view_name or 'unresolved'
+            REQUEST_SECONDS.labels(view_name, request.method).observe(
+                time.time() - started_at)
+        return response
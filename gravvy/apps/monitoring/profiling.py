@@ -0,0 +1,249 @@
+"""
+Per-request profiling: where a request's time goes between SQL queries,
+storage calls, APNS and Plivo calls, and serializers.
+
+A profile is started by the `ProfilingMiddleware` for a sample of requests and
+is kept in a thread local while the request is handled. Code that calls out to
+slow services wraps those calls in `profile_block` so their time is added to
+the current profile. When no request is being profiled `profile_block` does
+nothing more than a thread local lookup.
+
+Finished profiles are kept in a per-process ring buffer, `profile_buffer`,
+which is summarized by endpoint for the staff profiling view.
+
+Table Of Contents:
+    Profile: timings of a single request
+    get_current_profile: get the profile of the request being handled
+    set_current_profile: set the profile of the request being handled
+    profile_block: add the time spent in a block of code to the current profile
+    ProfileBuffer: ring buffer of the most recent profiles
+"""
+
+import collections
+import contextlib
+import threading
+import time
+
+from django.conf import settings
+
+from gravvy.utils import percentile
+
+# thread local holding the profile of the request being handled, if any.
+_local = threading.local()
+
+
+class Profile(object):
+    """
+    Timings of a single request.
+
+    `timings` maps a category, such as 'sql' or 'apns', to a [count, seconds]
+    list of the number of calls of that category and the time they took.
+    Categories can overlap, e.g. the time of a serializer includes that of the
+    SQL queries it makes.
+    """
+
+    def __init__(self, method, path):
+        """
+        Args:
+            method: HTTP method of the request
+            path: path of the request
+        """
+        self.method = method
+        self.path = path
+        self.endpoint = None
+        self.status_code = None
+        self.started_at = time.time()
+        self.duration = None
+        self.timings = {}
+        # state of each database connection's query log when the request
+        # started, by connection alias. This is used by the middleware.
+        self.query_log_state = {}
+        # depth of nested serializer calls, so that only the outermost
+        # serializer's time is recorded.
+        self.serializer_depth = 0
+
+    def add(self, category, seconds, count=1):
+        """
+        Add calls of a category to the profile
+
+        Args:
+            category: category of the calls
+            seconds: time taken by the calls
+            count: number of calls
+        """
+        timing = self.timings.setdefault(category, [0, 0.0])
+        timing[0] += count
+        timing[1] += seconds
+
+    def finish(self, status_code):
+        """
+        Mark the request as done
+
+        Args:
+            status_code: HTTP status code of the response
+        """
+        self.status_code = status_code
+        self.duration = time.time() - self.started_at
+
+    def as_dict(self):
+        """
+        Get a JSON serializable representation of the profile. Times are in
+        milliseconds.
+        """
+        return {
+            'method': self.method,
+            'path': self.path,
+            'endpoint': self.endpoint,
+            'status_code': self.status_code,
+            'started_at': self.started_at,
+            'duration_ms': round(self.duration * 1000, 3),
+            'timings': dict(
+                (category, {'count': count, 'ms': round(seconds * 1000, 3)})
+                for category, (count, seconds) in self.timings.items()),
+            }
+
+
+def get_current_profile():
+    """
+    Get the profile of the request being handled by this thread
+
+    Returns:
+        Profile instance or None if the request isn't being profiled
+    """
+    return getattr(_local, 'profile', None)
+
+
+def set_current_profile(profile):
+    """
+    Set the profile of the request being handled by this thread
+
+    Args:
+        profile: Profile instance, or None to stop profiling
+    """
+    _local.profile = profile
+
+
+@contextlib.contextmanager
+def profile_block(category):
+    """
+    Context manager that adds the time spent in its block to the current
+    profile, if any.
+
+    Args:
+        category: category the time is recorded under, e.g. 'apns'
+    """
+    profile = get_current_profile()
+    if profile is None:
+        yield
+        return
+
+    start = time.time()
+    try:
+        yield
+    finally:
+        profile.add(category, time.time() - start)
+
+
+class ProfileBuffer(object):
+    """
+    Thread-safe ring buffer of the most recent profiles of this process
+    """
+
+    def __init__(self, maxlen=None):
+        """
+        Args:
+            maxlen: number of profiles to keep. Defaults to the
+                PROFILING_BUFFER_SIZE setting.
+        """
+        if maxlen is None:
+            maxlen = getattr(settings, 'PROFILING_BUFFER_SIZE', 1000)
+        self._profiles = collections.deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def record(self, profile):
+        """
+        Add a finished profile to the buffer, dropping the oldest profile if
+        the buffer is full.
+        """
+        with self._lock:
+            self._profiles.append(profile)
+
+    def clear(self):
+        """
+        Remove all profiles from the buffer
+        """
+        with self._lock:
+            self._profiles.clear()
+
+    def profiles(self):
+        """
+        Get the profiles in the buffer, oldest first
+
+        Returns:
+            list of Profile instances
+        """
+        with self._lock:
+            return list(self._profiles)
+
+    def slowest_requests(self, limit=20):
+        """
+        Get the slowest profiled requests
+
+        Args:
+            limit: max number of requests to return
+
+        Returns:
+            list of Profile instances, slowest first
+        """
+        profiles = sorted(self.profiles(), key=lambda p: p.duration,
+                          reverse=True)
+        return profiles[:limit]
+
+    def slowest_endpoints(self, limit=20):
+        """
+        Summarize the profiles by endpoint
+
+        Args:
+            limit: max number of endpoints to return
+
+        Returns:
+            list of dictionaries, one per endpoint ordered by total time spent
+            on the endpoint. Each has the `endpoint`, the number of `requests`,
+            the `mean_ms`, `p95_ms` and `max_ms` request duration, and the
+            mean count and time of each category of calls in `timings`.
+        """
+        by_endpoint = collections.defaultdict(list)
+        for profile in self.profiles():
+            by_endpoint[(profile.endpoint, profile.method)].append(profile)
+
+        summaries = []
+        for (endpoint, method), profiles in by_endpoint.items():
+            durations = sorted(p.duration * 1000 for p in profiles)
+            totals = {}
+            for profile in profiles:
+                for category, (count, seconds) in profile.timings.items():
+                    total = totals.setdefault(category, [0, 0.0])
+                    total[0] += count
+                    total[1] += seconds
+
+            requests = len(profiles)
+            summaries.append({
+                    'endpoint': endpoint,
+                    'method': method,
+                    'requests': requests,
+                    'total_ms': sum(durations),
+                    'mean_ms': sum(durations) / requests,
+                    'p95_ms': percentile(durations, 95),
+                    'max_ms': durations[-1],
+                    'timings': sorted(
+                        (category, float(count) / requests,
+                         seconds * 1000 / requests)
+                        for category, (count, seconds) in totals.items()),
+                    })
+
+        summaries.sort(key=lambda s: s['total_ms'], reverse=True)
+        return summaries[:limit]
+
+
+# process-wide buffer of recent profiles
+profile_buffer = ProfileBuffer()
@@ -0,0 +1,39 @@
+"""
+Serializer mixins for profiling.
+
+Table Of Contents:
+    ProfiledSerializerMixin: record serializer time in the current profile
+"""
+
+import time
+
+from gravvy.apps.monitoring.profiling import get_current_profile
+
+
+class ProfiledSerializerMixin(object):
+    """
+    Mixin for Serializer classes that records the time taken to serialize
+    instances in the current profile, under a 'serializer.<class name>'
+    category.
+
+    Only the outermost profiled serializer is recorded, so the time of nested
+    serializers is counted towards the serializer that uses them. A list of
+    instances is recorded as one call per instance.
+    """
+
+    def to_representation(self, instance):
+        profile = get_current_profile()
+        if profile is None:
+            return super(ProfiledSerializerMixin, self).to_representation(
+                instance)
+
+        start = time.time()
+        profile.serializer_depth += 1
+        try:
+            return super(ProfiledSerializerMixin, self).to_representation(
+                instance)
+        finally:
+            profile.serializer_depth -= 1
+            if profile.serializer_depth == 0:
+                profile.add('serializer.%s' % self.__class__.__name__,
+                            time.time() - start)
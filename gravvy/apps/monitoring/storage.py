@@ -0,0 +1,54 @@
+"""
+File storages that record the time of their calls in the current request
+profile.
+
+Table Of Contents:
+    ProfiledStorageMixin: record storage calls in the current profile
+    ProfiledS3BotoStorage: S3 storage with its calls profiled
+"""
+
+from storages.backends.s3boto import S3BotoStorage
+
+from gravvy.apps.monitoring.profiling import profile_block
+
+
+class ProfiledStorageMixin(object):
+    """
+    Mixin for Storage classes that records the methods which may make network
+    calls under the 'storage' profile category.
+    """
+
+    def _open(self, name, mode='rb'):
+        with profile_block('storage'):
+            return super(ProfiledStorageMixin, self)._open(name, mode)
+
+    def _save(self, name, content):
+        with profile_block('storage'):
+            return super(ProfiledStorageMixin, self)._save(name, content)
+
+    def delete(self, name):
+        with profile_block('storage'):
+            return super(ProfiledStorageMixin, self).delete(name)
+
+    def exists(self, name):
+        with profile_block('storage'):
+            return super(ProfiledStorageMixin, self).exists(name)
+
+    def listdir(self, path):
+        with profile_block('storage'):
+            return super(ProfiledStorageMixin, self).listdir(path)
+
+    def size(self, name):
+        with profile_block('storage'):
+            return super(ProfiledStorageMixin, self).size(name)
+
+    def modified_time(self, name):
+        with profile_block('storage'):
+            return super(ProfiledStorageMixin, self).modified_time(name)
+
+
+class ProfiledS3BotoStorage(ProfiledStorageMixin, S3BotoStorage):
+    """
+    S3BotoStorage with its calls recorded in the current profile
+    """
+    pass
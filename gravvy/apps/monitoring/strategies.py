@@ -0,0 +1,23 @@
+"""
+imagekit cache file strategies that record thumbnail generation times.
+
+Table Of Contents:
+    TimedOptimistic: Optimistic strategy with timed thumbnail generation
+"""
+
+from imagekit.cachefiles.strategies import Optimistic
+
+from gravvy.apps.monitoring.metrics import THUMBNAIL_SECONDS
+from gravvy.apps.monitoring.profiling import profile_block
+
+
+class TimedOptimistic(Optimistic):
+    """
+    imagekit's Optimistic strategy, generating thumbnails when their source
+    file is saved, with generation times recorded in the THUMBNAIL_SECONDS
+    histogram and the current request profile.
+    """
+
+    def on_source_saved(self, file):
+        with THUMBNAIL_SECONDS.time(), profile_block('thumbnail'):
+            super(TimedOptimistic, self).on_source_saved(file)
@@ -0,0 +1,364 @@
+import os
+import shutil
+import tempfile
+
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.http import HttpResponse
+from django.test import TestCase, RequestFactory
+from django.test.utils import override_settings
+from prometheus_client import (
+    Counter, CONTENT_TYPE_LATEST, REGISTRY, values)
+from prometheus_client.parser import text_string_to_metric_families
+from rest_framework import serializers
+
+from gravvy.apps.account.models import User
+from gravvy.apps.monitoring.metrics import get_registry
+from gravvy.apps.monitoring.middleware import ProfilingMiddleware
+from gravvy.apps.monitoring.profiling import (
+    Profile, ProfileBuffer, get_current_profile, set_current_profile,
+    profile_buffer)
+from gravvy.apps.monitoring.serializers import ProfiledSerializerMixin
+
+# Create your tests here.
+
+def make_profile(endpoint, duration, method='GET', **timings):
+    """
+    Make a finished profile
+
+    Args:
+        endpoint: endpoint of the profiled request
+        duration: duration of the request, in seconds
+        method: HTTP method of the request
+        **timings: (count, seconds) tuples of the calls of each category
+
+    Returns:
+        Profile instance
+    """
+    profile = Profile(method, '/')
+    profile.endpoint = endpoint
+    for category, (count, seconds) in timings.items():
+        profile.add(category, seconds, count=count)
+    profile.finish(200)
+    profile.duration = duration
+    return profile
+
+
+class ProfilingMiddlewareTests(TestCase):
+    """
+    Tests of the sampling of requests and the recording of their SQL queries
+    """
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.middleware = ProfilingMiddleware()
+        profile_buffer.clear()
+
+    def tearDown(self):
+        set_current_profile(None)
+        profile_buffer.clear()
+
+    def profile(self, queries=0):
+        """
+        Run a request through the middleware, making some queries
+
+        Returns:
+            the request's Profile instance or None if it wasn't profiled
+        """
+        request = self.factory.get('/')
+        self.middleware.process_request(request)
+        profile = get_current_profile()
+        for _ in range(queries):
+            User.objects.count()
+        self.middleware.process_response(request, HttpResponse())
+        self.assertIsNone(get_current_profile())
+        return profile
+
+    @override_settings(PROFILING_SAMPLE_RATE=0)
+    def test_not_sampled(self):
+        self.assertIsNone(self.profile(queries=2))
+        self.assertEqual(profile_buffer.profiles(), [])
+        self.assertFalse(connection.force_debug_cursor)
+
+    @override_settings(PROFILING_SAMPLE_RATE=1)
+    def test_sampled(self):
+        profile = self.profile()
+        self.assertEqual(profile_buffer.profiles(), [profile])
+        self.assertEqual(profile.status_code, 200)
+        self.assertIsNotNone(profile.duration)
+
+    @override_settings(PROFILING_SAMPLE_RATE=1)
+    def test_sql_queries(self):
+        profile = self.profile(queries=3)
+        self.assertEqual(profile.timings['sql'][0], 3)
+        self.assertNotIn('sql', self.profile(queries=0).timings)
+
+    @override_settings(PROFILING_SAMPLE_RATE=1)
+    def test_debug_cursor_restored(self):
+        request = self.factory.get('/')
+        self.middleware.process_request(request)
+        self.assertTrue(connection.force_debug_cursor)
+        self.middleware.process_response(request, HttpResponse())
+        self.assertFalse(connection.force_debug_cursor)
+
+        # a debug cursor that was already on is left on
+        connection.force_debug_cursor = True
+        try:
+            self.profile(queries=1)
+            self.assertTrue(connection.force_debug_cursor)
+        finally:
+            connection.force_debug_cursor = False
+
+    @override_settings(PROFILING_SAMPLE_RATE=1)
+    def test_endpoint(self):
+        response = self.client.get(reverse('api_root'))
+        self.assertEqual(response.status_code, 200)
+        profile = profile_buffer.profiles()[-1]
+        self.assertEqual(profile.endpoint, 'api_root')
+        self.assertEqual(profile.method, 'GET')
+        self.assertEqual(profile.path, reverse('api_root'))
+
+
+class ChildSerializer(ProfiledSerializerMixin, serializers.Serializer):
+    name = serializers.CharField()
+
+
+class ParentSerializer(ProfiledSerializerMixin, serializers.Serializer):
+    name = serializers.CharField()
+    children = ChildSerializer(many=True)
+
+
+class ProfiledSerializerMixinTests(TestCase):
+    """
+    Tests of the recording of serializer time in the current profile
+    """
+
+    def setUp(self):
+        self.instance = {'name': 'parent',
+                         'children': [{'name': 'child'}, {'name': 'child'}]}
+
+    def tearDown(self):
+        set_current_profile(None)
+
+    def test_outermost_serializer_recorded(self):
+        profile = Profile('GET', '/')
+        set_current_profile(profile)
+        data = ParentSerializer(self.instance).data
+        self.assertEqual(data['children'][1]['name'], 'child')
+        self.assertEqual(profile.timings.keys(),
+                         ['serializer.ParentSerializer'])
+        self.assertEqual(profile.timings['serializer.ParentSerializer'][0], 1)
+        self.assertEqual(profile.serializer_depth, 0)
+
+    def test_list_recorded_per_instance(self):
+        profile = Profile('GET', '/')
+        set_current_profile(profile)
+        ParentSerializer([self.instance] * 3, many=True).data
+        self.assertEqual(profile.timings['serializer.ParentSerializer'][0], 3)
+
+    def test_not_profiled(self):
+        self.assertEqual(ParentSerializer(self.instance).data['name'],
+                         'parent')
+
+
+class ProfileBufferTests(TestCase):
+    """
+    Tests of the ring buffer of recent profiles and its summaries
+    """
+
+    def test_ring_buffer(self):
+        buffer = ProfileBuffer(maxlen=2)
+        profiles = [make_profile('a', 0.1) for _ in range(3)]
+        for profile in profiles:
+            buffer.record(profile)
+        self.assertEqual(buffer.profiles(), profiles[1:])
+        buffer.clear()
+        self.assertEqual(buffer.profiles(), [])
+
+    def test_slowest_requests(self):
+        buffer = ProfileBuffer()
+        profiles = [make_profile('a', duration)
+                    for duration in (0.2, 0.5, 0.1, 0.3)]
+        for profile in profiles:
+            buffer.record(profile)
+        self.assertEqual(buffer.slowest_requests(limit=3),
+                         [profiles[1], profiles[3], profiles[0]])
+
+    def test_slowest_endpoints(self):
+        buffer = ProfileBuffer()
+        for duration in (0.1, 0.2, 0.3):
+            buffer.record(make_profile('list', duration,
+                                       sql=(2, duration / 2)))
+        buffer.record(make_profile('detail', 0.5, sql=(1, 0.1),
+                                   apns=(1, 0.2)))
+        buffer.record(make_profile('list', 0.05, method='POST'))
+
+        endpoints = buffer.slowest_endpoints()
+        self.assertEqual(
+            [(e['endpoint'], e['method']) for e in endpoints],
+            [('list', 'GET'), ('detail', 'GET'), ('list', 'POST')])
+
+        summary = endpoints[0]
+        self.assertEqual(summary['requests'], 3)
+        self.assertAlmostEqual(summary['total_ms'], 600)
+        self.assertAlmostEqual(summary['mean_ms'], 200)
+        self.assertAlmostEqual(summary['p95_ms'], 300)
+        self.assertAlmostEqual(summary['max_ms'], 300)
+        (category, count, ms), = summary['timings']
+        self.assertEqual((category, count), ('sql', 2))
+        self.assertAlmostEqual(ms, 100)
+
+        self.assertEqual([t[0] for t in endpoints[1]['timings']],
+                         ['apns', 'sql'])
+        self.assertEqual(endpoints[2]['timings'], [])
+        self.assertEqual(len(buffer.slowest_endpoints(limit=1)), 1)
+
+
+# the requests of these tests mustn't be sampled into the buffer they check
+@override_settings(PROFILING_SAMPLE_RATE=0)
+class ProfilingViewTests(TestCase):
+    """
+    Tests of the staff profiling page
+    """
+
+    def setUp(self):
+        self.url = reverse('monitoring-profiling')
+        User.objects.create_user('+12025550100', 'password')
+        User.objects.create_superuser('+12025550101', 'password')
+        profile_buffer.clear()
+        profile_buffer.record(make_profile('video-list', 0.1, sql=(3, 0.01)))
+
+    def tearDown(self):
+        profile_buffer.clear()
+
+    def test_anonymous(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(reverse('admin:login'), response['Location'])
+
+    def test_not_staff(self):
+        self.client.login(phone_number='+12025550100', password='password')
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(reverse('admin:login'), response['Location'])
+
+    def test_staff(self):
+        self.client.login(phone_number='+12025550101', password='password')
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'video-list')
+
+    def test_clear(self):
+        self.client.login(phone_number='+12025550101', password='password')
+        response = self.client.post(self.url)
+        self.assertRedirects(response, self.url)
+        self.assertEqual(profile_buffer.profiles(), [])
+
+    def test_clear_not_staff(self):
+        self.client.login(phone_number='+12025550100', password='password')
+        self.client.post(self.url)
+        self.assertEqual(len(profile_buffer.profiles()), 1)
+
+
+class MetricsViewTests(TestCase):
+    """
+    Tests of the Prometheus scrape endpoint
+    """
+
+    def setUp(self):
+        self.url = reverse('metrics')
+
+    def scrape(self, remote_addr):
+        return self.client.get(self.url, REMOTE_ADDR=remote_addr)
+
+    @override_settings(METRICS_ALLOWED_IPS=('127.0.0.1', '10.0.0.2'))
+    def test_allowed(self):
+        self.assertEqual(self.scrape('127.0.0.1').status_code, 200)
+        self.assertEqual(self.scrape('10.0.0.2').status_code, 200)
+
+    @override_settings(METRICS_ALLOWED_IPS=('127.0.0.1',))
+    def test_denied(self):
+        self.assertEqual(self.scrape('10.0.0.1').status_code, 403)
+
+    @override_settings(METRICS_ALLOWED_IPS=None)
+    def test_any_address_allowed(self):
+        self.assertEqual(self.scrape('10.0.0.1').status_code, 200)
+
+    def test_output_format(self):
+        response = self.scrape('127.0.0.1')
+        self.assertEqual(response['Content-Type'], CONTENT_TYPE_LATEST)
+        families = dict(
+            (family.name, family) for family in
+            text_string_to_metric_families(response.content.decode('utf-8')))
+        self.assertEqual(families['gravvy_request_duration_seconds'].type,
+                         'histogram')
+        self.assertEqual(families['gravvy_auth_token_lookups'].type,
+                         'counter')
+        self.assertEqual(families['gravvy_activity_stream_subscriptions'].type,
+                         'gauge')
+
+
+class MetricsRegistryTests(TestCase):
+    """
+    Tests of aggregating the metrics of worker processes
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        os.environ['prometheus_multiproc_dir'] = self.directory
+        self.value_class = values.ValueClass
+
+    def tearDown(self):
+        values.ValueClass = self.value_class
+        os.environ.pop('prometheus_multiproc_dir', None)
+        os.environ.pop('PROMETHEUS_MULTIPROC_DIR', None)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_single_process(self):
+        os.environ.pop('prometheus_multiproc_dir')
+        self.assertIs(get_registry(), REGISTRY)
+
+    def test_multiprocess(self):
+        # count in the metric files of two worker processes
+        for pid, count in ((101, 2), (102, 3)):
+            values.ValueClass = values.MultiProcessValue(lambda pid=pid: pid)
+            counter = Counter('gravvy_test_requests', 'Test requests',
+                              ['result'], registry=None)
+            counter.labels('hit').inc(count)
+
+        registry = get_registry()
+        self.assertIsNot(registry, REGISTRY)
+        self.assertEqual(registry.get_sample_value(
+                'gravvy_test_requests_total', {'result': 'hit'}), 5)
+
+
+class MetricsMiddlewareTests(TestCase):
+    """
+    Tests of recording request durations by view
+    """
+
+    def get_requests_count(self, view, method='GET'):
+        return REGISTRY.get_sample_value(
+            'gravvy_request_duration_seconds_count',
+            {'view': view, 'method': method}) or 0
+
+    def assertRequestRecorded(self, view, request, method='GET'):
+        count = self.get_requests_count(view, method)
+        request()
+        self.assertEqual(self.get_requests_count(view, method), count + 1)
+
+    def test_rest_api_view(self):
+        self.assertRequestRecorded(
+            'UserList', lambda: self.client.get(reverse('user-list')))
+        self.assertRequestRecorded(
+            'ObtainExpiringAuthToken',
+            lambda: self.client.post(reverse('obtain_auth_token'), {}),
+            method='POST')
+
+    def test_function_view(self):
+        self.assertRequestRecorded(
+            'metrics', lambda: self.client.get(reverse('metrics')))
+
+    def test_unresolved(self):
+        self.assertRequestRecorded(
+            'unresolved', lambda: self.client.get('/no/such/page/'))
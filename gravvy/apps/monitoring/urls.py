@@ -0,0 +1,11 @@
+"""
+URL patterns of the staff monitoring pages
+"""
+
+from django.conf.urls import url
+from gravvy.apps.monitoring import views
+
+urlpatterns = [
+    # slowest endpoints of sampled requests
+    url(r'^profiling/$', views.profiling, name='monitoring-profiling'),
+]
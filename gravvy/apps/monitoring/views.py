@@ -0,0 +1,60 @@
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponse, HttpResponseRedirect
+from django.shortcuts import render_to_response
+from django.template import RequestContext
+from django.core.urlresolvers import reverse
+from django.conf import settings
+
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+
+from gravvy.apps.monitoring.metrics import get_registry
+from gravvy.apps.monitoring.profiling import profile_buffer
+from gravvy.fields.phonenumber_field.phonenumber import parse_cache
+
+# Create your views here.
+
+@staff_member_required
+def profiling(request):
+    """
+    Show the slowest endpoints and requests of the profiled requests kept by
+    this process. POST to clear the profiles.
+    
+    Args:
+        request: HttpRequest object
+        
+    Returns:
+        HttpResponse object
+    """
+    if request.method == 'POST':
+        profile_buffer.clear()
+        return HttpResponseRedirect(reverse('monitoring-profiling'))
+    
+    return render_to_response(
+        'monitoring/profiling.html',
+        {'endpoints': profile_buffer.slowest_endpoints(),
+         'requests': profile_buffer.slowest_requests(),
+         'profiles_count': len(profile_buffer.profiles()),
+         'sample_rate': getattr(settings, 'PROFILING_SAMPLE_RATE', 0),
+         'parse_cache_stats': parse_cache.stats()},
+        context_instance=RequestContext(request))
+
+
+def metrics(request):
+    """
+    Prometheus scrape endpoint, exposing the metrics of all worker processes.
+    Only addresses in the METRICS_ALLOWED_IPS setting may scrape it.
+    
+    Args:
+        request: HttpRequest object
+        
+    Returns:
+        HttpResponse object
+    """
+    allowed_ips = getattr(settings, 'METRICS_ALLOWED_IPS', None)
+    if (allowed_ips is not None and 
+        request.META.get('REMOTE_ADDR') not in allowed_ips):
+        raise PermissionDenied
+    
+    return HttpResponse(generate_latest(get_registry()),
+                        content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,320 @@
+"""
+Transport of APNS push notifications over the HTTP/2 APNS provider API.
+
+Each process keeps one long-lived HTTP/2 connection to APNS, and sends many
+notifications over it at once: up to APNS_MAX_CONCURRENT_STREAMS requests
+are in flight, each on its own stream, and a new one is sent as soon as the
+oldest one is answered. This is unlike the legacy binary gateway used by
+`push_notifications`, which sends notifications one device at a time over a
+new connection.
+
+APNS answers each notification with its own status. Devices whose token APNS
+rejects as unregistered or bad are deactivated, so they're no longer sent
+notifications.
+
+Table Of Contents:
+    get_payload: get the JSON payload of a notification
+    APNSConnection: long-lived HTTP/2 connection to APNS
+    get_connection: get the APNS connection of this process
+    send_notifications: send notifications to devices
+"""
+
+import collections
+import json
+import socket
+import threading
+import time
+
+from django.conf import settings
+from hyper import HTTP20Connection
+from hyper.common.exceptions import ConnectionResetError
+from hyper.http20.exceptions import HTTP20Error
+from hyper.tls import init_context
+from push_notifications.apns import APNSDataOverflow
+from push_notifications.models import APNSDevice
+
+from gravvy.apps.monitoring.metrics import (
+    APNS_RESPONSES, APNS_SEND_SECONDS, PUSH_DEVICES_DEACTIVATED,
+    PUSH_MESSAGES)
+from gravvy.apps.monitoring.profiling import profile_block
+
+# largest payload APNS accepts over HTTP/2, in bytes
+MAX_PAYLOAD_SIZE = 4096
+
+# reasons APNS rejects notifications for that mean the device token will never
+# be valid again
+INVALID_TOKEN_REASONS = ('BadDeviceToken', 'Unregistered',
+                         'DeviceTokenNotForTopic')
+
+# errors of a broken connection, after which it is reopened
+CONNECTION_ERRORS = (socket.error, ConnectionResetError, HTTP20Error)
+
+
+def get_payload(message, sound=None, badge=None, extra={}):
+    """
+    Get the JSON payload of a notification, as the legacy transport of
+    `push_notifications` builds it
+
+    Args:
+        message: message to be shown when app is in background/inactive
+        sound: sound to be played on notification arrival
+        badge: badge to be shown on the app
+        extra: extra content to be consumed by the app when active
+
+    Returns:
+        UTF-8 encoded JSON payload
+
+    Raises:
+        APNSDataOverflow: if the payload is larger than APNS accepts
+    """
+    aps = {}
+    if message is not None:
+        aps['alert'] = message
+    if badge is not None:
+        aps['badge'] = badge
+    if sound is not None:
+        aps['sound'] = sound
+
+    data = {'aps': aps}
+    data.update(extra)
+    payload = json.dumps(
+        data, separators=(',', ':'), sort_keys=True).encode('utf-8')
+    if len(payload) > MAX_PAYLOAD_SIZE:
+        raise APNSDataOverflow(
+            "Notification body cannot exceed %i bytes" % MAX_PAYLOAD_SIZE)
+    return payload
+
+
+# ---------------------------------------------------------------------------- #
+# CONNECTION
+# ---------------------------------------------------------------------------- #
+
+class APNSConnection(object):
+    """
+    A long-lived HTTP/2 connection to APNS, that notifications are sent over
+    concurrently.
+
+    The connection is opened when notifications are first sent, and is
+    reopened when it breaks.
+    """
+
+    def __init__(self, host, port=443, certificate=None, topic=None,
+                 secure=True, max_concurrent_streams=500):
+        """
+        Args:
+            host: host of the APNS provider API
+            port: port of the APNS provider API
+            certificate: path to the PEM file of the provider certificate and
+                its private key
+            topic: topic of the notifications, i.e. the app's bundle id. This
+                can be None if the certificate is for a single topic.
+            secure: whether to connect with TLS. Only a local stub server
+                is connected to without it.
+            max_concurrent_streams: largest number of notifications to have
+                in flight at once. Fewer are sent if APNS allows fewer.
+        """
+        self.host = host
+        self.port = port
+        self.certificate = certificate
+        self.topic = topic
+        self.secure = secure
+        self.max_concurrent_streams = max_concurrent_streams
+        self.connection = None
+        # a connection's streams can't be shared by concurrent sends
+        self.lock = threading.Lock()
+
+    def connect(self):
+        """
+        Open the connection, if it isn't already open
+        """
+        if self.connection is None:
+            ssl_context = None
+            if self.secure:
+                ssl_context = init_context(cert=self.certificate)
+            self.connection = HTTP20Connection(
+                self.host, self.port, secure=self.secure,
+                ssl_context=ssl_context)
+            # this also reads the settings APNS sends when the connection
+            # opens, including how many streams it allows
+            self.connection.connect()
+
+    def close(self):
+        """
+        Close the connection, if it's open
+        """
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except CONNECTION_ERRORS:
+                pass
+            self.connection = None
+
+    def get_max_concurrent_streams(self):
+        """
+        Get the largest number of notifications that can be in flight at once
+
+        Returns:
+            the smaller of our own limit and the one set by APNS
+        """
+        # hyper doesn't expose the settings APNS sent, but its h2 connection
+        # does. They can change while notifications are sent.
+        with self.connection._conn as h2_connection:
+            remote_limit = h2_connection.remote_settings.max_concurrent_streams
+        return max(1, min(self.max_concurrent_streams, remote_limit))
+
+    def send(self, notifications):
+        """
+        Send notifications, and get the responses of APNS to them.
+
+        Notifications that weren't answered because the connection broke are
+        sent again once over a new connection. The connection errors are
+        raised if they couldn't be sent then either.
+
+        Args:
+            notifications: list of (device token, payload) tuples
+
+        Returns:
+            list of (status code, reason) tuples, in the order of the given
+            notifications. reason is None for notifications that were sent.
+        """
+        with self.lock:
+            responses = [None] * len(notifications)
+            pending = range(len(notifications))
+            for attempt in range(2):
+                try:
+                    self.connect()
+                    self.send_streams(notifications, pending, responses)
+                    break
+                except CONNECTION_ERRORS:
+                    self.close()
+                    pending = [index for index, response in
+                               enumerate(responses) if response is None]
+                    if attempt:
+                        raise
+            return responses
+
+    def send_streams(self, notifications, indexes, responses):
+        """
+        Send notifications, each on its own stream, while keeping as many
+        streams in flight as possible
+
+        Args:
+            notifications: list of (device token, payload) tuples
+            indexes: indexes of the notifications to send
+            responses: list that the (status code, reason) tuple of each
+                notification's response is set in, at the notification's
+                index
+        """
+        in_flight = collections.deque()
+        for index in indexes:
+            if len(in_flight) >= self.get_max_concurrent_streams():
+                self.read_response(in_flight.popleft(), responses)
+            token, payload = notifications[index]
+            stream_id = self.connection.request(
+                'POST', '/3/device/%s' % token, body=payload,
+                headers=self.get_headers())
+            in_flight.append((index, stream_id))
+
+        while in_flight:
+            self.read_response(in_flight.popleft(), responses)
+
+    def read_response(self, stream, responses):
+        """
+        Wait for the response to a notification's stream
+
+        Args:
+            stream: (notification index, stream id) tuple
+            responses: list that the (status code, reason) tuple of the
+                response is set in, at the notification's index
+        """
+        index, stream_id = stream
+        response = self.connection.get_response(stream_id)
+        body = response.read()
+        reason = None
+        if response.status != 200:
+            try:
+                reason = json.loads(body)['reason']
+            except (ValueError, KeyError, TypeError):
+                reason = 'Unknown'
+        responses[index] = (response.status, reason)
+
+    def get_headers(self):
+        """
+        Get the request headers of a notification
+        """
+        headers = {'apns-priority': '10'}
+        if self.topic:
+            headers['apns-topic'] = self.topic
+        return headers
+
+
+# connection of this process, opened by get_connection()
+_connection = None
+_connection_lock = threading.Lock()
+
+
+def get_connection():
+    """
+    Get the APNS connection of this process, as configured by the
+    APNS_HTTP2_* settings
+
+    Returns:
+        APNSConnection
+    """
+    global _connection
+    with _connection_lock:
+        if _connection is None:
+            _connection = APNSConnection(
+                settings.APNS_HTTP2_HOST, settings.APNS_HTTP2_PORT,
+                certificate=settings.PUSH_NOTIFICATIONS_SETTINGS[
+                    'APNS_CERTIFICATE'],
+                topic=settings.APNS_TOPIC,
+                secure=settings.APNS_HTTP2_SECURE,
+                max_concurrent_streams=settings.APNS_MAX_CONCURRENT_STREAMS)
+        return _connection
+
+
+def send_notifications(notifications, connection=None):
+    """
+    Send notifications to devices over HTTP/2, and deactivate the devices APNS
+    rejects the tokens of
+
+    Args:
+        notifications: list of (device, message, sound, badge, extra) tuples
+            with the APNSDevice to send each notification to and its content,
+            as in get_payload
+        connection: APNSConnection to send the notifications over. The
+            connection of this process is used by default.
+
+    Returns:
+        list of ids of the devices that were deactivated
+    """
+    if not notifications:
+        return []
+    connection = connection or get_connection()
+
+    requests = [
+        (device.registration_id,
+         get_payload(message, sound=sound, badge=badge, extra=extra))
+        for device, message, sound, badge, extra in notifications]
+
+    start = time.time()
+    with profile_block('apns'):
+        try:
+            responses = connection.send(requests)
+        except CONNECTION_ERRORS:
+            PUSH_MESSAGES.labels('failed').inc(len(requests))
+            raise
+    APNS_SEND_SECONDS.observe(time.time() - start)
+
+    inactive_ids = []
+    for notification, (status, reason) in zip(notifications, responses):
+        APNS_RESPONSES.labels(reason or 'Success').inc()
+        PUSH_MESSAGES.labels('sent' if status == 200 else 'failed').inc()
+        if status == 410 or reason in INVALID_TOKEN_REASONS:
+            inactive_ids.append(notification[0].id)
+
+    if inactive_ids:
+        APNSDevice.objects.filter(id__in=inactive_ids).update(active=False)
+        PUSH_DEVICES_DEACTIVATED.labels('response').inc(len(inactive_ids))
+    return inactive_ids
@@ -0,0 +1,110 @@
+"""
+Pruning of the devices of apps that were uninstalled, as reported by the APNS
+feedback service.
+
+The feedback service reports each device token that APNS couldn't deliver
+notifications to because the app was uninstalled, with the time it found
+that out. The report is streamed and the matching devices are deactivated a
+batch at a time, so no more notifications are sent to them. Devices that
+were registered again after that time are left active, as the app was
+reinstalled.
+
+Table Of Contents:
+    read_feedback: stream the device tokens reported by the feedback service
+    deactivate_feedback_devices: deactivate the devices of reported tokens
+"""
+
+import binascii
+import datetime
+import socket
+import ssl
+import struct
+
+from django.utils import timezone
+from push_notifications.models import APNSDevice
+
+from gravvy.apps.monitoring.metrics import PUSH_DEVICES_DEACTIVATED
+
+# each reported token is preceded by the time it was found out as a 4 byte
+# timestamp, and by its length in 2 bytes
+HEADER_FORMAT = '!LH'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+
+def read_feedback(host, port, certificate=None, secure=True, timeout=60):
+    """
+    Stream the device tokens reported by the APNS feedback service. The
+    service closes the connection once all tokens are reported.
+
+    Args:
+        host: host of the feedback service
+        port: port of the feedback service
+        certificate: path to the PEM file of the provider certificate and its
+            private key
+        secure: whether to connect with TLS. Only a local stub server is
+            connected to without it.
+        timeout: number of seconds to wait for data before giving up
+
+    Yields:
+        (timestamp, device token) tuples with the time APNS found out the app
+        was uninstalled, and the token in hexadecimal
+    """
+    sock = socket.create_connection((host, port), timeout=timeout)
+    try:
+        if secure:
+            sock = ssl.wrap_socket(sock, certfile=certificate)
+        data = ''
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                return
+            data += chunk
+            offset = 0
+            while len(data) - offset >= HEADER_SIZE:
+                seconds, length = struct.unpack_from(
+                    HEADER_FORMAT, data, offset)
+                end = offset + HEADER_SIZE + length
+                if len(data) < end:
+                    break
+                token = binascii.hexlify(data[offset + HEADER_SIZE:end])
+                offset = end
+                yield (datetime.datetime.fromtimestamp(seconds, timezone.utc),
+                       token)
+            data = data[offset:]
+    finally:
+        sock.close()
+
+
+def deactivate_feedback_devices(feedback):
+    """
+    Deactivate the devices of tokens reported by the feedback service, unless
+    they were registered again since
+
+    Args:
+        feedback: list of (timestamp, device token) tuples as yielded by
+            read_feedback
+
+    Returns:
+        list of ids of the devices that were deactivated
+    """
+    # latest time each token was reported at
+    timestamps = {}
+    for timestamp, token in feedback:
+        token = token.lower()
+        timestamps[token] = max(timestamps.get(token, timestamp), timestamp)
+    if not timestamps:
+        return []
+
+    # tokens are reported in lowercase but may have been registered in either
+    tokens = timestamps.keys()
+    devices = APNSDevice.objects.filter(
+        registration_id__in=tokens + [token.upper() for token in tokens],
+        active=True).values_list('id', 'registration_id', 'date_created')
+    inactive_ids = [
+        device_id for device_id, token, date_created in devices
+        if date_created is None or date_created <= timestamps[token.lower()]]
+
+    if inactive_ids:
+        APNSDevice.objects.filter(id__in=inactive_ids).update(active=False)
+        PUSH_DEVICES_DEACTIVATED.labels('feedback').inc(len(inactive_ids))
+    return inactive_ids
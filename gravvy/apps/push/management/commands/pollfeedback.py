@@ -0,0 +1,81 @@
+"""
+Deactivate the devices of apps that were uninstalled, as reported by the APNS
+feedback service, so push notifications are no longer sent to them.
+
+The feedback service's report is streamed and the devices are deactivated a
+batch at a time. Without `--interval` the service is polled once. With it,
+it's polled every `--interval` seconds for `--duration` seconds, so the
+command can be run as a worker.
+"""
+import itertools
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from gravvy.apps.push.feedback import (
+    read_feedback, deactivate_feedback_devices)
+
+
+class Command(BaseCommand):
+    help = "Deactivate the devices reported by the APNS feedback service."
+
+    def add_arguments(self, parser):
+        push_settings = settings.PUSH_NOTIFICATIONS_SETTINGS
+        parser.add_argument(
+            '--host', dest='host', default=push_settings['APNS_FEEDBACK_HOST'],
+            help="Host of the feedback service.")
+        parser.add_argument(
+            '--port', type=int, dest='port',
+            default=push_settings.get('APNS_FEEDBACK_PORT', 2196),
+            help="Port of the feedback service.")
+        parser.add_argument(
+            '--insecure', action='store_false', dest='secure', default=True,
+            help="Connect without TLS, to a local stub feedback service.")
+        parser.add_argument(
+            '--interval', type=float, dest='interval',
+            help="Number of seconds between polls of the feedback service.")
+        parser.add_argument(
+            '--duration', type=float, default=3600, dest='duration',
+            help="Number of seconds to keep polling for, with --interval.")
+        parser.add_argument(
+            '--batch-size', type=int, default=500, dest='batch_size',
+            help="Number of reported tokens to deactivate at a time.")
+
+    def handle(self, *args, **options):
+        interval = options['interval']
+        deadline = time.time() + options['duration']
+        reported_count = deactivated_count = 0
+        while True:
+            counts = self.poll(options)
+            reported_count += counts[0]
+            deactivated_count += counts[1]
+            if not interval or time.time() + interval > deadline:
+                break
+            time.sleep(interval)
+
+        if int(options['verbosity']) > 1:
+            self.stdout.write(
+                "Deactivated %d devices of %d reported tokens"
+                % (deactivated_count, reported_count))
+
+    def poll(self, options):
+        """
+        Poll the feedback service and deactivate the reported devices, a
+        batch at a time
+
+        Returns:
+            (number of reported tokens, number of deactivated devices) tuple
+        """
+        feedback = read_feedback(
+            options['host'], options['port'],
+            certificate=settings.PUSH_NOTIFICATIONS_SETTINGS[
+                'APNS_CERTIFICATE'],
+            secure=options['secure'])
+        reported_count = deactivated_count = 0
+        while True:
+            batch = list(itertools.islice(feedback, options['batch_size']))
+            if not batch:
+                return reported_count, deactivated_count
+            reported_count += len(batch)
+            deactivated_count += len(deactivate_feedback_devices(batch))
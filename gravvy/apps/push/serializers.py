@@ -43,6 +43,9 @@ class AbstractBaseDeviceSerializer(serializers.ModelSerializer):
             device = ModelClass.objects.get(registration_id=registration_id)
             device.user = user
             device.date_created = timezone.now()
+            # the app may have been reinstalled since the device was
+            # deactivated
+            device.active = True
             device.save()
                         
         except ModelClass.DoesNotExist:
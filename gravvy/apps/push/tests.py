@@ -1,3 +1,378 @@
+import binascii
+import calendar
+import json
+import socket
+import struct
+import threading
+from datetime import timedelta
+
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
 from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+import h2.connection
+import h2.events
+import h2.settings
+from push_notifications.models import APNSDevice
+from rest_framework.test import APIClient
+
+from gravvy.apps.account.models import User
+from gravvy.apps.push import apns
+from gravvy.apps.push.apns import APNSConnection, send_notifications
+from gravvy.apps.push.feedback import (
+    read_feedback, deactivate_feedback_devices)
+from gravvy.apps.push.utils import send_bulk_push_messages
 
 # Create your tests here.
+
+class StubAPNSServer(threading.Thread):
+    """
+    A local HTTP/2 server that answers notifications the way the APNS provider
+    API does, without TLS.
+    """
+
+    def __init__(self, responses={}, max_concurrent_streams=None, hold=1,
+                 close_after=None):
+        """
+        Args:
+            responses: dictionary of the (status code, reason) tuple to answer
+                the notifications to a device token with. Other notifications
+                are answered with 200.
+            max_concurrent_streams: number of streams the server allows
+            hold: number of notifications to receive before answering any
+            close_after: number of notifications to receive before closing
+                the first connection, without answering them
+        """
+        super(StubAPNSServer, self).__init__(name='stub-apns')
+        self.daemon = True
+        self.responses = responses
+        self.max_concurrent_streams = max_concurrent_streams
+        self.hold = hold
+        self.close_after = close_after
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(5)
+        self.port = self.listener.getsockname()[1]
+        self.connections = 0
+        self.max_open_streams = 0
+        # (device token, headers, payload) tuple of each notification
+        self.notifications = []
+
+    def run(self):
+        while True:
+            try:
+                sock, _ = self.listener.accept()
+            except socket.error:
+                return
+            self.connections += 1
+            try:
+                self.serve(sock, close_after=(
+                        self.close_after if self.connections == 1 else None))
+            finally:
+                sock.close()
+
+    def stop(self):
+        self.listener.close()
+
+    def serve(self, sock, close_after=None):
+        connection = h2.connection.H2Connection(client_side=False)
+        if self.max_concurrent_streams:
+            connection.local_settings = h2.settings.Settings(
+                client=False, initial_values={
+                    h2.settings.SettingCodes.MAX_CONCURRENT_STREAMS:
+                    self.max_concurrent_streams})
+        connection.initiate_connection()
+        sock.sendall(connection.data_to_send())
+        # answer held notifications if no more arrive for a while
+        sock.settimeout(1)
+
+        requests = {}
+        answerable = []
+        received = 0
+        while True:
+            try:
+                data = sock.recv(65535)
+            except socket.timeout:
+                data = None
+            if data == '':
+                return
+
+            for event in connection.receive_data(data or ''):
+                if isinstance(event, h2.events.RequestReceived):
+                    requests[event.stream_id] = (dict(event.headers), '')
+                    self.max_open_streams = max(
+                        self.max_open_streams, len(requests))
+                elif isinstance(event, h2.events.DataReceived):
+                    headers, payload = requests[event.stream_id]
+                    requests[event.stream_id] = (headers, payload + event.data)
+                    connection.acknowledge_received_data(
+                        event.flow_controlled_length, event.stream_id)
+                elif isinstance(event, h2.events.StreamEnded):
+                    received += 1
+                    if close_after and received >= close_after:
+                        return
+                    answerable.append(event.stream_id)
+
+            if answerable and (len(answerable) >= self.hold or data is None):
+                for stream_id in answerable:
+                    self.answer(connection, stream_id, *requests.pop(stream_id))
+                answerable = []
+            sock.sendall(connection.data_to_send())
+
+    def answer(self, connection, stream_id, headers, payload):
+        token = headers[':path'].rsplit('/', 1)[1]
+        self.notifications.append((token, headers, payload))
+        status, reason = self.responses.get(token, (200, None))
+        response_headers = [(':status', str(status)), ('apns-id', 'stub')]
+        if reason is None:
+            connection.send_headers(stream_id, response_headers,
+                                    end_stream=True)
+        else:
+            connection.send_headers(stream_id, response_headers)
+            connection.send_data(stream_id, json.dumps({'reason': reason}),
+                                 end_stream=True)
+
+
+class StubFeedbackServer(threading.Thread):
+    """
+    A local server that reports device tokens the way the APNS feedback
+    service does, without TLS.
+    """
+
+    def __init__(self, feedback, chunk_size=65536):
+        """
+        Args:
+            feedback: list of (timestamp, device token) tuples to report, with
+                tokens in hexadecimal
+            chunk_size: number of bytes to send at a time, so the report is
+                read across many reads
+        """
+        super(StubFeedbackServer, self).__init__(name='stub-feedback')
+        self.daemon = True
+        self.data = ''.join(
+            struct.pack('!LH', calendar.timegm(timestamp.utctimetuple()),
+                        len(token) / 2) + binascii.unhexlify(token)
+            for timestamp, token in feedback)
+        self.chunk_size = chunk_size
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(5)
+        self.port = self.listener.getsockname()[1]
+
+    def run(self):
+        while True:
+            try:
+                sock, _ = self.listener.accept()
+            except socket.error:
+                return
+            for offset in range(0, len(self.data), self.chunk_size):
+                sock.sendall(self.data[offset:offset + self.chunk_size])
+            sock.close()
+
+    def stop(self):
+        self.listener.close()
+
+
+class APNSConnectionTests(TestCase):
+    """
+    Tests of sending notifications over HTTP/2 to a stub APNS server.
+    """
+
+    def start_server(self, **kwargs):
+        server = StubAPNSServer(**kwargs)
+        server.start()
+        self.addCleanup(server.stop)
+        connection = APNSConnection('127.0.0.1', server.port, secure=False,
+                                    topic='com.gravvy.test')
+        self.addCleanup(connection.close)
+        return server, connection
+
+    def test_send(self):
+        server, connection = self.start_server()
+        responses = connection.send(
+            [('token%d' % i, '{"aps":{}}') for i in range(3)])
+        self.assertEqual(responses, [(200, None)] * 3)
+        self.assertEqual(sorted(token for token, _, _ in server.notifications),
+                         ['token0', 'token1', 'token2'])
+        token, headers, payload = server.notifications[0]
+        self.assertEqual(headers[':method'], 'POST')
+        self.assertEqual(headers['apns-topic'], 'com.gravvy.test')
+        self.assertEqual(payload, '{"aps":{}}')
+
+    def test_concurrent_streams(self):
+        # notifications are only answered once all of them are in flight
+        server, connection = self.start_server(hold=5)
+        responses = connection.send([('token%d' % i, '{}') for i in range(5)])
+        self.assertEqual(responses, [(200, None)] * 5)
+        self.assertEqual(server.max_open_streams, 5)
+
+    def test_max_concurrent_streams(self):
+        server, connection = self.start_server(
+            max_concurrent_streams=2, hold=2)
+        responses = connection.send([('token%d' % i, '{}') for i in range(6)])
+        self.assertEqual(responses, [(200, None)] * 6)
+        self.assertEqual(server.max_open_streams, 2)
+
+    def test_connection_reused(self):
+        server, connection = self.start_server()
+        connection.send([('token0', '{}')])
+        connection.send([('token1', '{}')])
+        self.assertEqual(server.connections, 1)
+
+    def test_resent_after_broken_connection(self):
+        server, connection = self.start_server(close_after=2)
+        responses = connection.send([('token%d' % i, '{}') for i in range(4)])
+        self.assertEqual(responses, [(200, None)] * 4)
+        self.assertEqual(server.connections, 2)
+
+    def test_rejected(self):
+        server, connection = self.start_server(responses={
+                'gone': (410, 'Unregistered'),
+                'bad': (400, 'BadDeviceToken')})
+        responses = connection.send(
+            [('good', '{}'), ('gone', '{}'), ('bad', '{}')])
+        self.assertEqual(responses, [
+                (200, None), (410, 'Unregistered'), (400, 'BadDeviceToken')])
+
+
+@override_settings(PUSH_DRY_RUN=False, APNS_HTTP2=True)
+class SendNotificationsTests(TestCase):
+    """
+    Tests of sending notifications to devices over HTTP/2, and deactivating
+    the devices APNS rejects the tokens of.
+    """
+
+    def setUp(self):
+        self.server = StubAPNSServer(responses={
+                'gone': (410, 'Unregistered'),
+                'bad': (400, 'BadDeviceToken'),
+                'large': (413, 'PayloadTooLarge')})
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        self.connection = APNSConnection(
+            '127.0.0.1', self.server.port, secure=False)
+        self.addCleanup(self.connection.close)
+
+        self.user = User.objects.create_user('+12025550100', 'password')
+        self.devices = dict(
+            (token, APNSDevice.objects.create(
+                    user=self.user, registration_id=token))
+            for token in ('good', 'gone', 'bad', 'large'))
+
+    def test_deactivate_rejected_tokens(self):
+        inactive_ids = send_notifications(
+            [(device, 'hi', None, 1, {}) for device in self.devices.values()],
+            connection=self.connection)
+        self.assertEqual(sorted(inactive_ids), sorted(
+                [self.devices['gone'].id, self.devices['bad'].id]))
+        active = dict(APNSDevice.objects.values_list(
+                'registration_id', 'active'))
+        self.assertEqual(active, {
+                'good': True, 'gone': False, 'bad': False, 'large': True})
+
+    def test_payload(self):
+        send_notifications(
+            [(self.devices['good'], 'hi', 'default', 2, {'v': 'abc'})],
+            connection=self.connection)
+        token, headers, payload = self.server.notifications[0]
+        self.assertEqual(json.loads(payload), {
+                'aps': {'alert': 'hi', 'sound': 'default', 'badge': 2},
+                'v': 'abc'})
+
+    def test_bulk_push_messages(self):
+        self.addCleanup(setattr, apns, '_connection', None)
+        apns._connection = self.connection
+        other = User.objects.create_user('+12025550101', 'password')
+        APNSDevice.objects.create(user=other, registration_id='other')
+
+        send_bulk_push_messages([([self.user], 'hi', {}), ([other], None, {})])
+        self.assertEqual(len(self.server.notifications), 5)
+        self.assertFalse(APNSDevice.objects.get(registration_id='gone').active)
+
+    def test_inactive_devices_skipped(self):
+        self.addCleanup(setattr, apns, '_connection', None)
+        apns._connection = self.connection
+        APNSDevice.objects.filter(registration_id='good').update(active=False)
+
+        send_bulk_push_messages([([self.user], 'hi', {})])
+        self.assertEqual(
+            sorted(token for token, _, _ in self.server.notifications),
+            ['bad', 'gone', 'large'])
+
+
+class FeedbackTests(TestCase):
+    """
+    Tests of deactivating the devices reported by a stub APNS feedback
+    service.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user('+12025550100', 'password')
+        self.reported_at = timezone.now().replace(microsecond=0)
+        self.tokens = ['%064x' % i for i in range(1, 5)]
+        for token in self.tokens:
+            APNSDevice.objects.create(user=self.user, registration_id=token)
+        APNSDevice.objects.filter(registration_id__in=self.tokens).update(
+            date_created=self.reported_at - timedelta(days=1))
+
+    def start_server(self, feedback, **kwargs):
+        server = StubFeedbackServer(feedback, **kwargs)
+        server.start()
+        self.addCleanup(server.stop)
+        return server
+
+    def get_active(self):
+        return dict(APNSDevice.objects.values_list(
+                'registration_id', 'active'))
+
+    def test_read_feedback(self):
+        feedback = [(self.reported_at, token) for token in self.tokens]
+        # split the report into chunks that aren't aligned with its tokens
+        server = self.start_server(feedback, chunk_size=7)
+        self.assertEqual(
+            list(read_feedback('127.0.0.1', server.port, secure=False)),
+            feedback)
+
+    def test_deactivate(self):
+        deactivate_feedback_devices(
+            [(self.reported_at, token) for token in self.tokens[:2]])
+        self.assertEqual(self.get_active(), {
+                self.tokens[0]: False, self.tokens[1]: False,
+                self.tokens[2]: True, self.tokens[3]: True})
+
+    def test_registered_again_not_deactivated(self):
+        APNSDevice.objects.filter(registration_id=self.tokens[0]).update(
+            date_created=self.reported_at + timedelta(seconds=1))
+        inactive_ids = deactivate_feedback_devices(
+            [(self.reported_at, self.tokens[0])])
+        self.assertEqual(inactive_ids, [])
+        self.assertTrue(self.get_active()[self.tokens[0]])
+
+    def test_uppercase_token(self):
+        token = 'ab' * 32
+        APNSDevice.objects.create(
+            user=self.user, registration_id=token.upper())
+        APNSDevice.objects.filter(registration_id=token.upper()).update(
+            date_created=self.reported_at - timedelta(days=1))
+        deactivate_feedback_devices([(self.reported_at, token)])
+        self.assertFalse(self.get_active()[token.upper()])
+
+    def test_command(self):
+        server = self.start_server(
+            [(self.reported_at, token) for token in self.tokens[1:]] +
+            [(self.reported_at, '%064x' % 100)])
+        call_command('pollfeedback', host='127.0.0.1', port=server.port,
+                     secure=False, batch_size=2)
+        self.assertEqual(self.get_active(), {
+                self.tokens[0]: True, self.tokens[1]: False,
+                self.tokens[2]: False, self.tokens[3]: False})
+
+    def test_registering_again_reactivates(self):
+        APNSDevice.objects.update(active=False)
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        response = client.post(reverse('push_register_apns'),
+                               {'registration_id': self.tokens[0]})
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(self.get_active()[self.tokens[0]])
@@ -4,15 +4,29 @@ Utility functions that come in handy for push notifications
 Table Of Contents:
     send_sms_message: send an SMS to a given phone number
     send_bulk_sms_message: Send bulk SMS message to multiple users
+    send_device_message: Send a PUSH notification to a given device
+    send_device_messages: Send PUSH notifications to multiple devices
     send_push_message: Send a PUSH notification to a given user
     send_bulk_push_message: Send a bulk PUSH notification to multiple users
+    send_bulk_push_messages: Send multiple bulk PUSH notifications at once
+    
+Nothing is delivered when the PUSH_DRY_RUN setting is on, but everything else
+about sending messages is still done.
+
+PUSH notifications are sent over HTTP/2 by `gravvy.apps.push.apns` when the
+APNS_HTTP2 setting is on, and through the legacy APNS gateway otherwise.
 """
 
 import plivo
 from django.conf import settings
-from django.db.models import Q
+from django.db.models import F, Q
 from push_notifications.models import APNSDevice
 
+from gravvy.apps.monitoring.metrics import (
+    PUSH_MESSAGES, PUSH_FANOUT, SMS_MESSAGES)
+from gravvy.apps.monitoring.profiling import profile_block
+from gravvy.apps.push.apns import send_notifications
+
 def send_sms(phone_number, message):
     """
     Send an SMS message to a given phone number
@@ -35,11 +49,21 @@ def send_sms(phone_number, message):
                   'dst' : phone_number, 
                   'text' : message, 
                   'type' : 'sms'}
+        if settings.PUSH_DRY_RUN:
+            return
+        
         if settings.PLIVO_DEBUG:
             # Dont bother wasting credits when just testing out
             print params
         else:
-            plivoAPI.send_message(params)
+            with profile_block('sms'):
+                try:
+                    status_code, response = plivoAPI.send_message(params)
+                except Exception:
+                    SMS_MESSAGES.labels('failed').inc()
+                    raise
+            SMS_MESSAGES.labels(
+                'sent' if status_code < 400 else 'failed').inc()
 
 
 def send_sms_message(user, message):
@@ -83,15 +107,64 @@ def get_user_badge(user):
     """
     from gravvy.apps.video.models import VideoUsers
     
-    device_badge = VideoUsers.objects.filter(
-        Q(user_id=user.id),
-        Q(status=VideoUsers.STATUS_INVITED) | 
-        Q(new_likes_count__gt=0) | Q(new_clips_count__gt=0)
-        ).distinct().count()
+    with profile_block('badge'):
+        device_badge = VideoUsers.objects.filter(
+            Q(user_id=user.id),
+            Q(status=VideoUsers.STATUS_INVITED) | 
+            Q(acked_like_seq__lt=F('video__like_seq')) |
+            Q(acked_clip_seq__lt=F('video__clip_seq'))
+            ).distinct().count()
     if device_badge == 0:
         device_badge = None
     return device_badge
 
+def send_device_message(device, message, sound=None, badge=None, extra={}):
+    """
+    Send a PUSH notification to a given device
+    
+    Args:
+        device: APNSDevice to receive the push notification
+        message: message to be shown when app is in background/inactive
+        sound: sound to be played on notification arrival
+        badge: badge to be shown on the app
+        extra: extra content to be consumed by the app when active
+        
+    Returns:
+        None
+    """
+    send_device_messages([(device, message, sound, badge, extra)])
+
+
+def send_device_messages(notifications):
+    """
+    Send PUSH notifications to multiple devices. Over HTTP/2 they're all sent
+    at once on a single connection.
+    
+    Args:
+        notifications: list of (device, message, sound, badge, extra) tuples,
+            with each tuple describing a notification as in
+            send_device_message
+        
+    Returns:
+        None
+    """
+    if settings.PUSH_DRY_RUN or not notifications:
+        return
+    if settings.APNS_HTTP2:
+        send_notifications(notifications)
+        return
+    
+    for device, message, sound, badge, extra in notifications:
+        with profile_block('apns'):
+            try:
+                device.send_message(message, sound=sound, badge=badge, 
+                                    extra=extra)
+            except Exception:
+                PUSH_MESSAGES.labels('failed').inc()
+                raise
+        PUSH_MESSAGES.labels('sent').inc()
+
+
 def send_push_message(user, message, badge=None, extra={}):
     """
     Send a PUSH notification to a given user
@@ -114,7 +187,7 @@ def send_bulk_push_message(users, message, badge=None, extra={}):
     Send a bulk PUSH notification to multiple users
     
     Args:
-        users: users to receive the push notification
+        users: users, or ids of users, to receive the push notification
         message: message to be shown when app is in background/inactive
         extra: extra content to be consumed by the app when active
 
@@ -124,12 +197,67 @@ def send_bulk_push_message(users, message, badge=None, extra={}):
     # only send sound if there there's a message
     sound = settings.PUSH_SOUND_FILE if message else None
     
-    # get all devices associated with given users
-    devices = APNSDevice.objects.filter(user__in=users).select_related('user')
+    # get all active devices associated with given users
+    devices = APNSDevice.objects.filter(
+        user__in=users, active=True).select_related('user')
+    devices = list(devices)
+    PUSH_FANOUT.observe(len(devices))
+    device_notifications = []
     for device in devices:
         # can't invoke bulk messaging functionality as each user has a
         # unique badge count
         device_badge = get_user_badge(device.user)
-        device.send_message(message, sound=sound, badge=device_badge, 
-                            extra=extra)
+        device_notifications.append(
+            (device, message, sound, device_badge, extra))
+    send_device_messages(device_notifications)
+
 
+def send_bulk_push_messages(notifications):
+    """
+    Send multiple bulk PUSH notifications at once. The devices of all
+    recipients are fetched with a single query and each recipient's badge is
+    only computed once, however many of the notifications they receive.
+    
+    Args:
+        notifications: list of (users, message, extra) tuples, with each tuple
+            describing a bulk push notification as in send_bulk_push_message.
+            users must be lists of user objects or of user ids.
+    
+    Returns:
+        None
+    """
+    # each notification's recipients, by id and without duplicates
+    notifications = [
+        (set(getattr(user, 'id', user) for user in users), message, extra)
+        for users, message, extra in notifications]
+    user_ids = set()
+    for recipient_ids, message, extra in notifications:
+        user_ids.update(recipient_ids)
+    if not user_ids:
+        return
+    
+    # get all active devices associated with given users
+    devices_by_user = {}
+    devices = APNSDevice.objects.filter(
+        user_id__in=user_ids, active=True).select_related('user')
+    for device in devices:
+        devices_by_user.setdefault(device.user_id, []).append(device)
+    
+    badges = {}
+    device_notifications = []
+    for recipient_ids, message, extra in notifications:
+        # only send sound if there there's a message
+        sound = settings.PUSH_SOUND_FILE if message else None
+        
+        fanout = 0
+        for user_id in recipient_ids:
+            for device in devices_by_user.get(user_id, []):
+                fanout += 1
+                # can't invoke bulk messaging functionality as each user has a
+                # unique badge count
+                if user_id not in badges:
+                    badges[user_id] = get_user_badge(device.user)
+                device_notifications.append(
+                    (device, message, sound, badges[user_id], extra))
+        PUSH_FANOUT.observe(fanout)
+    send_device_messages(device_notifications)
@@ -0,0 +1,89 @@
+"""
+Customizations to rest_framework's content negotiation
+
+Table Of Contents:
+    get_media_type_quality: get the quality an Accept header gives a media type
+    accepts_webp: determine if WebP images should be served to a client
+    ImageFormatVaryMiddleware: vary responses on the Accept header
+"""
+from django.utils.cache import patch_vary_headers
+
+# name of the query parameter clients can use to pick the image format of
+# the thumbnail URLs in API responses. When present it takes precedence over
+# the image types listed in the request's Accept header.
+IMAGE_FORMAT_QUERY_PARAM = 'image_format'
+
+# attribute set on requests whose responses depend on their Accept header
+ACCEPT_NEGOTIATED_ATTR = '_image_format_from_accept'
+
+
+def get_media_type_quality(accept, media_type):
+    """
+    Get the quality an Accept header gives a media type, from the media range
+    naming it exactly. Wildcard ranges such as `image/*` are ignored, as
+    clients sending them can't be relied on to display the type.
+
+    Args:
+        accept: value of an Accept header
+        media_type: lowercase media type, e.g. `image/webp`
+
+    Returns:
+        quality of the media type in [0, 1], with 0 if it isn't acceptable
+    """
+    for media_range in accept.split(','):
+        params = media_range.split(';')
+        if params[0].strip().lower() != media_type:
+            continue
+
+        quality = 1.0
+        for param in params[1:]:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value.strip())
+                except ValueError:
+                    quality = 0.0
+        return min(max(quality, 0.0), 1.0)
+    return 0.0
+
+
+def accepts_webp(request):
+    """
+    Determine if the client making a request should be served WebP images.
+    The `image_format` query parameter is checked first, so clients that
+    can't customize their Accept header (like the iOS app's image loaders)
+    can still opt in. Otherwise the request's Accept header is used, and the
+    request is marked so its response varies on the Accept header.
+
+    Args:
+        request: rest_framework Request object, or None if there's no request
+
+    Returns:
+        (bool) True if WebP images should be served, otherwise False
+    """
+    if request is None:
+        return False
+
+    query_params = getattr(request, 'query_params', request.GET)
+    image_format = query_params.get(IMAGE_FORMAT_QUERY_PARAM)
+    if image_format:
+        return image_format.lower() == 'webp'
+
+    # middleware sees the HttpRequest a rest_framework Request wraps
+    setattr(getattr(request, '_request', request), ACCEPT_NEGOTIATED_ATTR,
+            True)
+    return get_media_type_quality(
+        request.META.get('HTTP_ACCEPT', ''), 'image/webp') > 0
+
+
+class ImageFormatVaryMiddleware(object):
+    """
+    Add the Accept header to the Vary header of responses whose image format
+    was picked from it, so caches don't serve WebP images to clients that
+    can't display them.
+    """
+
+    def process_response(self, request, response):
+        if getattr(request, ACCEPT_NEGOTIATED_ATTR, False):
+            patch_vary_headers(response, ['Accept'])
+        return response
@@ -0,0 +1,22 @@
+"""
+Customizations to rest_framework's renderers
+"""
+from rest_framework import renderers
+
+
+class EventStreamRenderer(renderers.BaseRenderer):
+    """
+    Renderer of server-sent event streams. Streams are sent as streaming
+    responses, which aren't rendered, so this only renders errors, such as
+    failed authentication, as a single `error` event with the JSON data of
+    the error.
+    """
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+    charset = 'utf-8'
+    
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return bytes()
+        return 'event: error\ndata: %s\n\n' % (
+            renderers.JSONRenderer().render(data))
@@ -0,0 +1,97 @@
+from django.core.urlresolvers import reverse
+from django.http import HttpResponse
+from django.test import TestCase, RequestFactory
+from rest_framework.request import Request
+from rest_framework.test import APIClient
+
+from gravvy.apps.account.models import User
+from gravvy.apps.rest.negotiation import (
+    accepts_webp, get_media_type_quality, ImageFormatVaryMiddleware,
+    IMAGE_FORMAT_QUERY_PARAM)
+from gravvy.apps.video.models import Video
+
+# Create your tests here.
+
+class ImageFormatNegotiationTests(TestCase):
+    """
+    Tests of picking the image format of thumbnails from the Accept header or
+    the image format query parameter.
+    """
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def accepts_webp(self, accept=None, **params):
+        headers = {} if accept is None else {'HTTP_ACCEPT': accept}
+        return accepts_webp(Request(self.factory.get('/', params, **headers)))
+
+    def test_media_type_quality(self):
+        for accept, quality in (
+            ('image/webp', 1.0),
+            ('image/webp;q=0.8,image/*;q=0.5', 0.8),
+            ('image/png, IMAGE/WEBP ; Q=0.3', 0.3),
+            ('image/webp;q=0', 0.0),
+            ('image/webp;q=bogus', 0.0),
+            ('image/webp;q=2', 1.0),
+            ('image/*,*/*;q=0.8', 0.0),
+            ('image/webpx', 0.0),
+            ('', 0.0)):
+            self.assertEqual(
+                get_media_type_quality(accept, 'image/webp'), quality, accept)
+
+    def test_accept_header(self):
+        self.assertTrue(self.accepts_webp('image/webp,*/*;q=0.8'))
+        self.assertFalse(self.accepts_webp('image/webp;q=0,image/*'))
+        self.assertFalse(self.accepts_webp('*/*'))
+        self.assertFalse(self.accepts_webp())
+
+    def test_query_param_overrides_accept_header(self):
+        self.assertTrue(self.accepts_webp(
+                '*/*', **{IMAGE_FORMAT_QUERY_PARAM: 'webp'}))
+        self.assertTrue(self.accepts_webp(
+                '*/*', **{IMAGE_FORMAT_QUERY_PARAM: 'WebP'}))
+        self.assertFalse(self.accepts_webp(
+                'image/webp', **{IMAGE_FORMAT_QUERY_PARAM: 'jpeg'}))
+
+    def test_no_request(self):
+        self.assertFalse(accepts_webp(None))
+
+
+class ImageFormatVaryTests(TestCase):
+    """
+    Tests of varying responses on the Accept header when it picks the image
+    format of thumbnails
+    """
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.middleware = ImageFormatVaryMiddleware()
+
+    def get_vary(self, params, response=None):
+        request = self.factory.get('/', params, HTTP_ACCEPT='image/webp')
+        accepts_webp(Request(request))
+        response = self.middleware.process_response(
+            request, response or HttpResponse())
+        return response.get('Vary')
+
+    def test_varies_on_accept(self):
+        self.assertEqual(self.get_vary({}), 'Accept')
+
+    def test_existing_vary_kept(self):
+        response = HttpResponse()
+        response['Vary'] = 'Cookie'
+        self.assertEqual(self.get_vary({}, response), 'Cookie, Accept')
+
+    def test_query_param_doesnt_vary(self):
+        self.assertIsNone(self.get_vary({IMAGE_FORMAT_QUERY_PARAM: 'webp'}))
+
+    def test_api_response(self):
+        owner = User.objects.create_user('+12025550100', 'password')
+        video = Video.objects.create(owner=owner, title='video')
+        client = APIClient()
+        client.force_authenticate(user=owner)
+        response = client.get(
+            reverse('video-detail', kwargs={'hash_key': video.hash_key}),
+            HTTP_ACCEPT='application/json, image/webp')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Accept', response['Vary'])
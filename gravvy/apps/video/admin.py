@@ -3,7 +3,8 @@ from django.utils.translation import ugettext_lazy as _
 
 from imagekit.admin import AdminThumbnail
 
-from gravvy.apps.video.models import Video, VideoUsers, Clip
+from gravvy.apps.video.models import (
+    Video, VideoUsers, Clip, Like, PendingNotification)
 
 # Register your models here.
 
@@ -33,13 +34,16 @@ class VideoAdmin(admin.ModelAdmin):
         (_('Timestamps'), {'fields': ('created_at', 'updated_at')}),
         (_('Leading Clip Media'), {'fields': ('photo', 'photo_thumbnail', 
                                               'photo_small_thumbnail',)}),
-        (_('Clips'), {'fields': ('clips_count', 'duration',)}),
+        (_('Clips'), {'fields': ('clips_count', 'duration', 
+                                 'next_clip_order',)}),
+        (_('Sequence Numbers'), {'fields': ('like_seq', 'clip_seq',)}),
         (_('Users'), {'fields': ('users',)}),
         )
     readonly_fields = ('hash_key', 'likes_count', 'plays_count', 'score',
                        'updated_at', 'created_at', 
                        'photo', 'photo_thumbnail', 'photo_small_thumbnail',
-                       'clips_count', 'duration', 'users',)
+                       'clips_count', 'duration', 'next_clip_order', 
+                       'like_seq', 'clip_seq', 'users',)
     inlines = (ClipInline,)
     search_fields = ('title', 'owner__phone_number', 'owner__full_name')
     ordering = ('-created_at',)
@@ -85,10 +89,11 @@ class VideoUsersAdmin(admin.ModelAdmin):
     """ 
     list_display = ('video', 'user', 'hash_key', 'new_likes_count', 
                     'new_clips_count', 'status')
+    list_select_related = ('video', 'user')
     fieldsets = (
         (None, {'fields': ('video', 'user', 'hash_key')}),
-        (_('Status'), {'fields': ('status','new_likes_count',
-                                  'new_clips_count')}),
+        (_('Status'), {'fields': ('status','acked_like_seq',
+                                  'acked_clip_seq')}),
         (_('Timestamps'), {'fields': ('created_at', 'updated_at')}),
         )
     readonly_fields = ('hash_key', 'created_at', 'updated_at')
@@ -148,6 +153,35 @@ class ClipAdmin(admin.ModelAdmin):
     delete_selected_c.short_description = "Delete selected clip(s)"
 
 
+class LikeAdmin(admin.ModelAdmin):
+    """
+    Representation of a Like in the admin interface
+    """
+    list_display = ('video', 'user', 'created_at')
+    fields = ('video', 'user', 'created_at')
+    raw_id_fields = ('video', 'user')
+    search_fields = ('video__title', 'video__hash_key', 'user__phone_number',
+                     'user__full_name')
+    ordering = ('-created_at',)
+
+
+class PendingNotificationAdmin(admin.ModelAdmin):
+    """
+    Representation of a PendingNotification in the admin interface
+    """
+    list_display = ('video', 'user', 'action_type', 'count', 'loud',
+                    'send_at')
+    fields = ('video', 'user', 'action_type', 'actor', 'multiple_actors',
+              'count', 'loud', 'object_identifier', 'created_at',
+              'updated_at', 'send_at')
+    raw_id_fields = ('video', 'user', 'actor')
+    search_fields = ('video__title', 'video__hash_key', 'user__phone_number',
+                     'user__full_name')
+    ordering = ('send_at',)
+
+
 admin.site.register(Video, VideoAdmin)
 admin.site.register(VideoUsers, VideoUsersAdmin)
 admin.site.register(Clip, ClipAdmin)
+admin.site.register(Like, LikeAdmin)
+admin.site.register(PendingNotification, PendingNotificationAdmin)
@@ -0,0 +1,170 @@
+"""
+Request-scoped loading of videos and of the request user's relations to
+them.
+
+A request can resolve the same video several times: in its permission
+checks, in the view, and in the serializers. The loader of a request is an
+identity map that fetches each of these at most once per request, however
+many times they're asked for. Permission classes, views and serializers get
+it with `get_loader(request)`.
+
+Table Of Contents:
+    VideoLoader: identity map of the videos and video users of a request
+    get_loader: get the loader of a request
+"""
+
+from gravvy.apps.video.models import Video, VideoUsers, Like
+
+
+class VideoLoader(object):
+    """
+    Identity map of the videos a request resolves, their memberships, and the
+    request user's video users and likes of them. Everything is loaded
+    lazily, at most once.
+
+    Videos are loaded from the database, not the cache, so views can modify
+    and save them.
+    """
+
+    def __init__(self, request):
+        """
+        Args:
+            request: REST framework Request being handled
+        """
+        self.request = request
+        # videos by hash key. None marks videos that don't exist.
+        self._videos = {}
+        # video memberships by hash key
+        self._memberships = {}
+        # request user's video users by video hash key. None marks videos
+        # the user isn't associated with.
+        self._video_users = {}
+        # request user's likes by video id
+        self._liked = {}
+
+    @property
+    def user(self):
+        # the request user is only looked up once the loader is used, which
+        # is after authentication.
+        return self.request.user
+
+    def add_video(self, video):
+        """
+        Add a video the view has loaded by other means, such as
+        `get_object()`, to the identity map so it isn't loaded again.
+        """
+        self._videos[video.hash_key] = video
+
+    def get_video(self, hash_key):
+        """
+        Get a video by hash key
+
+        Args:
+            hash_key: hash key of video
+
+        Returns:
+            Video instance
+
+        Raises:
+            Video.DoesNotExist: there's no video with this hash key
+        """
+        if hash_key not in self._videos:
+            try:
+                video = Video.objects.select_related('owner').get(
+                    hash_key=hash_key)
+            except Video.DoesNotExist:
+                video = None
+            self._videos[hash_key] = video
+
+        video = self._videos[hash_key]
+        if video is None:
+            raise Video.DoesNotExist(
+                "Video matching query does not exist.")
+        return video
+
+    def get_membership(self, hash_key):
+        """
+        Get the membership of a video by hash key. This comes from the cache
+        when it can.
+
+        Returns:
+            VideoMembership instance
+
+        Raises:
+            Video.DoesNotExist: there's no video with this hash key
+        """
+        if hash_key not in self._memberships:
+            self._memberships[hash_key] = VideoUsers.objects.get_membership(
+                hash_key)
+        return self._memberships[hash_key]
+
+    def get_video_user(self, hash_key):
+        """
+        Get the request user's association with a video. The video is
+        selected along with it, and added to the identity map.
+
+        Args:
+            hash_key: hash key of video
+
+        Returns:
+            VideoUsers instance, or None if the request user isn't
+            associated with the video or isn't authenticated.
+        """
+        if hash_key in self._video_users:
+            return self._video_users[hash_key]
+
+        video_user = None
+        membership = self._memberships.get(hash_key)
+        if not self.user.is_authenticated():
+            pass
+        elif membership is not None and (
+            self.user.id not in membership.members):
+            # an already loaded membership says there's no association
+            pass
+        else:
+            video = self._videos.get(hash_key)
+            try:
+                if video is not None:
+                    video_user = VideoUsers.objects.get(
+                        video_id=video.id, user_id=self.user.id)
+                    video_user.video = video
+                else:
+                    video_user = VideoUsers.objects.select_related(
+                        'video', 'video__owner').get(
+                        video__hash_key=hash_key, user_id=self.user.id)
+                    self._videos.setdefault(hash_key, video_user.video)
+            except VideoUsers.DoesNotExist:
+                pass
+
+        self._video_users[hash_key] = video_user
+        return video_user
+
+    def get_liked(self, video):
+        """
+        Determine if the request user liked a video
+
+        Returns:
+            Boolean indicator: True if the user liked the video
+        """
+        if video.id not in self._liked:
+            self._liked[video.id] = (
+                self.user.is_authenticated() and Like.objects.filter(
+                    user_id=self.user.id, video_id=video.id).exists())
+        return self._liked[video.id]
+
+
+def get_loader(request):
+    """
+    Get the loader of a request, creating it on first use.
+
+    Args:
+        request: REST framework Request being handled
+
+    Returns:
+        VideoLoader instance
+    """
+    loader = getattr(request, 'video_loader', None)
+    if loader is None:
+        loader = VideoLoader(request)
+        request.video_loader = loader
+    return loader
@@ -0,0 +1,258 @@
+"""
+Measure the bytes a page of the activity feed costs a client with JPEG
+thumbnails and with WebP thumbnails.
+
+A dataset is seeded, like the query budget tests do, and every seeded video,
+clip and user gets a photo or avatar. The viewer's first page of activities is
+then requested with `image_format=jpeg` and `image_format=webp`, and the
+thumbnails it references are summed up: all of them, as a page with no cached
+images costs, and each distinct one once, as a client with an image cache
+downloads them.
+
+Photos are generated, each a random gradient and shapes with a little noise,
+unless photos are given with `--photo`. Real photos give the most realistic
+savings. Everything seeded is rolled back and the media files are stored in
+a temporary directory that's deleted afterwards.
+
+Results are written as JSON with `--output`, so runs can be compared across
+commits.
+"""
+import json
+import random
+import shutil
+import tempfile
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import reverse
+from django.db import transaction
+from django.test.utils import override_settings
+from PIL import Image, ImageDraw
+from rest_framework.test import APIClient
+
+from gravvy.apps.account.models import User
+from gravvy.apps.video.models import Video, Clip
+from gravvy.seed import create_users, seed_dataset
+
+# formats of the thumbnails the API can serve
+IMAGE_FORMATS = ('jpeg', 'webp')
+
+# (model, source image field name, image spec field names) of the thumbnails
+# the API serves
+THUMBNAILS = (
+    (Video, 'photo', ('photo_thumbnail', 'photo_small_thumbnail',
+                      'photo_small_thumbnail_webp')),
+    (Clip, 'photo', ('photo_thumbnail', 'photo_thumbnail_webp')),
+    (User, 'avatar', ('avatar_thumbnail', 'avatar_thumbnail_webp')),
+)
+
+# media URL of the temporary media directory
+MEDIA_URL = '/media/'
+
+
+# ---------------------------------------------------------------------------- #
+# HELPER FUNCTIONS
+# ---------------------------------------------------------------------------- #
+
+def generate_photo(seed, width=1280, height=720):
+    """
+    Generate a JPEG photo with smooth areas and edges, so its thumbnails
+    compress somewhat like those of real photos: a gradient between two random
+    colours, random ellipses and a little noise.
+
+    Args:
+        seed: seed of the random colours and shapes
+        width: photo width
+        height: photo height
+
+    Returns:
+        JPEG file contents
+    """
+    rand = random.Random(seed)
+    colours = [tuple(rand.randrange(256) for _ in range(3))
+               for _ in range(14)]
+    img = Image.new('RGB', (width, height))
+    draw = ImageDraw.Draw(img)
+    top, bottom = colours[:2]
+    for y in range(height):
+        ratio = float(y) / height
+        draw.line([(0, y), (width, y)], fill=tuple(
+                int(t + (b - t) * ratio) for t, b in zip(top, bottom)))
+    for colour in colours[2:]:
+        x, y = rand.randrange(width), rand.randrange(height)
+        radius = rand.randrange(height // 20, height // 4)
+        draw.ellipse([x - radius, y - radius, x + radius, y + radius],
+                     fill=colour)
+    noise = Image.effect_noise((width, height), 32).convert('RGB')
+    img = Image.blend(img, noise, 0.1)
+
+    buf = BytesIO()
+    img.save(buf, 'JPEG', quality=90)
+    return buf.getvalue()
+
+
+def find_media_urls(data):
+    """
+    Find the media URLs in serialized data
+
+    Args:
+        data: deserialized JSON
+
+    Returns:
+        list of the media URLs, in the order they appear
+    """
+    if isinstance(data, dict):
+        data = data.values()
+    elif not isinstance(data, list):
+        if isinstance(data, basestring) and MEDIA_URL in data:
+            return [data]
+        return []
+    urls = []
+    for value in data:
+        urls.extend(find_media_urls(value))
+    return urls
+
+
+# ---------------------------------------------------------------------------- #
+# COMMAND
+# ---------------------------------------------------------------------------- #
+
+class Command(BaseCommand):
+    help = "Measure the thumbnail bytes of an activity feed page per format."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--photo', action='append', dest='photos', default=[],
+            help="JPEG photo to use as seeded photos and avatars. Can be "
+            "repeated. Photos are generated by default.")
+        parser.add_argument(
+            '--photos', type=int, default=20, dest='photos_count',
+            help="Number of photos to generate when none are given.")
+        parser.add_argument(
+            '--users', type=int, default=20, dest='users',
+            help="Number of users to seed.")
+        parser.add_argument(
+            '--videos', type=int, default=5, dest='videos',
+            help="Number of videos to seed.")
+        parser.add_argument(
+            '--clips', type=int, default=10, dest='clips',
+            help="Number of clips of each seeded video.")
+        parser.add_argument(
+            '--output', dest='output',
+            help="File to write the JSON results to.")
+
+    def handle(self, *args, **options):
+        photos = []
+        for path in options['photos']:
+            with open(path, 'rb') as photo:
+                photos.append(photo.read())
+        if not photos:
+            photos = [generate_photo(seed)
+                      for seed in range(options['photos_count'])]
+
+        media_root = tempfile.mkdtemp()
+        try:
+            # imagekit picks its storage when settings are loaded so it has to
+            # be overridden on its own.
+            file_storage = 'django.core.files.storage.FileSystemStorage'
+            with override_settings(
+                MEDIA_ROOT=media_root, MEDIA_URL=MEDIA_URL,
+                DEFAULT_FILE_STORAGE=file_storage,
+                IMAGEKIT_DEFAULT_FILE_STORAGE=file_storage,
+                ALLOWED_HOSTS=settings.ALLOWED_HOSTS + ['testserver']):
+                with transaction.atomic():
+                    results = self.benchmark(photos, options)
+                    transaction.set_rollback(True)
+        finally:
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        self.write_summary(results)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2, sort_keys=True)
+            self.stdout.write("Results written to %s" % options['output'])
+
+    def benchmark(self, photos, options):
+        """
+        Seed a dataset with photos and measure the viewer's first activity
+        feed page in each image format
+
+        Args:
+            photos: list of JPEG file contents
+            options: command options
+
+        Returns:
+            dictionary of the results
+        """
+        try:
+            viewer = create_users(1)[0]
+            seed_dataset(viewer=viewer, users=options['users'],
+                         videos=options['videos'],
+                         clips_per_video=options['clips'])
+        except ValueError as e:
+            raise CommandError("Could not seed the dataset: %s" % e)
+
+        photo_names = [default_storage.save('img/seed/photo.jpg',
+                                            ContentFile(photo))
+                       for photo in photos]
+        self.add_photos(photo_names)
+
+        client = APIClient()
+        client.force_authenticate(user=viewer)
+        results = {'photos': len(photos), 'formats': {}}
+        for image_format in IMAGE_FORMATS:
+            response = client.get(reverse('user-auth-activity-list'),
+                                  {'image_format': image_format})
+            if response.status_code != 200:
+                raise CommandError("Activity feed failed with status %d" %
+                                   response.status_code)
+            urls = find_media_urls(json.loads(response.content))
+            sizes = dict((url, default_storage.size(url[len(MEDIA_URL):]))
+                         for url in set(urls))
+            results['formats'][image_format] = {
+                'response_bytes': len(response.content),
+                'thumbnails': len(urls),
+                'thumbnail_bytes': sum(sizes[url] for url in urls),
+                'distinct_thumbnails': len(sizes),
+                'distinct_thumbnail_bytes': sum(sizes.values()),
+            }
+        return results
+
+    def add_photos(self, photo_names):
+        """
+        Give every video, clip and user a photo, taking turns through the
+        stored photos, and generate the thumbnails of each photo
+        """
+        for model, source_field, spec_fields in THUMBNAILS:
+            pks = model.objects.values_list('pk', flat=True).order_by('pk')
+            for i, name in enumerate(photo_names):
+                model.objects.filter(pk__in=pks[i::len(photo_names)]).update(
+                    **{source_field: name})
+
+            # thumbnails are named after their photo, so they only need to be
+            # generated once per photo
+            for name in photo_names:
+                instance = model.objects.filter(
+                    **{source_field: name}).first()
+                if instance is None:
+                    continue
+                for spec_field in spec_fields:
+                    getattr(instance, spec_field).generate()
+
+    def write_summary(self, results):
+        jpeg = results['formats']['jpeg']
+        webp = results['formats']['webp']
+        self.stdout.write("first activity feed page, %d source photos" %
+                          results['photos'])
+        self.stdout.write("%-30s %12s %12s %8s" % (
+                '', 'jpeg', 'webp', 'saving'))
+        for name in ('thumbnail_bytes', 'distinct_thumbnail_bytes',
+                     'response_bytes'):
+            self.stdout.write("%-30s %12d %12d %7.1f%%" % (
+                    name, jpeg[name], webp[name],
+                    100.0 * (jpeg[name] - webp[name]) / max(jpeg[name], 1)))
+        self.stdout.write("%d thumbnails, %d distinct" % (
+                jpeg['thumbnails'], jpeg['distinct_thumbnails']))
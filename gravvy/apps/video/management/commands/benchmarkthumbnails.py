@@ -0,0 +1,350 @@
+"""
+Benchmark the generation of the photo thumbnails of the image specs, with the
+Thumbnail processor and with the processor chain it replaced:
+    [Transpose(Transpose.AUTO), SmartResize(width, height), Adjust(...)]
+
+Each thumbnail is generated from the encoded photo, as imagekit does: the
+photo is decoded, processed and encoded in the spec's format. The photo is
+a generated 8 megapixel camera JPEG taken in portrait, unless photos are
+given with `--photo`.
+
+Wall-clock and process CPU times are measured for each thumbnail. The peak
+memory of generating each thumbnail is measured in a fresh process, so it
+isn't hidden by the peak of an earlier thumbnail: the command runs itself with
+`--peak-rss` and reports how far the process's peak resident set size rose
+above what it was before the thumbnail was generated.
+
+The thumbnails of a video photo are generated by separate specs, each
+decoding the photo on its own. The time it takes to generate them all from a
+single decode is reported too, as the saving a shared decode would bring.
+
+Results are written as JSON with `--output`, so runs can be compared across
+commits.
+"""
+import json
+import os
+import resource
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import SUPPRESS
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from imagekit.registry import generator_registry
+from PIL import Image
+from pilkit.processors import Transpose, SmartResize, Adjust
+from pilkit.utils import img_to_fobj
+
+from gravvy.processors import (
+    get_exif_orientation, EXIF_ORIENTATION_TAG, EXIF_TRANSPOSED_ORIENTATIONS)
+from gravvy.utils import percentile
+
+# ids of the image specs of video photos, clip photos and avatars
+SPEC_IDS = (
+    'video:video:photo_thumbnail',
+    'video:video:photo_small_thumbnail',
+    'video:video:photo_small_thumbnail_webp',
+    'video:clip:photo_thumbnail',
+    'video:clip:photo_thumbnail_webp',
+    'account:user:avatar_thumbnail',
+    'account:user:avatar_thumbnail_webp',
+)
+
+# specs generated from the same video photo
+VIDEO_SPEC_IDS = SPEC_IDS[:3]
+
+
+# ---------------------------------------------------------------------------- #
+# HELPER FUNCTIONS
+# ---------------------------------------------------------------------------- #
+
+def generate_photo(width=3264, height=2448, orientation=6):
+    """
+    Generate a JPEG photo like those of phone cameras: noisy, so it doesn't
+    compress (or decode) unrealistically well, and stored in landscape with
+    an EXIF orientation.
+
+    Returns:
+        JPEG file contents
+    """
+    noise = Image.effect_noise((width, height), 64)
+    img = Image.merge('RGB', (noise, noise.rotate(180), noise.transpose(
+                Image.FLIP_LEFT_RIGHT)))
+    # a big-endian TIFF header and an IFD with the orientation tag only
+    exif = b'Exif\x00\x00MM\x00\x2a' + struct.pack(
+        '>LHHHLHHL', 8, 1, EXIF_ORIENTATION_TAG, 3, 1, orientation, 0, 0)
+    buf = BytesIO()
+    img.save(buf, 'JPEG', quality=92, exif=exif)
+    return buf.getvalue()
+
+
+def get_chain(thumbnail):
+    """
+    Get the processor chain a Thumbnail processor replaced
+    """
+    return [Transpose(Transpose.AUTO),
+            SmartResize(width=thumbnail.width, height=thumbnail.height),
+            Adjust(contrast=thumbnail.contrast,
+                   sharpness=thumbnail.sharpness)]
+
+
+def generate(photo, spec, processors):
+    """
+    Generate a thumbnail of a photo with a spec's format and options
+
+    Args:
+        photo: JPEG file contents
+        spec: image spec of the thumbnail
+        processors: processors generating the thumbnail
+
+    Returns:
+        thumbnail file object
+    """
+    img = Image.open(BytesIO(photo))
+    for processor in processors:
+        img = processor.process(img)
+    return img_to_fobj(img, spec.format, **spec.options)
+
+
+def get_cpu_time():
+    """
+    Get the CPU time used by this process, in user and system mode
+
+    Returns:
+        CPU time, in seconds
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def get_peak_rss():
+    """
+    Get the peak resident set size of this process
+
+    Returns:
+        peak RSS, in KB
+    """
+    # on Linux ru_maxrss keeps the RSS the parent process had when it forked
+    # this one, even across exec, so the peak of this process's own memory is
+    # read from /proc instead
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on OS X, but in KB everywhere else
+    if sys.platform == 'darwin':
+        peak_rss /= 1024
+    return peak_rss
+
+
+def time_runs(function, runs):
+    """
+    Time runs of a function
+
+    Returns:
+        dictionary of the median and 95th percentile wall-clock durations and
+        CPU times, in ms
+    """
+    durations = []
+    cpu_times = []
+    for _ in range(runs):
+        start = time.time()
+        cpu_start = get_cpu_time()
+        function()
+        cpu_times.append((get_cpu_time() - cpu_start) * 1000)
+        durations.append((time.time() - start) * 1000)
+    durations.sort()
+    cpu_times.sort()
+    return {'p50': round(percentile(durations, 50), 2),
+            'p95': round(percentile(durations, 95), 2),
+            'cpu_p50': round(percentile(cpu_times, 50), 2),
+            'cpu_p95': round(percentile(cpu_times, 95), 2)}
+
+
+# ---------------------------------------------------------------------------- #
+# COMMAND
+# ---------------------------------------------------------------------------- #
+
+class Command(BaseCommand):
+    help = "Benchmark the generation of photo thumbnails."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--photo', action='append', dest='photos', default=[],
+            help="JPEG photo to generate thumbnails of. Can be repeated. A "
+            "camera photo is generated by default.")
+        parser.add_argument(
+            '--runs', type=int, default=20, dest='runs',
+            help="Number of times each thumbnail is generated.")
+        parser.add_argument(
+            '--output', dest='output',
+            help="File to write the JSON results to.")
+        # used by the command to measure the peak memory of a thumbnail in a
+        # fresh process of its own
+        parser.add_argument('--peak-rss', dest='peak_rss', help=SUPPRESS)
+        parser.add_argument('--chain', action='store_true', dest='chain',
+                            default=False, help=SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['peak_rss']:
+            self.write_peak_rss(options['photos'][0], options['peak_rss'],
+                                options['chain'])
+            return
+
+        photos = [(path, path) for path in options['photos']]
+        generated_path = None
+        if not photos:
+            handle, generated_path = tempfile.mkstemp(suffix='.jpg')
+            with os.fdopen(handle, 'wb') as photo:
+                photo.write(generate_photo())
+            photos.append(('generated', generated_path))
+
+        runs = options['runs']
+        results = {}
+        try:
+            for name, path in photos:
+                results[name] = self.benchmark(path, runs)
+                self.write_summary(name, results[name])
+        finally:
+            if generated_path:
+                os.remove(generated_path)
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2, sort_keys=True)
+            self.stdout.write("Results written to %s" % options['output'])
+
+    def benchmark(self, path, runs):
+        """
+        Benchmark the thumbnails of a photo
+
+        Args:
+            path: path of the JPEG photo
+            runs: number of times each thumbnail is generated
+
+        Returns:
+            dictionary of the results
+        """
+        with open(path, 'rb') as photo_file:
+            photo = photo_file.read()
+        img = Image.open(BytesIO(photo))
+        results = {'size': img.size, 'specs': {}}
+        results['decode_ms'] = time_runs(
+            lambda: Image.open(BytesIO(photo)).load(), runs)
+
+        specs = {}
+        for spec_id in SPEC_IDS:
+            spec = specs[spec_id] = generator_registry.get(
+                spec_id, source=File(BytesIO(photo), name='photo.jpg'))
+            thumbnail = spec.processors[0]
+            results['specs'][spec_id] = {
+                'thumbnail_ms': time_runs(
+                    lambda: generate(photo, spec, spec.processors), runs),
+                'chain_ms': time_runs(
+                    lambda: generate(photo, spec, get_chain(thumbnail)),
+                    runs),
+                'thumbnail_rss_kb': self.measure_peak_rss(path, spec_id),
+                'chain_rss_kb': self.measure_peak_rss(
+                    path, spec_id, chain=True),
+            }
+
+        # a single decode drafted to the largest thumbnail, shared by all
+        # thumbnails of a video photo
+        video_specs = [specs[spec_id] for spec_id in VIDEO_SPEC_IDS]
+        size = (max(spec.processors[0].width for spec in video_specs),
+                max(spec.processors[0].height for spec in video_specs))
+        def generate_shared():
+            img = Image.open(BytesIO(photo))
+            if get_exif_orientation(img) in EXIF_TRANSPOSED_ORIENTATIONS:
+                img.draft(img.mode, size[::-1])
+            else:
+                img.draft(img.mode, size)
+            img.load()
+            for spec in video_specs:
+                thumbnail = spec.processors[0]
+                img_to_fobj(thumbnail.process(img.copy()), spec.format,
+                            **spec.options)
+        def generate_separately():
+            for spec in video_specs:
+                generate(photo, spec, spec.processors)
+        results['video_photo_ms'] = {
+            'separate_decodes': time_runs(generate_separately, runs),
+            'shared_decode': time_runs(generate_shared, runs),
+        }
+        return results
+
+    def measure_peak_rss(self, path, spec_id, chain=False):
+        """
+        Measure the peak memory of generating a thumbnail, in a fresh process
+
+        Args:
+            path: path of the JPEG photo
+            spec_id: id of the thumbnail's image spec
+            chain: generate the thumbnail with the processor chain the
+                Thumbnail processor replaced
+
+        Returns:
+            dictionary of the process's peak RSS and how far generating the
+            thumbnail raised it, in KB
+        """
+        command = [sys.executable,
+                   os.path.join(settings.BASE_DIR, 'manage.py'),
+                   'benchmarkthumbnails', '--photo', path,
+                   '--peak-rss', spec_id]
+        if chain:
+            command.append('--chain')
+        return json.loads(subprocess.check_output(command))
+
+    def write_peak_rss(self, path, spec_id, chain):
+        """
+        Generate a thumbnail once and write the peak memory of this process
+        as JSON, for measure_peak_rss()
+        """
+        with open(path, 'rb') as photo_file:
+            photo = photo_file.read()
+        spec = generator_registry.get(
+            spec_id, source=File(BytesIO(photo), name='photo.jpg'))
+        processors = spec.processors
+        if chain:
+            processors = get_chain(spec.processors[0])
+
+        baseline = get_peak_rss()
+        generate(photo, spec, processors)
+        peak = get_peak_rss()
+        self.stdout.write(json.dumps({'peak': peak,
+                                      'increase': peak - baseline}))
+
+    def write_summary(self, name, results):
+        self.stdout.write("%s (%dx%d): full decode p50 %.1f ms" % (
+                name, results['size'][0], results['size'][1],
+                results['decode_ms']['p50']))
+        self.stdout.write("%-40s %23s %23s %23s" % (
+                '', 'wall p50 (ms)', 'CPU p50 (ms)', 'peak RSS rise (MB)'))
+        self.stdout.write("%-40s %11s %11s %11s %11s %11s %11s" % (
+                'spec', 'chain', 'thumbnail', 'chain', 'thumbnail', 'chain',
+                'thumbnail'))
+        for spec_id in SPEC_IDS:
+            spec = results['specs'][spec_id]
+            self.stdout.write(
+                "%-40s %11.1f %11.1f %11.1f %11.1f %11.1f %11.1f" % (
+                    spec_id, spec['chain_ms']['p50'],
+                    spec['thumbnail_ms']['p50'], spec['chain_ms']['cpu_p50'],
+                    spec['thumbnail_ms']['cpu_p50'],
+                    spec['chain_rss_kb']['increase'] / 1024.0,
+                    spec['thumbnail_rss_kb']['increase'] / 1024.0))
+        video_photo = results['video_photo_ms']
+        self.stdout.write(
+            "video photo thumbnails: %.1f ms with separate decodes, %.1f ms "
+            "with a shared decode" % (
+                video_photo['separate_decodes']['p50'],
+                video_photo['shared_decode']['p50']))
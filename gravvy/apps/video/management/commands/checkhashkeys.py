@@ -0,0 +1,57 @@
+"""
+Load test the generation of video and video user hash keys: generate many
+keys from consecutive ids, as the hash key generator does, and check they're
+all unique and of the right length.
+
+The keys are generated from ids starting at a random id (or `--start`), with
+the round keys of the project's SECRET_KEY, so no database sequence values
+are used up.
+"""
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from gravvy.hashkeys import permute_id, _round_keys
+from gravvy.apps.video.models import VIDEO_HASH_LENGTH
+
+
+class Command(BaseCommand):
+    help = "Check that many generated hash keys are all unique."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--count', type=int, default=1000000, dest='count',
+            help="Number of hash keys to generate.")
+        parser.add_argument(
+            '--start', type=int, dest='start',
+            help="First id to generate a hash key of. Defaults to a random "
+            "id.")
+
+    def handle(self, *args, **options):
+        count = options['count']
+        bits = VIDEO_HASH_LENGTH * 4
+        start = options['start']
+        if start is None:
+            start = random.randrange(0, (1 << bits) - count)
+        if start < 0 or start + count > 1 << bits:
+            raise CommandError("Ids must be in [0, 2**%d)" % bits)
+
+        round_keys = _round_keys(bits)
+        key_format = '%%0%dx' % VIDEO_HASH_LENGTH
+        started = time.time()
+        keys = set()
+        for id_ in xrange(start, start + count):
+            key = key_format % permute_id(id_, bits, round_keys)
+            if len(key) != VIDEO_HASH_LENGTH:
+                raise CommandError("Id %d has a hash key of the wrong "
+                                   "length: %s" % (id_, key))
+            keys.add(key)
+        elapsed = time.time() - started
+
+        if len(keys) != count:
+            raise CommandError("%d duplicate hash keys in %d keys from id %d"
+                               % (count - len(keys), count, start))
+        self.stdout.write(
+            "%d unique hash keys from id %d in %.1fs (%d keys/s)" % (
+                count, start, elapsed, count / max(elapsed, 1e-6)))
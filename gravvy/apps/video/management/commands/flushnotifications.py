@@ -0,0 +1,59 @@
+"""
+Send the push notifications that have been held for coalescing and are due.
+
+Like and new clip notifications are held for PUSH_COALESCE_WINDOW seconds so
+a burst of them is merged into one push per video user. Without `--interval`
+the due notifications are sent once. With it, they're sent every `--interval`
+seconds for `--duration` seconds, so the command can be run by cron every
+minute and still send notifications soon after they're due.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from gravvy.apps.video.models import PendingNotification
+
+
+class Command(BaseCommand):
+    help = "Send the held push notifications that are due."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float, dest='interval',
+            help="Number of seconds between sends of the due notifications.")
+        parser.add_argument(
+            '--duration', type=float, default=60, dest='duration',
+            help="Number of seconds to keep sending for, with --interval.")
+        parser.add_argument(
+            '--batch-size', type=int, default=500, dest='batch_size',
+            help="Number of held notifications to send at a time.")
+
+    def handle(self, *args, **options):
+        interval = options['interval']
+        deadline = time.time() + options['duration']
+        recipients_count = 0
+        while True:
+            recipients_count += self.flush(options['batch_size'])
+            if not interval or time.time() + interval > deadline:
+                break
+            time.sleep(interval)
+
+        if int(options['verbosity']) > 1:
+            self.stdout.write("Sent notifications to %d video users"
+                              % recipients_count)
+
+    def flush(self, batch_size):
+        """
+        Send all notifications that are due, a batch at a time
+
+        Returns:
+            number of video users notified
+        """
+        recipients_count = 0
+        while True:
+            notifications = PendingNotification.objects.flush(
+                batch_size=batch_size)
+            if not notifications:
+                return recipients_count
+            recipients_count += sum(
+                len(user_ids) for user_ids, message, extra in notifications)
@@ -0,0 +1,67 @@
+"""
+Generate the WebP thumbnails of existing videos, clips and user avatars.
+
+WebP thumbnails of new uploads are generated just like their JPEG
+counterparts, so this is only needed to backfill media that was uploaded
+before the WebP variants were added. Thumbnails that already exist in storage
+are skipped unless `--force` is used, so the command is safe to re-run.
+"""
+from django.core.management.base import BaseCommand
+
+from gravvy.apps.account.models import User
+from gravvy.apps.video.models import Video, Clip
+
+# (model, source image field name, WebP image spec field name) of each WebP
+# thumbnail to be generated
+WEBP_THUMBNAILS = (
+    (Video, 'photo', 'photo_small_thumbnail_webp'),
+    (Clip, 'photo', 'photo_thumbnail_webp'),
+    (User, 'avatar', 'avatar_thumbnail_webp'),
+)
+
+
+class Command(BaseCommand):
+    help = "Generate WebP thumbnails of existing videos, clips and avatars."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500, dest='batch_size',
+            help="Number of objects to fetch from the database at a time.")
+        parser.add_argument(
+            '--force', action='store_true', dest='force', default=False,
+            help="Regenerate thumbnails that already exist.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        force = options['force']
+
+        for model, source_field, spec_field in WEBP_THUMBNAILS:
+            # objects without a source image have no thumbnails and only the
+            # source image is needed to generate a thumbnail.
+            queryset = model.objects.exclude(**{source_field: ''}).only(
+                'pk', source_field).order_by('pk')
+
+            generated = failed = 0
+            last_pk = 0
+            while True:
+                # page through the table by primary key so each batch is a
+                # cheap index range scan no matter how far along we are.
+                batch = list(queryset.filter(pk__gt=last_pk)[:batch_size])
+                if not batch:
+                    break
+
+                for instance in batch:
+                    thumbnail = getattr(instance, spec_field)
+                    try:
+                        thumbnail.generate(force=force)
+                    except Exception as e:
+                        failed += 1
+                        self.stderr.write("%s %s: %s" % (
+                                model.__name__, instance.pk, e))
+                    else:
+                        generated += 1
+
+                last_pk = batch[-1].pk
+
+            self.stdout.write("%s.%s: %d generated, %d failed" % (
+                    model.__name__, spec_field, generated, failed))
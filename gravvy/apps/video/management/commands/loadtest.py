@@ -0,0 +1,383 @@
+"""
+Drive concurrent requests against the hot endpoints of the REST API and report
+their latency percentiles, throughput and, for in-process runs, database
+queries per request.
+
+By default requests are made in-process with the test client, against the
+configured database. Uploaded files then go to a temporary directory and push
+notifications and SMS messages aren't delivered (see the PUSH_DRY_RUN
+setting). Use `--url` to load test a running server instead. That server
+should be run with `PUSH_DRY_RUN = True`.
+
+Requests are made as the given user, which should be a member of many videos,
+like the viewer of the `seeddata` command. Every user video is a target of
+the video requests in turn.
+
+Results are written as JSON with `--output`, so runs can be compared across
+commits.
+"""
+import json
+import shutil
+import tempfile
+import threading
+import time
+from cStringIO import StringIO
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from PIL import Image
+import requests
+from rest_framework.test import APIClient
+
+from gravvy.utils import percentile, get_commit
+
+# endpoints that can be load tested, in the order each worker requests them
+ENDPOINTS = ('auth_token', 'like', 'unlike', 'play', 'clip_upload',
+             'activity_feed', 'user_videos')
+
+
+# ---------------------------------------------------------------------------- #
+# HELPER FUNCTIONS
+# ---------------------------------------------------------------------------- #
+
+def summarize(samples, elapsed):
+    """
+    Summarize the samples of an endpoint
+
+    Args:
+        samples: list of (status code, seconds, bytes, queries) tuples.
+            queries is None if it wasn't measured.
+        elapsed: wall clock duration of the load test, in seconds
+
+    Returns:
+        dictionary of the endpoint's statistics
+    """
+    latencies = sorted(sample[1] * 1000 for sample in samples)
+    queries = [sample[3] for sample in samples if sample[3] is not None]
+    return {
+        'requests': len(samples),
+        'errors': len([s for s in samples if s[0] >= 400]),
+        'requests_per_second': round(len(samples) / elapsed, 2),
+        'latency_ms': {
+            'mean': round(sum(latencies) / len(latencies), 2),
+            'p50': round(percentile(latencies, 50), 2),
+            'p95': round(percentile(latencies, 95), 2),
+            'p99': round(percentile(latencies, 99), 2),
+            'max': round(latencies[-1], 2),
+            },
+        'bytes_per_request': sum(s[2] for s in samples) // len(samples),
+        'queries_per_request': {
+            'mean': round(float(sum(queries)) / len(queries), 2),
+            'max': max(queries),
+            } if queries else None,
+        }
+
+
+def generate_photo():
+    """
+    Generate the contents of a small JPEG clip photo
+    """
+    output = StringIO()
+    Image.new('RGB', (320, 320), (128, 128, 128)).save(output, 'JPEG')
+    return output.getvalue()
+
+
+# ---------------------------------------------------------------------------- #
+# CLIENTS
+# ---------------------------------------------------------------------------- #
+
+class InProcessClient(object):
+    """
+    Makes requests in-process with the test client, and counts their queries.
+    """
+    measures_queries = True
+
+    def __init__(self):
+        self.client = APIClient()
+
+    def authenticate(self, token):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token)
+
+    def request(self, method, path, data=None, files=None):
+        """
+        Make a request
+
+        Args:
+            method: HTTP method
+            path: URL path
+            data: dictionary of request data
+            files: dictionary of (name, content, content type) tuples of the
+                files to upload, if any
+
+        Returns:
+            (status code, content, number of queries) tuple
+        """
+        kwargs = {}
+        if files:
+            data = dict(data or {})
+            for field, (name, content, content_type) in files.items():
+                data[field] = SimpleUploadedFile(name, content, content_type)
+            kwargs['format'] = 'multipart'
+        elif data is not None:
+            kwargs['format'] = 'json'
+
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method)(path, data, **kwargs)
+        return response.status_code, response.content, len(context)
+
+    def close(self):
+        # each worker thread has its own database connection
+        connection.close()
+
+
+class HTTPClient(object):
+    """
+    Makes requests to a running server.
+    """
+    measures_queries = False
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.session = requests.Session()
+
+    def authenticate(self, token):
+        self.session.headers['Authorization'] = 'Token ' + token
+
+    def request(self, method, path, data=None, files=None):
+        """
+        Make a request. See InProcessClient.request
+        """
+        kwargs = {}
+        if files:
+            kwargs['data'] = data
+            kwargs['files'] = files
+        elif data is not None:
+            kwargs['json'] = data
+        response = self.session.request(method, self.url + path, **kwargs)
+        return response.status_code, response.content, None
+
+    def close(self):
+        self.session.close()
+
+
+# ---------------------------------------------------------------------------- #
+# COMMAND
+# ---------------------------------------------------------------------------- #
+
+class Command(BaseCommand):
+    help = "Load test the hot endpoints of the REST API."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--phone-number', dest='phone_number', required=True,
+            help="Phone number of the user to make requests as.")
+        parser.add_argument(
+            '--password', dest='password', default='password',
+            help="Password of the user to make requests as.")
+        parser.add_argument(
+            '--url', dest='url',
+            help="Base URL of a running server to load test, e.g. "
+            "http://localhost:8000. Requests are made in-process otherwise.")
+        parser.add_argument(
+            '--requests', type=int, default=100, dest='requests',
+            help="Number of requests to make to each endpoint.")
+        parser.add_argument(
+            '--concurrency', type=int, default=4, dest='concurrency',
+            help="Number of concurrent workers.")
+        parser.add_argument(
+            '--warmup', type=int, default=2, dest='warmup',
+            help="Number of requests to each endpoint that aren't measured.")
+        parser.add_argument(
+            '--endpoints', dest='endpoints', default=','.join(ENDPOINTS),
+            help="Comma separated endpoints to load test, out of: %s."
+            % ', '.join(ENDPOINTS))
+        parser.add_argument(
+            '--output', dest='output',
+            help="File to write the JSON results to.")
+
+    def handle(self, *args, **options):
+        endpoints = [e.strip() for e in options['endpoints'].split(',')]
+        unknown = set(endpoints) - set(ENDPOINTS)
+        if unknown:
+            raise CommandError("Unknown endpoints: %s" % ', '.join(unknown))
+        self.endpoints = [e for e in ENDPOINTS if e in endpoints]
+        self.phone_number = options['phone_number']
+        self.password = options['password']
+        self.photo = generate_photo()
+
+        if options['url']:
+            self.make_client = lambda: HTTPClient(options['url'])
+            results = self.run(options)
+        else:
+            self.make_client = InProcessClient
+            media_root = tempfile.mkdtemp()
+            try:
+                # imagekit picks its storage when settings are loaded so it
+                # has to be overridden on its own.
+                file_storage = 'django.core.files.storage.FileSystemStorage'
+                with override_settings(
+                    PUSH_DRY_RUN=True, MEDIA_ROOT=media_root,
+                    DEFAULT_FILE_STORAGE=file_storage,
+                    IMAGEKIT_DEFAULT_FILE_STORAGE=file_storage,
+                    ALLOWED_HOSTS=settings.ALLOWED_HOSTS + ['testserver']):
+                    results = self.run(options)
+            finally:
+                shutil.rmtree(media_root, ignore_errors=True)
+
+        self.write_summary(results)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2, sort_keys=True)
+            self.stdout.write("Results written to %s" % options['output'])
+
+    def run(self, options):
+        """
+        Run the load test
+
+        Returns:
+            dictionary of the results
+        """
+        client = self.make_client()
+        token = self.obtain_token(client)
+        client.authenticate(token)
+        status_code, content, _ = client.request(
+            'get', reverse('user-auth-video-list'))
+        videos = json.loads(content)
+        if isinstance(videos, dict):
+            videos = videos['results']
+        client.close()
+        if not videos:
+            raise CommandError("%s isn't a member of any videos"
+                               % self.phone_number)
+        self.hash_keys = [video['hash_key'] for video in videos]
+
+        # hand out iterations to workers, with the warmup iterations first
+        iterations = range(options['warmup'] + options['requests'])
+        self.iterations = iter(iterations)
+        self.warmup = options['warmup']
+        self.lock = threading.Lock()
+        self.samples = dict((endpoint, []) for endpoint in self.endpoints)
+
+        workers = [threading.Thread(target=self.work, args=(token,))
+                   for _ in range(options['concurrency'])]
+        started_at = timezone.now()
+        start = time.time()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.time() - start
+
+        return {
+            'commit': get_commit(),
+            'started_at': started_at.isoformat(),
+            'target': options['url'] or 'in-process',
+            'database': connection.vendor,
+            'concurrency': options['concurrency'],
+            'requests': options['requests'],
+            'videos': len(self.hash_keys),
+            'elapsed_seconds': round(elapsed, 2),
+            'endpoints': dict(
+                (endpoint, summarize(samples, elapsed))
+                for endpoint, samples in self.samples.items() if samples),
+            }
+
+    def obtain_token(self, client):
+        status_code, content, _ = client.request(
+            'post', reverse('obtain_auth_token'),
+            {'phone_number': self.phone_number, 'password': self.password})
+        if status_code != 200:
+            raise CommandError("Couldn't obtain an auth token: %s" % content)
+        return json.loads(content)['token']
+
+    def work(self, token):
+        """
+        Worker thread: request every endpoint once per iteration until all
+        iterations have been handed out.
+        """
+        client = self.make_client()
+        client.authenticate(token)
+        try:
+            while True:
+                with self.lock:
+                    iteration = next(self.iterations, None)
+                if iteration is None:
+                    break
+
+                for endpoint in self.endpoints:
+                    method, path, data, files = self.build_request(
+                        endpoint, iteration)
+                    start = time.time()
+                    try:
+                        status_code, content, queries = client.request(
+                            method, path, data, files)
+                    except Exception as e:
+                        # count exceptions of in-process requests as server
+                        # errors, just like a server would.
+                        self.stderr.write("%s: %r" % (endpoint, e))
+                        status_code, content, queries = 500, '', None
+                    seconds = time.time() - start
+
+                    if iteration >= self.warmup:
+                        with self.lock:
+                            self.samples[endpoint].append(
+                                (status_code, seconds, len(content), queries))
+        finally:
+            client.close()
+
+    def build_request(self, endpoint, iteration):
+        """
+        Build the request of an endpoint for a given iteration
+
+        Returns:
+            (method, path, data, files) tuple
+        """
+        hash_key = self.hash_keys[iteration % len(self.hash_keys)]
+        video_kwargs = {'hash_key': hash_key}
+
+        if endpoint == 'auth_token':
+            return ('post', reverse('obtain_auth_token'),
+                    {'phone_number': self.phone_number,
+                     'password': self.password}, None)
+        elif endpoint == 'like':
+            return ('put', reverse('video-detail-like', kwargs=video_kwargs),
+                    None, None)
+        elif endpoint == 'unlike':
+            return ('delete',
+                    reverse('video-detail-like', kwargs=video_kwargs),
+                    None, None)
+        elif endpoint == 'play':
+            return ('put', reverse('video-detail-play', kwargs=video_kwargs),
+                    None, None)
+        elif endpoint == 'clip_upload':
+            return ('post', reverse('video-clip-list', kwargs=video_kwargs),
+                    {'duration': 2.0},
+                    {'mp4': ('clip.mp4', '\x00' * 1024, 'video/mp4'),
+                     'photo': ('clip.jpg', self.photo, 'image/jpeg')})
+        elif endpoint == 'activity_feed':
+            return ('get', reverse('user-auth-activity-list'), None, None)
+        elif endpoint == 'user_videos':
+            return ('get', reverse('user-auth-video-list'), None, None)
+
+    def write_summary(self, results):
+        self.stdout.write("%s: %d requests per endpoint, %d workers, %.1fs" % (
+                results['target'], results['requests'],
+                results['concurrency'], results['elapsed_seconds']))
+        self.stdout.write("%-14s %8s %8s %8s %8s %8s %8s" % (
+                'endpoint', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms',
+                'queries'))
+        for endpoint in self.endpoints:
+            stats = results['endpoints'].get(endpoint)
+            if stats is None:
+                continue
+            queries = stats['queries_per_request']
+            self.stdout.write("%-14s %8d %8.1f %8.1f %8.1f %8.1f %8s" % (
+                    endpoint, stats['errors'], stats['requests_per_second'],
+                    stats['latency_ms']['p50'], stats['latency_ms']['p95'],
+                    stats['latency_ms']['p99'],
+                    '%.1f' % queries['mean'] if queries else '-'))
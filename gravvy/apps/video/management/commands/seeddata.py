@@ -0,0 +1,70 @@
+"""
+Seed the database with a dataset of users, videos, clips, members and
+activities at a configurable scale. This is meant for load testing on a
+development database, so never run it against production data.
+
+The viewer, if given, is made a member of every seeded video and gets a known
+password so it can be used to log in, e.g. by the `loadtest` command.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from gravvy.apps.account.models import User
+from gravvy.seed import seed_dataset
+
+
+class Command(BaseCommand):
+    help = "Seed the database with users, videos, clips and activities."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users', type=int, default=1000, dest='users',
+            help="Number of users to create.")
+        parser.add_argument(
+            '--videos', type=int, default=200, dest='videos',
+            help="Number of videos to create.")
+        parser.add_argument(
+            '--members-per-video', type=int, default=10,
+            dest='members_per_video',
+            help="Number of members of each video.")
+        parser.add_argument(
+            '--clips-per-video', type=int, default=20,
+            dest='clips_per_video',
+            help="Number of clips of each video.")
+        parser.add_argument(
+            '--likes-per-video', type=int, default=5,
+            dest='likes_per_video',
+            help="Number of likes of each video.")
+        parser.add_argument(
+            '--viewer', dest='viewer',
+            help="Phone number of a user to add to every video.")
+        parser.add_argument(
+            '--password', dest='password', default='password',
+            help="Password to set on the viewer.")
+
+    def handle(self, *args, **options):
+        if options['members_per_video'] > options['users']:
+            raise CommandError(
+                "There must be at least as many users as members per video.")
+
+        with transaction.atomic():
+            viewer = None
+            if options['viewer']:
+                viewer = User.objects.get_user_by_number(options['viewer'])
+                viewer.is_active = True
+                viewer.set_password(options['password'])
+                viewer.save()
+
+            users, videos = seed_dataset(
+                viewer=viewer,
+                users=options['users'],
+                videos=options['videos'],
+                members_per_video=options['members_per_video'],
+                clips_per_video=options['clips_per_video'],
+                likes_per_video=options['likes_per_video'])
+
+        self.stdout.write("Seeded %d users and %d videos" % (
+                len(users), len(videos)))
+        if viewer is not None:
+            self.stdout.write("Viewer %s is a member of every seeded video" % (
+                    viewer.phone_number.as_e164))
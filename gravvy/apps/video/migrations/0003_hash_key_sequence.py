@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+# Each value of the sequence reserves a block of 1000 ids. Hash keys are 10
+# hex characters (40 bits) so the largest usable value is 2**40 // 1000 - 1.
+CREATE_SEQUENCE_SQL = """
+CREATE SEQUENCE video_hash_key_seq MINVALUE 1 MAXVALUE 1099511626 NO CYCLE
+"""
+
+DROP_SEQUENCE_SQL = "DROP SEQUENCE IF EXISTS video_hash_key_seq"
+
+
+def create_sequence(apps, schema_editor):
+    # only postgresql has sequences. Other databases get random id blocks.
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(CREATE_SEQUENCE_SQL)
+
+
+def drop_sequence(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_SEQUENCE_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video', '0002_alter_videousers_status'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_sequence, drop_sequence),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.core.validators
+
+
+def set_next_clip_order(apps, schema_editor):
+    # start each video's counter right after its highest clip order
+    Video = apps.get_model('video', 'Video')
+    Clip = apps.get_model('video', 'Clip')
+    max_orders = Clip.objects.values('video_id').annotate(
+        max_order=models.Max('order')).values_list('video_id', 'max_order')
+    for video_id, max_order in max_orders:
+        Video.objects.filter(pk=video_id).update(next_clip_order=max_order + 1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video', '0003_hash_key_sequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='next_clip_order',
+            field=models.IntegerField(default=0, help_text='order of the next clip to be added', verbose_name='next clip order', validators=[django.core.validators.MinValueValidator(0)]),
+        ),
+        migrations.RunPython(set_next_clip_order, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.utils.timezone
+from django.conf import settings
+
+
+def backfill_likes(apps, schema_editor):
+    # create a Like for each user's earliest like activity of each video
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    Activity = apps.get_model('activity', 'Activity')
+    Video = apps.get_model('video', 'Video')
+    Like = apps.get_model('video', 'Like')
+    try:
+        video_type = ContentType.objects.get(app_label='video', model='video')
+    except ContentType.DoesNotExist:
+        # nothing could have been liked yet
+        return
+    
+    like_activities = Activity.objects.filter(
+        verb='like', object_content_type=video_type,
+        object_id__in=Video.objects.values('pk')).order_by().values(
+        'actor_id', 'object_id').annotate(
+        first_liked_at=models.Min('created_at'))
+    Like.objects.bulk_create(
+        [Like(user_id=activity['actor_id'], video_id=activity['object_id'],
+              created_at=activity['first_liked_at'])
+         for activity in like_activities.iterator()],
+        batch_size=1000)
+    
+    # duplicate like activities could have inflated the likes counts
+    likes_counts = Like.objects.order_by().values('video_id').annotate(
+        count=models.Count('id')).values_list('video_id', 'count')
+    for video_id, count in likes_counts:
+        Video.objects.filter(pk=video_id).update(likes_count=count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('video', '0004_video_next_clip_order'),
+        ('activity', '0002_auto_20160831_0603'),
+        ('contenttypes', '0002_remove_content_type_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Like',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, help_text='Like creation date/time', verbose_name='date created')),
+                ('user', models.ForeignKey(related_name='likes', verbose_name='user', to=settings.AUTH_USER_MODEL, help_text='User that liked the video')),
+                ('video', models.ForeignKey(related_name='likes', verbose_name='video', to='video.Video', help_text='Video that was liked')),
+            ],
+            options={
+                'ordering': ('-created_at',),
+                'verbose_name': 'like',
+                'verbose_name_plural': 'likes',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='like',
+            unique_together=set([('user', 'video')]),
+        ),
+        migrations.RunPython(backfill_likes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.core.validators
+
+
+def counts_to_seqs(apps, schema_editor):
+    # start each video's sequence numbers at the highest unread counts of its
+    # users, and have each user acknowledge all but their unread likes/clips
+    Video = apps.get_model('video', 'Video')
+    VideoUsers = apps.get_model('video', 'VideoUsers')
+    unread = VideoUsers.objects.filter(
+        models.Q(new_likes_count__gt=0) | models.Q(new_clips_count__gt=0)
+        ).order_by().values('video_id').annotate(
+        like_seq=models.Max('new_likes_count'),
+        clip_seq=models.Max('new_clips_count'))
+    for video in unread.iterator():
+        Video.objects.filter(pk=video['video_id']).update(
+            like_seq=video['like_seq'], clip_seq=video['clip_seq'])
+        VideoUsers.objects.filter(video_id=video['video_id']).update(
+            acked_like_seq=video['like_seq'] - models.F('new_likes_count'),
+            acked_clip_seq=video['clip_seq'] - models.F('new_clips_count'))
+
+
+def seqs_to_counts(apps, schema_editor):
+    Video = apps.get_model('video', 'Video')
+    VideoUsers = apps.get_model('video', 'VideoUsers')
+    videos = Video.objects.filter(
+        models.Q(like_seq__gt=0) | models.Q(clip_seq__gt=0)).values_list(
+        'id', 'like_seq', 'clip_seq')
+    for video_id, like_seq, clip_seq in videos.iterator():
+        VideoUsers.objects.filter(video_id=video_id).update(
+            new_likes_count=like_seq - models.F('acked_like_seq'),
+            new_clips_count=clip_seq - models.F('acked_clip_seq'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video', '0005_like'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='clip_seq',
+            field=models.IntegerField(default=0, help_text='incremented on every clip added to the video', verbose_name='clip sequence number', validators=[django.core.validators.MinValueValidator(0)]),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='like_seq',
+            field=models.IntegerField(default=0, help_text='incremented on every like of the video', verbose_name='like sequence number', validators=[django.core.validators.MinValueValidator(0)]),
+        ),
+        migrations.AddField(
+            model_name='videousers',
+            name='acked_clip_seq',
+            field=models.IntegerField(default=0, help_text="video's clip sequence number when its clips were last acknowledged by video user", verbose_name='Acknowledged clip sequence number', validators=[django.core.validators.MinValueValidator(0)]),
+        ),
+        migrations.AddField(
+            model_name='videousers',
+            name='acked_like_seq',
+            field=models.IntegerField(default=0, help_text="video's like sequence number when its likes were last acknowledged by video user", verbose_name='Acknowledged like sequence number', validators=[django.core.validators.MinValueValidator(0)]),
+        ),
+        migrations.RunPython(counts_to_seqs, seqs_to_counts),
+        migrations.RemoveField(
+            model_name='videousers',
+            name='new_clips_count',
+        ),
+        migrations.RemoveField(
+            model_name='videousers',
+            name='new_likes_count',
+        ),
+    ]
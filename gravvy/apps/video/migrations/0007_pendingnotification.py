@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.utils.timezone
+from django.conf import settings
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('video', '0006_video_seq'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingNotification',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('action_type', models.PositiveSmallIntegerField(help_text='Push action type of the notification', verbose_name='action type')),
+                ('multiple_actors', models.BooleanField(default=False, help_text='Designates if the notified actions were performed by more than one user', verbose_name='multiple actors')),
+                ('count', models.PositiveIntegerField(default=1, help_text='Number of notifications merged into this one', verbose_name='count')),
+                ('loud', models.BooleanField(default=False, help_text='Designates if the notification is sent with a message and sound, rather than silently', verbose_name='loud')),
+                ('object_identifier', models.CharField(help_text="Identifier of the latest notified action's object", max_length=50, null=True, verbose_name='object identifier', blank=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, help_text='Date/time the first notification was held', verbose_name='date created')),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now, help_text='Date/time the latest notification was merged', verbose_name='date updated')),
+                ('send_at', models.DateTimeField(help_text='Date/time the notification is due to be sent', verbose_name='send date', db_index=True)),
+                ('actor', models.ForeignKey(related_name='+', verbose_name='actor', to=settings.AUTH_USER_MODEL, help_text='User that performed the latest notified action')),
+                ('user', models.ForeignKey(related_name='pending_notifications', verbose_name='user', to=settings.AUTH_USER_MODEL, help_text='User to notify')),
+                ('video', models.ForeignKey(related_name='pending_notifications', verbose_name='video', to='video.Video', help_text='Video the notification is about')),
+            ],
+            options={
+                'ordering': ('send_at',),
+                'verbose_name': 'pending notification',
+                'verbose_name_plural': 'pending notifications',
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='pendingnotification',
+            index_together=set([('video', 'action_type', 'user')]),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+def set_actor_ids(apps, schema_editor):
+    # notifications held before this only know their latest actor
+    PendingNotification = apps.get_model('video', 'PendingNotification')
+    notifications = PendingNotification.objects.values_list('id', 'actor_id')
+    for notification_id, actor_id in notifications.iterator():
+        PendingNotification.objects.filter(pk=notification_id).update(
+            actor_ids=',%d,' % actor_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video', '0007_pendingnotification'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pendingnotification',
+            name='actor_ids',
+            field=models.TextField(default='', help_text='Comma-separated ids of the distinct users that performed the notified actions', verbose_name='actor ids'),
+        ),
+        migrations.RunPython(set_actor_ids, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,10 @@
-import uuid
-import hashlib
-import random
+from collections import OrderedDict
+from datetime import timedelta
 
-from django.db import models
-from django.utils import timezone, six
+from django.db import models, transaction, IntegrityError
+from django.db.models.functions import Concat
+from django.db.models.signals import post_save, pre_delete, post_delete
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 from django.core.validators import MinValueValidator
 from django.core.urlresolvers import reverse
@@ -12,14 +13,16 @@ from django.contrib.contenttypes.models import ContentType
 from django.conf import settings
 
 from imagekit.models import ImageSpecField
-from imagekit.processors import SmartResize, Adjust, Transpose
-
 from gravvy.utils import get_upload_path
+from gravvy.cache import CacheNamespace, VersionedCacheNamespace
+from gravvy.hashkeys import HashKeyGenerator
+from gravvy.processors import Thumbnail
 from gravvy.apps.account.models import User
 from gravvy.apps.push.utils import (
     send_sms_message, send_bulk_sms_message, send_push_message, 
-    send_bulk_push_message)
+    send_bulk_push_message, send_bulk_push_messages)
 from gravvy.apps.activity.models import Activity
+from gravvy.apps.monitoring.metrics import PUSH_COALESCED
 
 # Create your models here.
 
@@ -28,10 +31,29 @@ from gravvy.apps.activity.models import Activity
 # ---------------------------------------------------------------------------- #
 VIDEO_HASH_LENGTH = 10
 VIDEO_USERS_HASH_LENGTH = 10
+# database sequence hash keys are generated from. This is shared by videos and
+# video users so their hash keys don't overlap.
+HASH_KEY_SEQUENCE = 'video_hash_key_seq'
 # Assume 153 characters max length but account for many unicode characters
 VIDEO_TITLE_LENGTH = 50
 
 
+# generator of Video and VideoUsers hash keys
+hash_key_generator = HashKeyGenerator(HASH_KEY_SEQUENCE, 
+                                      length=VIDEO_HASH_LENGTH)
+
+# cache of videos by hash key
+video_cache = CacheNamespace('video')
+# caches of the memberships of videos by video hash key, and of the ids of
+# users' videos by user id
+membership_cache = VersionedCacheNamespace('video-membership')
+user_videos_cache = VersionedCacheNamespace('user-videos')
+
+# most phone numbers a removed users push notification has, so its payload
+# fits in the 4KB APNS allows
+MAX_REMOVED_USERS_PER_PUSH = 100
+
+
 # ---------------------------------------------------------------------------- #
 # HELPER FUNCTIONS
 # ---------------------------------------------------------------------------- #
@@ -118,6 +140,31 @@ def video_push_dictionary(video, user, message,
 # MODEL CLASSES
 # ---------------------------------------------------------------------------- #
 
+class VideoManager(models.Manager):
+    """
+    Custom manager for the Video model
+    """
+    
+    def get_cached(self, hash_key):
+        """
+        Get a video by hash key from the cache, or from the database if it
+        isn't cached. Cached videos are invalidated when saved, but are shared
+        by other requests so this is only for reading videos: never save the
+        returned video.
+        
+        Args:
+            hash_key: hash key of video
+            
+        Returns:
+            Video instance
+        
+        Raises:
+            Video.DoesNotExist: there's no video with this hash key
+        """
+        return video_cache.get_or_load(
+            hash_key, lambda: self.get(hash_key=hash_key))
+
+
 class Video(models.Model):
     """
     Video stream class which is the container class of the linked video clips.
@@ -162,30 +209,35 @@ class Video(models.Model):
                     "collection of associated clips."))
     
     # imagekit spec for thumbnail-sized image.
-    # The Transpose processor will use the metadata in the image and rotate by 
+    # The Thumbnail processor uses the metadata in the image to rotate it by 
     # the specified amount. This ensures the image will be the right orientation
-    # We put this processor first as subsequent processors will strip the
-    # metadata from the image.
     photo_thumbnail = ImageSpecField(
         source='photo',
-        processors=[Transpose(Transpose.AUTO),
-                    SmartResize(width=settings.VIDEO_PHOTO_THUMBNAIL_SIZE, 
-                                height=settings.VIDEO_PHOTO_THUMBNAIL_SIZE),
-                    Adjust(contrast = 1.2, sharpness=1.1)],
+        processors=[Thumbnail(width=settings.VIDEO_PHOTO_THUMBNAIL_SIZE, 
+                              height=settings.VIDEO_PHOTO_THUMBNAIL_SIZE)],
         format='JPEG',
         options={'quality':90})
     
     # imagekit spec for small/activity stream thumbnail-sized image
     photo_small_thumbnail = ImageSpecField(
         source='photo',
-        processors=[Transpose(Transpose.AUTO),
-                    SmartResize(
+        processors=[Thumbnail(
                 width=settings.VIDEO_PHOTO_ACTIVITY_THUMBNAIL_SIZE, 
-                height=settings.VIDEO_PHOTO_ACTIVITY_THUMBNAIL_SIZE),
-                    Adjust(contrast = 1.2, sharpness=1.1)],
+                height=settings.VIDEO_PHOTO_ACTIVITY_THUMBNAIL_SIZE)],
         format='JPEG',
         options={'quality':90})
     
+    # WebP version of the small thumbnail for clients that can display it.
+    # Activity streams are mostly made up of these thumbnails so serving them
+    # in a format that's a fraction of the size of JPEG is a big saving.
+    photo_small_thumbnail_webp = ImageSpecField(
+        source='photo',
+        processors=[Thumbnail(
+                width=settings.VIDEO_PHOTO_ACTIVITY_THUMBNAIL_SIZE, 
+                height=settings.VIDEO_PHOTO_ACTIVITY_THUMBNAIL_SIZE)],
+        format='WEBP',
+        options={'quality':80})
+    
     likes_count = models.IntegerField(
         _('likes count'), default=0, validators=[MinValueValidator(0)],
         help_text=_("Number of likes"))
@@ -202,15 +254,45 @@ class Video(models.Model):
         _('total duration'), default=0.0,
         help_text=_("total duration of all clip mp4s, in seconds."))
     
+    # counter clip orders are allocated from, so new clips don't have to look
+    # up the highest clip order in the video.
+    next_clip_order = models.IntegerField(
+        _('next clip order'), default=0, validators=[MinValueValidator(0)],
+        help_text=_("order of the next clip to be added"))
+    
+    # sequence numbers of the video's likes and added clips. These only ever
+    # go up, and video users record the values they've acknowledged so their
+    # unread counts are the differences. This way a like or a new clip is a
+    # single row update no matter how many users the video has.
+    like_seq = models.IntegerField(
+        _('like sequence number'), default=0,
+        validators=[MinValueValidator(0)],
+        help_text=_("incremented on every like of the video"))
+    
+    clip_seq = models.IntegerField(
+        _('clip sequence number'), default=0,
+        validators=[MinValueValidator(0)],
+        help_text=_("incremented on every clip added to the video"))
+    
     created_at = models.DateTimeField(
         _('date created'), default=timezone.now, 
         help_text=_('creation date/time'))
     
+    # counters that are updated in the database without loading the video.
+    # save() leaves them alone unless they're named in update_fields, so an
+    # instance loaded before a concurrent update can't write stale values.
+    COUNTER_FIELDS = ('likes_count', 'plays_count', 'clips_count', 'duration',
+                      'next_clip_order', 'like_seq', 'clip_seq')
+    
     updated_at = models.DateTimeField(_('last update date/time'), auto_now=True)
     
     # this is used for tracking photo changes
     # ref: http://stackoverflow.com/a/1793323
     __original_photo = None
+    # this is used for tracking owner changes
+    __original_owner_id = None
+    
+    objects = VideoManager()
     
     class Meta:
         ordering = ['-updated_at'] 
@@ -220,6 +302,7 @@ class Video(models.Model):
     def __init__(self, *args, **kwargs):
         super(Video, self).__init__(*args, **kwargs)
         self.__original_photo = self.photo
+        self.__original_owner_id = self.owner_id
         
     def __unicode__(self):
         return '%s (%s)' % (self.title, self.hash_key)
@@ -264,13 +347,17 @@ class Video(models.Model):
         """
         return self.photo_thumbnail.url if self.photo_thumbnail else ''
     
-    def get_photo_small_thumbnail_url(self):
+    def get_photo_small_thumbnail_url(self, webp=False):
         """
         get url of photo's small thumbnail. If there isn't a 
         photo_small_thumbnail then return an empty string
+        
+        Args:
+            webp: (bool) get the url of the WebP version of the thumbnail
         """
-        return (self.photo_small_thumbnail.url 
-                if self.photo_small_thumbnail else '')
+        thumbnail = (self.photo_small_thumbnail_webp if webp else 
+                     self.photo_small_thumbnail)
+        return thumbnail.url if thumbnail else ''
     
     @property
     def score(self):
@@ -297,7 +384,7 @@ class Video(models.Model):
         rank_score = points / ((hours + 2.0)**settings.VIDEO_SCORE_GRAVITY)
         return rank_score
     
-    def delete_photo_files(self, instance):
+    def delete_photo_files(self, instance, save=True):
         """
         Delete a video's photo files in storage
             * First delete the clip's ImageCacheFiles on storage. The reason 
@@ -309,14 +396,18 @@ class Video(models.Model):
                 
         Args:   
             instance: Clip object instance to have files deleted
+            save: save the instance after clearing its photo field?
         
         Returns:      
             None 
         """
-        # get photo_thumbnail location and delete it
-        instance.photo_thumbnail.storage.delete(instance.photo_thumbnail.name)
+        # get thumbnail locations and delete them
+        for thumbnail in (instance.photo_thumbnail, 
+                          instance.photo_small_thumbnail,
+                          instance.photo_small_thumbnail_webp):
+            thumbnail.storage.delete(thumbnail.name)
         # delete photo
-        instance.photo.delete()
+        instance.photo.delete(save=save)
         
     def get_lead_clip(self):
         """
@@ -344,47 +435,104 @@ class Video(models.Model):
         Returns:
             Unique hash key
         """
-        # Generate the hash key
-        hash_key = unicode(uuid.uuid4()).replace('-','')[:VIDEO_HASH_LENGTH]
-        
-        # Confirm it's unique
-        if Video.objects.filter(hash_key=hash_key).exists():
-            # hash key isn't unique so append owner id to it
-            hash_key = hash_key+str(self.owner_id)
-        return hash_key
+        return hash_key_generator.next_key()
     
-    def refresh_photo(self):
+    def refresh_photo(self, save=True):
         """
         Update cached photo of leading clip. This should only be called
         when the leading clip is changed.
+        
+        Args:
+            save: save the video after the update?
         """
         lead_clip = self.get_lead_clip()
         self.photo = lead_clip.photo if lead_clip else None
-        self.save()
+        if save:
+            self.save(update_fields=['photo', 'updated_at'])
         
-    def refresh_clip_stats(self):
+    def refresh_clip_stats(self, save=True):
         """
         Refresh clips_count and duration
+        
+        Args:
+            save: save the video after the update?
         """
         clips = self.clips.all()
         self.clips_count = clips.count()
-        self.duration = clips.aggregate(models.Sum('duration'))['duration__sum']
-        self.save()
+        # the sum is None when there are no clips left
+        self.duration = clips.aggregate(
+            models.Sum('duration'))['duration__sum'] or 0
+        if save:
+            self.save(update_fields=['clips_count', 'duration', 'updated_at'])
+        
+    def add_clip_to_stats(self, duration):
+        """
+        Allocate the order of a new clip and add the clip to the video's 
+        clips_count and duration, with a single update statement. The update
+        locks the video's row so concurrent clip uploads get distinct orders.
+        This should be called in a transaction so the lock is held until the
+        new clip is saved.
         
+        The first clip of a video with no clips gets order 0, and so becomes
+        the lead clip, just like the video's very first clip.
+        
+        Args:
+            duration: duration of the new clip, in seconds
+            
+        Returns:
+            order of the new clip
+        """
+        now = timezone.now()
+        Video.objects.filter(pk=self.pk).update(
+            next_clip_order=models.Case(
+                models.When(clips_count=0, then=models.Value(1)),
+                default=models.F('next_clip_order') + 1,
+                output_field=models.IntegerField()),
+            clips_count=models.F('clips_count') + 1,
+            duration=models.F('duration') + duration,
+            updated_at=now)
+        video_cache.invalidate(self.hash_key)
+        
+        # read back the updated stats to keep this instance in sync
+        self.next_clip_order, self.clips_count, self.duration = (
+            Video.objects.filter(pk=self.pk).values_list(
+                'next_clip_order', 'clips_count', 'duration')[0])
+        self.updated_at = now
+        return self.next_clip_order - 1
+    
+    def increment_seq(self, field):
+        """
+        Increment one of the video's sequence numbers, with a single update
+        statement.
+        
+        Args:
+            field: name of the sequence number field, 'like_seq' or 'clip_seq'
+        """
+        Video.objects.filter(pk=self.pk).update(
+            **{field: models.F(field) + 1})
+        video_cache.invalidate(self.hash_key)
+        
+        # read back the updated sequence number to keep this instance in sync
+        setattr(self, field, Video.objects.filter(pk=self.pk).values_list(
+                field, flat=True)[0])
+    
     def refresh_likes_count(self):
         """
-        Refresh number of likes on video by querying Activity model
+        Refresh number of likes on video by counting its Like objects. Only
+        likes_count is written so the video's other counters, which are 
+        updated atomically, aren't overwritten with stale values.
         """
-        self.likes_count = Activity.objects.filter(
-            verb='like', object_id=self.id,
-            object_content_type=ContentType.objects.get_for_model(self)).count()
-        self.save()
+        self.likes_count = self.likes.count()
+        self.save(update_fields=['likes_count', 'updated_at'])
             
     def save(self, *args, **kwargs):
         """
         On instance creation, generate hash key and set owner as an associated
         user if this isn't already the case.
-        On instance save, if photo has changed, delete old photo's files
+        On instance save, if photo has changed, delete old photo's files, and
+        if owner has changed, invalidate the video's cached membership.
+        Updates don't write the COUNTER_FIELDS unless they're named in
+        update_fields.
                 
         Args:   
             *args: all positional arguments
@@ -400,17 +548,44 @@ class Video(models.Model):
             new_video = True
             # generate a hash key now
             self.hash_key = self.generate_hash_key()
+        
+        elif kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and 
+                field.name not in self.COUNTER_FIELDS]
             
         if self.__original_photo and self.photo != self.__original_photo:
             # photo has changed and this isn't the first photo upload, so
             # delete old files.
+            # the original instance is only used to find the old files so
+            # there's no need to save it.
             orig = Video.objects.get(pk=self.pk)
-            self.delete_photo_files(orig)
+            self.delete_photo_files(orig, save=False)
         
-        super(Video, self).save(*args, **kwargs)
+        if new_video:
+            # generated hash keys never clash with each other but could clash
+            # with a legacy (randomly generated) hash key. That's very 
+            # unlikely, so simply try again with a new hash key if it happens.
+            try:
+                with transaction.atomic():
+                    super(Video, self).save(*args, **kwargs)
+            except IntegrityError:
+                if not Video.objects.filter(hash_key=self.hash_key).exists():
+                    raise
+                self.hash_key = self.generate_hash_key()
+                super(Video, self).save(*args, **kwargs)
+        else:
+            super(Video, self).save(*args, **kwargs)
         
         # update the image file tracking properties
         self.__original_photo = self.photo
+        
+        # the owner is part of the video's membership
+        if not new_video and self.owner_id != self.__original_owner_id:
+            invalidate_memberships(
+                [self.hash_key], [self.owner_id, self.__original_owner_id])
+        self.__original_owner_id = self.owner_id
 
         # set owner as an associated user if this isn't already the case
         if new_video:
@@ -450,7 +625,9 @@ class Video(models.Model):
         """
         Send notification saying the video has been liked.
         The notification goes out to all video clip creators with the app 
-        installed
+        installed, and silently to the other active video users. When the
+        PUSH_COALESCE_WINDOW setting is on, it's held to be merged with other
+        likes of the video.
         
         Args:
             sender: User who liked the video
@@ -466,18 +643,24 @@ class Video(models.Model):
         # Setup content for alert shown when app is in background/inactive
         push_message = ('%s liked %s' % (sender_name, video_title))
         
+        membership = VideoUsers.objects.get_membership(self.hash_key)
+        user_ids = set(membership.active_member_ids(exclude=[sender.id]))
+        
         # clips_users get loud push notifications
-        clips = self.clips.all().select_related('owner')
-        clips_users = [clip.owner for clip in clips 
-                       if clip.owner.is_active == True and clip.owner != sender]
-        send_bulk_push_message(clips_users, push_message, extra=push_extra)
+        clips_user_ids = user_ids.intersection(
+            self.clips.values_list('owner_id', flat=True))
+        if settings.PUSH_COALESCE_WINDOW:
+            PendingNotification.objects.queue(
+                self, settings.PUSH_ACTION_TYPE_LIKED, sender, user_ids,
+                loud_user_ids=clips_user_ids)
+            return
+        
+        send_bulk_push_message(list(clips_user_ids), push_message, 
+                               extra=push_extra)
         
         # all other video users get silent notifications
-        excluded_user_ids = [user.id for user in clips_users]
-        excluded_user_ids.append(sender.id)
-        users = self.users.filter(is_active=True).exclude(
-            id__in=excluded_user_ids)
-        send_bulk_push_message(users, None, extra=push_extra)
+        send_bulk_push_message(list(user_ids - clips_user_ids), None, 
+                               extra=push_extra)
             
 
 class Clip(models.Model):
@@ -512,13 +695,19 @@ class Clip(models.Model):
     # imagekit spec for thumbnail-sized image.
     photo_thumbnail = ImageSpecField(
         source='photo',
-        processors=[Transpose(Transpose.AUTO),
-                    SmartResize(width=settings.VIDEO_PHOTO_THUMBNAIL_SIZE, 
-                                height=settings.VIDEO_PHOTO_THUMBNAIL_SIZE),
-                    Adjust(contrast = 1.2, sharpness=1.1)],
+        processors=[Thumbnail(width=settings.VIDEO_PHOTO_THUMBNAIL_SIZE, 
+                              height=settings.VIDEO_PHOTO_THUMBNAIL_SIZE)],
         format='JPEG',
         options={'quality':90})
     
+    # WebP version of the thumbnail for clients that can display it.
+    photo_thumbnail_webp = ImageSpecField(
+        source='photo',
+        processors=[Thumbnail(width=settings.VIDEO_PHOTO_THUMBNAIL_SIZE, 
+                              height=settings.VIDEO_PHOTO_THUMBNAIL_SIZE)],
+        format='WEBP',
+        options={'quality':80})
+    
     duration = models.FloatField(
         _('clip duration'), default=0.0,
         help_text=_("duration of clip mp4, in seconds."))
@@ -542,14 +731,18 @@ class Clip(models.Model):
                        kwargs={'hash_key':self.video.hash_key,
                                'pk':self.pk})
     
-    def get_photo_thumbnail_url(self):
+    def get_photo_thumbnail_url(self, webp=False):
         """
         get url of photo's thumbnail. If there isn't a photo_thumbnail then
         return an empty string
+        
+        Args:
+            webp: (bool) get the url of the WebP version of the thumbnail
         """
-        return self.photo_thumbnail.url if self.photo_thumbnail else ''
+        thumbnail = self.photo_thumbnail_webp if webp else self.photo_thumbnail
+        return thumbnail.url if thumbnail else ''
     
-    def delete_photo_files(self, instance):
+    def delete_photo_files(self, instance, save=True):
         """
         Delete a clip's photo files in storage
             * First delete the clip's ImageCacheFiles on storage. The reason 
@@ -561,14 +754,17 @@ class Clip(models.Model):
                 
         Args:   
             instance: Clip object instance to have files deleted
+            save: save the instance after clearing its photo field?
         
         Returns:      
             None 
         """
-        # get photo_thumbnail location and delete it
-        instance.photo_thumbnail.storage.delete(instance.photo_thumbnail.name)
+        # get thumbnail locations and delete them
+        for thumbnail in (instance.photo_thumbnail, 
+                          instance.photo_thumbnail_webp):
+            thumbnail.storage.delete(thumbnail.name)
         # delete photo
-        instance.photo.delete()
+        instance.photo.delete(save=save)
 
     def save(self, *args, **kwargs):
         """
@@ -581,35 +777,52 @@ class Clip(models.Model):
         Returns:
             None 
         """
-        new_clip = False
         if self.pk is None:
-            new_clip = True
-            qs = self.__class__.objects.filter(
-                video=self.video).order_by('-order')
-            # if a new clip is being created, it's order will be next up in the
-            # video
-            try:
-                self.order = qs[0].order + 1
-            except IndexError:
-                # but if this new clip is also the first clip associated with
-                # the video start it off with a 0-based index. 
-                self.order = 0
+            self.save_new_clip(*args, **kwargs)
+            return
         
         super(Clip, self).save(*args, **kwargs)
         
-        # if this was the first clip of the video, the video need to refresh its
+        # if this is the first clip of the video, the video need to refresh its
         # cached copy of the photo
         if self.order == 0:
             self.video.refresh_photo()
+    
+    def save_new_clip(self, *args, **kwargs):
+        """
+        Create a new clip in one transaction:
+            * allocate the clip's order and update the video's clip stats
+            * insert the clip
+            * update the uploader's video user status
+            * update the video's cached photo if this is its lead clip
+        then inform video users.
+        
+        Args:   
+            *args: all positional arguments of save()
+            **kwargs: all keyword arguments of save()
+
+        Returns:
+            None 
+        """
+        video = self.video
+        with transaction.atomic():
+            self.order = video.add_clip_to_stats(self.duration)
+            super(Clip, self).save(*args, **kwargs)
             
-        # if this is a new clip update clip stats and inform video users
-        if new_clip:
-            # update associated video user's status
-            video_user = VideoUsers.objects.get(
-                video_id=self.video.id, user_id=self.owner.id)
-            video_user.added_clip()
-            self.video.refresh_clip_stats()
-            self.send_new_clip_notification()
+            VideoUsers.objects.filter(
+                video_id=video.id, user_id=self.owner_id,
+                status__lt=VideoUsers.STATUS_CONTRIBUTED
+                ).update(status=VideoUsers.STATUS_CONTRIBUTED, 
+                         updated_at=timezone.now())
+            
+            # if this is the first clip of the video, the video need to 
+            # refresh its cached copy of the photo. Orders only ever increase
+            # so a new clip with order 0 is always the lead clip.
+            if self.order == 0:
+                video.photo = self.photo
+                video.save(update_fields=['photo', 'updated_at'])
+        
+        self.send_new_clip_notification()
         
     def delete(self, *args, **kwargs):
         """
@@ -662,7 +875,9 @@ class Clip(models.Model):
         """
         Send notification saying a new clip has been added to the video.
         The notification goes out to all video users with the app installed,
-        i.e. active video users, except the clip owner.
+        i.e. active video users, except the clip owner. When the
+        PUSH_COALESCE_WINDOW setting is on, it's held to be merged with other
+        new clips of the video.
         """
         video_title = self.video.get_title()
         clip_owner_name = self.owner.get_short_name()
@@ -677,9 +892,15 @@ class Clip(models.Model):
         push_message = ('%s @ %s:\nAdded new clip'
                         % (clip_owner_name, video_title))
         
-        users = self.video.users.filter(is_active=True).exclude(
-            pk=self.owner.pk)
-        send_bulk_push_message(users, push_message, extra=push_extra)
+        user_ids = VideoUsers.objects.get_membership(
+            self.video.hash_key).active_member_ids(exclude=[self.owner_id])
+        if settings.PUSH_COALESCE_WINDOW:
+            PendingNotification.objects.queue(
+                self.video, settings.PUSH_ACTION_TYPE_ADDED_CLIP, self.owner,
+                user_ids, loud_user_ids=user_ids, object_identifier=self.pk)
+            return
+        
+        send_bulk_push_message(user_ids, push_message, extra=push_extra)
     
     def send_deleted_clip_notification(self, video, owner, clip_pk):
         """
@@ -695,8 +916,49 @@ class Clip(models.Model):
         push_extra = video_push_dictionary(
             video, owner, None, settings.PUSH_ACTION_TYPE_DELETED_CLIP, 
             clip_pk)
-        users = video.users.filter(is_active=True).exclude(pk=owner.pk)
-        send_bulk_push_message(users, None, extra=push_extra)
+        user_ids = VideoUsers.objects.get_membership(
+            video.hash_key).active_member_ids(exclude=[owner.pk])
+        send_bulk_push_message(user_ids, None, extra=push_extra)
+
+
+class VideoMembership(object):
+    """
+    The users of a video and their active flags, as cached for permission
+    checks and notification fan-out. Get these from
+    `VideoUsers.objects.get_membership()`.
+    """
+    
+    def __init__(self, video_id, owner_id, members):
+        """
+        Args:
+            video_id: id of the video
+            owner_id: id of the video's owner
+            members: dictionary of the video users' active flags by user id
+        """
+        self.video_id = video_id
+        self.owner_id = owner_id
+        self.members = members
+    
+    def is_member(self, user_id):
+        """
+        Determine if a user is associated with the video. The video's owner
+        always is, even without an associated VideoUsers object.
+        """
+        return user_id == self.owner_id or user_id in self.members
+    
+    def active_member_ids(self, exclude=()):
+        """
+        Get the ids of the active video users, i.e. those with the app
+        installed.
+        
+        Args:
+            exclude: ids of users to leave out
+            
+        Returns:
+            list of user ids
+        """
+        return [user_id for user_id, is_active in self.members.items()
+                if is_active and user_id not in exclude]
 
 
 class VideoUsersManager(models.Manager):
@@ -710,12 +972,60 @@ class VideoUsersManager(models.Manager):
     This Manager gives us back versions of those methods
     """
     
+    def get_membership(self, hash_key):
+        """
+        Get the membership of a video from the cache, or from the database if
+        it isn't cached. 
+        
+        Args:
+            hash_key: hash key of the video to get the membership of
+            
+        Returns:
+            VideoMembership instance
+        
+        Raises:
+            Video.DoesNotExist: there's no video with this hash key
+        """
+        def load():
+            rows = list(self.filter(video__hash_key=hash_key).values_list(
+                    'video_id', 'video__owner_id', 'user_id', 
+                    'user__is_active'))
+            if rows:
+                video_id, owner_id = rows[0][:2]
+            else:
+                # a video always has its owner as a video user, but check the
+                # video exists just in case
+                video_id, owner_id = Video.objects.values_list(
+                    'id', 'owner_id').get(hash_key=hash_key)
+            members = dict(row[2:] for row in rows)
+            return VideoMembership(video_id, owner_id, members)
+        
+        return membership_cache.get_or_load(hash_key, load)
+    
+    def get_video_ids(self, user):
+        """
+        Get the ids of the videos a user is associated with, or owns, from the
+        cache or from the database if they aren't cached.
+        
+        Args:
+            user: user to get the video ids of
+            
+        Returns:
+            list of video ids
+        """
+        return user_videos_cache.get_or_load(
+            user.id, lambda: list(Video.objects.filter(
+                    models.Q(users__id=user.id) | models.Q(owner_id=user.id)
+                    ).order_by().values_list('id', flat=True).distinct()))
+    
     def add_users_to_video(self, video, *users):
         """
         Associate users with a given video's collection of users
         
         Args:
-            video: video to associate users with
+            video: video to associate users with, as read from the database.
+                Its sequence numbers are the likes and clips the new video
+                users start off having acknowledged.
             users: 0 or more user objects to add to video.users
             
         Returns:
@@ -728,35 +1038,124 @@ class VideoUsersManager(models.Manager):
         users = list(users)
         users_ids = [u.id for u in users]
         
-        # Get users that are already added to the video
-        users_already_added = video.users.filter(id__in=users_ids)
+        # Get ids of users that are already added to the video
+        users_already_added_ids = set(self.filter(
+                video=video, user_id__in=users_ids).values_list(
+                'user_id', flat=True))
+        
+        # Get users to add by (users - users_already_added), skipping any
+        # duplicates in the provided users
+        users_to_add = []
+        for user in users:
+            if user.id not in users_already_added_ids:
+                users_already_added_ids.add(user.id)
+                users_to_add.append(user)
         
-        # Get users to add by (users - users_already_added)
-        users_to_add = [u for u in users if u not in users_already_added]
+        if not users_to_add:
+            return associations_to_create
         
-        for user in users_to_add:
-            association = self.model(video=video, user=user)
-            association.hash_key = association.generate_hash_key()
+        hash_keys = hash_key_generator.next_keys(len(users_to_add))
+        for user, hash_key in zip(users_to_add, hash_keys):
+            association = self.model(video=video, user=user, hash_key=hash_key)
+            # new users have nothing to catch up on
+            association.acknowledge(video)
             associations_to_create.append(association)
         
         # now bulk create all these associations
-        self.bulk_create(associations_to_create)
+        try:
+            with transaction.atomic():
+                self.bulk_create(associations_to_create)
+        except IntegrityError:
+            # a generated hash key could clash with a legacy (randomly 
+            # generated) hash key. That's very unlikely, so simply try again
+            # with new hash keys if it happens.
+            hash_keys = hash_key_generator.next_keys(
+                len(associations_to_create))
+            for association, hash_key in zip(associations_to_create, hash_keys):
+                association.hash_key = hash_key
+            self.bulk_create(associations_to_create)
+        
+        # bulk creates don't send signals, so invalidate the cached
+        # memberships here
+        invalidate_memberships([video.hash_key], 
+                               [user.id for user in users_to_add])
         return associations_to_create
     
     def remove_users_from_video(self, video, *users):
         """
-        Dissociate users with a given video's collection of users
+        Dissociate users with a given video's collection of users, and clean
+        up after them. This is the one way video users are removed, so it is
+        set-based no matter how many users are removed:
+            * The associations, the users' clips in the video and the
+              activities of those clips are deleted with a query each, in one
+              transaction.
+            * The video's clip stats and photo are refreshed with one save.
+            * The clips' files are deleted from storage once the database
+              changes are in.
+            * A single removed user notification goes out per removed user.
+              This also covers the deleted clips, so there are no per-clip
+              notifications.
         
         Args:
             video: video to dissociate users with
             users: 0 or more user objects to remove from video.users
             
         Returns:
-            None
+            list of users that were removed. Users that weren't associated
+            with the video are ignored.
         """
-        users = list(users)
-        associations = self.filter(video=video, user__in=users)
-        associations.delete()
+        users = dict((user.id, user) for user in users)
+        if not users:
+            return []
+        
+        with transaction.atomic():
+            associations = self.filter(video=video, user_id__in=users.keys())
+            removed_ids = set(associations.values_list('user_id', flat=True))
+            if not removed_ids:
+                return []
+            
+            clips = list(video.clips.filter(owner_id__in=removed_ids))
+            clip_ids = [clip.id for clip in clips]
+            if clip_ids:
+                # a lead clip being removed means the video's cached photo
+                # needs a refresh.
+                lead_clip = video.get_lead_clip()
+                is_lead_clip_removed = lead_clip.id in clip_ids
+                
+                content_type = ContentType.objects.get_for_model(Clip)
+                Activity.objects.filter(
+                    models.Q(object_id__in=clip_ids, 
+                             object_content_type=content_type) |
+                    models.Q(target_id__in=clip_ids, 
+                             target_content_type=content_type)
+                    ).delete()
+                Clip.objects.filter(pk__in=clip_ids).delete()
+            
+            self.filter(video=video, user_id__in=removed_ids).delete()
+            
+            # this also refreshes video's updated_at time
+            update_fields = ['updated_at']
+            if clip_ids:
+                video.refresh_clip_stats(save=False)
+                update_fields += ['clips_count', 'duration']
+                if is_lead_clip_removed:
+                    video.refresh_photo(save=False)
+                    update_fields.append('photo')
+            video.save(update_fields=update_fields)
+        
+        invalidate_memberships([video.hash_key], removed_ids)
+        
+        # the clips are gone so now delete their files. This doesn't need any
+        # database writes as the clip objects no longer exist.
+        for clip in clips:
+            if clip.photo:
+                clip.delete_photo_files(clip, save=False)
+            if clip.mp4:
+                clip.mp4.delete(save=False)
+        
+        removed_users = [users[user_id] for user_id in removed_ids]
+        VideoUsers.send_removed_users_notification(video, removed_users)
+        return removed_users
         
 
 class VideoUsers(models.Model):
@@ -790,15 +1189,19 @@ class VideoUsers(models.Model):
         _('Video interaction status'), 
         choices=INTERACTION_STATUS_CHOICES, default=STATUS_INVITED) 
     
-    new_likes_count = models.IntegerField(
-        _('New likes count'), default=0, validators=[MinValueValidator(0)],
-        help_text=_("count of new video likes that haven't been acknowledged "
-                    "by video user"))
+    # the video's sequence numbers as of the video user's last
+    # acknowledgement of its likes and clips.
+    acked_like_seq = models.IntegerField(
+        _('Acknowledged like sequence number'), default=0,
+        validators=[MinValueValidator(0)],
+        help_text=_("video's like sequence number when its likes were last "
+                    "acknowledged by video user"))
     
-    new_clips_count = models.IntegerField(
-        _('New clips count'), default=0, validators=[MinValueValidator(0)],
-        help_text=_("count of new video clips that haven't been acknowledged "
-                    "by video user"))
+    acked_clip_seq = models.IntegerField(
+        _('Acknowledged clip sequence number'), default=0,
+        validators=[MinValueValidator(0)],
+        help_text=_("video's clip sequence number when its clips were last "
+                    "acknowledged by video user"))
     
     created_at = models.DateTimeField(
         _('date created'), default=timezone.now,
@@ -825,30 +1228,47 @@ class VideoUsers(models.Model):
                        kwargs={'hash_key':self.video.hash_key,
                                'phone_number':self.user.phone_number})
     
+    @property
+    def new_likes_count(self):
+        """
+        Count of new video likes that haven't been acknowledged by video user.
+        This reads the video so select it along with the video user.
+        """
+        return max(self.video.like_seq - self.acked_like_seq, 0)
+    
+    @property
+    def new_clips_count(self):
+        """
+        Count of new video clips that haven't been acknowledged by video user.
+        This reads the video so select it along with the video user.
+        """
+        return max(self.video.clip_seq - self.acked_clip_seq, 0)
+    
+    def acknowledge(self, video=None):
+        """
+        Mark all of the video's likes and clips as seen by video user. This
+        doesn't save the video user.
+        
+        Args:
+            video: up to date copy of the video user's video, if the caller
+                has one. Otherwise the video is read from the database.
+        """
+        if video is None:
+            video = Video.objects.get(pk=self.video_id)
+        self.acked_like_seq = video.like_seq
+        self.acked_clip_seq = video.clip_seq
+    
     def generate_hash_key(self):
         """
         Generate unique string to be used as hash key for current VideoUser
         object.
         """
-        # Generate the hash key
-        salt = hashlib.sha1(six.text_type(random.random()).encode(
-                'ascii')).hexdigest()[:5]
-        salt = salt.encode('ascii')
-        phone_number = self.user.phone_number.as_e164.encode('utf-8')
-        video_hash = self.video.hash_key.encode('utf-8')
-        hash_key = hashlib.sha1(salt+phone_number+video_hash).hexdigest()[
-            :VIDEO_USERS_HASH_LENGTH]
-        
-        # Confirm hash key is unique. If it isn't append user id and video id
-        # to it.
-        #if VideoUsers.objects.filter(hash_key=hash_key).exists():
-        #    hash_key = hash_key+str(self.user_id)+str(self.video_id)
-        
-        return hash_key
+        return hash_key_generator.next_key()
     
     def save(self, *args, **kwargs):
         """
-        On instance creation, generate object's hash key.
+        On instance creation, generate object's hash key and acknowledge the
+        video's existing likes and clips.
                 
         Args:   
             *args: all positional arguments
@@ -862,12 +1282,29 @@ class VideoUsers(models.Model):
             # generate a hash key now
             self.hash_key = self.generate_hash_key()
             
+            # new video users have nothing to catch up on
+            self.acknowledge(self.video)
+            
+            # generated hash keys never clash with each other but could clash
+            # with a legacy (randomly generated) hash key. That's very 
+            # unlikely, so simply try again with a new hash key if it happens.
+            try:
+                with transaction.atomic():
+                    super(VideoUsers, self).save(*args, **kwargs)
+                return
+            except IntegrityError:
+                if not VideoUsers.objects.filter(
+                    hash_key=self.hash_key).exists():
+                    raise
+                self.hash_key = self.generate_hash_key()
+            
         super(VideoUsers, self).save(*args, **kwargs)
         
     def delete(self, *args, **kwargs):
         """
         On object delete, update parent video to indicate change in related
-        user entity
+        user entity. This goes through remove_users_from_video so the user's
+        clips are cleaned up just as they would be for a bulk removal.
         
         Args:
             *args: all positional arguments
@@ -876,18 +1313,7 @@ class VideoUsers(models.Model):
         Returns:
             None 
         """
-        # cache video and user for after instance deletion.
-        video = self.video 
-        user = self.user
-        super(VideoUsers, self).delete(*args, **kwargs)
-        
-        # delete these user's clips in the video
-        owned_clips = video.clips.filter(owner_id=user.id)
-        for clip in owned_clips:
-            clip.delete()
-        
-        video.save() # this refreshes video's updated_at time
-        self.send_removed_user_notification(video, user)
+        VideoUsers.objects.remove_users_from_video(self.video, self.user)
         
     def added_clip(self):
         """
@@ -950,8 +1376,9 @@ class VideoUsers(models.Model):
             self.video, self.video.owner, None,
             settings.PUSH_ACTION_TYPE_ADDED_USER, 
             self.user.phone_number.as_e164)        
-        users = self.video.users.filter(is_active=True)
-        send_bulk_push_message(users, None, extra=push_extra)
+        user_ids = VideoUsers.objects.get_membership(
+            self.video.hash_key).active_member_ids()
+        send_bulk_push_message(user_ids, None, extra=push_extra)
         
     def send_removed_user_notification(self, video, user):
         """
@@ -963,10 +1390,507 @@ class VideoUsers(models.Model):
             video: video that user was removed from
             user: video user that was removed from video
         """
-        push_extra = video_push_dictionary(
-            video, video.owner, None, settings.PUSH_ACTION_TYPE_REMOVED_USER, 
-            user.phone_number.as_e164)
-        users = video.users.filter(is_active=True)
-        users = list(users)
-        users.append(user)
-        send_bulk_push_message(users, None, extra=push_extra)
+        VideoUsers.send_removed_users_notification(video, [user])
+    
+    @staticmethod
+    def get_removed_users_notifications(video, removed_users):
+        """
+        Get the notifications saying users have been removed as video users.
+        Video users with the app installed, i.e. active event members, get a
+        single notification with the phone numbers of all removed users (one
+        per MAX_REMOVED_USERS_PER_PUSH users), and each removed user gets one
+        with their own phone number.
+        
+        Args:
+            video: video that users were removed from
+            removed_users: video users that were removed from video
+        
+        Returns:
+            list of (users, message, extra) tuples as taken by
+            send_bulk_push_messages
+        """
+        if not removed_users:
+            return []
+        
+        notifications = []
+        for user in removed_users:
+            push_extra = video_push_dictionary(
+                video, video.owner, None, 
+                settings.PUSH_ACTION_TYPE_REMOVED_USER, 
+                user.phone_number.as_e164)
+            notifications.append(([user.id], None, push_extra))
+        
+        user_ids = VideoUsers.objects.get_membership(
+            video.hash_key).active_member_ids()
+        if not user_ids:
+            return notifications
+        
+        phone_numbers = [user.phone_number.as_e164 for user in removed_users]
+        for start in range(0, len(phone_numbers), MAX_REMOVED_USERS_PER_PUSH):
+            batch = phone_numbers[start:start + MAX_REMOVED_USERS_PER_PUSH]
+            push_extra = video_push_dictionary(
+                video, video.owner, None, 
+                settings.PUSH_ACTION_TYPE_REMOVED_USER,
+                # a single removed user's notification is the same for
+                # everyone
+                batch[0] if len(phone_numbers) == 1 else None)
+            push_extra[settings.PUSH_ACTION_OBJECT_IDENTIFIERS_KEY] = batch
+            notifications.append((user_ids, None, push_extra))
+        return notifications
+    
+    @staticmethod
+    def send_removed_users_notification(video, removed_users):
+        """
+        Send notifications saying users have been removed as video users,
+        as described in get_removed_users_notifications. These are all sent
+        together, so the recipients' devices are only fetched once however
+        many users were removed.
+        
+        Args:
+            video: video that users were removed from
+            removed_users: video users that were removed from video
+        """
+        send_bulk_push_messages(
+            VideoUsers.get_removed_users_notifications(video, removed_users))
+
+
+class LikeManager(models.Manager):
+    """
+    Custom manager for the Like model
+    """
+    
+    def add_like(self, user, video):
+        """
+        Record a user's like of a video, if it isn't already recorded. This is
+        safe to call concurrently for the same user and video: the unique
+        constraint on likes ensures only one of the calls records the like.
+        
+        Args:
+            user: user liking the video
+            video: video being liked
+            
+        Returns:
+            Boolean indicator: True if the like was recorded by this call, or
+            False if the video was already liked.
+        """
+        try:
+            with transaction.atomic(using=self._db):
+                self.create(user=user, video=video)
+        except IntegrityError:
+            return False
+        return True
+    
+    def remove_like(self, user, video):
+        """
+        Remove a user's like of a video, if there is one.
+        
+        Args:
+            user: user unliking the video
+            video: video being unliked
+            
+        Returns:
+            Boolean indicator: True if a like was removed, or False if the
+            video wasn't liked.
+        """
+        likes = self.filter(user_id=user.id, video_id=video.id)
+        # QuerySet.delete() doesn't report what it deleted, so check first
+        liked = likes.exists()
+        if liked:
+            likes.delete()
+        return liked
+
+
+class Like(models.Model):
+    """
+    A user's like of a video. Likes are also recorded as Activities for the
+    activity feed, but this is the narrow table that like lookups use.
+    """
+    user = models.ForeignKey(
+        User, related_name='likes', verbose_name=_('user'),
+        help_text=_("User that liked the video"))
+    
+    video = models.ForeignKey(
+        Video, related_name='likes', verbose_name=_('video'),
+        help_text=_("Video that was liked"))
+    
+    created_at = models.DateTimeField(
+        _('date created'), default=timezone.now,
+        help_text=_("Like creation date/time"))
+    
+    objects = LikeManager()
+    
+    class Meta:
+        unique_together = ('user', 'video')
+        verbose_name = _('like')
+        verbose_name_plural = _('likes')
+        ordering = ('-created_at',)
+    
+    def __unicode__(self):
+        return u'user:%s video:%s' % (str(self.user), str(self.video))
+
+
+class PendingNotificationManager(models.Manager):
+    """
+    Custom manager for the PendingNotification model
+    """
+
+    def queue(self, video, action_type, actor, user_ids, loud_user_ids=(),
+              object_identifier=None):
+        """
+        Hold a push notification of video users for coalescing. Each
+        recipient's notification is merged into the one already held for them
+        about the same video and action type, if there is one. Otherwise it's
+        held for PUSH_COALESCE_WINDOW seconds.
+
+        This takes at most 3 queries in a transaction, however many
+        recipients there are.
+
+        Args:
+            video: video the notification is about
+            action_type: PUSH_ACTION_TYPE_* of the notification
+            actor: user performing the notified action
+            user_ids: ids of users to notify
+            loud_user_ids: ids of those users who get the notification with a
+                message and sound. The others get a silent notification.
+            object_identifier: identifier of the action's related object
+        """
+        user_ids = set(user_ids)
+        if not user_ids:
+            return
+        loud_user_ids = user_ids.intersection(loud_user_ids)
+        now = timezone.now()
+
+        # only merge into notifications that aren't due, so they aren't being
+        # sent already. The held notifications are locked until they're
+        # merged into, as a flush deleting them in between would lose their
+        # recipients' notifications. A flush holding the lock first has
+        # deleted them by the time they're read.
+        with transaction.atomic(using=self._db):
+            held = self.filter(video_id=video.id, action_type=action_type,
+                               send_at__gt=now)
+            held_user_ids = set(held.select_for_update().filter(
+                    user_id__in=user_ids).values_list('user_id', flat=True))
+            if held_user_ids:
+                held_loud_user_ids = held_user_ids.intersection(loud_user_ids)
+                if held_loud_user_ids == held_user_ids:
+                    loud = True
+                elif held_loud_user_ids:
+                    loud = models.Case(
+                        models.When(user_id__in=held_loud_user_ids,
+                                    then=models.Value(True)),
+                        default=models.F('loud'),
+                        output_field=models.BooleanField())
+                else:
+                    loud = models.F('loud')
+                # the columns are updated from their old values, so the case
+                # compares the previous actor with the new one.
+                held.filter(user_id__in=held_user_ids).update(
+                    count=models.F('count') + 1,
+                    multiple_actors=models.Case(
+                        models.When(actor_id=actor.id,
+                                    then=models.F('multiple_actors')),
+                        default=models.Value(True),
+                        output_field=models.BooleanField()),
+                    actor_ids=models.Case(
+                        models.When(actor_ids__contains=',%d,' % actor.id,
+                                    then=models.F('actor_ids')),
+                        default=Concat(models.F('actor_ids'),
+                                       models.Value('%d,' % actor.id)),
+                        output_field=models.TextField()),
+                    actor=actor, loud=loud,
+                    object_identifier=object_identifier, updated_at=now)
+                PUSH_COALESCED.labels('merged').inc(len(held_user_ids))
+
+            send_at = now + timedelta(seconds=settings.PUSH_COALESCE_WINDOW)
+            self.bulk_create([
+                    self.model(user_id=user_id, video=video,
+                               action_type=action_type, actor=actor,
+                               actor_ids=',%d,' % actor.id,
+                               loud=user_id in loud_user_ids,
+                               object_identifier=object_identifier,
+                               created_at=now, updated_at=now,
+                               send_at=send_at)
+                    for user_id in user_ids - held_user_ids])
+        PUSH_COALESCED.labels('held').inc(len(user_ids - held_user_ids))
+
+    def flush(self, now=None, batch_size=500):
+        """
+        Send the held notifications that are due, in one push per recipient
+        for each video and action type. Notifications of recipients that are
+        no longer active video users are dropped.
+
+        Args:
+            now: time notifications are due by. Defaults to the current time.
+            batch_size: max number of held notifications to send
+
+        Returns:
+            list of (user ids, message, extra) tuples of the notifications
+            sent, as passed to send_bulk_push_messages
+        """
+        if now is None:
+            now = timezone.now()
+
+        # claim the due notifications by deleting them, so concurrent flushes
+        # don't send them again.
+        with transaction.atomic(using=self._db):
+            ids = list(self.select_for_update().filter(
+                    send_at__lte=now).order_by('send_at').values_list(
+                    'id', flat=True)[:batch_size])
+            if not ids:
+                return []
+            held = list(self.filter(id__in=ids).select_related(
+                    'video', 'actor').order_by('updated_at', 'id'))
+            self.filter(id__in=ids).delete()
+
+        # concurrent queueing can hold more than one notification of a
+        # recipient about a video and action type, so merge these.
+        merged = OrderedDict()
+        for notification in held:
+            key = (notification.user_id, notification.video_id,
+                   notification.action_type)
+            if key in merged:
+                merged[key].merge(notification)
+            else:
+                merged[key] = notification
+
+        # recipients with the same notification share a push
+        memberships = {}
+        notifications = OrderedDict()
+        for notification in merged.values():
+            video = notification.video
+            if video.id not in memberships:
+                memberships[video.id] = VideoUsers.objects.get_membership(
+                    video.hash_key)
+            if not memberships[video.id].members.get(notification.user_id):
+                continue
+            message, extra = notification.get_push_content()
+            key = (message, tuple(sorted(extra.items())))
+            if key not in notifications:
+                notifications[key] = ([], message, extra)
+            notifications[key][0].append(notification.user_id)
+
+        notifications = notifications.values()
+        send_bulk_push_messages(notifications)
+        return notifications
+
+
+class PendingNotification(models.Model):
+    """
+    A push notification of a video user held for a short while, so the
+    notifications of a burst of likes or clips of a video are merged into
+    one push. Held notifications are sent by the `flushnotifications`
+    management command.
+    """
+    user = models.ForeignKey(
+        User, related_name='pending_notifications', verbose_name=_('user'),
+        help_text=_("User to notify"))
+
+    video = models.ForeignKey(
+        Video, related_name='pending_notifications', verbose_name=_('video'),
+        help_text=_("Video the notification is about"))
+
+    action_type = models.PositiveSmallIntegerField(
+        _('action type'),
+        help_text=_("Push action type of the notification"))
+
+    actor = models.ForeignKey(
+        User, related_name='+', verbose_name=_('actor'),
+        help_text=_("User that performed the latest notified action"))
+
+    multiple_actors = models.BooleanField(
+        _('multiple actors'), default=False,
+        help_text=_("Designates if the notified actions were performed by "
+                    "more than one user"))
+
+    # stored as ",1,5," so an id is appended to it, unless it's already in it,
+    # by a single update
+    actor_ids = models.TextField(
+        _('actor ids'), default='',
+        help_text=_("Comma-separated ids of the distinct users that performed "
+                    "the notified actions"))
+
+    count = models.PositiveIntegerField(
+        _('count'), default=1,
+        help_text=_("Number of notifications merged into this one"))
+
+    loud = models.BooleanField(
+        _('loud'), default=False,
+        help_text=_("Designates if the notification is sent with a message "
+                    "and sound, rather than silently"))
+
+    object_identifier = models.CharField(
+        _('object identifier'), max_length=50, blank=True, null=True,
+        help_text=_("Identifier of the latest notified action's object"))
+
+    created_at = models.DateTimeField(
+        _('date created'), default=timezone.now,
+        help_text=_("Date/time the first notification was held"))
+
+    updated_at = models.DateTimeField(
+        _('date updated'), default=timezone.now,
+        help_text=_("Date/time the latest notification was merged"))
+
+    send_at = models.DateTimeField(
+        _('send date'), db_index=True,
+        help_text=_("Date/time the notification is due to be sent"))
+
+    objects = PendingNotificationManager()
+
+    class Meta:
+        index_together = (('video', 'action_type', 'user'),)
+        verbose_name = _('pending notification')
+        verbose_name_plural = _('pending notifications')
+        ordering = ('send_at',)
+
+    def __unicode__(self):
+        return u'user:%s video:%s action:%s count:%s' % (
+            str(self.user), str(self.video), self.action_type, self.count)
+
+    def merge(self, notification):
+        """
+        Merge a notification that was held later into this one
+
+        Args:
+            notification: PendingNotification to merge in
+        """
+        self.multiple_actors = (self.multiple_actors or
+                                notification.multiple_actors or
+                                self.actor_id != notification.actor_id)
+        self.actor_ids = ',%s,' % ','.join(
+            str(actor_id) for actor_id in sorted(
+                self.get_actor_ids() | notification.get_actor_ids()))
+        self.count += notification.count
+        self.loud = self.loud or notification.loud
+        self.actor = notification.actor
+        self.object_identifier = notification.object_identifier
+
+    def get_actor_ids(self):
+        """
+        Get the ids of the distinct users that performed the notified actions
+
+        Returns:
+            set of user ids
+        """
+        return set(int(actor_id) for actor_id in self.actor_ids.split(',')
+                   if actor_id)
+
+    def get_push_content(self):
+        """
+        Get the content of the push notification. A single notification has
+        the same content it would have had if it were sent right away.
+
+        Returns:
+            (message, extra) tuple, where message is None for silent
+            notifications
+        """
+        video_title = self.video.get_title()
+        actor_name = self.actor.get_short_name()
+
+        if self.action_type == settings.PUSH_ACTION_TYPE_LIKED:
+            # a user that unliked and liked again is only counted once
+            likers_count = len(self.get_actor_ids())
+            if likers_count > 1:
+                extra_message = "Liked by %d people" % likers_count
+                message = '%s liked by %d people' % (video_title,
+                                                     likers_count)
+            else:
+                extra_message = "Liked video"
+                message = '%s liked %s' % (actor_name, video_title)
+
+        elif self.action_type == settings.PUSH_ACTION_TYPE_ADDED_CLIP:
+            if self.count == 1:
+                extra_message = "Added new clip"
+                message = '%s @ %s:\nAdded new clip' % (actor_name,
+                                                        video_title)
+            elif self.multiple_actors:
+                extra_message = "Added %d clips" % self.count
+                message = '%s:\nAdded %d clips' % (video_title, self.count)
+            else:
+                extra_message = "Added %d clips" % self.count
+                message = '%s @ %s:\nAdded %d clips' % (
+                    actor_name, video_title, self.count)
+
+        else:
+            extra_message = message = None
+
+        extra = video_push_dictionary(
+            self.video, self.actor, extra_message, self.action_type,
+            self.object_identifier)
+        return (message if self.loud else None), extra
+
+
+# ---------------------------------------------------------------------------- #
+# SIGNAL HANDLERS
+# ---------------------------------------------------------------------------- #
+
+def invalidate_memberships(hash_keys=(), user_ids=()):
+    """
+    Invalidate the cached memberships of videos and video ids of users
+    
+    Args:
+        hash_keys: hash keys of videos whose memberships changed
+        user_ids: ids of users whose videos changed
+    """
+    membership_cache.invalidate(*hash_keys)
+    user_videos_cache.invalidate(*user_ids)
+
+
+def invalidate_cached_video(sender, instance, **kwargs):
+    """
+    Remove a saved or deleted video from the cache
+    """
+    video_cache.invalidate(instance.hash_key)
+
+
+def invalidate_deleted_video_memberships(sender, instance, **kwargs):
+    """
+    Invalidate the membership of a video about to be deleted, and the video
+    ids of its users as its VideoUsers objects are deleted along with it.
+    """
+    user_ids = set(VideoUsers.objects.filter(
+            video_id=instance.id).values_list('user_id', flat=True))
+    user_ids.add(instance.owner_id)
+    invalidate_memberships([instance.hash_key], user_ids)
+
+
+def invalidate_created_video_user(sender, instance, created, **kwargs):
+    """
+    Invalidate the membership of a video a user has been added to
+    """
+    if created:
+        invalidate_memberships([instance.video.hash_key], [instance.user_id])
+
+
+def invalidate_user_memberships(sender, instance, **kwargs):
+    """
+    Invalidate the memberships of the videos of a user whose active flag has
+    changed.
+    """
+    if instance.is_active_changed():
+        invalidate_memberships(VideoUsers.objects.filter(
+                user_id=instance.id).values_list(
+                'video__hash_key', flat=True))
+
+
+def invalidate_deleted_user_memberships(sender, instance, **kwargs):
+    """
+    Invalidate the memberships of the videos of a user about to be deleted,
+    as their VideoUsers objects are deleted along with them.
+    """
+    invalidate_memberships(VideoUsers.objects.filter(
+            user_id=instance.id).values_list('video__hash_key', flat=True))
+
+
+# connect the signals
+post_save.connect(invalidate_cached_video, sender=Video,
+                  dispatch_uid="gravvy.apps.video.models")
+post_delete.connect(invalidate_cached_video, sender=Video,
+                    dispatch_uid="gravvy.apps.video.models")
+pre_delete.connect(invalidate_deleted_video_memberships, sender=Video,
+                   dispatch_uid="gravvy.apps.video.models")
+post_save.connect(invalidate_created_video_user, sender=VideoUsers,
+                  dispatch_uid="gravvy.apps.video.models")
+post_save.connect(invalidate_user_memberships, sender=User,
+                  dispatch_uid="gravvy.apps.video.models")
+pre_delete.connect(invalidate_deleted_user_memberships, sender=User,
+                   dispatch_uid="gravvy.apps.video.models")
@@ -3,7 +3,8 @@ Permissions for REST API
 """
 
 from rest_framework import permissions
-from gravvy.apps.video.models import Video, VideoUsers
+from gravvy.apps.video.models import Video
+from gravvy.apps.video.loaders import get_loader
 from gravvy.apps.account.models import User
 
 class IsOwnerOrReadOnly(permissions.BasePermission):
@@ -33,6 +34,7 @@ class IsAssociatedUser(permissions.BasePermission):
 
     Assumptions:
         - expects to be used on a detail view or a view with a lookup_field
+        - the lookup_field is the video's `hash_key`
     """
     
     def has_permission(self, request, view):
@@ -43,18 +45,10 @@ class IsAssociatedUser(permissions.BasePermission):
             lookup = view.kwargs.get(lookup_url_kwarg, None)
             
             if lookup is not None:
-                videousers_lookup_field = 'video__' + view.lookup_field
-                filter_kwargs = {videousers_lookup_field: lookup,
-                                 'user_id': request.user.id}
-                user_is_associated = VideoUsers.objects.filter(
-                    **filter_kwargs).exists()
-                
-                if not user_is_associated:
-                    # no VideoUsers object, so check if user is owner and
-                    # oddly without an associated VideoUsers object
-                    filter_kwargs = {view.lookup_field: lookup}
-                    video = Video.objects.get(**filter_kwargs)
-                    user_is_associated = video.owner_id == request.user.id
+                # the video's membership includes its owner, even if oddly 
+                # without an associated VideoUsers object
+                membership = get_loader(request).get_membership(lookup)
+                user_is_associated = membership.is_member(request.user.id)
 
         except Video.DoesNotExist:
             pass
@@ -121,9 +115,8 @@ class IsOwnerOrUserDetailOwner(IsUserDetailOwner):
             lookup = view.kwargs.get(lookup_url_kwarg, None)
             
             if lookup is not None:
-                filter_kwargs = {view.lookup_field: lookup}
-                video = Video.objects.get(**filter_kwargs)
-                user_is_owner = (request.user.id == video.owner_id)
+                membership = get_loader(request).get_membership(lookup)
+                user_is_owner = (request.user.id == membership.owner_id)
                 
         except Video.DoesNotExist:
             pass # user_is_owner already set
@@ -4,19 +4,21 @@ instances into representations such as json.
 """
 
 from django.utils.translation import ugettext_lazy as _
-from django.contrib.contenttypes.models import ContentType
 from django.conf import settings
 
 from rest_framework import serializers
 
 from gravvy.utils import human_readable_size
 from gravvy.apps.video.models import Video, Clip, VideoUsers
+from gravvy.apps.video.loaders import get_loader
+from gravvy.apps.account.models import RecentContact
 from gravvy.apps.account.serializers import (
     UserPublicSerializer, UserNumberSerializer, UserMinimalSerializer)
 from gravvy.apps.activity import activity
-from gravvy.apps.activity.models import Activity
+from gravvy.apps.rest.negotiation import accepts_webp
+from gravvy.apps.monitoring.serializers import ProfiledSerializerMixin
 
-class ClipSerializer(serializers.ModelSerializer):
+class ClipSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     """
     Serializer to be used for getting and updating Clips.
     """
@@ -74,12 +76,15 @@ class ClipSerializer(serializers.ModelSerializer):
     
     def get_photo_thumbnail(self, obj):
         """
-        Get the absolute URI of the clips's photo thumbnail
+        Get the absolute URI of the clips's photo thumbnail, in the best
+        image format the client accepts
         """
-        return obj.get_photo_thumbnail_url()
+        return obj.get_photo_thumbnail_url(
+            webp=accepts_webp(self.context.get('request')))
      
 
-class VideoSerializer(serializers.HyperlinkedModelSerializer):
+class VideoSerializer(ProfiledSerializerMixin,
+                      serializers.HyperlinkedModelSerializer):
     """
     Serializer to be used for getting and updating Videos.
     """
@@ -122,27 +127,22 @@ class VideoSerializer(serializers.HyperlinkedModelSerializer):
     
     def get_photo_small_thumbnail(self, obj):
         """
-        Get the absolute URI of the video's small photo thumbnail
+        Get the absolute URI of the video's small photo thumbnail, in the best
+        image format the client accepts
         """
-        return obj.get_photo_small_thumbnail_url()
+        return obj.get_photo_small_thumbnail_url(
+            webp=accepts_webp(self.context.get('request')))
     
     def get_liked(self, obj):
         """
         Determine if the current request user liked the video
         """
-        user = self.context['request'].user
-        
-        has_liked = False
         try:
-            like_activities = obj.prefetched_activity_object_likes
-            has_liked = len(like_activities) > 0
+            likes = obj.prefetched_likes
+            has_liked = len(likes) > 0
         
         except AttributeError:
-            if user.is_authenticated():
-                has_liked = Activity.objects.filter(
-                    actor_id=user.id, verb='like', object_id=obj.id,
-                    object_content_type=ContentType.objects.get_for_model(obj)
-                    ).exists()
+            has_liked = get_loader(self.context['request']).get_liked(obj)
         
         return has_liked
         
@@ -181,23 +181,20 @@ class VideoSerializer(serializers.HyperlinkedModelSerializer):
         new_likes_count = 0
         status = VideoUsers.STATUS_NONE
         
-        user = self.context['request'].user
         video_user = None
         try:
             videousers = obj.prefetched_videousers
             if len(videousers) == 1:
                 video_user = videousers[0]
         except AttributeError:
-            if user.is_authenticated():
-                try:
-                    video_user = VideoUsers.objects.get(
-                        video_id=obj.id, user_id=user.id)
-                except VideoUsers.DoesNotExist:
-                    pass
+            video_user = get_loader(self.context['request']).get_video_user(
+                obj.hash_key)
         
         if video_user is not None:
-            new_clips_count = video_user.new_clips_count
-            new_likes_count = video_user.new_likes_count
+            # unread counts are the video's sequence numbers less the ones
+            # the video user has acknowledged
+            new_clips_count = max(obj.clip_seq - video_user.acked_clip_seq, 0)
+            new_likes_count = max(obj.like_seq - video_user.acked_like_seq, 0)
             status = video_user.status
 
         ret['new_likes_count'] = new_likes_count
@@ -278,9 +275,10 @@ class VideoCreationSerializer(VideoSerializer):
         
         # log creation of all users and send them push notifications
         request = self.context['request']
-        for user in new_users:
-            activity.send(request.user, verb='invite', 
-                          object=user, target=video)
+        activity.send_many(request.user, [
+                {'verb': 'invite', 'object': user, 'target': video}
+                for user in new_users])
+        RecentContact.objects.record_invites(request.user, new_users)
         for video_user in new_video_users:
             video_user.send_invitation_message(request.user)
         
@@ -288,7 +286,8 @@ class VideoCreationSerializer(VideoSerializer):
         return video
         
 
-class VideoUserSerializer(serializers.ModelSerializer):
+class VideoUserSerializer(ProfiledSerializerMixin,
+                          serializers.ModelSerializer):
     """
     Serializer to be used for getting and updating video users
     """
@@ -337,14 +336,15 @@ class VideoUsersCreationSerializer(serializers.Serializer):
                 
         # log creation of all users and send them push notifications
         request = self.context['request']
-        for user in new_users:
-            activity.send(request.user, verb='invite', 
-                          object=user, target=video)
+        activity.send_many(request.user, [
+                {'verb': 'invite', 'object': user, 'target': video}
+                for user in new_users])
+        RecentContact.objects.record_invites(request.user, new_users)
         for video_user in new_video_users:
             video_user.send_invitation_message(request.user)
                 
         # save video to update its updated_at property
-        video.save()
+        video.save(update_fields=['updated_at'])
         return video
 
 
@@ -1,3 +1,702 @@
-from django.test import TestCase
+import struct
+from datetime import timedelta
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files import File
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.urlresolvers import reverse
+from django.test import TestCase, RequestFactory
+from django.test.utils import override_settings
+from django.utils import timezone
+from imagekit.registry import generator_registry
+from PIL import Image
+from rest_framework.test import APIClient
+
+from gravvy.hashkeys import HashKeyGenerator
+from gravvy.processors import Thumbnail, EXIF_ORIENTATION_TAG
+from gravvy.apps.account.models import User
+from gravvy.apps.video.models import (
+    Video, Clip, VideoUsers, Like, VideoMembership, PendingNotification,
+    membership_cache)
+from gravvy.apps.video.views import activity_send
+from gravvy.apps.video.loaders import get_loader
 
 # Create your tests here.
+
+def make_jpeg(width, height, orientation=None):
+    """
+    Make a JPEG photo with a red left half and a blue right half, as stored
+    
+    Args:
+        width: width of the photo
+        height: height of the photo
+        orientation: EXIF orientation of the photo, if any
+    
+    Returns:
+        BytesIO of the JPEG file
+    """
+    img = Image.new('RGB', (width, height), (255, 0, 0))
+    img.paste((0, 0, 255), (width // 2, 0, width, height))
+    options = {'quality': 95}
+    if orientation is not None:
+        # a big-endian TIFF header and an IFD with the orientation tag only
+        options['exif'] = b'Exif\x00\x00MM\x00\x2a' + struct.pack(
+            '>LHHHLHHL', 8, 1, EXIF_ORIENTATION_TAG, 3, 1, orientation, 0, 0)
+    buf = BytesIO()
+    img.save(buf, 'JPEG', **options)
+    buf.seek(0)
+    return buf
+
+
+def get_color(img, xy):
+    """
+    Get the name of the dominant color of a pixel
+    """
+    red, green, blue = img.convert('RGB').getpixel(xy)[:3]
+    return 'red' if red > blue else 'blue'
+
+
+class ThumbnailTests(TestCase):
+    """
+    Tests of the Thumbnail processor and the image specs using it
+    """
+    
+    def test_size(self):
+        for width, height in ((800, 600), (600, 800), (50, 40)):
+            img = Thumbnail(120, 90).process(
+                Image.open(make_jpeg(width, height)))
+            self.assertEqual(img.size, (120, 90))
+    
+    def test_exif_orientations(self):
+        # the photo is displayed with its red half on the side given by each
+        # orientation, once transposed. Photos rotated by 90 degrees are
+        # stored in portrait so they're displayed in landscape.
+        red_sides = {1: 'left', 2: 'right', 3: 'right', 4: 'left',
+                     5: 'top', 6: 'top', 7: 'bottom', 8: 'bottom'}
+        for orientation, red_side in red_sides.items():
+            if red_side in ('left', 'right'):
+                jpeg = make_jpeg(400, 200, orientation)
+                xys = ((10, 25), (90, 25))
+            else:
+                jpeg = make_jpeg(200, 400, orientation)
+                xys = ((50, 5), (50, 45))
+            img = Thumbnail(100, 50).process(Image.open(jpeg))
+            
+            self.assertEqual(img.size, (100, 50))
+            self.assertEqual(
+                [get_color(img, xy) for xy in xys],
+                ['red', 'blue'] if red_side in ('left', 'top')
+                else ['blue', 'red'], orientation)
+    
+    def test_draft_downscale(self):
+        # JPEGs are decoded at the smallest scale that covers the thumbnail
+        for size, decoded_size in (((100, 50), (200, 100)),
+                                   ((300, 150), (400, 200)),
+                                   ((1000, 500), (1600, 800))):
+            img = Image.open(make_jpeg(1600, 800))
+            Thumbnail(*size).process(img)
+            self.assertEqual(img.size, decoded_size)
+        
+        # the transposed thumbnail size is covered
+        img = Image.open(make_jpeg(1600, 800, orientation=6))
+        Thumbnail(50, 300).process(img)
+        self.assertEqual(img.size, (400, 200))
+    
+    def test_specs(self):
+        for spec_id, size, image_format in (
+            ('video:video:photo_thumbnail',
+             settings.VIDEO_PHOTO_THUMBNAIL_SIZE, 'JPEG'),
+            ('video:video:photo_small_thumbnail_webp',
+             settings.VIDEO_PHOTO_ACTIVITY_THUMBNAIL_SIZE, 'WEBP'),
+            ('account:user:avatar_thumbnail',
+             settings.AVATAR_THUMBNAIL_SIZE, 'JPEG')):
+            spec = generator_registry.get(
+                spec_id, source=File(make_jpeg(1600, 1200, orientation=6),
+                                     name='photo.jpg'))
+            img = Image.open(spec.generate())
+            self.assertEqual(img.format, image_format)
+            self.assertEqual(img.size, (size, size))
+
+
+class ClipCreateTests(TestCase):
+    """
+    Tests of Clip creation: the allocated orders, the video stats and the 
+    number of database round trips.
+    """
+    
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user('+12025550100', 'password')
+        self.member = User.objects.create_user('+12025550101', 'password')
+        self.video = Video.objects.create(owner=self.owner, title='video')
+        VideoUsers.objects.add_users_to_video(self.video, self.member)
+    
+    def create_clip(self, owner, duration=2.0):
+        # clips are created without media files so no storage is needed
+        return Clip.objects.create(
+            video=self.video, owner=owner, duration=duration)
+    
+    def test_orders_and_stats(self):
+        clips = [self.create_clip(self.owner) for _ in range(3)]
+        self.assertEqual([clip.order for clip in clips], [0, 1, 2])
+        
+        video = Video.objects.get(pk=self.video.pk)
+        self.assertEqual(video.clips_count, 3)
+        self.assertEqual(video.duration, 6.0)
+        self.assertEqual(video.next_clip_order, 3)
+    
+    def test_orders_not_reused(self):
+        clips = [self.create_clip(self.owner) for _ in range(3)]
+        clips[2].delete()
+        self.assertEqual(self.create_clip(self.owner).order, 3)
+    
+    def test_first_clip_after_all_deleted_is_lead_clip(self):
+        self.create_clip(self.owner).delete()
+        self.assertEqual(self.create_clip(self.owner).order, 0)
+    
+    def test_video_user_status(self):
+        self.create_clip(self.member)
+        video_user = VideoUsers.objects.get(
+            video=self.video, user=self.member)
+        self.assertEqual(video_user.status, VideoUsers.STATUS_CONTRIBUTED)
+    
+    def test_round_trips(self):
+        # lead clip: savepoint, video update + read back, clip insert, video
+        # user status update, video photo save, release savepoint, video 
+        # membership, and held notifications to lock and merge into and hold
+        # in a savepoint
+        with self.assertNumQueries(12):
+            self.create_clip(self.owner)
+        
+        # every other clip doesn't have to update the video's photo, and reads
+        # the video membership from the cache. Its notification is merged into
+        # the one held for the owner, if any, and held for the rest, in a
+        # savepoint.
+        with self.assertNumQueries(10):
+            self.create_clip(self.member)
+
+
+class VideoCountersTests(TestCase):
+    """
+    Tests that saving a video loaded before its counters were updated doesn't
+    write the stale counters back.
+    """
+    
+    def setUp(self):
+        self.owner = User.objects.create_user('+12025550100', 'password')
+        self.member = User.objects.create_user('+12025550101', 'password')
+        self.video = Video.objects.create(owner=self.owner, title='video')
+        VideoUsers.objects.add_users_to_video(self.video, self.member)
+        self.stale = Video.objects.get(pk=self.video.pk)
+        
+        # concurrent uploads and likes
+        for _ in range(2):
+            Clip.objects.create(
+                video=self.video, owner=self.owner, duration=2.0)
+        self.video.increment_seq('like_seq')
+        Video.objects.filter(pk=self.video.pk).update(plays_count=5)
+    
+    def assertCountersKept(self):
+        video = Video.objects.get(pk=self.video.pk)
+        self.assertEqual(video.next_clip_order, 2)
+        self.assertEqual(video.clip_seq, 0)
+        self.assertEqual(video.like_seq, 1)
+        self.assertEqual(video.plays_count, 5)
+        return video
+    
+    def test_save(self):
+        self.stale.title = 'new title'
+        self.stale.save()
+        video = self.assertCountersKept()
+        self.assertEqual(video.title, 'new title')
+        self.assertEqual(video.clips_count, 2)
+    
+    def test_refresh_photo(self):
+        self.stale.refresh_photo()
+        self.assertCountersKept()
+    
+    def test_refresh_likes_count(self):
+        Like.objects.add_like(self.member, self.stale)
+        self.stale.refresh_likes_count()
+        self.assertEqual(self.assertCountersKept().likes_count, 1)
+    
+    def test_remove_users(self):
+        Clip.objects.create(video=self.video, owner=self.member, duration=3.0)
+        VideoUsers.objects.remove_users_from_video(self.stale, self.member)
+        video = Video.objects.get(pk=self.video.pk)
+        self.assertEqual(video.next_clip_order, 3)
+        self.assertEqual(video.like_seq, 1)
+        self.assertEqual(video.clips_count, 2)
+        self.assertEqual(video.duration, 4.0)
+
+
+class RemovedUsersNotificationTests(TestCase):
+    """
+    Tests of the notifications sent when users are removed from a video
+    """
+    
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(
+            '+12025550100', 'password', is_active=True)
+        self.members = [
+            User.objects.create_user('+1202555011%d' % i, 'password',
+                                     is_active=True)
+            for i in range(4)]
+        self.video = Video.objects.create(owner=self.owner, title='video')
+        VideoUsers.objects.add_users_to_video(self.video, *self.members)
+    
+    def get_notifications(self, removed_users):
+        VideoUsers.objects.remove_users_from_video(self.video, *removed_users)
+        notifications = {}
+        for user_ids, message, extra in \
+                VideoUsers.get_removed_users_notifications(
+                    self.video, removed_users):
+            self.assertIsNone(message)
+            for user_id in user_ids:
+                notifications.setdefault(user_id, []).append(extra)
+        return notifications
+    
+    def test_single_push_per_member(self):
+        removed_users = self.members[2:]
+        phone_numbers = [user.phone_number.as_e164 for user in removed_users]
+        notifications = self.get_notifications(removed_users)
+        
+        for user in [self.owner] + self.members[:2]:
+            extras = notifications[user.id]
+            self.assertEqual(len(extras), 1)
+            self.assertEqual(
+                extras[0][settings.PUSH_ACTION_OBJECT_IDENTIFIERS_KEY],
+                phone_numbers)
+            self.assertNotIn(settings.PUSH_ACTION_OBJECT_IDENTIFIER_KEY,
+                             extras[0])
+        
+        # removed users only hear about their own removal
+        for user, phone_number in zip(removed_users, phone_numbers):
+            extras = notifications[user.id]
+            self.assertEqual(len(extras), 1)
+            self.assertEqual(
+                extras[0][settings.PUSH_ACTION_OBJECT_IDENTIFIER_KEY],
+                phone_number)
+    
+    def test_single_removed_user(self):
+        phone_number = self.members[0].phone_number.as_e164
+        notifications = self.get_notifications(self.members[:1])
+        for user in [self.owner] + self.members:
+            extras = notifications[user.id]
+            self.assertEqual(len(extras), 1)
+            self.assertEqual(
+                extras[0][settings.PUSH_ACTION_OBJECT_IDENTIFIER_KEY],
+                phone_number)
+            self.assertEqual(
+                extras[0][settings.PUSH_ACTION_TYPE_KEY],
+                settings.PUSH_ACTION_TYPE_REMOVED_USER)
+
+
+class VideoCacheTests(TestCase):
+    """
+    Tests of cached video lookups and their invalidation.
+    """
+    
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user('+12025550100', 'password')
+        self.video = Video.objects.create(owner=self.owner, title='video')
+    
+    def test_cached_lookup(self):
+        with self.assertNumQueries(1):
+            Video.objects.get_cached(self.video.hash_key)
+        with self.assertNumQueries(0):
+            video = Video.objects.get_cached(self.video.hash_key)
+        self.assertEqual(video.pk, self.video.pk)
+    
+    def test_missing_video(self):
+        with self.assertRaises(Video.DoesNotExist):
+            Video.objects.get_cached('missing')
+    
+    def test_invalidated_on_save(self):
+        Video.objects.get_cached(self.video.hash_key)
+        self.video.title = 'new title'
+        self.video.save()
+        video = Video.objects.get_cached(self.video.hash_key)
+        self.assertEqual(video.title, 'new title')
+    
+    def test_invalidated_on_clip_create(self):
+        Video.objects.get_cached(self.video.hash_key)
+        Clip.objects.create(video=self.video, owner=self.owner, duration=2.0)
+        video = Video.objects.get_cached(self.video.hash_key)
+        self.assertEqual(video.clips_count, 1)
+
+
+class LikeTests(TestCase):
+    """
+    Tests of recording and removing likes of a video.
+    """
+    
+    def setUp(self):
+        self.owner = User.objects.create_user('+12025550100', 'password')
+        self.member = User.objects.create_user('+12025550101', 'password')
+        self.video = Video.objects.create(owner=self.owner, title='video')
+    
+    def test_add_like_once(self):
+        self.assertTrue(Like.objects.add_like(self.member, self.video))
+        self.assertFalse(Like.objects.add_like(self.member, self.video))
+        self.assertEqual(self.video.likes.count(), 1)
+    
+    def test_remove_like(self):
+        Like.objects.add_like(self.member, self.video)
+        self.assertTrue(Like.objects.remove_like(self.member, self.video))
+        self.assertFalse(Like.objects.remove_like(self.member, self.video))
+        self.assertFalse(self.video.likes.exists())
+    
+    def test_refresh_likes_count(self):
+        Like.objects.add_like(self.owner, self.video)
+        Like.objects.add_like(self.member, self.video)
+        self.video.refresh_likes_count()
+        self.assertEqual(Video.objects.get(pk=self.video.pk).likes_count, 2)
+
+
+class UnreadCountsTests(TestCase):
+    """
+    Tests of video users' unread likes and clips counts, which are computed
+    from the video's sequence numbers.
+    """
+    
+    def setUp(self):
+        self.owner = User.objects.create_user('+12025550100', 'password')
+        self.member = User.objects.create_user('+12025550101', 'password')
+        self.video = Video.objects.create(owner=self.owner, title='video')
+        VideoUsers.objects.add_users_to_video(self.video, self.member)
+    
+    def get_video_user(self, user):
+        return VideoUsers.objects.select_related('video').get(
+            video=self.video, user=user)
+    
+    def test_like_unread_by_others(self):
+        activity_send(self.member, verb='like', object=self.video)
+        self.assertEqual(self.get_video_user(self.owner).new_likes_count, 1)
+        self.assertEqual(self.get_video_user(self.member).new_likes_count, 0)
+    
+    def test_clip_unread_by_all(self):
+        activity_send(self.member, verb='add', target=self.video,
+                      object=Clip.objects.create(
+                video=self.video, owner=self.member, duration=2.0))
+        self.assertEqual(self.get_video_user(self.owner).new_clips_count, 1)
+        self.assertEqual(self.get_video_user(self.member).new_clips_count, 1)
+    
+    def test_acknowledge(self):
+        activity_send(self.member, verb='like', object=self.video)
+        video_user = self.get_video_user(self.owner)
+        video_user.acknowledge()
+        video_user.save()
+        self.assertEqual(self.get_video_user(self.owner).new_likes_count, 0)
+    
+    def test_new_users_start_read(self):
+        activity_send(self.member, verb='like', object=self.video)
+        video = Video.objects.get(pk=self.video.pk)
+        user = User.objects.create_user('+12025550102', 'password')
+        VideoUsers.objects.add_users_to_video(video, user)
+        self.assertEqual(self.get_video_user(user).new_likes_count, 0)
+    
+    def test_single_row_writes(self):
+        # the like's activity and its group, the video's sequence number and
+        # reading it back, and the liker's acknowledgement, regardless of the
+        # number of video users
+        users = [User.objects.create_user('+1202555020%d' % i, 'password')
+                 for i in range(5)]
+        VideoUsers.objects.add_users_to_video(self.video, *users)
+        with self.assertNumQueries(6):
+            activity_send(self.member, verb='like', object=self.video)
+    
+    def test_like_endpoint(self):
+        # likes through the endpoint, which also refreshes the likes count
+        client = APIClient()
+        client.force_authenticate(user=self.member)
+        url = reverse('video-detail-like', 
+                      kwargs={'hash_key': self.video.hash_key})
+        client.put(url)
+        client.delete(url)
+        client.put(url)
+        
+        video = Video.objects.get(pk=self.video.pk)
+        self.assertEqual(video.like_seq, 2)
+        self.assertEqual(video.likes_count, 1)
+        self.assertEqual(self.get_video_user(self.owner).new_likes_count, 2)
+        self.assertEqual(self.get_video_user(self.member).new_likes_count, 0)
+
+
+class MembershipCacheTests(TestCase):
+    """
+    Tests of cached video memberships and users' video ids, and their
+    invalidation.
+    """
+    
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user('+12025550100', 'password')
+        self.member = User.objects.create_user('+12025550101', 'password')
+        self.video = Video.objects.create(owner=self.owner, title='video')
+        VideoUsers.objects.add_users_to_video(self.video, self.member)
+    
+    def get_membership(self):
+        return VideoUsers.objects.get_membership(self.video.hash_key)
+    
+    def test_cached_lookup(self):
+        with self.assertNumQueries(1):
+            membership = self.get_membership()
+        with self.assertNumQueries(0):
+            self.get_membership()
+        self.assertEqual(membership.video_id, self.video.id)
+        self.assertTrue(membership.is_member(self.owner.id))
+        self.assertTrue(membership.is_member(self.member.id))
+    
+    def test_missing_video(self):
+        with self.assertRaises(Video.DoesNotExist):
+            VideoUsers.objects.get_membership('missing')
+    
+    def test_invalidated_on_add_and_remove(self):
+        user = User.objects.create_user('+12025550102', 'password')
+        self.get_membership()
+        VideoUsers.objects.add_users_to_video(self.video, user)
+        self.assertTrue(self.get_membership().is_member(user.id))
+        
+        VideoUsers.objects.remove_users_from_video(self.video, user)
+        self.assertFalse(self.get_membership().is_member(user.id))
+    
+    def test_invalidated_on_create(self):
+        user = User.objects.create_user('+12025550102', 'password')
+        self.get_membership()
+        VideoUsers.objects.create(video=self.video, user=user)
+        self.assertTrue(self.get_membership().is_member(user.id))
+    
+    def test_invalidated_on_active_change(self):
+        self.assertIn(self.member.id, self.get_membership().active_member_ids())
+        self.member.is_active = False
+        self.member.save()
+        self.assertNotIn(self.member.id,
+                         self.get_membership().active_member_ids())
+    
+    def test_video_ids(self):
+        video = Video.objects.create(owner=self.owner, title='video 2')
+        self.assertEqual(VideoUsers.objects.get_video_ids(self.member),
+                         [self.video.id])
+        VideoUsers.objects.add_users_to_video(video, self.member)
+        self.assertEqual(
+            sorted(VideoUsers.objects.get_video_ids(self.member)),
+            sorted([self.video.id, video.id]))
+    
+    def test_invalidation_during_load(self):
+        # a membership loaded before an invalidation isn't served after it
+        user = User.objects.create_user('+12025550102', 'password')
+        def load():
+            membership = VideoMembership(self.video.id, self.owner.id, {})
+            VideoUsers.objects.add_users_to_video(self.video, user)
+            return membership
+        membership_cache.get_or_load(self.video.hash_key, load)
+        self.assertTrue(self.get_membership().is_member(user.id))
+
+
+class VideoLoaderTests(TestCase):
+    """
+    Tests of the request-scoped loading of videos and the request user's
+    relations to them.
+    """
+    
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user('+12025550100', 'password')
+        self.member = User.objects.create_user('+12025550101', 'password')
+        self.video = Video.objects.create(owner=self.owner, title='video')
+        VideoUsers.objects.add_users_to_video(self.video, self.member)
+    
+    def get_loader(self, user):
+        request = RequestFactory().get('/')
+        request.user = user
+        return get_loader(request)
+    
+    def test_shared_by_request(self):
+        request = RequestFactory().get('/')
+        request.user = self.member
+        self.assertIs(get_loader(request), get_loader(request))
+    
+    def test_video_user_loads_video(self):
+        loader = self.get_loader(self.member)
+        with self.assertNumQueries(1):
+            video_user = loader.get_video_user(self.video.hash_key)
+            video = loader.get_video(self.video.hash_key)
+        self.assertEqual(video_user.user_id, self.member.id)
+        self.assertIs(video_user.video, video)
+        with self.assertNumQueries(0):
+            loader.get_video_user(self.video.hash_key)
+    
+    def test_non_member_skips_query(self):
+        user = User.objects.create_user('+12025550102', 'password')
+        loader = self.get_loader(user)
+        loader.get_membership(self.video.hash_key)
+        with self.assertNumQueries(0):
+            self.assertIsNone(loader.get_video_user(self.video.hash_key))
+    
+    def test_missing_video(self):
+        loader = self.get_loader(self.member)
+        with self.assertNumQueries(1):
+            for _ in range(2):
+                with self.assertRaises(Video.DoesNotExist):
+                    loader.get_video('missing')
+    
+    def test_liked(self):
+        loader = self.get_loader(self.member)
+        Like.objects.add_like(self.member, self.video)
+        with self.assertNumQueries(1):
+            self.assertTrue(loader.get_liked(self.video))
+            self.assertTrue(loader.get_liked(self.video))
+
+
+@override_settings(PUSH_DRY_RUN=True, PUSH_COALESCE_WINDOW=30)
+class PendingNotificationTests(TestCase):
+    """
+    Tests of holding like and new clip notifications, merging them, and
+    sending them once they're due.
+    """
+    
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(
+            '+12025550100', 'password', full_name='Owner', is_active=True)
+        self.members = [
+            User.objects.create_user('+1202555011%d' % i, 'password',
+                                     full_name='Member %d' % i,
+                                     is_active=True)
+            for i in range(3)]
+        self.video = Video.objects.create(owner=self.owner, title='video')
+        VideoUsers.objects.add_users_to_video(self.video, *self.members)
+    
+    def flush(self):
+        return PendingNotification.objects.flush(
+            now=timezone.now() + timedelta(seconds=60))
+    
+    def test_likes_merged(self):
+        Clip.objects.create(video=self.video, owner=self.members[0])
+        PendingNotification.objects.all().delete()
+        for member in self.members[1:]:
+            Like.objects.add_like(member, self.video)
+            self.video.send_new_like_notification(member)
+        
+        notification = PendingNotification.objects.get(
+            user=self.members[0])
+        self.assertEqual(notification.count, 2)
+        self.assertTrue(notification.multiple_actors)
+        self.assertTrue(notification.loud)
+        self.assertFalse(PendingNotification.objects.get(
+                user=self.members[2]).loud)
+        
+        # the clip owner gets a loud push, and other users one silent push
+        # each
+        messages = {}
+        for user_ids, message, extra in self.flush():
+            for user_id in user_ids:
+                self.assertNotIn(user_id, messages)
+                messages[user_id] = message
+        self.assertEqual(messages, {
+                self.owner.id: None,
+                self.members[0].id: '"video" liked by 2 people',
+                self.members[1].id: None,
+                self.members[2].id: None})
+        self.assertFalse(PendingNotification.objects.exists())
+    
+    def test_likers_counted_once(self):
+        Clip.objects.create(video=self.video, owner=self.members[0])
+        PendingNotification.objects.all().delete()
+        # the second member unlikes and likes again
+        for member in (self.members[1], self.members[1], self.members[2]):
+            Like.objects.add_like(member, self.video)
+            self.video.send_new_like_notification(member)
+            Like.objects.remove_like(member, self.video)
+        
+        notification = PendingNotification.objects.get(
+            user=self.members[0])
+        self.assertEqual(notification.count, 3)
+        self.assertEqual(notification.get_actor_ids(),
+                         set([self.members[1].id, self.members[2].id]))
+        messages = dict((user_id, message)
+                        for user_ids, message, extra in self.flush()
+                        for user_id in user_ids)
+        self.assertEqual(messages[self.members[0].id],
+                         '"video" liked by 2 people')
+    
+    def test_single_liker(self):
+        Clip.objects.create(video=self.video, owner=self.members[0])
+        PendingNotification.objects.all().delete()
+        for _ in range(2):
+            Like.objects.add_like(self.members[1], self.video)
+            self.video.send_new_like_notification(self.members[1])
+            Like.objects.remove_like(self.members[1], self.video)
+        
+        messages = dict((user_id, message)
+                        for user_ids, message, extra in self.flush()
+                        for user_id in user_ids)
+        self.assertEqual(messages[self.members[0].id],
+                         'Member 1 liked "video"')
+    
+    def test_clips_merged(self):
+        clips = [Clip.objects.create(video=self.video, owner=self.owner)
+                 for _ in range(3)]
+        self.assertEqual(PendingNotification.objects.count(), 3)
+        
+        notifications = self.flush()
+        self.assertEqual(len(notifications), 1)
+        user_ids, message, extra = notifications[0]
+        self.assertEqual(sorted(user_ids),
+                         sorted(member.id for member in self.members))
+        self.assertEqual(message, 'Owner @ "video":\nAdded 3 clips')
+        self.assertEqual(extra[settings.PUSH_ACTION_OBJECT_IDENTIFIER_KEY],
+                         str(clips[-1].pk))
+    
+    def test_single_notification_unchanged(self):
+        clip = Clip.objects.create(video=self.video, owner=self.owner)
+        user_ids, message, extra = self.flush()[0]
+        self.assertEqual(message, 'Owner @ "video":\nAdded new clip')
+        self.assertEqual(extra[settings.PUSH_VIDEO_MESSAGE_KEY],
+                         'Added new clip')
+    
+    def test_held_until_due(self):
+        Clip.objects.create(video=self.video, owner=self.owner)
+        self.assertEqual(PendingNotification.objects.flush(), [])
+        self.assertEqual(PendingNotification.objects.count(), 3)
+    
+    def test_removed_users_dropped(self):
+        Clip.objects.create(video=self.video, owner=self.owner)
+        VideoUsers.objects.remove_users_from_video(
+            self.video, *self.members[1:])
+        user_ids, message, extra = self.flush()[0]
+        self.assertEqual(user_ids, [self.members[0].id])
+    
+    @override_settings(PUSH_COALESCE_WINDOW=0)
+    def test_sent_right_away_without_window(self):
+        Clip.objects.create(video=self.video, owner=self.owner)
+        self.assertFalse(PendingNotification.objects.exists())
+
+
+class HashKeyTests(TestCase):
+    """
+    Tests of hash key generation. The checkhashkeys command checks a million
+    keys; these check fewer to keep the test run quick.
+    """
+    
+    def test_keys_unique(self):
+        generator = HashKeyGenerator('test_hash_key_seq', block_size=100)
+        keys = generator.next_keys(1000)
+        self.assertEqual(len(set(keys)), 1000)
+        self.assertTrue(all(len(key) == 10 for key in keys))
+    
+    def test_check_command(self):
+        out = BytesIO()
+        call_command('checkhashkeys', count=10000, start=0, stdout=out)
+        self.assertIn('10000 unique hash keys', out.getvalue())
+    
+    def test_check_command_range(self):
+        with self.assertRaises(CommandError):
+            call_command('checkhashkeys', count=10, start=2 ** 40 - 5,
+                         stdout=BytesIO())
@@ -20,26 +20,32 @@ from rest_framework import (
     generics, status, permissions, parsers, renderers, exceptions)
 from rest_framework.response import Response
 
-from gravvy.apps.video.models import Video, Clip, VideoUsers
+from gravvy.apps.video.models import (
+    Video, Clip, VideoUsers, Like, video_cache)
 from gravvy.apps.video.serializers import (
     VideoSerializer, VideoCreationSerializer, VideoUserSerializer,
     VideoUsersCreationSerializer, ClipSerializer)
+from gravvy.apps.video.loaders import get_loader
 from gravvy.apps.video.permissions import (
     IsOwnerOrReadOnly, IsAssociatedUser, IsAssociatedUserOrReadOnly,
     IsOwnerOrUserDetailOwner, IsVideoOwnerOrClipOwnerOrReadOnly)
 from gravvy.apps.video.forms import UploadClipForm
 
-from gravvy.apps.account.models import User
+from gravvy.apps.account.models import User, RecentContact
 from gravvy.apps.account.serializers import UserPublicSerializer
 
 from gravvy.apps.activity import activity
 from gravvy.apps.activity.models import Activity
 
+from gravvy.apps.monitoring.metrics import (
+    ACTIVITY_SEND_SECONDS, CLIP_TRANSCODE_SECONDS)
+
 # Create your views here.
 
 # ------------------------------------------------------------------------------
 # Activity Helper Function
 # ------------------------------------------------------------------------------
+@ACTIVITY_SEND_SECONDS.time()
 def activity_send(user, verb=None, object=None, target=None):
     """
     wrapper method to activity.send() which updates VideoUser objects with
@@ -56,20 +62,20 @@ def activity_send(user, verb=None, object=None, target=None):
             video = object
     
     if isinstance(video, Video):
-        # get video's users
-        video_users = VideoUsers.objects.filter(video_id=video.id)
-        
-        # update their stats and send push notifications
+        # bump the video's sequence numbers, which makes the like or clip 
+        # unread for all video users
         if verb == 'like':
-            # get video's other users
-            video_users = video_users.exclude(user_id = user.id)
-            video_users.update(new_likes_count = F('new_likes_count') + 1)
+            video.increment_seq('like_seq')
+            # the liking user has seen their own like
+            VideoUsers.objects.filter(
+                video_id=video.id, user_id=user.id).update(
+                acked_like_seq=F('acked_like_seq') + 1)
             
         elif verb == 'add':
-            video_users.update(new_clips_count = F('new_clips_count') + 1)
+            video.increment_seq('clip_seq')
         
         elif verb == 'invite':
-            pass
+            RecentContact.objects.record_invites(user, [object])
     
     
 # ------------------------------------------------------------------------------
@@ -255,6 +261,25 @@ class VideoDetail(generics.RetrieveUpdateDestroyAPIView):
     # lookup by 'hash_key' not the 'pk' 
     lookup_field = 'hash_key'
     lookup_url_kwarg = 'hash_key'
+    
+    def get_object(self):
+        """
+        Get the video through the request's loader. The request user's
+        association with the video, which the serializer needs, is loaded
+        along with it.
+        """
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        hash_key = self.kwargs[lookup_url_kwarg]
+        loader = get_loader(self.request)
+        loader.get_video_user(hash_key)
+        try:
+            video = loader.get_video(hash_key)
+        except Video.DoesNotExist:
+            raise Http404
+        
+        # May raise a permission denied
+        self.check_object_permissions(self.request, video)
+        return video
 
 
 class VideoDetailLike(generics.GenericAPIView):
@@ -299,8 +324,7 @@ class VideoDetailLike(generics.GenericAPIView):
     
     def get(self, request, *args, **kwargs):
         video = self.get_object()
-        already_liked = self.get_activity_queryset(
-            request.user, video).exists()        
+        already_liked = get_loader(request).get_liked(video)
         status_code = (status.HTTP_204_NO_CONTENT if 
                        already_liked else status.HTTP_404_NOT_FOUND)
         return Response(status=status_code)
@@ -313,8 +337,7 @@ class VideoDetailLike(generics.GenericAPIView):
     
     def update(self, request, *args, **kwargs):
         video = self.get_object()
-        already_liked = self.get_activity_queryset(request.user, video).exists()
-        if not already_liked:
+        if Like.objects.add_like(request.user, video):
             activity_send(request.user, verb='like', object=video)
             video.refresh_likes_count()
             video.send_new_like_notification(request.user)
@@ -322,8 +345,9 @@ class VideoDetailLike(generics.GenericAPIView):
 
     def delete(self, request, *args, **kwargs):
         video = self.get_object()
-        self.get_activity_queryset(request.user, video).delete()
-        video.refresh_likes_count()
+        if Like.objects.remove_like(request.user, video):
+            self.get_activity_queryset(request.user, video).delete()
+            video.refresh_likes_count()
         return Response(status=status.HTTP_204_NO_CONTENT)
     
     def get_activity_queryset(self, user, video):
@@ -376,19 +400,21 @@ class VideoDetailPlay(generics.GenericAPIView):
         Video.objects.filter(**filter_kwargs).update(
             plays_count=(F('plays_count') + 1), 
             updated_at=timezone.now())
+        video_cache.invalidate(self.kwargs[lookup_url_kwarg])
         
-        video = get_object_or_404(Video, **filter_kwargs)
+        # update user's interaction status with the video. The user's
+        # association is loaded along with the video.
+        loader = get_loader(request)
+        video_user = loader.get_video_user(self.kwargs[lookup_url_kwarg])
+        if (video_user is not None and 
+            video_user.status <= VideoUsers.STATUS_INVITED):
+            video_user.status = VideoUsers.STATUS_VIEWED
+            video_user.save()
         
-        # update user's interaction status with the video
-        if request.user.is_authenticated():
-            try:
-                video_user = VideoUsers.objects.get(
-                    user_id=request.user.id, video_id=video.id)
-                if video_user.status <= VideoUsers.STATUS_INVITED:
-                    video_user.status = VideoUsers.STATUS_VIEWED
-                    video_user.save()
-            except VideoUsers.DoesNotExist:
-                pass
+        try:
+            video = loader.get_video(self.kwargs[lookup_url_kwarg])
+        except Video.DoesNotExist:
+            raise Http404
             
         return Response({'plays_count': video.plays_count}, 
                         status=status.HTTP_200_OK)
@@ -437,20 +463,17 @@ class VideoDetailClearNotifications(generics.GenericAPIView):
     
     def update(self, request, *args, **kwargs):
         lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
-        filter_kwargs = {self.lookup_field: self.kwargs[lookup_url_kwarg]}
-        video = get_object_or_404(Video, **filter_kwargs)
-        
-        try:
-            video_user = VideoUsers.objects.get(
-                user_id=request.user.id, video_id=video.id)
-            video_user.new_likes_count = 0
-            video_user.new_clips_count = 0
-            if video_user.status <= VideoUsers.STATUS_INVITED:
-                video_user.status = VideoUsers.STATUS_VIEWED
-            video_user.save()
-        except VideoUsers.DoesNotExist:
+        # the user's association is loaded along with the video
+        video_user = get_loader(request).get_video_user(
+            self.kwargs[lookup_url_kwarg])
+        if video_user is None:
             raise Http404
         
+        video_user.acknowledge(video_user.video)
+        if video_user.status <= VideoUsers.STATUS_INVITED:
+            video_user.status = VideoUsers.STATUS_VIEWED
+        video_user.save()
+        
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -537,8 +560,10 @@ class VideoClipList(generics.ListCreateAPIView):
         lookup = self.kwargs.get(lookup_url_kwarg, None)
                         
         if lookup is not None:
-            filter_kwargs = {self.lookup_field: lookup}
-            video = get_object_or_404(Video, **filter_kwargs)
+            try:
+                video = get_loader(self.request).get_video(lookup)
+            except Video.DoesNotExist:
+                raise Http404
             clip = serializer.save(video=video, owner=self.request.user) 
                         
             # register this new activity
@@ -794,28 +819,44 @@ class VideoUserDetail(generics.GenericAPIView):
     lookup_url_kwarg = 'hash_key'
     
     def get(self, request, hash_key, phone_number, format=None):
-        video = get_object_or_404(Video, hash_key=hash_key)
-        user = get_object_or_404(User, phone_number=phone_number)
+        try:
+            membership = get_loader(request).get_membership(hash_key)
+            user = User.objects.get_cached_by_number(phone_number)
+        except (Video.DoesNotExist, User.DoesNotExist):
+            raise Http404
         
+        # the membership says whether there's an association to get
+        if user.id not in membership.members:
+            return Response({})
         try:
             association = VideoUsers.objects.select_related(
-                'user', 'video').get(user=user, video=video)
+                'user', 'video').get(user=user, video_id=membership.video_id)
             serializer = self.get_serializer(association)
             return Response(serializer.data)
         except VideoUsers.DoesNotExist:
             return Response({})
     
     def delete(self, request,  hash_key, phone_number, format=None):
-        video = get_object_or_404(Video, hash_key=hash_key)
+        loader = get_loader(request)
+        try:
+            membership = loader.get_membership(hash_key)
+        except Video.DoesNotExist:
+            raise Http404
         user = get_object_or_404(User, phone_number=phone_number)
         
         # if this is the current owner then can't delete the association
-        if user.id == video.owner_id:
+        if user.id == membership.owner_id:
             raise exceptions.PermissionDenied(
                 "Cannot remove video owner's association with video")
         
-        association = get_object_or_404(VideoUsers, user=user, video=video)
-        association.delete() 
+        if user.id not in membership.members:
+            raise Http404
+        
+        # this is what deleting the association does, but without having to
+        # load the association first
+        video = loader.get_video(hash_key)
+        if not VideoUsers.objects.remove_users_from_video(video, user):
+            raise Http404
         return Response(status=status.HTTP_204_NO_CONTENT)
     
     def post(self, request,  hash_key, phone_number, format=None):
@@ -825,7 +866,10 @@ class VideoUserDetail(generics.GenericAPIView):
         """
         Create/Update VideoUsers association instance
         """
-        video = get_object_or_404(Video, hash_key=hash_key)
+        try:
+            video = get_loader(request).get_video(hash_key)
+        except Video.DoesNotExist:
+            raise Http404
                 
         try:
             user = User.objects.get_user_by_number(phone_number)
@@ -900,13 +944,14 @@ class VideoLikeList(generics.ListCreateAPIView):
         by the lookup parameters of the view.
         """
         lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
-        filter_kwargs = {self.lookup_field: self.kwargs[lookup_url_kwarg]}
-        video = generics.get_object_or_404(Video, **filter_kwargs)
-        video_content_type = ContentType.objects.get_for_model(video)
+        try:
+            # IsAssociatedUser has already loaded the video's membership
+            membership = get_loader(self.request).get_membership(
+                self.kwargs[lookup_url_kwarg])
+        except Video.DoesNotExist:
+            raise Http404
         
-        return User.objects.filter(
-            activities__verb='like', activities__object_id=video.id,
-            activities__object_content_type=video_content_type)
+        return User.objects.filter(likes__video_id=membership.video_id)
     
 
 # -----------------------------------------------------------------------------
@@ -1004,9 +1049,10 @@ def _videoclipupload(request, hash_key):
                 ffmpeg_path = '/home/nceruchalu/bin/'
             
             # Generate the output files
-            subprocess.check_call(
-                [script_path, input_video, output_video.name, 
-                 output_image.name, output_duration.name, ffmpeg_path])
+            with CLIP_TRANSCODE_SECONDS.time():
+                subprocess.check_call(
+                    [script_path, input_video, output_video.name, 
+                     output_image.name, output_duration.name, ffmpeg_path])
             
             # Get clip duration from the results
             clip_duration = map(float, output_duration)[0]
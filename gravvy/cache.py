@@ -0,0 +1,400 @@
+"""
+Two-tier caching: a small process-local LRU in front of a cache shared by all
+worker processes, and namespaced keys for caching hot objects in it.
+
+The local tier saves a network round trip to the shared cache for the hottest
+keys. It only keeps entries for a few seconds (the LOCAL_TIMEOUT option), as
+deleting a key only removes it from the local tier of the process doing the
+delete. Other processes may serve the old value until their local entry
+expires.
+
+Table Of Contents:
+    LocalTier: process-local LRU tier of a TieredCache
+    TieredCache: cache backend with a local LRU tier in front of a shared cache
+    CacheNamespace: namespaced, versioned keys of cached objects
+    VersionedCacheNamespace: cache namespace invalidated by bumping key versions
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+from django.utils.six.moves import cPickle as pickle
+
+from gravvy.apps.monitoring.metrics import CACHE_REQUESTS
+
+# local tiers of this process, by the location of their TieredCache. Django
+# creates cache instances per thread, so the tiers are kept here for all
+# threads to share.
+_local_tiers = {}
+_local_tiers_lock = threading.Lock()
+
+
+class LocalTier(object):
+    """
+    Thread-safe LRU of pickled values with expiry times. Values are pickled so
+    callers never share (and mutate) the same cached object.
+    """
+
+    def __init__(self, max_entries):
+        """
+        Args:
+            max_entries: max number of entries. Set to 0 to disable the tier.
+        """
+        self.max_entries = max_entries
+        # mapping of keys to (pickled value, expiry time) tuples in least to
+        # most recently used order.
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Get a value, marking it as the most recently used.
+
+        Returns:
+            (found, value) tuple
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[1] <= time.time():
+                return False, None
+            self._entries[key] = entry
+        return True, pickle.loads(entry[0])
+
+    def has_key(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+        return entry is not None and entry[1] > time.time()
+
+    def set(self, key, value, timeout):
+        """
+        Put a value in the tier, evicting the least recently used values if
+        the tier is full.
+
+        Args:
+            key: key of the value
+            value: value to cache
+            timeout: number of seconds to keep the value for
+        """
+        if timeout <= 0 or self.max_entries <= 0:
+            self.delete(key)
+            return
+
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (pickled, time.time() + timeout)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class TieredCache(BaseCache):
+    """
+    Cache backend with a process-local LRU tier in front of a shared cache.
+
+    Reads are served from the local tier when possible, and values read from
+    the shared cache are kept in the local tier. Writes and deletes go to both
+    tiers. Hits and misses of each tier are counted in the CACHE_REQUESTS
+    metric.
+
+    The LOCATION of the cache names its local tier, which is shared by all
+    threads of the process.
+
+    Options:
+        SHARED_CACHE: alias of the shared cache in the CACHES setting
+        LOCAL_MAX_ENTRIES: max number of entries in the local tier
+        LOCAL_TIMEOUT: max number of seconds entries stay in the local tier
+    """
+
+    def __init__(self, location, params):
+        super(TieredCache, self).__init__(params)
+        options = params.get('OPTIONS', {})
+        self._shared_alias = options.get('SHARED_CACHE', 'shared')
+        self._local_timeout = float(options.get('LOCAL_TIMEOUT', 5))
+        with _local_tiers_lock:
+            if location not in _local_tiers:
+                _local_tiers[location] = LocalTier(
+                    int(options.get('LOCAL_MAX_ENTRIES', 1000)))
+            self._local = _local_tiers[location]
+
+    @property
+    def shared(self):
+        """
+        The shared cache. Cache instances are per thread so this is looked up
+        on every use.
+        """
+        return caches[self._shared_alias]
+
+    def _local_get(self, key):
+        """
+        Get a value from the local tier, counting the hit or miss
+
+        Returns:
+            (found, value) tuple
+        """
+        found, value = self._local.get(key)
+        CACHE_REQUESTS.labels('local', 'hit' if found else 'miss').inc()
+        return found, value
+
+    def _local_set(self, key, value, timeout=DEFAULT_TIMEOUT):
+        """
+        Put a value in the local tier for no longer than the LOCAL_TIMEOUT
+        """
+        timeout = self.get_backend_timeout(timeout)
+        if timeout is None or timeout > self._local_timeout:
+            timeout = self._local_timeout
+        self._local.set(key, value, timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        local_key = self.make_key(key, version=version)
+        added = self.shared.add(key, value, timeout=timeout, version=version)
+        if added:
+            self._local_set(local_key, value, timeout)
+        return added
+
+    def get(self, key, default=None, version=None):
+        local_key = self.make_key(key, version=version)
+        found, value = self._local_get(local_key)
+        if found:
+            return value
+
+        # a sentinel tells cached None values apart from missing keys
+        missing = object()
+        value = self.shared.get(key, missing, version=version)
+        if value is missing:
+            CACHE_REQUESTS.labels('shared', 'miss').inc()
+            return default
+        CACHE_REQUESTS.labels('shared', 'hit').inc()
+        self._local_set(local_key, value)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout=timeout, version=version)
+        self._local_set(self.make_key(key, version=version), value, timeout)
+
+    def delete(self, key, version=None):
+        self._local.delete(self.make_key(key, version=version))
+        self.shared.delete(key, version=version)
+
+    def get_many(self, keys, version=None):
+        values = {}
+        shared_keys = []
+        for key in keys:
+            found, value = self._local_get(self.make_key(key, version=version))
+            if found:
+                values[key] = value
+            else:
+                shared_keys.append(key)
+
+        if shared_keys:
+            shared_values = self.shared.get_many(shared_keys, version=version)
+            for key in shared_keys:
+                if key in shared_values:
+                    CACHE_REQUESTS.labels('shared', 'hit').inc()
+                    values[key] = shared_values[key]
+                    self._local_set(self.make_key(key, version=version),
+                                    shared_values[key])
+                else:
+                    CACHE_REQUESTS.labels('shared', 'miss').inc()
+        return values
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set_many(data, timeout=timeout, version=version)
+        for key, value in data.items():
+            self._local_set(self.make_key(key, version=version), value,
+                            timeout)
+
+    def delete_many(self, keys, version=None):
+        for key in keys:
+            self._local.delete(self.make_key(key, version=version))
+        self.shared.delete_many(keys, version=version)
+
+    def has_key(self, key, version=None):
+        if self._local.has_key(self.make_key(key, version=version)):
+            return True
+        return self.shared.has_key(key, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        # counters live in the shared cache only, so all processes see them
+        self._local.delete(self.make_key(key, version=version))
+        return self.shared.incr(key, delta, version=version)
+
+    def clear(self):
+        self._local.clear()
+        self.shared.clear()
+
+    def clear_local(self):
+        """
+        Empty the local tier of this process
+        """
+        self._local.clear()
+
+    def close(self, **kwargs):
+        self.shared.close(**kwargs)
+
+    def stats(self):
+        """
+        Get the local tier statistics
+
+        Returns:
+            dictionary of the local tier `size` and `maxsize`
+        """
+        return {'size': len(self._local),
+                'maxsize': self._local.max_entries}
+
+
+class CacheNamespace(object):
+    """
+    Keys of a family of cached objects, such as videos by hash key, in the
+    default cache or another configured cache.
+
+    Keys are prefixed by the namespace's name, and carry its version: bumping
+    the version of a namespace when what's cached under it changes (e.g. a new
+    model field) makes the old entries unreachable.
+    """
+
+    def __init__(self, name, version=1, timeout=None, cache_alias='default'):
+        """
+        Args:
+            name: name of the namespace, used as a prefix of its keys
+            version: version of the namespace
+            timeout: number of seconds entries are cached for. Defaults to the
+                timeout of the cache.
+            cache_alias: alias of the cache in the CACHES setting. Objects
+                that must not be served after they're invalidated, even for a
+                few seconds, belong in the shared cache rather than the
+                default cache and its local tier.
+        """
+        self.name = name
+        self.version = version
+        self.timeout = DEFAULT_TIMEOUT if timeout is None else timeout
+        self.cache_alias = cache_alias
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def make_key(self, key):
+        """
+        Get the cache key of a key in the namespace
+        """
+        return '%s:%s' % (self.name, key)
+
+    def get(self, key):
+        """
+        Get a cached object
+
+        Returns:
+            the cached object or None if there isn't one
+        """
+        return self.cache.get(self.make_key(key), version=self.version)
+
+    def set(self, key, value):
+        """
+        Cache an object
+        """
+        self.cache.set(self.make_key(key), value, timeout=self.timeout,
+                       version=self.version)
+
+    def get_or_load(self, key, loader):
+        """
+        Get a cached object, loading and caching it if it isn't cached.
+
+        Args:
+            key: key of the object in the namespace
+            loader: callable taking no arguments that loads the object. If this
+                raises an exception nothing is cached.
+
+        Returns:
+            the object
+        """
+        value = self.get(key)
+        if value is None:
+            value = loader()
+            self.set(key, value)
+        return value
+
+    def invalidate(self, *keys):
+        """
+        Remove objects from the cache
+        """
+        self.cache.delete_many([self.make_key(key) for key in keys],
+                               version=self.version)
+
+
+class VersionedCacheNamespace(CacheNamespace):
+    """
+    Cache namespace where each key has its own version, kept in the cache, and
+    objects are invalidated by bumping the version of their key.
+
+    Deleting a cached object races with loading it: a request that read the
+    database just before a change can cache what it read just after the
+    change deleted the cached object, and the stale object is then served
+    until it expires. Here a loader caches what it loaded under the key
+    version it started with, which is never read again once the version has
+    been bumped. This costs an extra cache lookup, of the key version, on
+    every read.
+    """
+
+    def version_key(self, key):
+        """
+        Get the cache key of the version of a key in the namespace
+        """
+        return '%s:version:%s' % (self.name, key)
+
+    def get_key_version(self, key):
+        """
+        Get the current version of a key, starting it off if it has none.
+        Versions start at the current time in milliseconds, so a key whose
+        version was evicted from the cache doesn't reuse its old versions.
+        """
+        version_key = self.version_key(key)
+        key_version = self.cache.get(version_key, version=self.version)
+        if key_version is None:
+            self.cache.add(version_key, int(time.time() * 1000),
+                           timeout=None, version=self.version)
+            key_version = self.cache.get(version_key, version=self.version)
+        return key_version
+
+    def make_key(self, key, key_version=None):
+        """
+        Get the cache key of a version of a key in the namespace. Defaults
+        to the current version of the key.
+        """
+        if key_version is None:
+            key_version = self.get_key_version(key)
+        return '%s:%s:%s' % (self.name, key, key_version)
+
+    def get_or_load(self, key, loader):
+        key_version = self.get_key_version(key)
+        cache_key = self.make_key(key, key_version)
+        value = self.cache.get(cache_key, version=self.version)
+        if value is None:
+            value = loader()
+            self.cache.set(cache_key, value, timeout=self.timeout,
+                           version=self.version)
+        return value
+
+    def invalidate(self, *keys):
+        """
+        Bump the versions of keys, leaving their cached objects to expire
+        """
+        for key in keys:
+            try:
+                self.cache.incr(self.version_key(key), version=self.version)
+            except ValueError:
+                # the key has no version, so it has no cached object either
+                pass
@@ -4,7 +4,7 @@ from django.utils import six
 from django.core.exceptions import ValidationError
 
 # imports from containing package: phonenumber_field
-from phonenumber import PhoneNumber
+from phonenumber import PhoneNumber, LazyPhoneNumber
 from validators import validate_international_phonenumber
 import formfields
 
@@ -47,16 +47,21 @@ class PhoneNumberField(models.Field):
         and assigns a database value to our custom field attribute, we convert 
         that value into the appropriate Python object.
         
+        Phone numbers are validated before being saved and stored in their
+        E.164 representation, so the loaded value doesn't need to be parsed
+        and validated again. A LazyPhoneNumber defers that work till it's 
+        actually needed.
+        
         Args:
             value: a string representation of a phone number since this field
                 uses CharField as its internal type
     
         Returns:
-            A PhoneNumber class instance
+            A LazyPhoneNumber class instance
         """
-        if value is None:
-            return value
-        return self.to_python(value)
+        if value is None or value == '':
+            return self.to_python(value)
+        return LazyPhoneNumber(value)
     
     def to_python(self, value):
         """
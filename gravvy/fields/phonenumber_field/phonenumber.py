@@ -4,9 +4,18 @@ This is the Python object we want to store in a model's attribute of type
 PhoneNumberField.
 
 This class will be returned in PhoneNumberField's to_python method.
+
+Table Of Contents:
+    PhoneNumber: python representation of a PhoneNumberField value
+    LazyPhoneNumber: lightweight, lazily parsed version of PhoneNumber
+    ParseCache: thread-safe LRU cache of phone number parse results
+    parse_phone_number: get E.164 representation and region of a phone number
+    normalize_phone_number: get E.164 representation of a phone number string
 """
 
 import sys
+import threading
+from collections import OrderedDict
 
 from django.core import validators
 from django.conf import settings
@@ -15,6 +24,8 @@ import phonenumbers
 from phonenumbers.phonenumberutil import (NumberParseException,
     region_code_for_number)
 
+from gravvy.apps.monitoring.metrics import PHONENUMBER_PARSE_CACHE_REQUESTS
+
 # Snippet from the `six` library to help with Python3 compatibility
 if sys.version_info[0] == 3:
     string_types = str
@@ -77,21 +88,23 @@ class PhoneNumber(phonenumbers.phonenumber.PhoneNumber):
                 * invalid data
     
         Returns:
-            A PhoneNumber class instance
+            A PhoneNumber or LazyPhoneNumber class instance
         """
         if (not value) or (value in validators.EMPTY_VALUES):
             # phone number not provided
             phone_number_obj = None
             
         elif isinstance(value, string_types):
-            # argument is possibly the expected string format
-            try:
-                phone_number_obj = cls.from_string(phone_number=value)
-            except NumberParseException:
+            # argument is possibly the expected string format. The same
+            # numbers get parsed over and over so use the cached parse results
+            phone_number_e164, region_code = parse_phone_number(value)
+            if phone_number_e164:
+                phone_number_obj = LazyPhoneNumber(phone_number_e164)
+            else:
                 # the string provided is not a valid PhoneNumber.
-                phone_number_obj = cls(raw_input=value)
+                phone_number_obj = LazyPhoneNumber(value)
         
-        elif isinstance(value, PhoneNumber):
+        elif isinstance(value, (PhoneNumber, LazyPhoneNumber)):
             # argument is already a python object
             phone_number_obj = value
             
@@ -152,7 +165,7 @@ class PhoneNumber(phonenumbers.phonenumber.PhoneNumber):
         """
         Phone numbers are equal if E164 representations are equivalent
         """
-        if type(other) == PhoneNumber:
+        if type(other) in (PhoneNumber, LazyPhoneNumber):
             return self.as_e164 == other.as_e164
         else:
             return False
@@ -163,3 +176,281 @@ class PhoneNumber(phonenumbers.phonenumber.PhoneNumber):
         """
         return not self.__eq__(other)
 
+
+
+
+class LazyPhoneNumber(object):
+    """
+    A lightweight stand-in for PhoneNumber used for phone numbers loaded from 
+    the database, which are already stored in E.164 format, and for parsed
+    phone numbers.
+    
+    Loading and serializing users mostly needs the E.164 representation, so
+    this keeps the E.164 string as is and only parses it into a PhoneNumber 
+    when other phone number data is needed. The validity and region code of 
+    the phone number come from the parse cache and are memoized.
+    
+    It supports the same interface as PhoneNumber, with any other PhoneNumber
+    attributes (such as `country_code`) read off the parsed PhoneNumber.
+    """
+    __slots__ = ('_e164', '_phone_number', '_valid', '_region_code')
+    
+    def __init__(self, e164):
+        """
+        Args:
+            e164: E.164 string representation of the phone number
+        """
+        self._e164 = e164
+        self._phone_number = None
+        self._valid = None
+        self._region_code = None
+    
+    def __getstate__(self):
+        return self._e164
+    
+    def __setstate__(self, state):
+        self.__init__(state)
+        
+    def get_phone_number(self):
+        """
+        Get the PhoneNumber object represented by this object, parsing it on 
+        first access.
+        
+        Returns:
+            A PhoneNumber class instance
+        """
+        if self._phone_number is None:
+            try:
+                self._phone_number = PhoneNumber.from_string(self._e164)
+            except NumberParseException:
+                # the string isn't a valid PhoneNumber.
+                self._phone_number = PhoneNumber(raw_input=self._e164)
+        return self._phone_number
+    
+    def __getattr__(self, name):
+        """
+        Read any other attributes off the parsed PhoneNumber. This is only
+        called for attributes that aren't found on this object.
+        """
+        if name.startswith('__'):
+            # don't parse the phone number for special method lookups, such
+            # as those made when copying or pickling.
+            raise AttributeError(name)
+        return getattr(self.get_phone_number(), name)
+    
+    def __unicode__(self):
+        """
+        Generate E164 representation of phone number or raw input if it's
+        invalid.
+        """
+        return self.as_e164
+    
+    def __str__(self):
+        return self.as_e164.encode('utf-8')
+    
+    def __repr__(self):
+        return 'LazyPhoneNumber(%r)' % self._e164
+    
+    def is_valid(self):
+        """
+        Tests whether the phone number matches a valid pattern.
+        
+        Returns:
+            Boolean that indicates whether the number is of a valid pattern.
+        """
+        if self._valid is None:
+            phone_number_e164, self._region_code = parse_phone_number(
+                self._e164)
+            self._valid = phone_number_e164 is not None
+        return self._valid
+    
+    @property
+    def as_e164(self):
+        """
+        Generate E164 representation of phone number or raw input if it's
+        invalid. Both of these are the string this object was created with.
+        """
+        return self._e164
+    
+    @property
+    def region_code(self):
+        """
+        Generate region code of phone number or None if it's invalid.
+        """
+        # region code is set when validity is determined
+        self.is_valid()
+        return self._region_code
+    
+    def __len__(self):
+        """
+        Length of the object is the number of chars in its E164 representation
+        """
+        return len(self._e164)
+    
+    def __eq__(self, other):
+        """
+        Phone numbers are equal if E164 representations are equivalent
+        """
+        if type(other) in (PhoneNumber, LazyPhoneNumber):
+            return self.as_e164 == other.as_e164
+        else:
+            return False
+        
+    def __ne__(self, other):
+        """
+        Phone numbers are not equal if E164 represenations are not equivalent
+        """
+        return not self.__eq__(other)
+    
+    def __hash__(self):
+        return hash(self._e164)
+
+
+class ParseCache(object):
+    """
+    Bounded, thread-safe LRU cache of phone number parse results, keyed on the
+    phone number string and region it was parsed with. Parsing phone numbers 
+    with libphonenumber is slow, and the same numbers get parsed repeatedly:
+    on each request of authenticated users, each time a contact is invited, 
+    each time a user is looked up.
+    
+    Results of invalid phone numbers are cached too so bad input doesn't 
+    get parsed over and over either.
+    
+    The cache size is set with the PHONENUMBER_PARSE_CACHE_SIZE setting. A
+    size of 0 disables caching. Hits and misses are counted in the 
+    PHONENUMBER_PARSE_CACHE_REQUESTS metric, and this process's counts are 
+    available via `stats()`.
+    """
+    
+    def __init__(self):
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    @property
+    def maxsize(self):
+        return getattr(settings, 'PHONENUMBER_PARSE_CACHE_SIZE', 10000)
+    
+    def get(self, key):
+        """
+        Get a cached parse result, marking it as the most recently used.
+        
+        Args:
+            key: (phone number string, region) tuple
+        
+        Returns:
+            the cached parse result or None if there isn't one
+        """
+        with self._lock:
+            try:
+                value = self._cache.pop(key)
+            except KeyError:
+                self.misses += 1
+                PHONENUMBER_PARSE_CACHE_REQUESTS.labels('miss').inc()
+                return None
+            self._cache[key] = value
+            self.hits += 1
+            PHONENUMBER_PARSE_CACHE_REQUESTS.labels('hit').inc()
+            return value
+    
+    def set(self, key, value):
+        """
+        Cache a parse result, evicting the least recently used results if the
+        cache is full.
+        
+        Args:
+            key: (phone number string, region) tuple
+            value: parse result
+        """
+        maxsize = self.maxsize
+        if maxsize <= 0:
+            return
+        
+        with self._lock:
+            self._cache[key] = value
+            while len(self._cache) > maxsize:
+                self._cache.popitem(last=False)
+    
+    def clear(self):
+        """
+        Empty the cache and reset its hit and miss counts
+        """
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
+    
+    def stats(self):
+        """
+        Get the cache statistics
+        
+        Returns:
+            dictionary of the cache `hits`, `misses`, `size` and `maxsize`
+        """
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'size': len(self._cache),
+                    'maxsize': self.maxsize}
+
+
+# process-wide cache of phone number parse results
+parse_cache = ParseCache()
+
+
+def parse_phone_number(phone_number, region=None):
+    """
+    Parse, validate and format a phone number string. Results are cached in
+    `parse_cache`.
+    
+    Args:
+        phone_number: The number that we are attempting to parse. This can
+            contain formatting such as +, (, ) and -.
+        region: The region we are expecting the number to be from. This is
+            only used if the number being parsed is not written in
+            international format.
+    
+    Returns:
+        (E.164 representation, region code) tuple of the phone number, or
+        (None, None) if the phone number isn't valid
+    """
+    key = (phone_number, region)
+    result = parse_cache.get(key)
+    if result is not None:
+        return result
+    
+    result = (None, None)
+    try:
+        phone_number_obj = phonenumbers.parse(number=phone_number, 
+                                              region=region)
+    except NumberParseException:
+        pass
+    else:
+        if phonenumbers.is_valid_number(phone_number_obj):
+            result = (phonenumbers.format_number(
+                    phone_number_obj, phonenumbers.PhoneNumberFormat.E164),
+                      region_code_for_number(phone_number_obj))
+    
+    parse_cache.set(key, result)
+    return result
+
+
+def normalize_phone_number(phone_number, region=None):
+    """
+    Get the E.164 representation of a phone number string such as one from a
+    user's address book. This is cheaper than going through PhoneNumber as it
+    doesn't keep the raw input and the parse results are cached.
+    
+    Args:
+        phone_number: The number that we are attempting to normalize. This can
+            contain formatting such as +, (, ) and -.
+        region: The region we are expecting the number to be from. This is
+            only used if the number being parsed is not written in
+            international format.
+    
+    Returns:
+        (str) E.164 format phone number or None if the phone number isn't valid
+    """
+    return parse_phone_number(phone_number, region)[0]
@@ -0,0 +1,194 @@
+import copy
+import pickle
+
+from django.test import SimpleTestCase
+from django.test.utils import override_settings
+from prometheus_client import REGISTRY
+
+from gravvy.fields.phonenumber_field.phonenumber import (
+    PhoneNumber, LazyPhoneNumber, ParseCache, parse_cache, parse_phone_number,
+    normalize_phone_number)
+
+# Create your tests here.
+
+PHONE_NUMBER = '+13105550100'
+
+
+class LazyPhoneNumberTests(SimpleTestCase):
+    """
+    Tests of the LazyPhoneNumber value type that phone numbers are loaded from
+    the database as
+    """
+
+    def setUp(self):
+        parse_cache.clear()
+
+    def test_equality(self):
+        phone_number = LazyPhoneNumber(PHONE_NUMBER)
+        self.assertEqual(phone_number, LazyPhoneNumber(PHONE_NUMBER))
+        self.assertEqual(phone_number, PhoneNumber.from_string(PHONE_NUMBER))
+        self.assertEqual(PhoneNumber.from_string(PHONE_NUMBER), phone_number)
+        self.assertNotEqual(phone_number, LazyPhoneNumber('+13105550101'))
+        # like PhoneNumber, it doesn't compare equal to strings
+        self.assertNotEqual(phone_number, PHONE_NUMBER)
+        self.assertNotEqual(phone_number, None)
+
+    def test_hashing(self):
+        phone_numbers = set([LazyPhoneNumber(PHONE_NUMBER),
+                             LazyPhoneNumber(PHONE_NUMBER)])
+        self.assertEqual(len(phone_numbers), 1)
+        self.assertIn(LazyPhoneNumber(PHONE_NUMBER), phone_numbers)
+        self.assertNotIn(PHONE_NUMBER, phone_numbers)
+
+    def test_pickle(self):
+        phone_number = LazyPhoneNumber(PHONE_NUMBER)
+        # parse it first: only the E.164 string should get pickled
+        self.assertEqual(phone_number.country_code, 1)
+        self.assertEqual(phone_number.__getstate__(), PHONE_NUMBER)
+
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            unpickled = pickle.loads(pickle.dumps(phone_number, protocol))
+            self.assertEqual(unpickled, phone_number)
+            self.assertEqual(unpickled.as_e164, PHONE_NUMBER)
+            self.assertIsNone(unpickled._phone_number)
+            self.assertIsNone(unpickled._valid)
+            self.assertEqual(unpickled.region_code, 'US')
+
+    def test_copy(self):
+        phone_number = LazyPhoneNumber(PHONE_NUMBER)
+        self.assertEqual(copy.copy(phone_number), phone_number)
+        self.assertEqual(copy.deepcopy(phone_number), phone_number)
+
+    def test_attribute_delegation(self):
+        phone_number = LazyPhoneNumber(PHONE_NUMBER)
+        self.assertIsNone(phone_number._phone_number)
+        self.assertEqual(phone_number.country_code, 1)
+        self.assertEqual(phone_number.national_number, 3105550100)
+        self.assertIsInstance(phone_number.get_phone_number(), PhoneNumber)
+
+    def test_special_attributes_not_delegated(self):
+        phone_number = LazyPhoneNumber(PHONE_NUMBER)
+        with self.assertRaises(AttributeError):
+            phone_number.__deepcopy__
+        with self.assertRaises(AttributeError):
+            phone_number.__missing_attribute__
+        # special method lookups don't parse the phone number
+        self.assertIsNone(phone_number._phone_number)
+
+    def test_string_representations(self):
+        phone_number = LazyPhoneNumber(PHONE_NUMBER)
+        self.assertEqual(unicode(phone_number), PHONE_NUMBER)
+        self.assertEqual(str(phone_number), PHONE_NUMBER)
+        self.assertEqual(len(phone_number), len(PHONE_NUMBER))
+
+    def test_valid(self):
+        phone_number = LazyPhoneNumber(PHONE_NUMBER)
+        self.assertTrue(phone_number.is_valid())
+        self.assertEqual(phone_number.as_e164, PHONE_NUMBER)
+        self.assertEqual(phone_number.region_code, 'US')
+
+    def test_invalid(self):
+        for raw_input in ('not a number', '+1555'):
+            phone_number = LazyPhoneNumber(raw_input)
+            self.assertFalse(phone_number.is_valid())
+            self.assertEqual(phone_number.as_e164, raw_input)
+            self.assertEqual(unicode(phone_number), raw_input)
+            self.assertIsNone(phone_number.region_code)
+
+    def test_to_python(self):
+        phone_number = PhoneNumber.to_python('+1 (310) 555-0100')
+        self.assertIsInstance(phone_number, LazyPhoneNumber)
+        self.assertEqual(phone_number.as_e164, PHONE_NUMBER)
+
+        phone_number = PhoneNumber.to_python('not a number')
+        self.assertEqual(phone_number.as_e164, 'not a number')
+        self.assertFalse(phone_number.is_valid())
+
+    def test_validity_memoized(self):
+        phone_number = LazyPhoneNumber(PHONE_NUMBER)
+        self.assertTrue(phone_number.is_valid())
+        self.assertEqual(phone_number.region_code, 'US')
+        self.assertTrue(phone_number.is_valid())
+        self.assertEqual(phone_number.region_code, 'US')
+        # the phone number was only looked up in the parse cache once
+        stats = parse_cache.stats()
+        self.assertEqual(stats['hits'] + stats['misses'], 1)
+
+
+class ParseCacheTests(SimpleTestCase):
+    """
+    Tests of the LRU cache of phone number parse results
+    """
+
+    def setUp(self):
+        parse_cache.clear()
+
+    def get_requests_metric(self, result):
+        return REGISTRY.get_sample_value(
+            'gravvy_phonenumber_parse_cache_requests_total',
+            {'result': result}) or 0
+
+    def test_parse(self):
+        self.assertEqual(parse_phone_number('+1 (310) 555-0100'),
+                         (PHONE_NUMBER, 'US'))
+        self.assertEqual(normalize_phone_number('+1 (310) 555-0100'),
+                         PHONE_NUMBER)
+        self.assertEqual(parse_phone_number('not a number'), (None, None))
+        self.assertIsNone(normalize_phone_number('+1555'))
+
+    def test_hits_and_misses(self):
+        hits = self.get_requests_metric('hit')
+        misses = self.get_requests_metric('miss')
+        parse_phone_number(PHONE_NUMBER)
+        parse_phone_number(PHONE_NUMBER)
+        parse_phone_number(PHONE_NUMBER)
+        self.assertEqual(parse_cache.stats(), {
+                'hits': 2, 'misses': 1, 'size': 1, 'maxsize': 10000})
+        self.assertEqual(self.get_requests_metric('hit') - hits, 2)
+        self.assertEqual(self.get_requests_metric('miss') - misses, 1)
+
+    def test_invalid_numbers_cached(self):
+        self.assertEqual(parse_phone_number('not a number'), (None, None))
+        self.assertEqual(parse_phone_number('not a number'), (None, None))
+        stats = parse_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_keyed_on_region(self):
+        self.assertEqual(parse_phone_number('3105550100', 'US'),
+                         (PHONE_NUMBER, 'US'))
+        self.assertEqual(parse_phone_number('3105550100'), (None, None))
+        self.assertEqual(parse_phone_number('020 7946 0018', 'GB'),
+                         ('+442079460018', 'GB'))
+        self.assertEqual(parse_phone_number('020 7946 0018', 'US'),
+                         (None, None))
+        self.assertEqual(parse_cache.stats()['size'], 4)
+        self.assertEqual(parse_cache.stats()['hits'], 0)
+
+    @override_settings(PHONENUMBER_PARSE_CACHE_SIZE=2)
+    def test_lru_eviction(self):
+        cache = ParseCache()
+        cache.set('a', 1)
+        cache.set('b', 2)
+        # reading 'a' makes 'b' the least recently used
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.stats()['size'], 2)
+
+    @override_settings(PHONENUMBER_PARSE_CACHE_SIZE=0)
+    def test_disabled(self):
+        self.assertEqual(parse_phone_number(PHONE_NUMBER),
+                         (PHONE_NUMBER, 'US'))
+        self.assertEqual(parse_phone_number(PHONE_NUMBER),
+                         (PHONE_NUMBER, 'US'))
+        stats = parse_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']),
+                         (0, 2, 0))
+
+    def test_clear(self):
+        parse_phone_number(PHONE_NUMBER)
+        parse_cache.clear()
+        self.assertEqual(parse_cache.stats(), {
+                'hits': 0, 'misses': 0, 'size': 0, 'maxsize': 10000})
@@ -0,0 +1,157 @@
+"""
+Collision-free generation of the short hash keys used to identify objects in
+URLs, such as those of videos and video users.
+
+Each hash key is a unique integer id run through a keyed permutation, so
+generating a key never needs a uniqueness check against the database. The
+ids come from a database sequence, which is read in blocks of ids so most keys
+are generated without any database queries at all. The permutation (a Feistel
+network keyed by the project's SECRET_KEY) makes consecutive ids map to
+unrelated looking keys, so keys can't be guessed from one another.
+
+Table Of Contents:
+    permute_id: keyed permutation of an integer id
+    HashKeyGenerator: generate unique hash keys from a database sequence
+"""
+
+import hashlib
+import random
+import struct
+import threading
+
+from django.conf import settings
+from django.db import connection
+
+# number of Feistel rounds. 4 rounds are enough for the output to be
+# indistinguishable from a random permutation.
+FEISTEL_ROUNDS = 4
+
+
+def _round_keys(bits):
+    """
+    Derive the key of each Feistel round from the project's SECRET_KEY
+
+    Args:
+        bits: number of bits in the permutation's domain
+
+    Returns:
+        list of round keys
+    """
+    return [hashlib.sha256('gravvy.hashkeys:%d:%d:%s' % (
+                bits, r, settings.SECRET_KEY)).digest()
+            for r in range(FEISTEL_ROUNDS)]
+
+
+def permute_id(value, bits, round_keys=None):
+    """
+    Map an integer id to another integer in [0, 2**bits) using a balanced
+    Feistel network. This is a bijection, so distinct ids are always mapped to
+    distinct integers.
+
+    Args:
+        value: integer id in [0, 2**bits). bits must be even.
+        bits: number of bits in the permutation's domain
+        round_keys: round keys to use, derived from SECRET_KEY if not provided
+
+    Returns:
+        permuted integer id
+    """
+    half_bits = bits // 2
+    mask = (1 << half_bits) - 1
+    if round_keys is None:
+        round_keys = _round_keys(bits)
+
+    left, right = value >> half_bits, value & mask
+    for round_key in round_keys:
+        digest = hashlib.sha256(round_key + struct.pack('>Q', right)).digest()
+        left, right = right, left ^ (struct.unpack('>Q', digest[:8])[0] & mask)
+    return (left << half_bits) | right
+
+
+class HashKeyGenerator(object):
+    """
+    Generates unique fixed-length hex hash keys.
+
+    Ids are reserved from a database sequence a block at a time (the hi/lo
+    algorithm): each value read from the sequence reserves `block_size` ids
+    for this process. Ids of a block that aren't used before the process exits
+    are simply skipped.
+
+    Databases without sequences (i.e. sqlite during development) get random
+    blocks instead. These are unique with a high probability, which is good
+    enough for development.
+    """
+
+    def __init__(self, sequence_name, length=10, block_size=1000):
+        """
+        Args:
+            sequence_name: name of the database sequence ids are read from
+            length: number of hex characters in generated keys. Must be even.
+            block_size: number of ids reserved per database sequence read
+        """
+        self.sequence_name = sequence_name
+        self.length = length
+        self.bits = length * 4
+        self.block_size = block_size
+        self._round_keys = None
+        self._next_id = 0
+        self._block_end = 0
+        self._lock = threading.Lock()
+
+    def _reserve_block(self):
+        """
+        Reserve the next block of ids for this process
+
+        Returns:
+            first id in the block
+        """
+        if connection.vendor == 'postgresql':
+            cursor = connection.cursor()
+            cursor.execute("SELECT nextval(%s)", [self.sequence_name])
+            block = cursor.fetchone()[0]
+        else:
+            block = random.randrange(1, (1 << self.bits) // self.block_size)
+        return block * self.block_size
+
+    def _get_ids(self, count):
+        """
+        Get the next `count` unique ids, reserving more blocks as needed
+        """
+        ids = []
+        with self._lock:
+            while len(ids) < count:
+                if self._next_id >= self._block_end:
+                    self._next_id = self._reserve_block()
+                    self._block_end = self._next_id + self.block_size
+
+                end = min(self._block_end, self._next_id + count - len(ids))
+                ids.extend(range(self._next_id, end))
+                self._next_id = end
+        return ids
+
+    def next_keys(self, count):
+        """
+        Generate multiple unique hash keys
+
+        Args:
+            count: number of hash keys to generate
+
+        Returns:
+            list of hash key strings
+        """
+        if self._round_keys is None:
+            self._round_keys = _round_keys(self.bits)
+
+        key_format = '%%0%dx' % self.length
+        return [unicode(key_format % permute_id(
+                    id_, self.bits, self._round_keys))
+                for id_ in self._get_ids(count)]
+
+    def next_key(self):
+        """
+        Generate a unique hash key
+
+        Returns:
+            hash key string
+        """
+        return self.next_keys(1)[0]
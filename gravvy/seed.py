@@ -0,0 +1,198 @@
+"""
+Seeding of realistic datasets: users, videos with many clips and members, and
+the activities that go with them. This is used by the query budget tests and
+is fast enough to seed load testing datasets, as everything is created with
+bulk inserts.
+
+Seeded objects have no media files so seeding doesn't need any storage.
+
+Table Of Contents:
+    create_users: bulk create active users
+    create_videos: bulk create videos
+    populate_video: add members, clips and activities to a video
+    seed_dataset: seed a dataset of users and populated videos
+"""
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import models
+from django.utils import timezone
+
+from gravvy.apps.account.models import User, RecentContact
+from gravvy.apps.activity.models import Activity, ActivityGroup
+from gravvy.apps.video.models import (
+    Video, Clip, VideoUsers, Like, hash_key_generator)
+
+# seeded users get phone numbers and names of these formats, so they're easy
+# to spot.
+SEED_PHONE_NUMBER_FORMAT = '+1310555%04d'
+SEED_FULL_NAME_PREFIX = 'Seed User'
+# largest number of users that can be seeded
+MAX_SEED_USERS = 10000
+# number of users or videos created at a time. This keeps queries within the
+# query parameter limits of databases like sqlite.
+SEED_BATCH_SIZE = 500
+
+
+def create_users(count):
+    """
+    Bulk create active users with unusable passwords. Phone numbers carry on
+    from the last seeded user so this can be called multiple times.
+
+    Args:
+        count: number of users to create
+
+    Returns:
+        list of User instances
+    """
+    start = User.objects.filter(
+        full_name__startswith=SEED_FULL_NAME_PREFIX).count()
+    if start + count > MAX_SEED_USERS:
+        raise ValueError("At most %d users can be seeded" % MAX_SEED_USERS)
+
+    now = timezone.now()
+    phone_numbers = [SEED_PHONE_NUMBER_FORMAT % i
+                     for i in range(start, start + count)]
+    users = []
+    for i, phone_number in enumerate(phone_numbers):
+        user = User(phone_number=phone_number,
+                    full_name='%s %d' % (SEED_FULL_NAME_PREFIX, start + i),
+                    is_active=True, date_joined=now)
+        user.set_unusable_password()
+        users.append(user)
+    User.objects.bulk_create(users)
+
+    # bulk_create doesn't set primary keys so fetch the new users
+    users = dict((unicode(u.phone_number), u) for u in
+                 User.objects.filter(phone_number__in=phone_numbers))
+    return [users[n] for n in phone_numbers]
+
+
+def create_videos(owners):
+    """
+    Bulk create a video for each owner, with the owner as its only member.
+
+    Args:
+        owners: list of video owners. Owners can appear multiple times.
+
+    Returns:
+        list of Video instances in the order of their owners
+    """
+    hash_keys = hash_key_generator.next_keys(len(owners))
+    Video.objects.bulk_create([
+            Video(owner=owner, hash_key=hash_key, title='Seed Video %s' % i)
+            for i, (owner, hash_key) in enumerate(zip(owners, hash_keys))])
+
+    videos = dict((v.hash_key, v) for v in
+                  Video.objects.filter(hash_key__in=hash_keys))
+    videos = [videos[hash_key] for hash_key in hash_keys]
+
+    hash_keys = hash_key_generator.next_keys(len(videos))
+    VideoUsers.objects.bulk_create([
+            VideoUsers(video=video, user=video.owner, hash_key=hash_key)
+            for video, hash_key in zip(videos, hash_keys)])
+    return videos
+
+
+def populate_video(video, members, clips_count=0, likes_count=0):
+    """
+    Add members, clips and likes to a video along with the activities that
+    would have been recorded for them. Clips are uploaded by the members in
+    turn, and the likes are by the first `likes_count` members.
+
+    Args:
+        video: video to populate
+        members: users to add as video members, in addition to existing ones
+        clips_count: number of clips to add
+        likes_count: number of likes to add
+
+    Returns:
+        None
+    """
+    members = [m for m in members if m.id != video.owner_id]
+    new_video_users = VideoUsers.objects.add_users_to_video(video, *members)
+    uploaders = [video.owner] + members
+
+    stats = Video.objects.filter(pk=video.pk).values_list(
+        'next_clip_order', 'likes_count')[0]
+    first_order, video_likes_count = stats
+    now = timezone.now()
+    Clip.objects.bulk_create([
+            Clip(video=video, owner=uploaders[i % len(uploaders)],
+                 order=first_order + i, duration=2.0, created_at=now)
+            for i in range(clips_count)])
+    clips = list(Clip.objects.filter(
+            video=video, order__gte=first_order).order_by('order'))
+
+    video_type = ContentType.objects.get_for_model(Video)
+    clip_type = ContentType.objects.get_for_model(Clip)
+    user_type = ContentType.objects.get_for_model(User)
+    activities = []
+    for video_user in new_video_users:
+        activities.append(Activity(
+                actor=video.owner, verb='invite',
+                object_content_type=user_type, object_id=video_user.user_id,
+                target_content_type=video_type, target_id=video.id))
+    for clip in clips:
+        activities.append(Activity(
+                actor=clip.owner, verb='add',
+                object_content_type=clip_type, object_id=clip.id,
+                target_content_type=video_type, target_id=video.id))
+    for member in members[:likes_count]:
+        activities.append(Activity(
+                actor=member, verb='like',
+                object_content_type=video_type, object_id=video.id))
+    ActivityGroup.objects.add_activities(activities)
+    Activity.objects.bulk_create(activities)
+    Like.objects.bulk_create([Like(user=member, video=video)
+                              for member in members[:likes_count]])
+    RecentContact.objects.record_invites(
+        video.owner, [video_user.user for video_user in new_video_users])
+
+    # keep the video's cached stats in line with what was added
+    clips = video.clips.all()
+    Video.objects.filter(pk=video.pk).update(
+        clips_count=clips.count(),
+        duration=clips.aggregate(models.Sum('duration'))['duration__sum'] or 0,
+        next_clip_order=first_order + clips_count,
+        likes_count=video_likes_count + len(members[:likes_count]))
+
+
+def seed_dataset(viewer=None, users=20, videos=5, members_per_video=5,
+                 clips_per_video=10, likes_per_video=3):
+    """
+    Seed a dataset of users and videos. Each video is owned by one of the
+    seeded users and populated with members, clips and likes. The viewer, if
+    any, is a member of every video.
+
+    Args:
+        viewer: user to add to every video, i.e. the user whose point of view
+            the dataset will be seen from
+        users: number of users to create
+        videos: number of videos to create
+        members_per_video: number of members of each video, excluding the
+            owner and viewer
+        clips_per_video: number of clips of each video
+        likes_per_video: number of likes of each video
+
+    Returns:
+        (users, videos) tuple of the lists of seeded users and videos
+    """
+    seeded_users = []
+    while len(seeded_users) < users:
+        seeded_users.extend(create_users(
+                min(SEED_BATCH_SIZE, users - len(seeded_users))))
+
+    owners = [seeded_users[i % users] for i in range(videos)]
+    seeded_videos = []
+    for start in range(0, videos, SEED_BATCH_SIZE):
+        seeded_videos.extend(
+            create_videos(owners[start:start + SEED_BATCH_SIZE]))
+
+    for i, video in enumerate(seeded_videos):
+        members = [seeded_users[(i + j + 1) % users]
+                   for j in range(members_per_video)]
+        if viewer is not None:
+            members.insert(0, viewer)
+        populate_video(video, members, clips_per_video, likes_per_video)
+
+    return seeded_users, seeded_videos
@@ -63,9 +63,12 @@ INSTALLED_APPS = (
     'gravvy.apps.video',
     'gravvy.apps.activity',
     'gravvy.apps.push',
+    'gravvy.apps.monitoring',
 )
 
 MIDDLEWARE_CLASSES = (
+    'gravvy.apps.monitoring.middleware.MetricsMiddleware',
+    'gravvy.apps.monitoring.middleware.ProfilingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -74,6 +77,7 @@ MIDDLEWARE_CLASSES = (
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'gravvy.apps.rest.negotiation.ImageFormatVaryMiddleware',
 )
 
 ROOT_URLCONF = 'gravvy.urls'
@@ -120,6 +124,38 @@ DATABASES = {
 }
 
 
+# ---------------------------------------------------------------------------- #
+# Caches
+# ---------------------------------------------------------------------------- #
+# https://docs.djangoproject.com/en/1.8/topics/cache/
+
+# The default cache is a small per-process LRU in front of the shared cache, so
+# the hottest keys don't need a round trip to the shared cache. All worker
+# processes use the same shared cache: memcached in production, and a local
+# memory stand-in during development and tests.
+CACHES = {
+    'default': {
+        'BACKEND': 'gravvy.cache.TieredCache',
+        'LOCATION': 'gravvy',
+        'TIMEOUT': 3600,
+        'OPTIONS': {
+            'SHARED_CACHE': 'shared',
+            'LOCAL_MAX_ENTRIES': 10000,
+            # seconds a process may serve a value after another process
+            # invalidated it
+            'LOCAL_TIMEOUT': 5,
+        },
+    },
+    'shared': {
+        'BACKEND': ('django.core.cache.backends.locmem.LocMemCache' if DEBUG 
+                    else 'django.core.cache.backends.memcached.MemcachedCache'),
+        'LOCATION': 'gravvy-shared' if DEBUG else '127.0.0.1:11211',
+        'TIMEOUT': 3600,
+        'KEY_PREFIX': 'gravvy',
+    },
+}
+
+
 # ---------------------------------------------------------------------------- #
 # Internationalization
 # ---------------------------------------------------------------------------- #
@@ -178,10 +214,14 @@ STATICFILES_DIRS = (
 #     to stderr. This handler uses the simple output format.
 #   + mail_admins, an AdminEmailHandler, which will email any ERROR (or higher)
 #     message to the site admins
-# - configures 1 logger:
+# - configures 3 loggers:
 #   + django, which passes all messages at ERROR or higher to the mail_admins
 #     handlers when not in DEBUG mode. In debug mode this logger passes messages
 #     to the console handler.
+#   + gravvy.profiling, which passes the JSON profiles of sampled requests to
+#     the console handler.
+#   + gravvy.activity, which passes errors of the realtime activity stream to
+#     the mail_admins handler.
 #
 
 LOGGING = {
@@ -212,6 +252,16 @@ LOGGING = {
             'level': 'ERROR',
             'propagate': True,
             },
+        'gravvy.profiling': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+            },
+        'gravvy.activity': {
+            'handlers': ['mail_admins'],
+            'level': 'ERROR',
+            'propagate': False,
+            },
         }
     }
 
@@ -234,7 +284,8 @@ else:
 # ---------------------------------------------------------------------------- #
 # Amazon AWS storage settings
 # ---------------------------------------------------------------------------- #
-DEFAULT_FILE_STORAGE = 'storages.backends.s3boto.S3BotoStorage'
+# S3BotoStorage with its calls recorded in request profiles
+DEFAULT_FILE_STORAGE = 'gravvy.apps.monitoring.storage.ProfiledS3BotoStorage'
 
 # Workaround to issues in AWS that lead to errors like:
 #     CertificateError: hostname 'media.gravvy.com.s3.amazonaws.com' 
@@ -270,11 +321,14 @@ else:
 # `imagekit` settings
 # ---------------------------------------------------------------------------- #
 # create appropriate thumbnails on source file save only and not during 
-# request-response cycle as with the 'JustInTime' strategy
-IMAGEKIT_DEFAULT_CACHEFILE_STRATEGY ='imagekit.cachefiles.strategies.Optimistic'
+# request-response cycle as with the 'JustInTime' strategy. This is imagekit's
+# Optimistic strategy, which also records thumbnail generation times.
+IMAGEKIT_DEFAULT_CACHEFILE_STRATEGY = (
+    'gravvy.apps.monitoring.strategies.TimedOptimistic')
 
 # The easiest and most significant improvement that can be made to site
-# performance is to ahve ImageKit cache the state of generated files.
+# performance is to ahve ImageKit cache the state of generated files. This is
+# the tiered cache, so all processes share the state.
 IMAGEKIT_CACHE_BACKEND = 'default'
 
 IMAGEKIT_CACHEFILE_DIR = 'cache'
@@ -315,6 +369,13 @@ AVATAR_THUMBNAIL_SIZE = 120
 # max number of users to return in a user's recent contacts list
 ACCOUNT_MAX_RECENT_CONTACTS = 8
 
+# max number of phone numbers that can be matched to users in one request
+ACCOUNT_MAX_MATCH_PHONE_NUMBERS = 5000
+
+# max number of phone number parse results to cache per process. Set to 0 to
+# disable the cache.
+PHONENUMBER_PARSE_CACHE_SIZE = 10000
+
 
 # ---------------------------------------------------------------------------- #
 # `feedback` settings
@@ -355,6 +416,37 @@ VIDEO_PLAYS_COUNT_WEIGHT = 1.0
 # weight of likes count when determining video score
 VIDEO_LIKES_COUNT_WEIGHT = 10.0
 
+# ---------------------------------------------------------------------------- #
+# `activity` settings
+# ---------------------------------------------------------------------------- #
+# PostgreSQL NOTIFY channel that activities are published to for the realtime
+# activity stream. This is used as an SQL identifier.
+ACTIVITY_STREAM_CHANNEL = 'gravvy_activities'
+
+# number of seconds between the keepalive comments sent to idle activity
+# streams. This is also how often streams pick up changes of the user's videos
+# that no activity was published for, such as being removed from a video.
+ACTIVITY_STREAM_KEEPALIVE = 20
+
+# number of seconds after which activity streams are closed, so clients
+# reconnect and have their authentication checked again.
+ACTIVITY_STREAM_MAX_AGE = 600
+
+# serve the realtime activity stream from this process? A stream holds a
+# worker for as long as it's open, so on the mod_wsgi threads a few dozen
+# streams would block every other request. Streams are served by gunicorn's
+# gevent worker instead, with the settings of gravvy/settings_stream.py, and
+# activities are published from every process regardless.
+ACTIVITY_STREAM_SERVE = False
+
+# number of seconds after the first activity of an activity group that
+# activities of the same actor, verb and target join the group, rather than
+# starting a new one. Groups are shown as one item in the aggregated feed.
+ACTIVITY_GROUP_WINDOW = 600
+
+# number of objects of an activity group shown in the aggregated feed
+ACTIVITY_GROUP_SAMPLE_SIZE = 3
+
 # ---------------------------------------------------------------------------- #
 # `push` settings
 # ---------------------------------------------------------------------------- #
@@ -382,6 +474,10 @@ PUSH_ACTION_TYPE_KEY = 'action_type'
 #     clip: id
 PUSH_ACTION_OBJECT_IDENTIFIER_KEY = 'object_identifier'
 
+# an action on many objects at once, such as removing users from a video, has
+# the identifiers of all of them in a single push notification as a list.
+PUSH_ACTION_OBJECT_IDENTIFIERS_KEY = 'object_identifiers'
+
 # default push notification sound file
 PUSH_SOUND_FILE = 'notification.caf'
 
@@ -467,9 +563,56 @@ PUSH_NOTIFICATIONS_SETTINGS = {
         'feedback.push.apple.com',
 }
 
+# Send APNS push notifications over a long-lived HTTP/2 connection to the APNS
+# provider API, with up to APNS_MAX_CONCURRENT_STREAMS notifications in flight
+# at once. Set to False to send them through the legacy binary gateway of
+# APNS_HOST instead, one device at a time.
+APNS_HTTP2 = True
+
+APNS_HTTP2_HOST = 'api.development.push.apple.com' if PUSH_DEBUG else \
+    'api.push.apple.com'
+
+APNS_HTTP2_PORT = 443
+
+# only a local stub server should be connected to without TLS
+APNS_HTTP2_SECURE = True
+
+# app bundle id sent as the topic of notifications. This can be None as long
+# as the APNS certificate is for a single topic.
+APNS_TOPIC = None
+
+APNS_MAX_CONCURRENT_STREAMS = 500
+
+# number of seconds like and new clip notifications are held for, so each
+# video user gets one push for a burst of likes or clips of a video rather than
+# one per like or clip. Held notifications are sent by the flushnotifications
+# management command. Set to 0 to send these notifications right away.
+PUSH_COALESCE_WINDOW = 30
+
+# Go through all the work of sending push notifications and SMS messages, but
+# don't actually deliver them. This is for load testing.
+PUSH_DRY_RUN = False
+
 
 # ---------------------------------------------------------------------------- #
 # Plivo settings
 # ---------------------------------------------------------------------------- #
 # Enter your Plivo phone number. This will show up on your caller ID
 PLIVO_NUMBER = '18583650635'
+
+
+# ---------------------------------------------------------------------------- #
+# `monitoring` settings
+# ---------------------------------------------------------------------------- #
+# fraction of requests to profile, in [0, 1]. Profiled requests have their SQL
+# queries logged, so keep this low in production.
+PROFILING_SAMPLE_RATE = 0.01
+
+# number of most recent request profiles each process keeps for the
+# profiling admin page
+PROFILING_BUFFER_SIZE = 1000
+
+# IP addresses allowed to scrape the Prometheus metrics endpoint. Set to None
+# to allow any address. Behind a reverse proxy every request comes from the
+# proxy's address, so the proxy has to restrict access to /metrics/ instead.
+METRICS_ALLOWED_IPS = ('127.0.0.1',)
@@ -0,0 +1,8 @@
+"""
+Django settings of the processes serving the realtime activity stream. These
+are the project's settings, with the stream endpoint turned on.
+"""
+
+from gravvy.settings import *
+
+ACTIVITY_STREAM_SERVE = True
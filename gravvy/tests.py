@@ -0,0 +1,617 @@
+"""
+Query budget tests of every URL in gravvy/urls.py.
+
+Each request is made against a seeded dataset, and made again after the
+dataset has grown: more videos, and more clips, members and likes per video.
+A request must make the same number of queries at both sizes, so N+1 query
+regressions are caught, and stay within the endpoint's query budget.
+
+A report of the queries, time and response size of every request is written
+to stderr once the tests have run. This serves as the performance baseline of
+the project.
+
+Requests that upload media (video and clip creation) are made with files
+stored on the local filesystem, and the web clip upload's ffmpeg transcode is
+stubbed out. The admin site isn't covered.
+"""
+
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from StringIO import StringIO
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.http import HttpResponse
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from PIL import Image
+from rest_framework.test import APIClient
+
+from gravvy.apps.account.models import (
+    User, AuthToken, RecentContact, RegistrationProfile)
+from gravvy.apps.activity.models import Activity
+from gravvy.apps.video.models import (
+    Video, VideoUsers, Like, PendingNotification)
+from gravvy.seed import create_users, create_videos, populate_video, \
+    seed_dataset
+
+
+# ---------------------------------------------------------------------------- #
+# HELPER FUNCTIONS
+# ---------------------------------------------------------------------------- #
+
+def write_report(report, stream):
+    """
+    Write a report of the measured requests as a table.
+
+    Args:
+        report: list of (name, size, queries, seconds, bytes) tuples
+        stream: file-like object to write to
+
+    Returns:
+        None
+    """
+    header = ('endpoint', 'dataset', 'queries', 'time (ms)', 'bytes')
+    rows = [header] + [
+        (name, size, str(queries), '%.1f' % (seconds * 1000), str(length))
+        for name, size, queries, seconds, length in report]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+
+    stream.write('\nQuery budget report\n')
+    for row in rows:
+        stream.write('  '.join(
+                cell.ljust(width) for cell, width in zip(row, widths)))
+        stream.write('\n')
+
+
+def generate_photo():
+    """
+    Generate the contents of a small JPEG clip photo
+
+    Returns:
+        JPEG image data, as a string
+    """
+    output = StringIO()
+    Image.new('RGB', (320, 320), (128, 128, 128)).save(output, 'JPEG')
+    return output.getvalue()
+
+
+def stub_transcode(args):
+    """
+    Stand-in for the subprocess.check_call of the web clip upload's process.sh
+    script. Instead of transcoding with ffmpeg it writes an mp4, photo and
+    duration to the script's output files.
+
+    Args:
+        args: the script's arguments: its path, the input video, the output
+            video, photo and duration, and the ffmpeg path
+
+    Returns:
+        0, the script's exit status
+    """
+    output_video, output_image, output_duration = args[2:5]
+    with open(output_video, 'wb') as output:
+        output.write('\x00' * 1024)
+    with open(output_image, 'wb') as output:
+        output.write(generate_photo())
+    with open(output_duration, 'w') as output:
+        output.write('2.0\n')
+    return 0
+
+
+# ---------------------------------------------------------------------------- #
+# TEST CASES
+# ---------------------------------------------------------------------------- #
+
+@override_settings(PLIVO_DEBUG=True)
+class QueryBudgetTests(TestCase):
+    """
+    Query budgets of every endpoint. Requests are made by a user that is a
+    member of all seeded videos and the owner of one of them.
+    """
+    # measurements of all requests, for the report
+    report = []
+
+    @classmethod
+    def tearDownClass(cls):
+        super(QueryBudgetTests, cls).tearDownClass()
+        write_report(sorted(cls.report), sys.stderr)
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            '+12025550100', 'password', full_name='Viewer', is_active=True)
+        self.token = AuthToken.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+        seed_dataset(viewer=self.user, users=10, videos=3,
+                     members_per_video=3, clips_per_video=3,
+                     likes_per_video=2)
+
+        # the user's own video, with a member that can be removed
+        self.video = create_videos([self.user])[0]
+        self.members = create_users(3)
+        populate_video(self.video, self.members, clips_count=3,
+                       likes_count=2)
+        self.member = self.members[-1]
+
+    def grow(self):
+        """
+        Grow the dataset with more of everything endpoints return.
+        """
+        seed_dataset(viewer=self.user, users=30, videos=10,
+                     members_per_video=10, clips_per_video=10,
+                     likes_per_video=5)
+        populate_video(self.video, create_users(10), clips_count=10,
+                       likes_count=5)
+
+    def measure(self, request):
+        """
+        Make a request and measure its queries, time and response size.
+        The cache is cleared first, so queries are measured with a cold cache.
+
+        Args:
+            request: callable making a request and returning its response
+
+        Returns:
+            (response, queries, seconds, bytes) tuple
+        """
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            start = time.time()
+            response = request()
+            seconds = time.time() - start
+        return response, len(context), seconds, len(response.content)
+
+    def assertQueryBudget(self, name, budget, request, prepare=None,
+                          status_code=200):
+        """
+        Assert a request makes the same number of queries before and after
+        the dataset grows, and stays within its query budget.
+
+        Args:
+            name: name of the endpoint in the report
+            budget: maximum number of queries the request can make
+            request: callable making the request and returning its response
+            prepare: callable setting up the request, if it needs to be set
+                up before each measurement. This isn't measured.
+            status_code: expected status code of the response
+        """
+        counts = []
+        for size in ('small', 'large'):
+            if size == 'large':
+                self.grow()
+            if prepare is not None:
+                prepare()
+
+            response, queries, seconds, length = self.measure(request)
+            self.assertEqual(response.status_code, status_code,
+                             '%s: %s' % (name, response.content[:200]))
+            self.report.append((name, size, queries, seconds, length))
+            counts.append(queries)
+
+        self.assertEqual(
+            counts[0], counts[1],
+            '%s made %d queries on the small dataset but %d on the large '
+            'dataset' % (name, counts[0], counts[1]))
+        self.assertLessEqual(
+            counts[1], budget,
+            '%s made %d queries, over its budget of %d'
+            % (name, counts[1], budget))
+
+    def video_url(self, name, video=None, **kwargs):
+        video = video or self.video
+        kwargs['hash_key'] = video.hash_key
+        return reverse(name, kwargs=kwargs)
+
+    def use_file_storage(self):
+        """
+        Store uploaded media in a temporary directory for the rest of the
+        test, instead of S3.
+        """
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        # imagekit picks its storage when settings are loaded so it has to be
+        # overridden on its own.
+        file_storage = 'django.core.files.storage.FileSystemStorage'
+        media_settings = override_settings(
+            MEDIA_ROOT=media_root, DEFAULT_FILE_STORAGE=file_storage,
+            IMAGEKIT_DEFAULT_FILE_STORAGE=file_storage)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+    def clip_files(self):
+        """
+        Files of a clip upload. They're read by the request, so each request
+        needs its own.
+
+        Returns:
+            dictionary of the clip's mp4 and photo uploaded files
+        """
+        return {
+            'mp4': SimpleUploadedFile('clip.mp4', '\x00' * 1024, 'video/mp4'),
+            'photo': SimpleUploadedFile('clip.jpg', generate_photo(),
+                                        'image/jpeg')}
+
+    # ------------------------------------------------------------------------ #
+    # Roots and web pages
+    # ------------------------------------------------------------------------ #
+    def test_api_root(self):
+        self.assertQueryBudget(
+            'api root', 2,
+            lambda: self.client.get(reverse('api_root')))
+
+    def test_account_root(self):
+        self.assertQueryBudget(
+            'account root', 2,
+            lambda: self.client.get(reverse('account_root')))
+
+    def test_push_root(self):
+        self.assertQueryBudget(
+            'push root', 2,
+            lambda: self.client.get(reverse('push_root')))
+
+    def test_web_pages(self):
+        for name in ('home', 'terms', 'privacy'):
+            response, queries, seconds, length = self.measure(
+                lambda: self.client.get(reverse(name)))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(queries, 0)
+            self.report.append((name, 'small', queries, seconds, length))
+
+    def test_web_video_detail(self):
+        def set_mp4s():
+            # the page links to each clip's mp4
+            self.video.clips.update(mp4='clips/mp4/clip.mp4')
+        self.assertQueryBudget(
+            'web video detail', 2,
+            lambda: self.client.get(self.video_url('web-video-detail')),
+            prepare=set_mp4s)
+
+    def test_web_video_clip_upload_form(self):
+        self.assertQueryBudget(
+            'web video clip upload form', 1,
+            lambda: self.client.get(self.video_url('web-video-clip-upload')))
+
+    def test_web_video_clip_upload(self):
+        self.use_file_storage()
+        numbers = iter(['+12025550180', '+12025550181'])
+
+        def upload():
+            number = next(numbers)
+            check_call = subprocess.check_call
+            subprocess.check_call = stub_transcode
+            try:
+                return self.client.post(
+                    self.video_url('web-video-clip-upload'),
+                    {'name': 'Guest', 'number': number,
+                     'formatted_number': number,
+                     'clip': SimpleUploadedFile('clip.mp4', '\x00' * 1024,
+                                                'video/mp4')})
+            finally:
+                subprocess.check_call = check_call
+
+        def clear_notifications():
+            # so each upload creates the video's pending notifications
+            PendingNotification.objects.filter(video=self.video).delete()
+        # creates the uploader's user, adds them to the video, creates the clip
+        # and queues the notification of the video's members
+        self.assertQueryBudget(
+            'web video clip upload', 20, upload, prepare=clear_notifications,
+            status_code=302)
+
+    # ------------------------------------------------------------------------ #
+    # Users
+    # ------------------------------------------------------------------------ #
+    def test_user_registration(self):
+        numbers = iter(['+12025550170', '+12025550171'])
+        self.client.credentials()
+        self.assertQueryBudget(
+            'user registration', 6,
+            lambda: self.client.post(
+                reverse('user-list'),
+                {'phone_number': next(numbers), 'password': 'password'},
+                format='json'),
+            status_code=201)
+
+    def test_user_match(self):
+        phone_numbers = [unicode(u.phone_number) for u in
+                         User.objects.all()[:50]] + ['+12025550199']
+        self.assertQueryBudget(
+            'user match', 3,
+            lambda: self.client.post(
+                reverse('user-match-list'),
+                {'phone_numbers': phone_numbers}, format='json'))
+
+    def test_user_detail(self):
+        url = reverse('user-detail',
+                      kwargs={'phone_number': unicode(self.member.phone_number)})
+        self.assertQueryBudget(
+            'user detail', 3, lambda: self.client.get(url))
+
+    def test_user_video_list(self):
+        url = reverse('user-video-list',
+                      kwargs={'phone_number': unicode(self.user.phone_number)})
+        self.assertQueryBudget(
+            'user video list', 7, lambda: self.client.get(url))
+
+    def test_authenticated_user_detail(self):
+        self.assertQueryBudget(
+            'authenticated user detail', 2,
+            lambda: self.client.get(reverse('user-auth-detail')))
+
+    def test_authenticated_user_update(self):
+        self.assertQueryBudget(
+            'authenticated user update', 3,
+            lambda: self.client.patch(reverse('user-auth-detail'),
+                                      {'full_name': 'Viewer'},
+                                      format='json'))
+
+    def test_authenticated_user_video_list(self):
+        self.assertQueryBudget(
+            'authenticated user video list', 7,
+            lambda: self.client.get(reverse('user-auth-video-list')))
+
+    def test_authenticated_user_activity_list(self):
+        self.assertQueryBudget(
+            'authenticated user activity list', 8,
+            lambda: self.client.get(reverse('user-auth-activity-list')))
+
+    @override_settings(ACTIVITY_STREAM_SERVE=True)
+    def test_authenticated_user_activity_stream(self):
+        def open_stream():
+            # the stream looks up the user's videos when its first event is
+            # read. It's then left waiting for activities, so it's closed.
+            response = self.client.get(reverse('user-auth-activity-stream'))
+            first_event = next(iter(response.streaming_content))
+            response.close()
+            return HttpResponse(first_event, status=response.status_code)
+        self.assertQueryBudget(
+            'authenticated user activity stream', 3, open_stream)
+
+    def test_authenticated_user_recent_contact_list(self):
+        self.assertQueryBudget(
+            'authenticated user recent contact list', 3,
+            lambda: self.client.get(reverse('user-auth-recentcontacts-list')))
+
+    # ------------------------------------------------------------------------ #
+    # Account management
+    # ------------------------------------------------------------------------ #
+    def test_obtain_auth_token(self):
+        self.client.credentials()
+        self.assertQueryBudget(
+            'obtain auth token', 2,
+            lambda: self.client.post(
+                reverse('obtain_auth_token'),
+                {'phone_number': unicode(self.user.phone_number),
+                 'password': 'password'}, format='json'))
+
+    def test_activate_account(self):
+        user = User.objects.create_user('+12025550160', 'password')
+        profile = RegistrationProfile.objects.create_or_update_profile(user)
+
+        def deactivate():
+            User.objects.filter(pk=user.pk).update(is_active=False)
+        self.client.credentials()
+        self.assertQueryBudget(
+            'activate account', 5,
+            lambda: self.client.post(
+                reverse('activate_user'),
+                {'phone_number': unicode(user.phone_number),
+                 'password': 'new password',
+                 'verification_code': profile.verification_code},
+                format='json'),
+            prepare=deactivate)
+
+    # ------------------------------------------------------------------------ #
+    # Videos
+    # ------------------------------------------------------------------------ #
+    def test_video_create(self):
+        self.use_file_storage()
+
+        def create():
+            files = self.clip_files()
+            return self.client.post(
+                reverse('video-list'),
+                {'title': 'New video',
+                 'lead_clip.mp4': files['mp4'],
+                 'lead_clip.photo': files['photo'],
+                 'lead_clip.duration': 2.0,
+                 'users[][phone_number]': [
+                        unicode(member.phone_number)
+                        for member in self.members]},
+                format='multipart')
+
+        def clear_recent_contacts():
+            # so each video's members are recorded as new recent contacts
+            RecentContact.objects.filter(user=self.user).delete()
+        # creates the video, its lead clip and members, then notifies the
+        # members, which takes 2 queries per member, and returns the video
+        self.assertQueryBudget('video create', 41, create,
+                               prepare=clear_recent_contacts, status_code=201)
+
+    def test_video_detail(self):
+        self.assertQueryBudget(
+            'video detail', 5,
+            lambda: self.client.get(self.video_url('video-detail')))
+
+    def test_video_update(self):
+        self.assertQueryBudget(
+            'video update', 6,
+            lambda: self.client.patch(self.video_url('video-detail'),
+                                      {'title': 'Video'}, format='json'))
+
+    def test_video_like_status(self):
+        self.assertQueryBudget(
+            'video like status', 4,
+            lambda: self.client.get(self.video_url('video-detail-like')),
+            status_code=404)
+
+    def test_video_like(self):
+        def unlike():
+            Activity.objects.filter(
+                actor=self.user, verb='like', object_id=self.video.id,
+                object_content_type=ContentType.objects.get_for_model(Video)
+                ).delete()
+            Like.objects.filter(user=self.user, video=self.video).delete()
+            # hold a like notification of one member, so the notification
+            # is merged into it and held for the other members
+            PendingNotification.objects.all().delete()
+            PendingNotification.objects.queue(
+                self.video, settings.PUSH_ACTION_TYPE_LIKED, self.members[0],
+                [self.member.id])
+        # the like is inserted in a savepoint so a concurrent like of the
+        # same video is caught by the unique constraint. Holding the like
+        # notification takes a query more than sending it to no devices, and
+        # a savepoint so the held notifications are locked until merged. The
+        # like's activity joins the user's latest activity group or starts
+        # one. The bumped like sequence number is read back so the likes
+        # count refresh doesn't write a stale one.
+        self.assertQueryBudget(
+            'video like', 21,
+            lambda: self.client.put(self.video_url('video-detail-like')),
+            prepare=unlike, status_code=204)
+
+    def test_video_unlike(self):
+        self.assertQueryBudget(
+            'video unlike', 6,
+            lambda: self.client.delete(self.video_url('video-detail-like')),
+            status_code=204)
+
+    def test_video_play(self):
+        def reset_status():
+            VideoUsers.objects.filter(video=self.video, user=self.user).update(
+                status=VideoUsers.STATUS_INVITED)
+        self.assertQueryBudget(
+            'video play', 5,
+            lambda: self.client.put(self.video_url('video-detail-play')),
+            prepare=reset_status)
+
+    def test_video_clear_notifications(self):
+        self.assertQueryBudget(
+            'video clear notifications', 4,
+            lambda: self.client.put(
+                self.video_url('video-detail-clearnotifications')),
+            status_code=204)
+
+    # ------------------------------------------------------------------------ #
+    # Video clips
+    # ------------------------------------------------------------------------ #
+    def test_video_clip_list(self):
+        self.assertQueryBudget(
+            'video clip list', 4,
+            lambda: self.client.get(self.video_url('video-clip-list')))
+
+    def test_video_clip_create(self):
+        self.use_file_storage()
+
+        def create():
+            data = self.clip_files()
+            data['duration'] = 2.0
+            return self.client.post(self.video_url('video-clip-list'), data,
+                                    format='multipart')
+
+        def clear_notifications():
+            # so each clip creates the video's pending notifications
+            PendingNotification.objects.filter(video=self.video).delete()
+        self.assertQueryBudget('video clip create', 19, create,
+                               prepare=clear_notifications, status_code=201)
+
+    def test_video_clip_detail(self):
+        clip = self.video.clips.all()[0]
+        self.assertQueryBudget(
+            'video clip detail', 3,
+            lambda: self.client.get(
+                self.video_url('video-clip-detail', pk=clip.pk)))
+
+    def test_video_clip_delete(self):
+        def url():
+            clip = self.video.clips.order_by('-order')[0]
+            return self.video_url('video-clip-detail', pk=clip.pk)
+        # the groups of the clip's activities are refreshed after these are
+        # deleted
+        self.assertQueryBudget(
+            'video clip delete', 16,
+            lambda: self.client.delete(url()), status_code=204)
+
+    # ------------------------------------------------------------------------ #
+    # Video users
+    # ------------------------------------------------------------------------ #
+    def test_video_user_list(self):
+        self.assertQueryBudget(
+            'video user list', 5,
+            lambda: self.client.get(self.video_url('video-user-list')))
+
+    def test_video_user_add(self):
+        numbers = iter([['+12025550180', '+12025550181'],
+                        ['+12025550182', '+12025550183']])
+        # invited users are recorded as recent contacts of the inviting user,
+        # and their invites join the inviting user's latest activity group
+        self.assertQueryBudget(
+            'video user add', 22,
+            lambda: self.client.post(
+                self.video_url('video-user-list'),
+                {'users': [{'phone_number': n} for n in next(numbers)]},
+                format='json'),
+            status_code=201)
+
+    def test_video_user_detail(self):
+        self.assertQueryBudget(
+            'video user detail', 5,
+            lambda: self.client.get(self.video_url(
+                    'video-user-detail',
+                    phone_number=unicode(self.member.phone_number))))
+
+    def test_video_user_create(self):
+        numbers = iter(['+12025550190', '+12025550191'])
+        # the invited user is recorded as a recent contact of the inviting
+        # user, and the invite joins their latest activity group
+        self.assertQueryBudget(
+            'video user create', 18,
+            lambda: self.client.post(self.video_url(
+                    'video-user-detail', phone_number=next(numbers))),
+            status_code=201)
+
+    def test_video_user_delete(self):
+        members = iter(self.members)
+        # the groups of the activities of the user's clips are refreshed after
+        # these are deleted
+        self.assertQueryBudget(
+            'video user delete', 21,
+            lambda: self.client.delete(self.video_url(
+                    'video-user-detail',
+                    phone_number=unicode(next(members).phone_number))),
+            status_code=204)
+
+    # ------------------------------------------------------------------------ #
+    # Video likes
+    # ------------------------------------------------------------------------ #
+    def test_video_like_list(self):
+        self.assertQueryBudget(
+            'video like list', 5,
+            lambda: self.client.get(self.video_url('video-like-list')))
+
+    # ------------------------------------------------------------------------ #
+    # Feedback and push notifications
+    # ------------------------------------------------------------------------ #
+    def test_feedback(self):
+        self.assertQueryBudget(
+            'feedback', 3,
+            lambda: self.client.post(reverse('feedback-list'),
+                                     {'body': 'feedback'}, format='json'))
+
+    def test_register_apns_device(self):
+        tokens = iter(['a' * 64, 'b' * 64])
+        self.assertQueryBudget(
+            'register apns device', 5,
+            lambda: self.client.post(reverse('push_register_apns'),
+                                     {'registration_id': next(tokens)},
+                                     format='json'),
+            status_code=201)
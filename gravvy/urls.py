@@ -28,5 +28,12 @@ urlpatterns = [
     url(r'^privacy/$', TemplateView.as_view(template_name="privacy.html"),
         name='privacy'),
     
+    # Prometheus metrics
+    url(r'^metrics/$', 'gravvy.apps.monitoring.views.metrics', 
+        name='metrics'),
+    
+    # staff monitoring pages
+    url(r'^admin/monitoring/', include('gravvy.apps.monitoring.urls')),
+    
     url(r'^admin/', include(admin.site.urls)),
 ]
@@ -6,10 +6,14 @@ Table Of Contents:
     get_upload_path:     determine a unique upload path for a given file
     list_dedup:          dedup a list and preserve order of elements
     human_readable_size: human readable size from byte count
+    percentile:          percentile of a sorted list of values
+    get_commit:          git commit of the running code
 """
 
 from datetime import datetime
-import os, re, unicodedata
+import os, re, subprocess, unicodedata
+
+from django.conf import settings
 
 
 def slugify(string):
@@ -87,4 +91,37 @@ def human_readable_size(num):
             return "%3.1f %s" % (num, x)
         num /= 1024.0
     return "%3.1f %s" % (num, 'TB')
+
+
+def percentile(sorted_values, percent):
+    """
+    Get a percentile of a list of values using the nearest-rank method
+    
+    Args:
+        sorted_values: list of values in ascending order
+        percent: percentile to get, in [0, 100]
+    
+    Returns:
+        value at the percentile or None if there are no values
+    """
+    if not sorted_values:
+        return None
+    rank = int(round(percent / 100.0 * len(sorted_values) + 0.5))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+def get_commit():
+    """
+    Get the git commit of the running code, if available. This is recorded
+    in benchmark and load test results so runs can be compared across
+    commits.
     
+    Returns:
+        commit hash string or None if it can't be determined
+    """
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR,
+            stderr=subprocess.STDOUT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
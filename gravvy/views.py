@@ -243,6 +243,23 @@ def api_root(request, format=None):
     easier for developers.
     
     
+    ## Image Formats
+    Thumbnail URLs (`avatar_thumbnail`, `photo_small_thumbnail` of videos and
+    `photo_thumbnail` of clips) point to JPEG images by default. Clients that
+    can display WebP images should say so, as these are much smaller. This
+    can be done by listing `image/webp` in the request's `Accept` header, or
+    with the `?image_format` parameter which takes precedence over the header.
+    
+    Parameter      | Description
+    -------------- | ------------------------------------------------------
+    `image_format` | `webp` for WebP thumbnails, `jpeg` for JPEG thumbnails
+    
+    **Example Request:**
+    ```
+    $ curl -i "http://gravvy.nnoduka.com/api/v1/user/activities/?image_format=webp"
+    ```
+    
+    
     ## Pagination
     Requests that return multiple items will be paginated by default. You
     can specify further pages with the `?page` parameter for page-number
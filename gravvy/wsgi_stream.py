@@ -0,0 +1,25 @@
+"""
+WSGI config of the realtime activity stream.
+
+This is served by gunicorn's gevent worker, which handles thousands of open
+streams in a single process, with the stream endpoint turned on by the
+settings of `gravvy.settings_stream`:
+```
+gunicorn -k gevent --worker-connections 5000 -b 127.0.0.1:8001 \
+    gravvy.wsgi_stream:application
+```
+The gevent worker has already patched the standard library by the time this
+is imported. psycopg2 needs a patch of its own so its queries, and the
+activity bus's LISTEN connection, yield to other streams while they wait.
+"""
+
+import os
+
+from psycogreen.gevent import patch_psycopg
+from django.core.wsgi import get_wsgi_application
+
+patch_psycopg()
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "gravvy.settings_stream")
+
+application = get_wsgi_application()